@@ -0,0 +1,193 @@
+/* Runtime of the C backend (see cbackend.py): the AtomC builtins.
+ *
+ * The input is read line by line and output is flushed before a line is
+ * read, like the Console of vm.py; get_i and get_d accept the same number
+ * syntax. A runtime error prints a message to stderr and exits with
+ * status 2.
+ */
+#define _POSIX_C_SOURCE 200809L
+#include <limits.h>
+#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+static char *rt_line;  /* Input line being read */
+static size_t rt_len, rt_pos, rt_cap;
+
+static void rt_fail(const char *message)
+{
+    fflush(stdout);
+    fprintf(stderr, "runtime error: %s\n", message);
+    exit(2);
+}
+
+static void rt_halt(void)
+{
+    fflush(stdout);
+    exit(0);
+}
+
+static int rt_idiv(int a, int b)
+{
+    if (b == 0)
+        rt_fail("division by zero");
+    if (a == INT_MIN && b == -1)
+        return a;
+    return a / b;
+}
+
+/* Read the next input line, 0 at the end of the input */
+static int rt_fill(void)
+{
+    int c;
+    fflush(stdout);
+    rt_len = rt_pos = 0;
+    while ((c = getchar()) != EOF) {
+        if (rt_len + 1 >= rt_cap) {
+            rt_cap = rt_cap ? rt_cap * 2 : 256;
+            rt_line = realloc(rt_line, rt_cap);
+            if (rt_line == NULL)
+                rt_fail("out of memory");
+        }
+        rt_line[rt_len++] = (char)c;
+        if (c == '\n')
+            break;
+    }
+    return rt_len > 0;
+}
+
+/* Skip blanks across lines, 0 at the end of the input */
+static int rt_skip_blanks(void)
+{
+    for (;;) {
+        while (rt_pos < rt_len && strchr(" \t\r\n\v\f", rt_line[rt_pos]) != NULL)
+            rt_pos++;
+        if (rt_pos < rt_len)
+            return 1;
+        if (!rt_fill())
+            return 0;
+    }
+}
+
+static size_t rt_digits(size_t p)
+{
+    while (p < rt_len && rt_line[p] >= '0' && rt_line[p] <= '9')
+        p++;
+    return p;
+}
+
+static void put_s(signed char *s)
+{
+    fputs((const char *)s, stdout);
+}
+
+static void get_s(signed char *s)
+{
+    size_t n;
+    if (rt_pos >= rt_len && !rt_fill()) {
+        s[0] = 0;
+        return;
+    }
+    n = rt_len - rt_pos;
+    while (n > 0 && (rt_line[rt_pos + n - 1] == '\n' || rt_line[rt_pos + n - 1] == '\r'))
+        n--;
+    memcpy(s, rt_line + rt_pos, n);
+    s[n] = 0;
+    rt_pos = rt_len;
+}
+
+static void put_i(int i)
+{
+    printf("%d", i);
+}
+
+/* [+-]?[0-9]+, wrapping around on 32 bits; 0 if there is none */
+static int get_i(void)
+{
+    size_t p, end;
+    unsigned value = 0;
+    if (!rt_skip_blanks())
+        return 0;
+    p = rt_pos;
+    if (rt_line[p] == '+' || rt_line[p] == '-')
+        p++;
+    end = rt_digits(p);
+    if (end == p)
+        return 0;
+    for (; p < end; p++)
+        value = value * 10u + (unsigned)(rt_line[p] - '0');
+    if (rt_line[rt_pos] == '-')
+        value = 0u - value;
+    rt_pos = end;
+    return (int)value;
+}
+
+static void put_d(double d)
+{
+    if (isnan(d))
+        fputs("nan", stdout);
+    else
+        printf("%g", d);
+}
+
+/* [+-]?([0-9]+\.?[0-9]* | \.[0-9]+)([eE][+-]?[0-9]+)?, 0 if there is none */
+static double get_d(void)
+{
+    size_t p, start, end;
+    char buffer[512];
+    double value;
+    if (!rt_skip_blanks())
+        return 0.0;
+    p = rt_pos;
+    if (rt_line[p] == '+' || rt_line[p] == '-')
+        p++;
+    start = p;
+    end = rt_digits(p);
+    if (end > start) {
+        if (end < rt_len && rt_line[end] == '.')
+            end = rt_digits(end + 1);
+    } else if (p < rt_len && rt_line[p] == '.' && rt_digits(p + 1) > p + 1) {
+        end = rt_digits(p + 1);
+    } else {
+        return 0.0;
+    }
+    if (end < rt_len && (rt_line[end] == 'e' || rt_line[end] == 'E')) {
+        p = end + 1;
+        if (p < rt_len && (rt_line[p] == '+' || rt_line[p] == '-'))
+            p++;
+        if (rt_digits(p) > p)
+            end = rt_digits(p);
+    }
+    if (end - rt_pos >= sizeof buffer)
+        rt_fail("get_d: number too long");
+    memcpy(buffer, rt_line + rt_pos, end - rt_pos);
+    buffer[end - rt_pos] = 0;
+    value = strtod(buffer, NULL);
+    rt_pos = end;
+    return value;
+}
+
+static void put_c(signed char c)
+{
+    putchar((unsigned char)c);
+}
+
+static signed char get_c(void)
+{
+    if (rt_pos >= rt_len && !rt_fill())
+        return -1;
+    return (signed char)rt_line[rt_pos++];
+}
+
+static double seconds(void)
+{
+#ifdef CLOCK_MONOTONIC
+    struct timespec t;
+    clock_gettime(CLOCK_MONOTONIC, &t);
+    return (double)t.tv_sec + (double)t.tv_nsec * 1e-9;
+#else
+    return (double)clock() / CLOCKS_PER_SEC;
+#endif
+}
@@ -0,0 +1,259 @@
+"""Parallel batch compilation.
+
+Compiles many AtomC files with a pool of worker processes. Each file is
+compiled into its own output buffer and the buffers are merged in sorted
+filename order, so the report is the same whatever the number of jobs.
+Files are handed out largest first so that a big file does not start last
+and leave one worker running alone at the end. Progress and timings go to
+stderr, never into the report. With --cache, unchanged files are answered
+from a CompileCache without lexing or parsing them. A path of - is the
+standard input, compiled by this process as it is read (see
+compiler.compile_file) and never cached.
+
+Usage: python batch.py [-j N] [--timeout S] [--cache DIR] [--recover] [-o report.txt] [--times times.tsv] paths...
+"""
+import io
+import os
+import signal
+import sys
+import time
+from contextlib import redirect_stdout
+
+from compile_cache import CompileCache
+from parser_trace import TRACE_OFF, TRACE_LEVELS, trace_level
+
+REPORT_HEADER = "===== Compiler Analysis Results =====\n"
+REPORT_FOOTER = "\n===== Analysis Complete =====\n"
+
+
+class CompileTimeout(Exception):
+    """A file took longer than the per-file timeout"""
+
+
+def _alarm(signum, frame):
+    raise CompileTimeout()
+
+
+_caches = {}  # Cache directory -> CompileCache of this process
+
+
+def open_cache(directory):
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = CompileCache(directory)
+    return cache
+
+
+STDIN = "-"  # Path standing for the standard input
+
+
+def collect_files(paths):
+    """(name, path) of the files to compile, sorted by name. Directories are
+    walked recursively and their files named relative to the directory;
+    STDIN is named <stdin>."""
+    files = []
+    for path in paths:
+        if path == STDIN:
+            files.append(("<stdin>", STDIN))
+        elif os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for filename in filenames:
+                    full = os.path.join(dirpath, filename)
+                    files.append((os.path.relpath(full, path), full))
+        elif os.path.isfile(path):
+            files.append((os.path.basename(path), path))
+        else:
+            raise FileNotFoundError(path)
+    files.sort()
+    return files
+
+
+def print_error(kind, message, line, column):
+    if kind == "syntax":
+        print(f"Syntax error: {message} at line {line}, column {column}")
+    else:
+        print(f"Semantic error: {message}")
+
+
+def print_result(name, result):
+    """Print the outcome of a compilation (a CompileResult or a cached one)"""
+    for offset, char in result.lex_errors:
+        print(f"Illegal character '{char}'")
+    if result.diagnostics:
+        for d in result.diagnostics:
+            print_error(d.kind, d.message, d.line, d.column)
+        if result.truncated:
+            print(f"Too many errors: stopped after {len(result.diagnostics)}")
+    elif result.error_kind:
+        print_error(result.error_kind, result.error, result.line, result.column)
+    else:
+        print(f"Result for {name}: {'SUCCESS' if result else 'FAILURE'}")
+
+
+def compile_one(job):
+    """Compile one file into its report section.
+    Returns (name, report text, status, wall time, cache state), the cache
+    state being "hit", "miss" or None without a cache."""
+    name, path, timeout, trace, cache_dir, lexer_backend, max_errors = job
+    out = io.StringIO()
+    status = "error"
+    cached = None
+    use_alarm = timeout and hasattr(signal, "setitimer")
+    t0 = time.perf_counter()
+    with redirect_stdout(out):
+        print(f"\nProcessing file: {name}")
+        try:
+            if use_alarm:
+                signal.signal(signal.SIGALRM, _alarm)
+                signal.setitimer(signal.ITIMER_REAL, timeout)
+            try:
+                options = {"recover": True, "max_errors": max_errors} if max_errors else {}
+                if path == STDIN:
+                    # Streamed as it is read: there is no text to key the cache with
+                    from compiler import compile_file
+                    result = compile_file(sys.stdin, lexer_backend=lexer_backend, trace=trace, trace_sink=print,
+                                          **options)
+                else:
+                    with open(path, 'r') as f:
+                        text = f.read()
+                    result = None
+                    # A traced compilation prints more than the cached outcome
+                    cache = open_cache(cache_dir) if cache_dir and not trace else None
+                    if cache:
+                        key = cache.key(text, f"recover:{max_errors}" if max_errors else "")
+                        result = cache.get(key)
+                        cached = "miss" if result is None else "hit"
+                    if result is None:
+                        from compiler import compile_source
+                        result = compile_source(text, lexer_backend=lexer_backend, trace=trace, trace_sink=print,
+                                                **options)
+                        if cache:
+                            cache.put(key, result.summary())
+            finally:
+                if use_alarm:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+            print_result(name, result)
+            status = result.error_kind or ("success" if result else "failure")
+        except CompileTimeout:
+            print(f"Timeout: {name} took more than {timeout}s")
+            status = "timeout"
+        except Exception:
+            import traceback
+            print(f"\n Error processing {name}:")
+            traceback.print_exc(file=out)
+            print("=" * 50)
+    return name, out.getvalue(), status, time.perf_counter() - t0, cached
+
+
+def run_batch(files, jobs=1, timeout=None, trace=TRACE_OFF, progress=None, cache_dir=None, lexer_backend="ply",
+              max_errors=0):
+    """Compile (name, path) files and return
+    {name: (text, status, seconds, cache state)}.
+    progress, if given, is called with (done, total, name, status) after
+    each file. The cache in cache_dir, if given, is pruned at the end.
+    With max_errors, the parser recovers from errors and reports up to
+    max_errors of them per file."""
+    # Largest files first, by name among equal sizes
+    order = sorted(files, key=lambda f: (-os.path.getsize(f[1]) if f[1] != STDIN else 0, f[0]))
+    work = [(name, path, timeout, trace, cache_dir, lexer_backend, max_errors) for name, path in order]
+    results = {}
+
+    def record(item):
+        name, text, status, seconds, cached = item
+        results[name] = (text, status, seconds, cached)
+        if progress:
+            progress(len(results), len(work), name, status)
+
+    if jobs <= 1:
+        for job in work:
+            record(compile_one(job))
+    else:
+        # The standard input can only be read by this process
+        for job in work:
+            if job[1] == STDIN:
+                record(compile_one(job))
+        from multiprocessing import Pool
+        with Pool(jobs) as pool:
+            for item in pool.imap_unordered(compile_one, [job for job in work if job[1] != STDIN], chunksize=1):
+                record(item)
+    if cache_dir:
+        open_cache(cache_dir).prune()
+    return results
+
+
+def write_report(results, out):
+    """Write the report sections in sorted filename order"""
+    out.write(REPORT_HEADER)
+    for name in sorted(results):
+        out.write(results[name][0])
+    out.write(REPORT_FOOTER)
+
+
+def stderr_progress(done, total, name, status):
+    sys.stderr.write(f"\r[{done}/{total}] {status:8} {name[:60]:60}")
+    if done == total:
+        sys.stderr.write("\n")
+    sys.stderr.flush()
+
+
+def main(argv=None):
+    import argparse
+    from lexical_analyzer import LEXER_BACKENDS
+    from syntax_analyzer import DEFAULT_MAX_ERRORS
+    ap = argparse.ArgumentParser(description="Compile AtomC files in parallel")
+    ap.add_argument("paths", nargs="*", default=["tests"], help="files or directories, - for stdin (default: tests)")
+    ap.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="worker processes")
+    ap.add_argument("--timeout", type=float, default=None, help="per-file timeout in seconds")
+    ap.add_argument("-o", "--output", default=None, help="report file (default: stdout)")
+    ap.add_argument("--cache", default=None, metavar="DIR", help="compile cache directory")
+    ap.add_argument("--cache-max-mb", type=float, default=64, help="cache size bound (LRU eviction)")
+    ap.add_argument("--times", default=None, help="write per-file wall times to this TSV file")
+    ap.add_argument("--trace", default="off", choices=sorted(TRACE_LEVELS), help="parser trace in the report")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    ap.add_argument("--recover", action="store_true", help="report every error of a file, not only the first")
+    ap.add_argument("--max-errors", type=int, default=DEFAULT_MAX_ERRORS, help="errors reported per file with --recover")
+    ap.add_argument("-q", "--quiet", action="store_true", help="no progress or summary")
+    args = ap.parse_args(argv)
+
+    files = collect_files(args.paths)
+    if args.cache:
+        open_cache(args.cache).max_bytes = int(args.cache_max_mb * (1 << 20))
+    t0 = time.perf_counter()
+    results = run_batch(files, args.jobs, args.timeout, trace_level(args.trace),
+                        None if args.quiet else stderr_progress, args.cache, args.lexer,
+                        max(args.max_errors, 1) if args.recover else 0)
+    wall = time.perf_counter() - t0
+
+    if args.output:
+        with open(args.output, "w") as out:
+            write_report(results, out)
+    else:
+        write_report(results, sys.stdout)
+
+    by_time = sorted(results.items(), key=lambda item: -item[1][2])
+    if args.times:
+        with open(args.times, "w") as out:
+            out.write("file\tstatus\tseconds\tcache\n")
+            for name, (text, status, seconds, cached) in by_time:
+                out.write(f"{name}\t{status}\t{seconds:.6f}\t{cached or '-'}\n")
+    if not args.quiet:
+        counts = {}
+        for text, status, seconds, cached in results.values():
+            counts[status] = counts.get(status, 0) + 1
+        cpu = sum(item[2] for item in results.values())
+        summary = ", ".join(f"{n} {status}" for status, n in sorted(counts.items()))
+        sys.stderr.write(f"{len(results)} files ({summary}) in {wall:.3f}s wall, "
+                         f"{cpu:.3f}s compiling, {args.jobs} jobs\n")
+        if args.cache:
+            hits = sum(1 for item in results.values() if item[3] == "hit")
+            misses = sum(1 for item in results.values() if item[3] == "miss")
+            evicted = open_cache(args.cache).evictions
+            sys.stderr.write(f"cache: {hits} hits, {misses} misses, {evicted} evicted\n")
+        for name, (text, status, seconds, cached) in by_time[:10]:
+            sys.stderr.write(f"  {seconds:8.3f}s  {status:8}  {cached or '':4}  {name}\n")
+    return 1 if any(item[1] in ("timeout", "error") for item in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+"""Cost of building the syntax tree.
+
+Parses a generated program with and without build_ast and reports the
+parse time overhead of the tree, its node count and its memory per node
+(typed arrays, interned values/types/symbols and the lists holding them),
+measured with tracemalloc. A walk over the tree and a Visitor pass are
+timed as well.
+
+Usage: python benchmarks/bench_ast.py [functions]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from syntax_analyzer import CompilationContext, Parser  # noqa: E402
+from syntax_tree import Visitor  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+def generate(n):
+    parts = ["struct P{ int x; double y; char name[8]; };", "struct P pts[16];", "double total;"]
+    for i in range(n):
+        parts.append(f"""int g{i}; double h{i}[4];
+int f{i}(int a, double b, char c)
+{{
+    int k; int v[10]; double d;
+    d = b * 2.5 + a / 3 - c;
+    for(k = 0; k < 10; k = k + 1){{
+        v[k] = a * k + (int)d - v[k] / 2;
+        if(v[k] > a && d <= b || !c) total = total + v[k] * 1.5;
+        else pts[k].x = pts[k].x + k;
+    }}
+    while(a != 0){{ a = a - 1; d = -d + (double)a; put_d(d); }}
+    return v[a] + (int)(d * b) + c;
+}}""")
+    return "\n".join(parts)
+
+
+def parse(tokens, build_ast):
+    parser = Parser(tokens, CompilationContext(), build_ast=build_ast)
+    parser.unit()
+    return parser.ast
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t0
+        best = t if best is None or t < best else best
+    return best
+
+
+class Counter(Visitor):
+    """Counts the calls, visiting every node"""
+
+    def __init__(self, tree):
+        super().__init__(tree)
+        self.calls = 0
+
+    def visit_CALL(self, n):
+        self.calls += 1
+        self.generic_visit(n)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    tokens = tokenize(CompilationContext().lexer, generate(n))
+
+    # Interleaved, so that both see the same machine load
+    plain = with_ast = None
+    for _ in range(7):
+        t = best_of(lambda: parse(tokens, False), 1)
+        plain = t if plain is None else min(plain, t)
+        t = best_of(lambda: parse(tokens, True), 1)
+        with_ast = t if with_ast is None else min(with_ast, t)
+
+    tracemalloc.start()
+    tree = parse(tokens, True)
+    # The parse itself retains the global symbols; count what the tree adds
+    tree_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    ctx = CompilationContext()
+    Parser(tokens, ctx).unit()
+    plain_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del ctx
+    nodes = len(tree)
+
+    walk = best_of(lambda: sum(1 for _ in tree.walk()))
+    visit = best_of(lambda: Counter(tree).visit())
+
+    print(f"{n} functions, {len(tokens)} tokens, {nodes} nodes ({nodes / len(tokens):.2f} per token)")
+    print(f"  parse            {plain * 1e3:8.1f} ms")
+    print(f"  parse + tree     {with_ast * 1e3:8.1f} ms  (+{(with_ast / plain - 1) * 100:.1f}%)")
+    print(f"  tree memory      {(tree_size - plain_size) / nodes:8.1f} B/node"
+          f"  ({(tree_size - plain_size) / 1024:.0f} KiB)")
+    print(f"  walk()           {nodes / walk / 1e6:8.2f} M nodes/s")
+    print(f"  Visitor          {nodes / visit / 1e6:8.2f} M nodes/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""Run time of compute-heavy AtomC programs on each execution backend.
+
+The programs (a sieve, a matrix multiply, a scan of a struct array like
+tests/9.c, the calls of tests/0.c) run on the bytecode VM (vm.py), as
+translated Python (pybackend.py) and as native code (cbackend.py, when a C
+compiler is found; its time includes starting the process). Each one
+reports its best run time and its speedup over the VM; their outputs must
+be the same. The compile time of the Python backend is shown cold and
+from its memory cache, the build time of the C backend cold.
+
+Usage: python benchmarks/bench_backends.py [scale]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from cbackend import CBuildError, compile_c, temporary_cache  # noqa: E402
+from codegen import compile_program  # noqa: E402
+from pybackend import compile_python  # noqa: E402
+from vm import Console, Machine  # noqa: E402
+
+PROGRAMS = {
+    "sieve": """
+char composite[20000];
+void main()
+{
+    int i, j, r, count;
+    for(r = 0; r < {n}; r = r + 1){
+        count = 0;
+        for(i = 0; i < 20000; i = i + 1) composite[i] = 0;
+        for(i = 2; i < 20000; i = i + 1){
+            if(!composite[i]){
+                count = count + 1;
+                for(j = i * 2; j < 20000; j = j + i) composite[j] = 1;
+            }
+        }
+    }
+    put_i(count);
+}""",
+    "matmul": """
+double a[1600];
+double b[1600];
+double c[1600];
+void main()
+{
+    int i, j, k, r, n;
+    double s;
+    n = 40;
+    for(i = 0; i < n * n; i = i + 1){ a[i] = i / n + 1; b[i] = 1.0 / (i + 1); }
+    for(r = 0; r < {n}; r = r + 1){
+        for(i = 0; i < n; i = i + 1){
+            for(j = 0; j < n; j = j + 1){
+                s = 0.0;
+                for(k = 0; k < n; k = k + 1) s = s + a[i * n + k] * b[k * n + j];
+                c[i * n + j] = s;
+            }
+        }
+    }
+    put_d(c[n * n - 1]);
+}""",
+    "structs": """
+struct Pt{
+    int x, y;
+};
+struct Pt points[1000];
+int count()
+{
+    int i, n;
+    for(i = n = 0; i < 1000; i = i + 1){
+        if(points[i].x >= 0 && points[i].y >= 0) n = n + 1;
+    }
+    return n;
+}
+void main()
+{
+    int i, r, total;
+    for(i = 0; i < 1000; i = i + 1){ points[i].x = i - 300; points[i].y = 700 - i; }
+    total = 0;
+    for(r = 0; r < {n} * 10; r = r + 1) total = total + count();
+    put_i(total);
+}""",
+    "calls": """
+int sum()
+{
+    int i, v[5], s;
+    s = 0;
+    for(i = 0; i < 5; i = i + 1){ v[i] = i; s = s + v[i]; }
+    return s;
+}
+void main()
+{
+    int i, s;
+    for(i = 0; i < {n} * 4000; i = i + 1) s = sum();
+    put_i(s);
+}""",
+}
+
+
+def run_vm(program):
+    out = io.BytesIO()
+    Machine(program, Console(io.BytesIO(), out)).run()
+    return out.getvalue()
+
+
+def run_python(program):
+    out = io.BytesIO()
+    program.run(Console(io.BytesIO(), out))
+    return out.getvalue()
+
+
+def run_c(program):
+    done = program.run()
+    if done.returncode != 0:
+        raise SystemExit(f"native program failed: {done.stderr.decode()}")
+    return done.stdout
+
+
+def best_of(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        t = time.perf_counter() - t0
+        best = t if best is None or t < best else best
+    return best, result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    cache = temporary_cache()
+    print(f"{'program':10} {'vm':>10} {'python':>10} {'speedup':>8} {'c':>10} {'speedup':>8}"
+          f"   python compile: cold / cached   c build")
+    for name, template in PROGRAMS.items():
+        source = template.replace("{n}", str(n))
+        bytecode = compile_program(source)[1]
+        t0 = time.perf_counter()
+        result, program = compile_python(source)
+        cold = time.perf_counter() - t0
+        if program is None:
+            raise SystemExit(f"{name}: {result.error}")
+        cached, _ = best_of(lambda: compile_python(source), 3)
+
+        vm_time, vm_out = best_of(lambda: run_vm(bytecode), 1)
+        py_time, py_out = best_of(lambda: run_python(program), 3)
+        if vm_out != py_out:
+            raise SystemExit(f"{name}: outputs differ: {vm_out!r} {py_out!r}")
+        line = f"{name:10} {vm_time * 1e3:8.1f}ms {py_time * 1e3:8.1f}ms {vm_time / py_time:7.1f}x"
+
+        try:
+            native = compile_c(source)[1]
+            t0 = time.perf_counter()
+            native.build(cache)
+            build = time.perf_counter() - t0
+        except CBuildError as e:
+            native = None
+            print(f"  (no native run: {e})")
+        if native is not None:
+            c_time, c_out = best_of(lambda: run_c(native), 3)
+            if c_out != vm_out:
+                raise SystemExit(f"{name}: native output differs: {vm_out!r} {c_out!r}")
+            line += f" {c_time * 1e3:8.1f}ms {vm_time / c_time:7.0f}x"
+        else:
+            line += f" {'-':>10} {'':8}"
+        line += f"   {cold * 1e3:.1f} ms / {cached * 1e6:.0f} us"
+        if native is not None:
+            line += f"   {build * 1e3:.0f} ms"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Small compiles through the compile daemon vs. cold processes.
+
+Writes small programs with program_generator.py (every tenth one with a
+syntax error), starts a daemon on a private socket and compiles every
+program each way:
+    cold       a fresh `python batch.py -q -j 1 file` process per file, as
+               a build system running the compiler does today
+    client     a fresh `python compile_client.py file` process per file,
+               answered by the warm daemon
+    connected  one DaemonClient connection sending every request: the
+               daemon's own cost, without any process start
+and reports the total and per-compile wall time of each, and the time the
+daemon took to start and warm its workers. The report of every file must
+be the same each way.
+
+Usage: python benchmarks/bench_daemon.py [--count N] [--workers N]
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from batch import REPORT_FOOTER, REPORT_HEADER  # noqa: E402
+from compile_client import DaemonClient, connect  # noqa: E402
+from program_generator import generate_program  # noqa: E402
+
+
+def write_programs(directory, count):
+    paths = []
+    for k in range(count):
+        text = generate_program(functions=2, depth=2, seed=k)
+        if k % 10 == 9:
+            text = text.replace(";", "", 1)
+        path = os.path.join(directory, f"p{k:04}.c")
+        with open(path, 'w') as f:
+            f.write(text)
+        paths.append(path)
+    return paths
+
+
+def cold(paths, sock):
+    reports = []
+    for path in paths:
+        out = subprocess.run([sys.executable, os.path.join(ROOT, "batch.py"), "-q", "-j", "1", path],
+                             capture_output=True, text=True)
+        reports.append(out.stdout[len(REPORT_HEADER):-len(REPORT_FOOTER)])
+    return reports
+
+
+def client(paths, sock):
+    reports = []
+    for path in paths:
+        out = subprocess.run([sys.executable, os.path.join(ROOT, "compile_client.py"), "--socket", sock,
+                              "--no-start", path], capture_output=True, text=True)
+        reports.append(out.stdout)
+    return reports
+
+
+def connected(paths, sock):
+    with DaemonClient(sock, start=False) as c:
+        return [c.compile(path)["report"] for path in paths]
+
+
+def start_daemon(sock, workers):
+    """Daemon process listening on sock, and the seconds it took to be ready"""
+    t0 = time.perf_counter()
+    daemon = subprocess.Popen([sys.executable, os.path.join(ROOT, "compile_daemon.py"), "--socket", sock,
+                               "--workers", str(workers), "--idle", "600"])
+    while True:
+        try:
+            connect(sock, start=False).close()
+            return daemon, time.perf_counter() - t0
+        except OSError:
+            if daemon.poll() is not None:
+                raise SystemExit("the daemon did not start")
+            time.sleep(0.01)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Compile daemon vs. cold compiler processes")
+    ap.add_argument("--count", type=int, default=1000, help="files compiled each way")
+    ap.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="daemon worker processes")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = write_programs(tmp, args.count)
+        sock = os.path.join(tmp, "daemon.sock")
+        daemon, ready = start_daemon(sock, args.workers)
+        print(f"{args.count} files; daemon ready in {ready:.2f}s with {args.workers} workers")
+        try:
+            results = {}
+            times = {}
+            for label, run in (("cold", cold), ("client", client), ("connected", connected)):
+                t0 = time.perf_counter()
+                results[label] = run(paths, sock)
+                elapsed = times[label] = time.perf_counter() - t0
+                print(f"  {label:10} {elapsed:8.2f}s  {elapsed / args.count * 1000:8.2f} ms/compile"
+                      f"  {times['cold'] / elapsed:6.1f}x")
+            with DaemonClient(sock, start=False) as c:
+                stats = c.request({"op": "stats"})
+                c.request({"op": "shutdown"})
+            daemon.wait(timeout=60)
+        finally:
+            if daemon.poll() is None:
+                daemon.terminate()
+                daemon.wait()
+        print(f"  daemon: {stats['compiled']} compiled, {stats['busy']} busy, {stats['errors']} errors")
+        for label, reports in results.items():
+            for path, report, expected in zip(paths, reports, results["cold"]):
+                if report != expected:
+                    raise SystemExit(f"{label}: report of {os.path.basename(path)} differs:\n"
+                                     f"{report}\n--- cold:\n{expected}")
+        print("  same reports each way")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Predictive (FIRST-set) dispatch vs. backtracking.
+
+Parses every file of tests/ with both strategies, checks that they agree on
+the outcome and on the global symbols left in the table, and reports the
+number of consume() attempts and the parse time of each. The agreement is
+then checked on MUTATIONS token sequences of those files with one token
+deleted, duplicated or replaced, which exercise the error paths.
+
+Usage: python benchmarks/bench_dispatch.py
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lexical_analyzer import lexer  # noqa: E402
+from syntax_analyzer import Parser, SemanticError  # noqa: E402
+from token_stream import END, TokenBuffer, tokenize  # noqa: E402
+
+MUTATIONS = 600
+
+
+def parse(tokens, backtrack):
+    parser = Parser(tokens, backtrack=backtrack)
+    attempts = [0]
+    original_consume = parser.consume
+
+    def counting_consume(code):
+        attempts[0] += 1
+        return original_consume(code)
+
+    parser.consume = counting_consume
+    t0 = time.perf_counter()
+    try:
+        parser.unit()
+        outcome = "SUCCESS"
+    except (SyntaxError, SemanticError) as e:
+        outcome = f"{type(e).__name__}: {e}"
+    except Exception as e:  # A mutated input may reach a semantic action that does not expect it
+        outcome = f"crash: {e!r}"
+    elapsed = time.perf_counter() - t0
+    names = [s.name for s in parser.ctx.symbols.begin]
+    return outcome, names, attempts[0], elapsed
+
+
+def mutate(rng, buf):
+    """Copy of a TokenBuffer with one token deleted, duplicated or replaced"""
+    tokens = [(buf.kinds[i], buf.value(i), buf.starts[i]) for i in range(len(buf) - 1)]  # END apart
+    i = rng.randrange(len(tokens))
+    op = rng.randrange(3)
+    if op == 0:
+        del tokens[i]
+    elif op == 1:
+        tokens.insert(i, tokens[rng.randrange(len(tokens))])
+    else:
+        tokens[i] = tokens[rng.randrange(len(tokens))]
+    mutated = TokenBuffer(buf.source)
+    mutated.extend(tokens)
+    mutated.append(END, None, len(buf.source))
+    return mutated
+
+
+def main():
+    print(f"{'file':8} {'same':>5} {'consume bt':>11} {'consume pd':>11} {'bt ms':>8} {'pd ms':>8}")
+    folder = os.path.join(ROOT, 'tests')
+    mismatches = 0
+    files = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            tokens = tokenize(lexer, f.read())
+        files.append(tokens)
+        bt = parse(tokens, True)
+        pd = parse(tokens, False)
+        same = bt[:2] == pd[:2]
+        mismatches += not same
+        print(f"{filename:8} {'yes' if same else 'NO':>5} {bt[2]:11} {pd[2]:11}"
+              f" {bt[3] * 1000:8.2f} {pd[3] * 1000:8.2f}")
+
+    rng = random.Random(0)
+    differ = 0
+    for _ in range(MUTATIONS):
+        tokens = mutate(rng, rng.choice(files))
+        bt = parse(tokens, True)
+        pd = parse(tokens, False)
+        if bt[:2] != pd[:2]:
+            differ += 1
+            print(f"mutated: {bt[0]} backtracking, {pd[0]} predictive")
+    print(f"{MUTATIONS} mutated token sequences, {differ} differ")
+    mismatches += differ
+    if mismatches:
+        print(f"{mismatches} input(s) differ between the two strategies")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Latency benchmark for the language server.
+
+Replays an edit session against a local lsp_server.py process and measures
+the time from sending each change to receiving the diagnostics for that
+version, and from sending each hover/definition request to its response.
+The default session opens a generated file of several thousand lines and
+types a statement into a few of its functions one character at a time,
+hovering and jumping to a definition after each statement. A session
+recorded from a real editor (lsp_server.py --record FILE) can be replayed
+instead.
+
+Usage: python benchmarks/bench_lsp.py [--functions N] [--interval S]
+       [--debounce S] [--session FILE] [--speed X]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lsp_server import read_message, write_message  # noqa: E402
+
+URI = "file:///bench/session.c"
+
+
+def generate_source(n_functions):
+    """AtomC source of n structs, globals and functions (9 lines each)"""
+    parts = []
+    for i in range(n_functions):
+        parts.append(f"""struct S{i}{{ int x; double y[4]; }};
+int g{i};
+int f{i}(int a, double b)
+{{
+    struct S{i} s;
+    int k;
+    for(k=0;k<10;k=k+1){{ if(a>k) s.x=s.x+k; else s.y[1]=b*2.0; }}
+    return s.x + g{i};
+}}""")
+    return "\n".join(parts)
+
+
+def position(text, offset):
+    line = text.count("\n", 0, offset)
+    return {"line": line, "character": offset - (text.rfind("\n", 0, offset) + 1)}
+
+
+def make_session(n_functions, interval, edits=3):
+    """Timed messages of a typing session, as recorded by lsp_server.py"""
+    text = generate_source(n_functions)
+    t = 0.0
+    msg_id = 0
+    version = 1
+    session = []
+
+    def add(message, delay=interval):
+        nonlocal t
+        session.append({"t": round(t, 6), "message": message})
+        t += delay
+
+    def request(method, params):
+        nonlocal msg_id
+        msg_id += 1
+        add({"jsonrpc": "2.0", "id": msg_id, "method": method, "params": params})
+
+    request("initialize", {"capabilities": {}})
+    add({"jsonrpc": "2.0", "method": "initialized", "params": {}})
+    add({"jsonrpc": "2.0", "method": "textDocument/didOpen", "params": {
+        "textDocument": {"uri": URI, "languageId": "atomc", "version": version, "text": text}}}, 1.0)
+
+    for e in range(edits):
+        f = (e + 1) * n_functions // (edits + 1)
+        pos = text.find("int k;\n", text.find(f"int f{f}(")) + len("int k;\n")
+        statement = f"    k = k + g{f} * s.x;\n"
+        for c in statement:
+            where = position(text, pos)
+            text = text[:pos] + c + text[pos:]
+            pos += 1
+            version += 1
+            add({"jsonrpc": "2.0", "method": "textDocument/didChange", "params": {
+                "textDocument": {"uri": URI, "version": version},
+                "contentChanges": [{"range": {"start": where, "end": where}, "text": c}]}})
+        target = text.rfind(f"g{f}", 0, pos)
+        request("textDocument/hover", {"textDocument": {"uri": URI}, "position": position(text, target)})
+        request("textDocument/definition", {"textDocument": {"uri": URI}, "position": position(text, target)})
+    return session
+
+
+def load_session(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(session, debounce, speed):
+    """Run the session against a server process. Returns the send times of
+    versions and requests and the received (time, message) list."""
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, "lsp_server.py"), "--debounce", str(debounce)],
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    received = []
+
+    def reader():
+        while True:
+            msg = read_message(proc.stdout)
+            if msg is None:
+                return
+            received.append((time.perf_counter(), msg))
+
+    thread = threading.Thread(target=reader, daemon=True)
+    thread.start()
+
+    sent_versions = {}  # version -> (send time, "open"/"change")
+    sent_requests = {}  # id -> (send time, method)
+    t0 = time.perf_counter()
+    for entry in session:
+        delay = t0 + entry["t"] / speed - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        msg = entry["message"]
+        if msg.get("method") in ("shutdown", "exit"):
+            continue  # Sent below, once everything was answered
+        now = time.perf_counter()
+        write_message(proc.stdin, msg)
+        method = msg.get("method")
+        if method in ("textDocument/didOpen", "textDocument/didChange"):
+            kind = "open" if method.endswith("didOpen") else "change"
+            sent_versions[msg["params"]["textDocument"]["version"]] = (now, kind)
+        elif "id" in msg:
+            sent_requests[msg["id"]] = (now, method)
+
+    # Wait until everything was answered, then stop the server
+    write_message(proc.stdin, {"jsonrpc": "2.0", "id": "bench-shutdown", "method": "shutdown"})
+    while not any(m.get("id") == "bench-shutdown" for _, m in received):
+        time.sleep(0.01)
+    write_message(proc.stdin, {"jsonrpc": "2.0", "method": "exit"})
+    proc.stdin.close()
+    proc.wait()
+    thread.join()
+    return sent_versions, sent_requests, received
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return "-"
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]  # noqa: E731
+    return (f"n={len(values):4}  p50 {pick(0.5) * 1e3:7.2f} ms  p95 {pick(0.95) * 1e3:7.2f} ms  "
+            f"max {values[-1] * 1e3:7.2f} ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    ap.add_argument("--functions", type=int, default=600, help="functions in the generated file (9 lines each)")
+    ap.add_argument("--interval", type=float, default=0.05, help="seconds between keystrokes")
+    ap.add_argument("--debounce", type=float, default=0.005)
+    ap.add_argument("--session", default=None, help="replay a session recorded by lsp_server.py --record")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed factor")
+    args = ap.parse_args()
+
+    session = load_session(args.session) if args.session else make_session(args.functions, args.interval)
+    sent_versions, sent_requests, received = replay(session, args.debounce, args.speed)
+
+    published = {}
+    answers = {}
+    for t, msg in received:
+        if msg.get("method") == "textDocument/publishDiagnostics":
+            v = msg["params"].get("version")
+            if v is not None and v not in published:
+                published[v] = t
+        elif "id" in msg:
+            answers[msg["id"]] = t
+
+    latency = {"open": [], "change": []}
+    superseded = 0
+    for v, (t, kind) in sent_versions.items():
+        if v in published:
+            latency[kind].append(published[v] - t)
+        else:
+            superseded += 1
+    requests = {}
+    for msg_id, (t, method) in sent_requests.items():
+        if msg_id in answers:
+            requests.setdefault(method, []).append(answers[msg_id] - t)
+
+    print(f"debounce {args.debounce * 1e3:.1f} ms, {len(session)} messages")
+    print(f"  open        {percentiles(latency['open'])}")
+    print(f"  diagnostics {percentiles(latency['change'])}   ({superseded} versions superseded)")
+    for method, values in sorted(requests.items()):
+        print(f"  {method.split('/')[-1]:11} {percentiles(values)}")
+
+
+if __name__ == '__main__':
+    main()
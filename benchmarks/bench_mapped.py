@@ -0,0 +1,124 @@
+"""Peak memory and throughput of mapped byte input vs. text input.
+
+Generates a valid AtomC file of the requested size (functions with long
+bodies, with non-ASCII text in comments and strings), then lexes and parses
+it in a fresh process for each input path and reports the peak RSS, the
+lexing time (whole-buffer paths only) and the time and MiB/s of lex+parse:
+    text           read() as str, tokenize() with the master-regex Scanner
+    text-stream    open_stream() over the text file, same Scanner
+    mapped         MappedSource + tokenize_mapped() (mapped_source.py)
+    mapped-stream  MappedSource + stream_mapped()
+Each path must find the same number of tokens. With --lex-only the input
+is only lexed (the stream paths count the tokens without keeping them), to
+measure the input layer alone on inputs too large to parse here.
+
+Usage: python benchmarks/bench_mapped.py [--size MB] [--modes text,mapped,...] [--lex-only]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+MODES = ("text", "text-stream", "mapped", "mapped-stream")
+
+
+def body(n):
+    lines = []
+    for k in range(120):
+        if k % 12 == 0:
+            lines.append(f"\t/* étape {k}: größe × {n} */\n")
+        if k % 30 == 0:
+            lines.append(f"\tput_s(\"naïve café n°{k}\");\n")
+        lines.append(f"\ts = s + i * {k} - (a / 2) + v[{k % 8}];  // ok\n")
+    return "".join(lines)
+
+
+def generate(path, size_mb):
+    size = size_mb * 1024 * 1024
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("int v[8];\n")
+        n = 0
+        text = body(0)
+        while f.tell() < size:
+            f.write(f"int f{n}(int a)\n{{\n\tint\t\ti, s;\n\tchar c;\n\ts = 0;\n\tc = 'x';\n"
+                    f"\tfor(i=0;i<a;i=i+1){{\n{text}\t}}\n\treturn s;\n}}\n")
+            n += 1
+
+
+def run(mode, path, lex_only=False):
+    """Lex and parse path in this process; print token count, peak RSS
+    (KiB), lexing seconds (or -1) and total seconds"""
+    from mapped_source import MappedSource, scan_mapped, stream_mapped, tokenize_mapped
+    from syntax_analyzer import CompilationContext, Parser
+    from token_stream import lex_stream, open_stream, tokenize
+
+    ctx = CompilationContext(lexer_backend="scanner")
+    lexed = -1
+    t0 = time.perf_counter()
+    if lex_only and mode.endswith("-stream"):
+        if mode == "text-stream":
+            tokens = lex_stream(ctx.lexer, open(path, 'r', encoding='utf-8'))
+        else:
+            tokens = scan_mapped(MappedSource(path), ctx.lex_errors)
+        count = sum(1 for _ in tokens)
+        elapsed = time.perf_counter() - t0
+        print(count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed, elapsed)
+        return
+    if mode == "text":
+        with open(path, 'r', encoding='utf-8') as f:
+            tokens = tokenize(ctx.lexer, f.read())
+        lexed = time.perf_counter() - t0
+    elif mode == "text-stream":
+        tokens = open_stream(ctx.lexer, open(path, 'r', encoding='utf-8'))
+    elif mode == "mapped":
+        tokens = tokenize_mapped(MappedSource(path), ctx.lex_errors)
+        lexed = time.perf_counter() - t0
+    else:
+        tokens = stream_mapped(MappedSource(path), ctx.lex_errors)
+    if not lex_only and not Parser(tokens, ctx).unit():
+        raise SystemExit(f"{mode}: parse failed")
+    elapsed = time.perf_counter() - t0
+    count = tokens.base + len(tokens)
+    print(count, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, lexed, elapsed)
+
+
+def main(argv=None):
+    if argv is None and len(sys.argv) > 2 and sys.argv[1] == '--run':
+        run(sys.argv[2], sys.argv[3], '--lex-only' in sys.argv[4:])
+        return
+    ap = argparse.ArgumentParser(description="Mapped byte input vs. text input")
+    ap.add_argument("--size", type=int, default=500, help="input size in MiB")
+    ap.add_argument("--modes", default=",".join(MODES), help="input paths to run, comma separated")
+    ap.add_argument("--lex-only", action="store_true", help="lex the input without parsing it")
+    args = ap.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'big.c')
+        generate(path, args.size)
+        size = os.path.getsize(path)
+        print(f"Input: {size / 2 ** 20:.0f} MiB")
+        print(f"  {'path':14} {'tokens':>11} {'peak RSS MiB':>13} {'lex s':>8} {'total s':>8} {'MiB/s':>7}")
+        counts = set()
+        for mode in args.modes.split(","):
+            command = [sys.executable, __file__, '--run', mode, path] + ['--lex-only'] * args.lex_only
+            out = subprocess.run(command, capture_output=True, text=True)
+            if out.returncode:
+                print(f"  {mode:14} failed: {(out.stderr or out.stdout).strip().splitlines()[-1]}")
+                continue
+            count, rss, lexed, elapsed = out.stdout.split()
+            counts.add(count)
+            lexed = f"{float(lexed):8.2f}" if float(lexed) >= 0 else f"{'-':>8}"
+            print(f"  {mode:14} {int(count):11} {int(rss) / 1024:13.1f} {lexed} {float(elapsed):8.2f}"
+                  f" {size / 2 ** 20 / float(elapsed):7.2f}")
+        if len(counts) > 1:
+            raise SystemExit(f"token counts differ: {sorted(counts)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Packrat memoization report.
+
+Parses every file of tests/ (and a generated deeply parenthesized
+expression) with and without packrat mode, and prints how many rule
+invocations and tokens of re-parsing the memo table saved.
+
+Usage: python benchmarks/bench_packrat.py [paren_depth]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lexical_analyzer import lexer  # noqa: E402
+from syntax_analyzer import Parser  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+def parse(data, packrat):
+    tokens = tokenize(lexer, data)
+    t0 = time.perf_counter()
+    parser = Parser(tokens, packrat=packrat)
+    parser.unit()
+    return time.perf_counter() - t0, parser.memo_stats
+
+
+def report(name, data):
+    plain, _ = parse(data, False)
+    memo, stats = parse(data, True)
+    print(f"{name:12} {stats['calls']:8} {stats['hits']:8} {stats['tokens_saved']:10}"
+          f" {plain * 1000:10.2f} {memo * 1000:10.2f}")
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+    print(f"{'file':12} {'calls':>8} {'hits':>8} {'tok saved':>10} {'plain ms':>10} {'packrat ms':>10}")
+    folder = os.path.join(ROOT, 'tests')
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            report(filename, f.read())
+    nested = "void main(){ int x; x = " + "(" * depth + "1" + ")" * depth + "; }"
+    report(f"parens({depth})", nested)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Cost of source positions.
+
+Compares tokenizing a large generated input while recording token start
+offsets against the same loop without them, then times what a diagnostic
+pays: building the LineIndex on first use and each position/snippet query.
+
+Usage: python benchmarks/bench_positions.py [n_functions]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lexical_analyzer import lexer  # noqa: E402
+from token_stream import END, TOKEN_CODES, TokenBuffer, tokenize  # noqa: E402
+
+
+def generate_source(n_functions):
+    return "\n".join(
+        f"int f{i}(int a)\n{{\n\tint i;\n\tfor(i=0;i<a;i=i+1){{\n\t\ta = a*2+i;\n\t}}\n\treturn a;\n}}"
+        for i in range(n_functions))
+
+
+def tokenize_without_positions(data):
+    lexer.input(data)
+    buf = TokenBuffer(data)
+    append = buf.append
+    codes = TOKEN_CODES
+    while True:
+        tok = lexer.token()
+        if not tok:
+            break
+        append(codes[tok.type], tok.value)
+    append(END)
+    return buf
+
+
+def best_of(fn, *args, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    n_functions = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    data = generate_source(n_functions)
+
+    plain, _ = best_of(tokenize_without_positions, data)
+    positioned, buf = best_of(tokenize, lexer, data)
+    n = len(buf)
+    print(f"{n:,} tokens, {data.count(chr(10)) + 1:,} lines")
+    print(f"  tokenize without positions {plain:7.3f}s   with start offsets {positioned:7.3f}s"
+          f"   overhead {100 * (positioned / plain - 1):+5.1f}%")
+
+    t0 = time.perf_counter()
+    buf.position(n - 1)
+    print(f"  first diagnostic (builds line index) {1000 * (time.perf_counter() - t0):8.2f} ms")
+
+    queries = range(0, n, max(n // 10000, 1))
+    t0 = time.perf_counter()
+    for i in queries:
+        buf.position(i)
+    print(f"  position query {1e6 * (time.perf_counter() - t0) / len(queries):8.2f} us")
+    t0 = time.perf_counter()
+    for i in queries:
+        buf.snippet(i)
+    print(f"  snippet query  {1e6 * (time.perf_counter() - t0) / len(queries):8.2f} us")
+
+
+if __name__ == '__main__':
+    main()
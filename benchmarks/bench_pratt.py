@@ -0,0 +1,247 @@
+"""The precedence engine (Parser(pratt=True)) against the recursive rules.
+
+First checks that both give the same results: random expressions (valid or
+not) over variables, arrays, structs and functions parsed with expr(), and
+the corpus files of tests/, generated programs and mutated copies of them
+parsed whole, with and without a syntax tree and with error recovery. The
+RetVal of each expression (type, lvalue, constant and its value), the
+error and the token it is raised at, the syntax tree and the diagnostics
+must be the same.
+
+Then parses expressions and statements nested deeper than the Python
+recursion limit, which only the precedence engine gets through, and times
+the parse of an expression of each shape with both, in microseconds, and
+the tokens per second of the corpus.
+
+Usage: python benchmarks/bench_pratt.py [expressions] [repeat]
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from bench_recovery import mutate  # noqa: E402
+from lexical_analyzer import lexer  # noqa: E402
+from program_generator import generate_program  # noqa: E402
+from syntax_analyzer import CompilationContext, Parser, RetVal, SemanticError  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+PRELUDE = """
+struct P{ int a; double b; int v[4]; };
+struct P p, ps[3];
+int i, j, ia[5];
+double d, da[5];
+char c, ca[8];
+int f(int x, double y){ return x; }
+double g(){ return 1.0; }
+void h(){ }
+"""
+INTS = ["i", "j", "ia[1]", "ia[i]", "p.a", "ps[j].a", "p.v[2]", "c", "f(i, d)", "1", "2", "7", "'x'", "0"]
+DOUBLES = ["d", "da[2]", "p.b", "ps[1].b", "g()", "2.5", "0.5"]
+ODD = ["p", "ia", "ca", "\"str\"", "h()", "f", "i[1]", "p.z", "q", "d[0]", "f(1)(2)", "(p).a"]
+SHAPES = {  # Expressions timed, by shape
+    "constant": "1",
+    "variable": "i",
+    "arithmetic": "i + j * 2 - ia[1] / 3",
+    "long chain": " + ".join(["i", "j", "d", "c"] * 8),
+    "comparison": "i < j && d >= 2.5 || !(c == 'x')",
+    "assignment": "i = j = ia[2] = p.a + 1",
+    "nested": "((((i + 1) * (j - 2)) / ((d + 3) - (p.b * 4))) + f(i, (d)))",
+    "cast": "(int)d + (double)i * (char)j",
+    "calls": "f(f(i, d), g()) + f(ia[f(1, 2.0)], da[i])",
+}
+ENGINES = (("recursive", {}), ("precedence", {"pratt": True}))
+
+
+def prelude_context():
+    """A context with the prelude's globals and the function being parsed"""
+    ctx = CompilationContext()
+    Parser(tokenize(lexer, PRELUDE), ctx).unit()
+    ctx.crtFunc = ctx.symbols.find("h")  # Lets an assignment declare an unknown name
+    ctx.crtDepth = 1
+    return ctx
+
+
+def random_expr(rng, depth=0):
+    """A random expression, mostly well typed"""
+    r = rng.random()
+    if depth > 4 or r < 0.3:
+        pool = rng.choice((INTS, INTS, DOUBLES, ODD if rng.random() < 0.1 else INTS))
+        return rng.choice(pool)
+    if r < 0.55:
+        op = rng.choice(["+", "-", "*", "/", "<", "<=", ">", ">=", "==", "!=", "&&", "||", "="])
+        return f"{random_expr(rng, depth + 1)} {op} {random_expr(rng, depth + 1)}"
+    if r < 0.65:
+        return f"{rng.choice(['-', '!', '- -', '-!'])}{random_expr(rng, depth + 1)}"
+    if r < 0.75:
+        return f"({rng.choice(['int', 'double', 'char', 'struct P', 'int[2]'])}){random_expr(rng, depth + 1)}"
+    if r < 0.85:
+        return f"({random_expr(rng, depth + 1)})"
+    if r < 0.92:
+        return f"ia[{random_expr(rng, depth + 1)}]"
+    return f"f({random_expr(rng, depth + 1)}, {random_expr(rng, depth + 1)})"
+
+
+def damage(text, rng):
+    """text with a token dropped, doubled or replaced, or cut short"""
+    words = text.split(" ")
+    k = rng.randrange(len(words))
+    op = rng.random()
+    if op < 0.3:
+        del words[k]
+    elif op < 0.5:
+        words.insert(k, words[k])
+    elif op < 0.8:
+        words[k] = rng.choice(["(", ")", "[", "]", ",", "+", "=", "-", "!", "int", ".", ";", "(int)"])
+    else:
+        words = words[:k]
+    return " ".join(words)
+
+
+def tree_state(tree):
+    """Everything a syntax tree holds, comparable across parses"""
+    if tree is None:
+        return None
+    return (tree.kinds.tolist(), tree.tokens.tolist(), tree.type_ids.tolist(), tree.refs.tolist(),
+            tree.firsts.tolist(), tree.nexts.tolist(), list(tree.stack), [repr(t) for t in tree.types],
+            [s.name for s in tree.symbols], tree.constants)
+
+
+def parse_expr(text, **options):
+    """(outcome, end token or error position, RetVal fields, tree) of text parsed by expr()"""
+    parser = Parser(tokenize(lexer, text), prelude_context(), **options)
+    rv = RetVal()
+    try:
+        ok = parser.expr(rv)
+    except (SyntaxError, SemanticError, TypeError) as e:  # Folding 'x' - 1 raises a TypeError
+        return f"{type(e).__name__}: {e}", parser.pos, None, None
+    symbol = rv.symbol.name if rv.symbol is not None else None
+    return ok, parser.pos, (repr(rv.type), rv.isLVal, rv.isCtVal, rv.ctVal, symbol), tree_state(parser.ast)
+
+
+def parse_unit(text, **options):
+    """(outcome, error position, diagnostics, tree) of a whole program"""
+    ctx = CompilationContext()
+    parser = Parser(tokenize(ctx.lexer, text), ctx, **options)
+    try:
+        ok = parser.unit()
+    except (SyntaxError, SemanticError) as e:
+        return f"{type(e).__name__}: {e}", parser.pos, None, None
+    diagnostics = [(d.kind, d.message, d.line, d.column) for d in parser.diagnostics or ()]
+    return ok, parser.pos, diagnostics, tree_state(parser.ast)
+
+
+def equivalence(corpus, expressions):
+    rng = random.Random(23)
+    for k in range(expressions):
+        text = random_expr(rng)
+        if rng.random() < 0.3:
+            text = damage(text, rng)
+        for options in ({}, {"build_ast": True}):
+            old = parse_expr(text, **options)
+            new = parse_expr(text, pratt=True, **options)
+            if old != new:
+                raise SystemExit(f"expression {text!r} {options}:\n  recursive  {old}\n  precedence {new}")
+    print(f"{expressions} random expressions: same results")
+
+    programs = list(corpus)
+    for seed in range(8):
+        programs.append((f"generated~{seed}", generate_program(functions=6, depth=4, seed=seed)))
+    mutated = [(f"{name}~{k}", mutate(text, rng, rng.randint(1, 10))) for k in range(4) for name, text in programs]
+    cases = 0
+    for name, text in programs + mutated:
+        for options in ({}, {"build_ast": True}, {"recover": True}, {"recover": True, "build_ast": True}):
+            old = parse_unit(text, **options)
+            new = parse_unit(text, pratt=True, **options)
+            if old != new:
+                raise SystemExit(f"{name} {options}:\n  recursive  {old[:3]}\n  precedence {new[:3]}")
+            cases += 1
+    print(f"{cases} program parses ({len(programs)} programs, {len(mutated)} mutated): same results")
+
+
+def deep_nesting(depth):
+    """Parse deeply nested inputs with both engines"""
+    inputs = {
+        "parentheses": "int x; void main(){ x = " + "(" * depth + "1" + ")" * depth + "; }",
+        "unary minus": "int x; void main(){ x = " + "- " * depth + "1; }",
+        "assignments": "int x; void main(){ " + "x = " * depth + "1; }",
+        "indexes": "int a[2]; void main(){ " + "a[" * depth + "0" + "]" * depth + " = 1; }",
+        "blocks": "void main(){ " + "{ " * depth + "}" * depth + " }",
+        "ifs": "int x; void main(){ " + "if(x) " * depth + "x = 1; }",
+    }
+    print(f"{'nesting ' + str(depth):>22} {'recursive':>16} {'precedence':>16}")
+    for label, text in inputs.items():
+        outcomes = []
+        for _, options in ENGINES:
+            try:
+                outcomes.append("ok" if parse_unit(text, **options)[0] is True else "error")
+            except RecursionError:
+                outcomes.append("RecursionError")
+        print(f"{label:>22} {outcomes[0]:>16} {outcomes[1]:>16}")
+        if outcomes[1] != "ok":
+            raise SystemExit(f"the precedence engine failed on nested {label}")
+
+
+def time_expr(tokens, repeat, options):
+    """Seconds of one parse of the expression in tokens"""
+    ctx = prelude_context()
+    parsers = [Parser(tokens, ctx, **options) for _ in range(repeat)]
+    t0 = time.perf_counter()
+    for parser in parsers:
+        parser.expr(RetVal())
+    return (time.perf_counter() - t0) / repeat
+
+
+def best_times(run, rounds=7):
+    """Best time of run(options) for each engine, the engines interleaved"""
+    best = [None] * len(ENGINES)
+    for _ in range(rounds):
+        for k, (_, options) in enumerate(ENGINES):
+            t = run(options)
+            best[k] = t if best[k] is None else min(best[k], t)
+    return best
+
+
+def timing(corpus, repeat):
+    print(f"{'expression':>14} {'tokens':>6} {'recursive us':>13} {'precedence us':>14} {'speedup':>8}"
+          f" {'tree: rec us':>13} {'prec us':>8} {'speedup':>8}")
+    for label, text in SHAPES.items():
+        tokens = tokenize(lexer, text)
+        row = []
+        for tree in ({}, {"build_ast": True}):
+            times = best_times(lambda options: time_expr(tokens, repeat, dict(options, **tree)))
+            row.append(f"{times[0] * 1e6:13.2f} {times[1] * 1e6:{14 if not tree else 8}.2f} {times[0] / times[1]:7.2f}x")
+        print(f"{label:>14} {len(tokens) - 1:6} {row[0]} {row[1]}")
+
+    lexed = [tokenize(lexer, text) for _, text in corpus]
+    n_tokens = sum(len(tokens) for tokens in lexed)
+    for tree in ({}, {"build_ast": True}):
+        def run(options):
+            t0 = time.perf_counter()
+            for tokens in lexed:
+                Parser(tokens, **options, **tree).unit()
+            return (time.perf_counter() - t0) / n_tokens
+
+        times = best_times(run, max(repeat // 100, 5))
+        print(f"corpus{' with trees' if tree else ''}: recursive {1 / times[0]:.0f} tokens/s, "
+              f"precedence {1 / times[1]:.0f} tokens/s ({times[0] / times[1]:.2f}x)")
+
+
+def main():
+    expressions = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    folder = os.path.join(ROOT, 'tests')
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            corpus.append((filename, f.read()))
+    equivalence(corpus, expressions)
+    deep_nesting(sys.getrecursionlimit() * 2)
+    timing(corpus, repeat)
+
+
+if __name__ == '__main__':
+    main()
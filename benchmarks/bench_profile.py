@@ -0,0 +1,55 @@
+"""Parse throughput with rule profiling off and on.
+
+Parses every file of tests/ repeatedly without a profile and with a
+ParserProfile (see parser_profile.py), interleaving the two, and prints the
+tokens per second of each and the profile table of the corpus. Without a
+profile the parser runs no profiling code at all.
+
+Usage: python benchmarks/bench_profile.py [repeat]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lexical_analyzer import lexer  # noqa: E402
+from parser_profile import ParserProfile  # noqa: E402
+from syntax_analyzer import Parser  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+def throughput(corpus, repeat, profile):
+    n_tokens = 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for tokens in corpus:
+            Parser(tokens, profile=profile).unit()
+            n_tokens += len(tokens)
+    return n_tokens / (time.perf_counter() - t0)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    folder = os.path.join(ROOT, 'tests')
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            corpus.append(tokenize(lexer, f.read()))
+
+    throughput(corpus, 1, None)  # Warm up
+    best = {"off": 0.0, "on": 0.0}
+    profile = None
+    for _ in range(5):
+        best["off"] = max(best["off"], throughput(corpus, repeat, None))
+        profile = ParserProfile()
+        best["on"] = max(best["on"], throughput(corpus, repeat, profile))
+    print(f"profiling off: {best['off']:10.0f} tokens/s")
+    print(f"profiling on:  {best['on']:10.0f} tokens/s ({best['off'] / best['on']:.1f}x slower)")
+    print()
+    print(profile.table())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""Memory of the compiler's record objects: Token, Symbol, RetVal, Type.
+
+Generates a source of about `tokens` tokens (1M by default) and reports, with
+tracemalloc:
+  - bytes per Token, for a Token object built for every token of the source
+    from its kind name, value, line and column (as for diagnostics),
+  - bytes per Symbol, RetVal and Type object (field values not included),
+  - the memory retained by a parse of the source per global symbol (the
+    global symbols and their argument tables, types included).
+
+Usage: python benchmarks/bench_records.py [tokens]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from syntax_analyzer import TB_INT, CompilationContext, Parser, RetVal, Symbol, Token, Type  # noqa: E402
+from token_stream import TOKEN_NAMES, tokenize  # noqa: E402
+
+
+def generate(n):
+    parts = ["struct P{ int x; double y; };"]
+    for i in range(n):
+        parts.append(f"""int g{i}; double h{i}[4]; struct P p{i};
+double f{i}(int a, double b, char c[8])
+{{
+    int k; double d;
+    d = b * 2.5 + a / 3;
+    for(k = 0; k < a; k = k + 1){{ d = d + c[k] * p{i}.y - g{i}; }}
+    if(d > b && a != 0) h{i}[1] = d; else p{i}.x = (int)d;
+    return d + h{i}[a];
+}}""")
+    return "\n".join(parts)
+
+
+def measure(build):
+    """(bytes allocated by build() and kept in its result, result)"""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def per_object(build, n):
+    """Bytes per object of a list of n objects made by build(i), the list excluded"""
+    size, objects = measure(lambda: [build(i) for i in range(n)])
+    return (size - sys.getsizeof(objects)) / n
+
+
+def main():
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    ctx = CompilationContext()
+    text = generate(max(1, target // 114))
+    buf = tokenize(ctx.lexer, text)
+    n = len(buf)
+    print(f"{n:,} tokens, {len(text):,} characters")
+
+    positions = [buf.position(i) for i in range(n)]
+    kinds = buf.kinds
+    token_size, tokens = measure(lambda: [Token(code=TOKEN_NAMES[kinds[i]], value=buf.value(i),
+                                                line=positions[i][0], column=positions[i][1])
+                                          for i in range(n)])
+    print(f"  Token      {(token_size - sys.getsizeof(tokens)) / n:7.1f} B/object")
+    del tokens
+
+    count = 100_000
+    print(f"  Symbol     {per_object(lambda i: Symbol('s', 'CLS_VAR'), count):7.1f} B/object")
+    print(f"  RetVal     {per_object(lambda i: RetVal(), count):7.1f} B/object")
+    print(f"  Type       {per_object(lambda i: Type(TB_INT, 10), count):7.1f} B/object")
+
+    def parse():
+        parsed = CompilationContext(ctx.lexer)
+        Parser(buf, parsed).unit()
+        return parsed
+
+    t0 = time.perf_counter()
+    size, parsed = measure(parse)
+    seconds = time.perf_counter() - t0
+    symbols = parsed.symbols.begin
+    n_symbols = len(symbols) + sum(len(s.args.begin) for s in symbols if s.args is not None)
+    print(f"  parse      {size / n_symbols:7.1f} B/global symbol retained ({n_symbols:,} symbols,"
+          f" {size / 1024 / 1024:.1f} MiB, {seconds:.1f} s with tracemalloc)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""Panic-mode error recovery on mutated corpus files.
+
+First parses random mutations of every file of tests/ (tokens deleted,
+duplicated or replaced by punctuation and keywords) with recover=True, in
+all the parser modes (FIRST-set dispatch or backtracking, with a syntax
+tree, over a streamed token window, with the precedence engine) and
+checks that the parse never raises, that a file with errors reports at
+least one, the first one where a parse without recovery stops, and that
+the streamed and the buffered parses, and the precedence engine and the
+rules, report the same diagnostics.
+
+Then times the recovering parse of broken inputs of growing size, made of
+mutated corpus files, against the parse of the unmutated inputs: the time
+per token must stay about the same as the input grows, however many errors
+it has.
+
+Usage: python benchmarks/bench_recovery.py [mutations] [max_copies]
+"""
+import io
+import os
+import random
+import re
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from syntax_analyzer import CompilationContext, Parser, SemanticError  # noqa: E402
+from token_stream import open_stream, tokenize  # noqa: E402
+
+MODES = (("dispatch", {}), ("backtrack", {"backtrack": True}), ("tree", {"build_ast": True}), ("stream", {}),
+         ("precedence", {"pratt": True}))
+KEYWORDS = {"int", "double", "char", "void", "struct", "if", "else", "while", "for", "break", "return",
+            "put_s", "get_s", "put_i", "get_i", "put_d", "get_d", "put_c", "get_c", "seconds"}
+NOISE = [";", "{", "}", "(", ")", ",", "=", "+", "int", "double", "struct", "if", "else", "return", "x", "1"]
+# Without braces, an error does not swallow the rest of its file
+LOCAL_NOISE = [word for word in NOISE if word not in "{}"]
+
+
+def mutate(text, rng, edits, noise=NOISE):
+    """text with some of its words and punctuation changed"""
+    # Line breaks are kept, so that // comments stay on their line
+    words = re.findall(r"[;{}()]|[^\s;{}()]+|\n", text)
+    for _ in range(edits):
+        i = rng.randrange(len(words))
+        if words[i] == "\n":
+            continue
+        op = rng.random()
+        if op < 0.4:
+            del words[i]
+        elif op < 0.6:
+            words.insert(i, words[i])
+        else:
+            words[i] = rng.choice(noise)
+    return " ".join(words)
+
+
+def rename(text, k):
+    """text with its own names suffixed by k, so that copies do not clash"""
+    return re.sub(r"(?<!\w)[A-Za-z_]\w*", lambda m: m.group() if m.group() in KEYWORDS else f"{m.group()}_{k}", text)
+
+
+def lex(text, stream=False):
+    """Tokens of text, lexed in a context that records illegal characters"""
+    ctx = CompilationContext()
+    return ctx, open_stream(ctx.lexer, io.StringIO(text)) if stream else tokenize(ctx.lexer, text)
+
+
+def parse(lexed, **options):
+    ctx, tokens = lexed
+    parser = Parser(tokens, ctx, **options)
+    try:
+        ok = parser.unit()
+    except (SyntaxError, SemanticError) as e:
+        return False, [(str(e), parser.position())]
+    return ok, [(d.message, (d.line, d.column)) for d in parser.diagnostics or ()]
+
+
+def robustness(corpus, mutations):
+    rng = random.Random(20)
+    cases = 0
+    errors = 0
+    for k in range(mutations):
+        for name, text in corpus:
+            text = mutate(text, rng, rng.randint(1, 12))
+            ok, first = parse(lex(text))
+            reports = {}
+            for mode, options in MODES:
+                try:
+                    outcome = parse(lex(text, mode == "stream"), recover=True, max_errors=10 ** 6, **options)
+                except Exception as e:
+                    raise SystemExit(f"{name}~{k} ({mode}): {type(e).__name__}: {e}\n{text}")
+                if outcome[0] != ok or (not ok and not outcome[1]):
+                    raise SystemExit(f"{name}~{k} ({mode}): outcome {outcome} without recovery {ok} {first}")
+                if mode != "backtrack" and not ok and outcome[1][0][1] != first[0][1]:
+                    raise SystemExit(f"{name}~{k} ({mode}): first error {outcome[1][0]}, not {first[0]}")
+                reports[mode] = outcome
+            if reports["stream"] != reports["dispatch"]:
+                raise SystemExit(f"{name}~{k}: streamed {reports['stream']}, buffered {reports['dispatch']}")
+            if reports["precedence"] != reports["dispatch"]:
+                raise SystemExit(f"{name}~{k}: precedence engine {reports['precedence']}, rules {reports['dispatch']}")
+            cases += 1
+            errors += len(reports["dispatch"][1])
+    print(f"{cases} mutated files, {errors} errors reported, no failure")
+
+
+def timing(corpus, max_copies):
+    rng = random.Random(21)
+    print(f"{'copies':>6} {'tokens':>8} {'errors':>7} {'clean us/tk':>12} {'broken us/tk':>13} {'ratio':>6}")
+    copies = 1
+    while copies <= max_copies:
+        files = [rename(text, f"{k}_{i}") for k in range(copies) for i, (name, text) in enumerate(corpus)]
+        clean = "\n".join(files)
+        broken = "\n".join(mutate(text, rng, len(text) // 40, LOCAL_NOISE) for text in files)
+        clean_tokens = lex(clean)[1]
+        broken_tokens = lex(broken)[1]
+        best = {}
+        for label, tokens in (("clean", clean_tokens), ("broken", broken_tokens)) * 3:
+            t0 = time.perf_counter()
+            ok, diagnostics = parse((CompilationContext(), tokens), recover=True, max_errors=10 ** 6)
+            t = (time.perf_counter() - t0) / len(tokens)
+            if label == "clean" and not ok:
+                raise SystemExit(f"the unmutated input does not compile: {diagnostics[0]}")
+            if label == "broken":
+                n_errors = len(diagnostics)
+            best[label] = min(best.get(label, t), t)
+        print(f"{copies:6} {len(broken_tokens):8} {n_errors:7} {best['clean'] * 1e6:12.2f} "
+              f"{best['broken'] * 1e6:13.2f} {best['broken'] / best['clean']:6.2f}")
+        copies *= 2
+
+
+def main():
+    mutations = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    max_copies = int(sys.argv[2]) if len(sys.argv) > 2 else 64
+    folder = os.path.join(ROOT, 'tests')
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            corpus.append((filename, f.read()))
+    robustness(corpus, mutations)
+    timing(corpus, max_copies)
+
+
+if __name__ == '__main__':
+    main()
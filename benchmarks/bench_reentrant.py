@@ -0,0 +1,53 @@
+"""Re-entrancy check for compile_source().
+
+Compiles every file of tests/ sequentially, then many times concurrently from
+a thread pool, and checks that every concurrent result matches the
+sequential one (each compilation owns its CompilationContext).
+
+Usage: python benchmarks/bench_reentrant.py [rounds] [threads]
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from compiler import compile_source  # noqa: E402
+
+
+def outcome(result):
+    names = [s.name for s in result.symbols.begin]
+    return result.success, result.error, names
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+
+    folder = os.path.join(ROOT, 'tests')
+    sources = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            sources.append((filename, f.read()))
+
+    t0 = time.perf_counter()
+    expected = {name: outcome(compile_source(text)) for name, text in sources * rounds}
+    sequential = time.perf_counter() - t0
+
+    jobs = sources * rounds
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        results = list(pool.map(lambda job: (job[0], outcome(compile_source(job[1]))), jobs))
+    concurrent = time.perf_counter() - t0
+
+    mismatches = sum(1 for name, got in results if got != expected[name])
+    print(f"{len(jobs)} compilations, {threads} threads")
+    print(f"  sequential {sequential:8.3f}s   threaded {concurrent:8.3f}s")
+    print(f"  mismatches {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,190 @@
+"""How each compiler phase scales with the size of the program.
+
+Generates programs of growing size with program_generator.py (one of its
+shape options doubled at each step, functions by default) and times, best
+of a few runs:
+    lex        tokenize()
+    parse      Parser.unit(), with its semantic actions
+    semantic   the time spent in the semantic actions of the Parser
+               (operators, casts, indexing, members, calls, variable
+               declarations) and in the symbol table and type helpers,
+               measured in a separate run where they are wrapped in timers
+    parse_ast  Parser.unit() building the syntax tree
+    codegen    bytecode generation from the syntax tree (codegen.py)
+Each phase gets a power-law fit, time ~ size ** exponent, over the token
+counts; an exponent above 1 + tolerance flags the phase as superlinear and
+makes the exit status 1. The sizes, times and fits are written as JSON.
+
+Usage: python benchmarks/bench_scaling.py [--axis functions] [--start N] [--steps N] [--lexer ply] [--json scaling.json]
+"""
+import json
+import math
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import syntax_analyzer  # noqa: E402
+from codegen import generate  # noqa: E402
+from lexical_analyzer import LEXER_BACKENDS  # noqa: E402
+from program_generator import ProgramGenerator  # noqa: E402
+from syntax_analyzer import CompilationContext, Parser  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+AXES = {  # Shape option grown by the runner -> its value at the first step
+    "functions": 10,
+    "structs": 8,
+    "depth": 1,
+    "expr_length": 8,
+    "identifiers": 16,
+    "statements": 2,
+}
+PHASES = ("lex", "parse", "semantic", "parse_ast", "codegen")
+# Module helpers the rules call besides the actions, wrapped while a SemanticTimer is active
+SEMANTIC_HELPERS = ("add_symbol", "delete_symbols_after", "cast", "get_arith_type")
+# Semantic actions and symbol/type hooks of a Parser, wrapped on the instance
+SEMANTIC_METHODS = ("find_symbol", "create_type", "add_var", "binary_action", "unary_action", "cast_action",
+                    "index_action", "member_action", "call_check", "call_action")
+
+
+class SemanticTimer:
+    """Times the semantic analysis of the parsers it is attached to: their
+    semantic actions and hooks, and the helpers of syntax_analyzer while
+    the timer is active. Nested calls are counted once."""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.depth = 0
+        self.saved = {}
+
+    def wrap(self, fn):
+        clock = time.perf_counter
+
+        def run(*args):
+            if self.depth:
+                return fn(*args)
+            self.depth = 1
+            t0 = clock()
+            try:
+                return fn(*args)
+            finally:
+                self.seconds += clock() - t0
+                self.depth = 0
+
+        return run
+
+    def attach(self, parser):
+        for name in SEMANTIC_METHODS:
+            setattr(parser, name, self.wrap(getattr(parser, name)))
+        return parser
+
+    def __enter__(self):
+        for name in SEMANTIC_HELPERS:
+            self.saved[name] = getattr(syntax_analyzer, name)
+            setattr(syntax_analyzer, name, self.wrap(self.saved[name]))
+        return self
+
+    def __exit__(self, *exc):
+        for name, fn in self.saved.items():
+            setattr(syntax_analyzer, name, fn)
+        self.saved.clear()
+
+
+def measure(text, repeat, lexer_backend):
+    """{phase: best seconds} and the token count of a program"""
+    best = {}
+
+    def record(phase, seconds):
+        best[phase] = min(best.get(phase, seconds), seconds)
+
+    for _ in range(repeat):
+        ctx = CompilationContext(lexer_backend=lexer_backend)
+        t0 = time.perf_counter()
+        tokens = tokenize(ctx.lexer, text)
+        record("lex", time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        if not Parser(tokens, ctx).unit():
+            raise SystemExit("a generated program does not compile")
+        record("parse", time.perf_counter() - t0)
+
+        with SemanticTimer() as timer:
+            timer.attach(Parser(tokens, CompilationContext(lexer_backend=lexer_backend))).unit()
+        record("semantic", timer.seconds)
+
+        parser = Parser(tokens, CompilationContext(lexer_backend=lexer_backend), build_ast=True)
+        t0 = time.perf_counter()
+        parser.unit()
+        record("parse_ast", time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        generate(parser.ast)
+        record("codegen", time.perf_counter() - t0)
+    return best, len(tokens)
+
+
+def fit(sizes, times):
+    """(exponent, coefficient) of the least-squares fit of
+    log(time) = log(coefficient) + exponent * log(size)"""
+    xs = [math.log(s) for s in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in times]
+    n = len(xs)
+    mx, my = sum(xs) / n, sum(ys) / n
+    sxx = sum((x - mx) ** 2 for x in xs)
+    if sxx == 0:
+        return 1.0, math.exp(my - mx)
+    b = sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / sxx
+    return b, math.exp(my - b * mx)
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Per-phase scaling of the compiler on generated programs")
+    ap.add_argument("--axis", default="functions", choices=sorted(AXES), help="shape option to grow")
+    ap.add_argument("--start", type=int, default=None, help="value of the axis at the first step")
+    ap.add_argument("--steps", type=int, default=5, help="number of sizes, doubling the axis each time")
+    ap.add_argument("--repeat", type=int, default=3, help="runs per size, the best one counts")
+    ap.add_argument("--tolerance", type=float, default=0.15, help="exponent above 1 flagged as superlinear")
+    ap.add_argument("--seed", type=int, default=0, help="generator seed")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    ap.add_argument("--json", default="scaling.json", help="output file")
+    args = ap.parse_args(argv)
+
+    value = args.start if args.start is not None else AXES[args.axis]
+    # Growing the depth multiplies the size: it is stepped by one
+    step = (lambda v: v + 1) if args.axis == "depth" else (lambda v: v * 2)
+    runs = []
+    print(f"{args.axis:>11} {'tokens':>8} " + " ".join(f"{phase:>10}" for phase in PHASES))
+    for _ in range(args.steps):
+        text = ProgramGenerator(seed=args.seed, **{args.axis: value}).generate()
+        times, tokens = measure(text, args.repeat, args.lexer)
+        runs.append({args.axis: value, "bytes": len(text), "tokens": tokens, "seconds": times})
+        print(f"{value:11} {tokens:8} " + " ".join(f"{times[phase] * 1e3:8.1f}ms" for phase in PHASES))
+        value = step(value)
+
+    sizes = [run["tokens"] for run in runs]
+    phases = {}
+    flagged = []
+    for phase in PHASES:
+        times = [run["seconds"][phase] for run in runs]
+        exponent, coefficient = fit(sizes, times)
+        superlinear = exponent > 1 + args.tolerance
+        phases[phase] = {"exponent": exponent, "coefficient": coefficient,
+                         "us_per_token": [t / s * 1e6 for t, s in zip(times, sizes)],
+                         "superlinear": superlinear}
+        if superlinear:
+            flagged.append(phase)
+    print("exponents: " + ", ".join(f"{phase} {phases[phase]['exponent']:.2f}" for phase in PHASES))
+    for phase in flagged:
+        print(f"SUPERLINEAR: {phase} grows as tokens ** {phases[phase]['exponent']:.2f}")
+
+    with open(args.json, "w") as f:
+        json.dump({"axis": args.axis, "seed": args.seed, "lexer": args.lexer, "tolerance": args.tolerance,
+                   "runs": runs, "phases": phases, "superlinear": flagged}, f, indent=2)
+    return 1 if flagged else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
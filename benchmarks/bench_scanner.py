@@ -0,0 +1,123 @@
+"""Scanner vs PLY lexer: differential check and tokens/sec benchmark.
+
+First checks that the master-regex Scanner produces exactly the tokens of
+the PLY lexer (kind, value, start offset) and reports the same illegal
+characters, on every file of tests/ and on random mutations of them (bytes
+deleted, duplicated or replaced by arbitrary characters, comment and string
+openers included). Stops at the first difference.
+
+Then times tokenize() with both backends on the corpus repeated to about
+`tokens` tokens, and the Scanner's token() interface as well.
+
+Usage: python benchmarks/bench_scanner.py [tokens] [mutations]
+"""
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lexical_analyzer import get_lexer  # noqa: E402
+from token_stream import TOKEN_NAMES, tokenize  # noqa: E402
+
+NOISE = "@#$`~\\'\"/*\n\t\r\0 {}()[];,.+-<>=!&|0123456789.eExX_abz"
+
+
+def lex(backend, text):
+    """(tokens, illegal characters) of text with a fresh clone of a backend"""
+    lexer = get_lexer(backend).clone()
+    errors = []
+
+    def on_error(t):
+        errors.append((t.lexpos, t.value[0]))
+        t.lexer.skip(1)
+
+    lexer.lexerrorf = on_error
+    buf = tokenize(lexer, text)
+    tokens = [(TOKEN_NAMES[buf.kinds[i]], buf.value(i), buf.starts[i]) for i in range(len(buf))]
+    return tokens, errors
+
+
+def mutate(text, rng):
+    chars = list(text)
+    for _ in range(rng.randint(1, 8)):
+        i = rng.randrange(len(chars) + 1)
+        op = rng.random()
+        if op < 0.3 and i < len(chars):
+            del chars[i]
+        elif op < 0.5 and i < len(chars):
+            chars.insert(i, chars[i])
+        else:
+            chars.insert(i, rng.choice(NOISE))
+    return "".join(chars)
+
+
+def differential(corpus, mutations):
+    rng = random.Random(13)
+    cases = list(corpus) + [(f"{name}~{k}", mutate(text, rng))
+                            for k in range(mutations) for name, text in corpus]
+    for name, text in cases:
+        expected = lex("ply", text)
+        got = lex("scanner", text)
+        if got != expected:
+            for i, (a, b) in enumerate(zip(expected[0], got[0])):
+                if a != b:
+                    print(f"MISMATCH in {name} at token {i}: ply {a}, scanner {b}")
+                    break
+            else:
+                print(f"MISMATCH in {name}: {len(expected[0])} vs {len(got[0])} tokens, "
+                      f"errors {expected[1][:5]} vs {got[1][:5]}")
+            return False
+    print(f"differential: {len(cases)} inputs, identical tokens and errors")
+    return True
+
+
+def best_of(fn, repeat=5):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t0
+        best = t if best is None or t < best else best
+    return best
+
+
+def main():
+    target = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    mutations = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    folder = os.path.join(ROOT, 'tests')
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            corpus.append((filename, f.read()))
+    if not differential(corpus, mutations):
+        sys.exit(1)
+
+    # Illegal characters of the corpus would be printed by the default handler
+    sample = "\n".join(text for name, text in corpus if not lex("ply", text)[1])
+    per_copy = len(lex("ply", sample)[0])
+    data = "\n".join([sample] * max(1, target // per_copy))
+    ply_lexer = get_lexer("ply").clone()
+    scanner = get_lexer("scanner").clone()
+    n = len(tokenize(ply_lexer, data))
+
+    def scanner_tokens():
+        scanner.input(data)
+        while scanner.token():
+            pass
+
+    print(f"{n} tokens, {len(data)} characters")
+    base = None
+    for label, fn in (("ply tokenize", lambda: tokenize(ply_lexer, data)),
+                      ("scanner tokenize", lambda: tokenize(scanner, data)),
+                      ("scanner token()", scanner_tokens)):
+        t = best_of(fn)
+        base = base or t
+        print(f"  {label:18} {t * 1e3:8.1f} ms  {n / t / 1e6:6.2f} M tokens/s  x{base / t:.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Startup-time benchmark with an import-time budget.
+
+Runs each scenario in a fresh interpreter under `python -X importtime`,
+after one warm-up run that writes the bytecode and lexer-table caches. For
+each it reports the median wall time of the process and the time spent
+importing our modules and their dependencies (modules the bare interpreter
+already imports at startup are left out), and compares the import time
+with a budget. The "rebuilt tables" scenario ignores the saved lexer
+tables, as a first start would.
+
+Usage: python benchmarks/bench_startup.py [runs] [--check]
+       --check exits with status 1 when a scenario is over its budget.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+SAMPLE = os.path.join(ROOT, 'tests', '8.c')
+
+# name -> (code, import-time budget in ms)
+SCENARIOS = {
+    "import compiler": ("import compiler", 25),
+    "import batch": ("import batch", 30),
+    "import lsp_server": ("import lsp_server", 50),
+    "first lexer": ("import lexical_analyzer; lexical_analyzer.get_lexer()", 45),
+    "first lexer, rebuilt tables": (
+        "import lexical_analyzer as la; la.load_tables = lambda name: None; la.get_lexer()", 50),
+    "compile one file": (f"import compiler; compiler.compile_file({SAMPLE!r})", 50),
+    "batch, cache hit": ("import batch; batch.run_batch(batch.collect_files([{sample!r}]), cache_dir={cache!r})", 30),
+}
+
+
+def parse_importtime(stderr):
+    """[(module, cumulative us)] of the top-level imports in -X importtime output"""
+    found = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[1].strip().isdigit():
+            continue  # Header
+        name = fields[2][1:].rstrip()
+        if name.startswith(" "):
+            continue  # Imported by another module: part of its cumulative time
+        found.append((name, int(fields[1])))
+    return found
+
+
+def run(code, env):
+    t0 = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True)
+    wall = time.perf_counter() - t0
+    if proc.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{proc.stderr}")
+    return wall, parse_importtime(proc.stderr)
+
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    check = "--check" in sys.argv[1:]
+    runs = int(args[0]) if args else 10
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.pop("PYTHONDONTWRITEBYTECODE", None)
+        env["PYTHONPYCACHEPREFIX"] = os.path.join(tmp, "pycache")
+        cache = os.path.join(tmp, "compile_cache")
+
+        wall, startup = run("pass", env)
+        startup = {name for name, us in startup}
+        base = statistics.median(run("pass", env)[0] for _ in range(runs))
+        print(f"{'scenario':30} {'wall':>9} {'- bare':>9} {'imports':>9} {'budget':>7}  slowest imports")
+        print(f"{'bare interpreter':30} {base * 1e3:7.1f}ms")
+
+        over = []
+        for name, (code, budget) in SCENARIOS.items():
+            code = code.format(sample=SAMPLE, cache=cache)
+            run(code, env)  # Warm-up: bytecode, lexer tables, compile cache
+            walls, totals, modules = [], [], {}
+            for _ in range(runs):
+                wall, found = run(code, env)
+                walls.append(wall)
+                ours = [(m, us) for m, us in found if m not in startup]
+                totals.append(sum(us for m, us in ours))
+                for m, us in ours:
+                    modules.setdefault(m, []).append(us)
+            wall = statistics.median(walls)
+            imports = statistics.median(totals) / 1e3
+            slowest = sorted(modules.items(), key=lambda item: -statistics.median(item[1]))[:3]
+            top = ", ".join(f"{m} {statistics.median(us) / 1e3:.1f}" for m, us in slowest)
+            flag = "" if imports <= budget else "  OVER"
+            if flag:
+                over.append(name)
+            print(f"{name:30} {wall * 1e3:7.1f}ms {(wall - base) * 1e3:7.1f}ms {imports:7.1f}ms "
+                  f"{budget:5}ms  {top}{flag}")
+
+    if over:
+        print(f"over budget: {', '.join(over)}")
+        if check:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Peak memory of the streaming pipeline vs. tokenizing the whole input.
+
+Generates an AtomC file of the requested size (many functions with long
+bodies), then parses it in a fresh process both ways and reports the peak
+RSS and the wall time of each.
+
+Usage: python benchmarks/bench_streaming.py [size_mb]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+BODY = "".join(f"\ts = s + i * {k} - (a / 2);\n" for k in range(200))
+
+
+def generate(path, size_mb):
+    size = size_mb * 1024 * 1024
+    with open(path, 'w') as f:
+        n = 0
+        while f.tell() < size:
+            f.write(f"int f{n}(int a)\n{{\n\tint\t\ti, s;\n\ts = 0;\n"
+                    f"\tfor(i=0;i<a;i=i+1){{\n{BODY}\t}}\n\treturn s;\n}}\n")
+            n += 1
+
+
+def run(mode, path):
+    """Parse path in this process and print peak RSS (KiB) and seconds"""
+    from lexical_analyzer import lexer
+    from syntax_analyzer import Parser
+    from token_stream import open_stream, tokenize
+
+    t0 = time.perf_counter()
+    with open(path, 'r') as f:
+        if mode == 'stream':
+            tokens = open_stream(lexer, f)
+        else:
+            tokens = tokenize(lexer, f.read())
+        Parser(tokens).unit()
+    elapsed = time.perf_counter() - t0
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, elapsed)
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == '--run':
+        run(sys.argv[2], sys.argv[3])
+        return
+
+    size_mb = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'big.c')
+        generate(path, size_mb)
+        print(f"Input: {os.path.getsize(path) / 2 ** 20:.0f} MiB")
+        for mode in ('stream', 'buffer'):
+            out = subprocess.run([sys.executable, __file__, '--run', mode, path],
+                                 capture_output=True, text=True)
+            if out.returncode:
+                print(f"  {mode:8} failed: {out.stderr.strip().splitlines()[-1]}")
+                continue
+            rss, elapsed = out.stdout.split()
+            print(f"  {mode:8} peak RSS {int(rss) / 1024:9.1f} MiB   {float(elapsed):8.2f}s")
+
+
+if __name__ == '__main__':
+    main()
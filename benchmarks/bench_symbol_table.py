@@ -0,0 +1,119 @@
+"""Scaling benchmark for the symbol table.
+
+Compares the hash-indexed SymbolTable against the previous linear-scan
+implementation (reproduced below) on many globals and deeply nested blocks,
+both as a micro benchmark and end to end through the Parser.
+
+Usage: python benchmarks/bench_symbol_table.py [n_globals] [depth]
+"""
+import contextlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import syntax_analyzer  # noqa: E402
+from lexical_analyzer import lexer  # noqa: E402
+from syntax_analyzer import CompilationContext, Parser, Symbol  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+# Previous implementation: linear lookup, index/slice on scope exit
+def linear_find_symbol(symtab, name):
+    for s in reversed(symtab.begin):
+        if s.name == name:
+            return s
+    return None
+
+
+def linear_add_symbol(symtab, name, cls, depth=0):
+    s = Symbol(name, cls)
+    s.depth = depth
+    symtab.begin.append(s)
+    return s
+
+
+def linear_delete_symbols_after(symtab, start, depth=0):
+    if start is None:
+        symtab.begin = [s for s in symtab.begin if s.depth < depth]
+    else:
+        try:
+            idx = symtab.begin.index(start)
+            symtab.begin = symtab.begin[:idx + 1]
+        except ValueError:
+            pass
+
+
+@contextlib.contextmanager
+def linear_symbols():
+    """Temporarily route the parser through the linear implementation"""
+    saved = (syntax_analyzer.find_symbol, syntax_analyzer.add_symbol,
+             syntax_analyzer.delete_symbols_after)
+    syntax_analyzer.find_symbol = linear_find_symbol
+    syntax_analyzer.add_symbol = linear_add_symbol
+    syntax_analyzer.delete_symbols_after = linear_delete_symbols_after
+    try:
+        yield
+    finally:
+        (syntax_analyzer.find_symbol, syntax_analyzer.add_symbol,
+         syntax_analyzer.delete_symbols_after) = saved
+
+
+def micro(n_globals, depth, find, add, delete):
+    """Declare globals, then open `depth` nested blocks that each declare a
+    local and look up a global, then close them again"""
+    symbols = CompilationContext().symbols
+    t0 = time.perf_counter()
+    for i in range(n_globals):
+        find(symbols, f"g{i}")
+        add(symbols, f"g{i}", "CLS_VAR", 0)
+    starts = []
+    for d in range(depth):
+        starts.append(symbols.begin[-1])
+        find(symbols, f"l{d}")
+        add(symbols, f"l{d}", "CLS_VAR", d + 1)
+        find(symbols, f"g{d % n_globals}")
+    for d in reversed(range(depth)):
+        delete(symbols, starts[d], d + 1)
+    return time.perf_counter() - t0
+
+
+def generate_source(n_globals, depth):
+    """AtomC source with many globals and one function with nested blocks"""
+    lines = [f"int g{i};" for i in range(n_globals)]
+    lines.append("void main()")
+    lines.append("{")
+    for d in range(depth):
+        lines.append("{ " + f"int l{d}; l{d} = g{d % n_globals};")
+    lines.append("}" * depth)
+    lines.append("}")
+    return "\n".join(lines)
+
+
+def parse_time(tokens):
+    t0 = time.perf_counter()
+    Parser(tokens).unit()
+    return time.perf_counter() - t0
+
+
+def main():
+    n_globals = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    depth = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    print(f"Symbol table: {n_globals} globals, {depth} nested blocks")
+    new = micro(n_globals, depth, syntax_analyzer.find_symbol,
+                syntax_analyzer.add_symbol, syntax_analyzer.delete_symbols_after)
+    old = micro(n_globals, depth, linear_find_symbol,
+                linear_add_symbol, linear_delete_symbols_after)
+    print(f"  micro     linear {old:8.3f}s   indexed {new:8.3f}s   x{old / new:6.1f}")
+
+    tokens = tokenize(lexer, generate_source(n_globals, depth))
+    new = parse_time(tokens)
+    with linear_symbols():
+        old = parse_time(tokens)
+    print(f"  parser    linear {old:8.3f}s   indexed {new:8.3f}s   x{old / new:6.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Token buffer vs. the former linked list of Token objects.
+
+Lexes a large generated input once, stores it both as a linked list of
+Token objects (the previous representation) and as a TokenBuffer, and
+reports memory per token and the speed of consume/save/restore on each.
+
+Usage: python benchmarks/bench_token_stream.py [n_functions]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lexical_analyzer import lexer  # noqa: E402
+from syntax_analyzer import Parser, Token  # noqa: E402
+from token_stream import END, TOKEN_CODES, TokenBuffer  # noqa: E402
+
+
+def generate_source(n_functions):
+    return "\n".join(
+        f"int f{i}(int a){{ int i; for(i=0;i<a;i=i+1){{ a = a*2+i; }} return a; }}"
+        for i in range(n_functions))
+
+
+def lex(data):
+    lexer.input(data)
+    lexer.lineno = 1
+    result = []
+    while True:
+        tok = lexer.token()
+        if not tok:
+            return result
+        result.append((tok.type, tok.value))
+
+
+def build_linked_list(lexed):
+    tokens = [Token(code=code, value=value) for code, value in lexed]
+    tokens.append(Token(code='END', value='None'))
+    for i in range(len(tokens) - 1):
+        tokens[i].next = tokens[i + 1]
+    return tokens[0]
+
+
+def build_buffer(lexed):
+    buf = TokenBuffer()
+    for code, value in lexed:
+        buf.append(TOKEN_CODES[code], value)
+    buf.append(END)
+    return buf
+
+
+def measure(build, lexed):
+    tracemalloc.start()
+    result = build(lexed)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size
+
+
+def walk_linked_list(first):
+    """Per token: a failed and a successful consume, save and restore"""
+    tk = first
+    while tk.code != 'END':
+        saved = tk
+        if tk.code == 'SEMICOLON':
+            pass
+        tk = saved
+        if tk.code == tk.code:
+            tk = tk.next
+
+
+def walk_buffer(buf):
+    kinds = buf.kinds
+    pos = 0
+    while kinds[pos] != END:
+        saved = pos
+        if kinds[pos] == 6:
+            pass
+        pos = saved
+        if kinds[pos] == kinds[pos]:
+            pos += 1
+
+
+def walk_parser(buf):
+    """Same walk through the Parser's own cursor methods"""
+    parser = Parser(buf)
+    kinds = buf.kinds
+    while kinds[parser.pos] != END:
+        saved = parser.save()
+        parser.consume(-1)
+        parser.restore(saved)
+        parser.consume(kinds[parser.pos])
+
+
+def timed(fn, arg):
+    t0 = time.perf_counter()
+    fn(arg)
+    return time.perf_counter() - t0
+
+
+def main():
+    n_functions = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    lexed = lex(generate_source(n_functions))
+    n = len(lexed) + 1
+    print(f"{n:,} tokens")
+
+    first, linked_size = measure(build_linked_list, lexed)
+    buf, buffer_size = measure(build_buffer, lexed)
+    print(f"  memory     linked list {linked_size / n:7.1f} B/token   buffer {buffer_size / n:7.1f} B/token"
+          f"   x{linked_size / buffer_size:5.1f}")
+
+    old = timed(walk_linked_list, first)
+    new = timed(walk_buffer, buf)
+    print(f"  cursor     linked list {n / old / 1e6:7.2f} Mtok/s    buffer {n / new / 1e6:7.2f} Mtok/s")
+    print(f"  Parser     consume/save/restore {n / timed(walk_parser, buf) / 1e6:7.2f} Mtok/s")
+
+
+if __name__ == '__main__':
+    main()
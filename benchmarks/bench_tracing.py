@@ -0,0 +1,49 @@
+"""Compile throughput with parser tracing off and on.
+
+Parses every file of tests/ repeatedly at each trace level, sending the
+trace to a ring buffer and to a file, and prints tokens per second.
+
+Usage: python benchmarks/bench_tracing.py [repeat]
+"""
+import os
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+from lexical_analyzer import lexer  # noqa: E402
+from parser_trace import TRACE_LEVELS, RingBuffer, file_sink  # noqa: E402
+from syntax_analyzer import Parser  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+def throughput(corpus, repeat, level, sink):
+    n_tokens = 0
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for tokens in corpus:
+            Parser(tokens, trace=level, trace_sink=sink).unit()
+            n_tokens += len(tokens)
+    return n_tokens / (time.perf_counter() - t0)
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    folder = os.path.join(ROOT, 'tests')
+    corpus = []
+    for filename in sorted(os.listdir(folder)):
+        with open(os.path.join(folder, filename), 'r') as f:
+            corpus.append(tokenize(lexer, f.read()))
+
+    throughput(corpus, 1, TRACE_LEVELS["off"], None)  # Warm up
+    print(f"{'level':10} {'ring buffer tok/s':>18} {'file tok/s':>12}")
+    with open(os.devnull, 'w') as devnull:
+        for name, level in TRACE_LEVELS.items():
+            ring = throughput(corpus, repeat, level, RingBuffer())
+            to_file = throughput(corpus, repeat, level, file_sink(devnull))
+            print(f"{name:10} {ring:18,.0f} {to_file:12,.0f}")
+
+
+if __name__ == '__main__':
+    main()
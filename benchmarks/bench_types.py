@@ -0,0 +1,95 @@
+"""Allocation benchmark for the semantic types.
+
+Compiles a generated, expression-heavy program and reports:
+  - how many Type objects were constructed (counted on Type.__init__),
+  - tracemalloc's peak and retained memory for the parse, and the blocks
+    still allocated by syntax_analyzer.py once it is done (mostly the
+    global symbols and their types),
+  - the parse time without instrumentation.
+
+Usage: python benchmarks/bench_types.py [functions]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import syntax_analyzer  # noqa: E402
+from syntax_analyzer import CompilationContext, Parser  # noqa: E402
+from token_stream import tokenize  # noqa: E402
+
+
+def generate(n):
+    parts = ["struct P{ int x; double y; char name[8]; };", "struct P pts[16];", "double total;"]
+    for i in range(n):
+        parts.append(f"""int g{i}; double h{i}[4]; struct P q{i};
+int f{i}(int a, double b, char c)
+{{
+    int k; int v[10]; double d; char s[4];
+    d = b * 2.5 + a / 3 - c;
+    for(k = 0; k < 10; k = k + 1){{
+        v[k] = a * k + (int)d - v[k] / 2;
+        if(v[k] > a && d <= b || !c) total = total + v[k] * 1.5;
+        pts[k].x = pts[k].x + k; pts[k].y = pts[k].y * d + pts[k].name[1];
+    }}
+    while(a != 0){{ a = a - 1; d = -d + (double)a; }}
+    return v[a] + (int)(d * b) + c;
+}}""")
+    return "\n".join(parts)
+
+
+def parse(tokens):
+    ctx = CompilationContext()
+    Parser(tokens, ctx).unit()
+    return ctx
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    text = generate(n)
+    ctx = CompilationContext()
+    tokens = tokenize(ctx.lexer, text)
+    parse(tokens)  # Warm-up
+
+    t0 = time.perf_counter()
+    parse(tokens)
+    seconds = time.perf_counter() - t0
+
+    constructed = 0
+    init = syntax_analyzer.Type.__init__
+
+    def counting_init(self, *args, **kwargs):
+        nonlocal constructed
+        constructed += 1
+        init(self, *args, **kwargs)
+
+    syntax_analyzer.Type.__init__ = counting_init
+    try:
+        kept = parse(tokens)
+    finally:
+        syntax_analyzer.Type.__init__ = init
+    del kept
+
+    tracemalloc.start()
+    kept = parse(tokens)
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        [tracemalloc.Filter(True, syntax_analyzer.__file__)])
+    tracemalloc.stop()
+    stats = snapshot.statistics("filename")
+    blocks = sum(s.count for s in stats)
+    size = sum(s.size for s in stats)
+
+    print(f"{n} functions, {len(tokens)} tokens")
+    print(f"  Type objects constructed   {constructed:10}")
+    print(f"  tracemalloc peak           {peak / 1024:10.1f} KiB")
+    print(f"  retained after parse       {current / 1024:10.1f} KiB")
+    print(f"  retained from syntax_analyzer.py: {blocks} blocks, {size / 1024:.1f} KiB")
+    print(f"  parse time                 {seconds * 1e3:10.1f} ms")
+    del kept
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Speed of the bytecode virtual machine.
+
+Compiles a few loop-heavy AtomC programs (function calls as in tests/0.c,
+int array arithmetic, double arithmetic, char strings, struct members),
+counts the instructions each one executes, then reports the best time of
+several runs and the instructions per second. Program output goes to a
+memory buffer.
+
+Usage: python benchmarks/bench_vm.py [scale]
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from codegen import compile_program  # noqa: E402
+from vm import Console, Machine, count_instructions  # noqa: E402
+
+PROGRAMS = {
+    "calls": """
+int sum()
+{
+    int i, v[5], s;
+    s = 0;
+    for(i = 0; i < 5; i = i + 1){ v[i] = i; s = s + v[i]; }
+    return s;
+}
+void main()
+{
+    int i, s;
+    for(i = 0; i < {n}; i = i + 1) s = sum();
+    put_i(s);
+}""",
+    "sieve": """
+char composite[10000];
+void main()
+{
+    int i, j, r, count;
+    for(r = 0; r < {n} / 10000; r = r + 1){
+        count = 0;
+        for(i = 0; i < 10000; i = i + 1) composite[i] = 0;
+        for(i = 2; i < 10000; i = i + 1){
+            if(!composite[i]){
+                count = count + 1;
+                for(j = i * 2; j < 10000; j = j + i) composite[j] = 1;
+            }
+        }
+    }
+    put_i(count);
+}""",
+    "doubles": """
+void main()
+{
+    int i;
+    double x, s;
+    s = 0.0;
+    x = 1.0;
+    for(i = 0; i < {n}; i = i + 1){
+        s = s + x * 0.5 - s / 3.0;
+        x = x + 1.0;
+    }
+    put_d(s);
+}""",
+    "strings": """
+int length(char s[64])
+{
+    int n;
+    n = 0;
+    while(s[n]) n = n + 1;
+    return n;
+}
+void main()
+{
+    int i, total;
+    char text[64];
+    total = 0;
+    for(i = 0; i < {n} / 40; i = i + 1){
+        text[0] = 'a' + i - i / 26 * 26;
+        text[1] = 0;
+        total = total + length("the quick brown fox jumps over the lazy dog");
+    }
+    put_i(total);
+}""",
+    "structs": """
+struct Pt{ int x; int y; double w; };
+struct Pt pts[100];
+void main()
+{
+    int i, k;
+    double sum;
+    sum = 0.0;
+    for(k = 0; k < {n} / 100; k = k + 1){
+        for(i = 0; i < 100; i = i + 1){
+            pts[i].x = i + k;
+            pts[i].y = pts[i].x * 2;
+            sum = sum + pts[i].y * pts[i].w + 1;
+        }
+    }
+    put_d(sum);
+}""",
+}
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    total_steps = total_time = 0
+    for name, source in PROGRAMS.items():
+        result, program = compile_program(source.replace("{n}", str(n)))
+        if program is None:
+            raise SystemExit(f"{name}: {result.error}")
+        steps = count_instructions(program, Console(io.BytesIO(), io.BytesIO()))
+        best = None
+        for _ in range(3):
+            machine = Machine(program, Console(io.BytesIO(), io.BytesIO()))
+            t0 = time.perf_counter()
+            machine.run()
+            t = time.perf_counter() - t0
+            best = t if best is None or t < best else best
+        total_steps += steps
+        total_time += best
+        print(f"  {name:10} {len(program):5} instructions, {steps:10,} executed"
+              f"  {best * 1e3:8.1f} ms  {steps / best / 1e6:6.2f} M instructions/s")
+    print(f"  {'total':10} {'':36}  {total_time * 1e3:8.1f} ms"
+          f"  {total_steps / total_time / 1e6:6.2f} M instructions/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+"""Stack bytecode of the AtomC virtual machine (see codegen.py and vm.py).
+
+The instruction set is the classic AtomC one, typed per int (_I), double
+(_D) and char (_C), plus a few fused instructions for variables (LOADL_I:
+FPADDR + LOAD_I...). Every instruction takes two slots of an array('i'):
+the opcode and one operand (a constant, an address, a frame offset, a
+size, a jump target or a builtin number; 0 when unused). Doubles are
+pushed from a constant table.
+
+Values live on an operand stack; variables, arrays and structs live in one
+flat byte memory. It starts with the globals (and the string constants),
+followed by the frames of the called functions. Addresses are byte
+offsets in it and every scalar is aligned on its size. Frame addresses are
+relative to the frame pointer (FP).
+"""
+from array import array
+
+OPCODE_NAMES = (
+    'NOP', 'HALT',
+    # Constants and operand stack
+    'PUSHCT_I', 'PUSHCT_C', 'PUSHCT_D', 'PUSHCT_A', 'DROP', 'DUP', 'SWAP',
+    # Addresses: FP + operand, + operand, + popped index * operand
+    'FPADDR', 'OFFSET', 'INDEX',
+    # Memory through an address popped from the stack. STORE pops the
+    # value and the address and pushes the value back, SET does not.
+    'LOAD_I', 'LOAD_D', 'LOAD_C', 'STORE_I', 'STORE_D', 'STORE_C', 'SET_I', 'SET_D', 'SET_C',
+    # COPY pops a source address and copies operand bytes to the address below it
+    'COPY',
+    # Variables at a frame offset (L) or an absolute address (G)
+    'LOADL_I', 'LOADL_D', 'LOADL_C', 'LOADG_I', 'LOADG_D', 'LOADG_C',
+    'SETL_I', 'SETL_D', 'SETL_C', 'SETG_I', 'SETG_D', 'SETG_C',
+    # Arithmetic
+    'ADD_I', 'ADD_D', 'ADD_C', 'SUB_I', 'SUB_D', 'SUB_C', 'MUL_I', 'MUL_D', 'MUL_C',
+    'DIV_I', 'DIV_D', 'DIV_C', 'NEG_I', 'NEG_D', 'NEG_C',
+    # Comparisons (push 0 or 1) and logical not
+    'EQ_I', 'EQ_D', 'EQ_C', 'NOTEQ_I', 'NOTEQ_D', 'NOTEQ_C', 'LESS_I', 'LESS_D', 'LESS_C',
+    'LESSEQ_I', 'LESSEQ_D', 'LESSEQ_C', 'GREATER_I', 'GREATER_D', 'GREATER_C',
+    'GREATEREQ_I', 'GREATEREQ_D', 'GREATEREQ_C', 'NOT_I', 'NOT_D', 'NOT_C',
+    # Conversions
+    'CAST_I_D', 'CAST_I_C', 'CAST_D_I', 'CAST_D_C', 'CAST_C_D',
+    # Jumps: always, if the popped value is false (JF) or true (JT)
+    'JMP', 'JF_I', 'JF_D', 'JF_C', 'JT_I', 'JT_D', 'JT_C',
+    # Calls: CALL pushes a frame, ENTER gives it operand bytes, RET pops it
+    'CALL', 'CALLEXT', 'ENTER', 'RET',
+)
+
+(NOP, HALT,
+ PUSHCT_I, PUSHCT_C, PUSHCT_D, PUSHCT_A, DROP, DUP, SWAP,
+ FPADDR, OFFSET, INDEX,
+ LOAD_I, LOAD_D, LOAD_C, STORE_I, STORE_D, STORE_C, SET_I, SET_D, SET_C,
+ COPY,
+ LOADL_I, LOADL_D, LOADL_C, LOADG_I, LOADG_D, LOADG_C,
+ SETL_I, SETL_D, SETL_C, SETG_I, SETG_D, SETG_C,
+ ADD_I, ADD_D, ADD_C, SUB_I, SUB_D, SUB_C, MUL_I, MUL_D, MUL_C,
+ DIV_I, DIV_D, DIV_C, NEG_I, NEG_D, NEG_C,
+ EQ_I, EQ_D, EQ_C, NOTEQ_I, NOTEQ_D, NOTEQ_C, LESS_I, LESS_D, LESS_C,
+ LESSEQ_I, LESSEQ_D, LESSEQ_C, GREATER_I, GREATER_D, GREATER_C,
+ GREATEREQ_I, GREATEREQ_D, GREATEREQ_C, NOT_I, NOT_D, NOT_C,
+ CAST_I_D, CAST_I_C, CAST_D_I, CAST_D_C, CAST_C_D,
+ JMP, JF_I, JF_D, JF_C, JT_I, JT_D, JT_C,
+ CALL, CALLEXT, ENTER, RET) = range(len(OPCODE_NAMES))
+
+OPCODES = {name: code for code, name in enumerate(OPCODE_NAMES)}
+
+# Builtin functions (see syntax_analyzer.add_ext_funcs), by CALLEXT number
+BUILTINS = ("put_s", "get_s", "put_i", "get_i", "put_d", "get_d", "put_c", "get_c", "seconds")
+
+# Instructions whose operand is a code position
+JUMPS = frozenset((JMP, JF_I, JF_D, JF_C, JT_I, JT_D, JT_C, CALL))
+
+# Instructions that use their operand
+WITH_OPERAND = JUMPS | frozenset((
+    PUSHCT_I, PUSHCT_C, PUSHCT_D, PUSHCT_A, FPADDR, OFFSET, INDEX, COPY,
+    LOADL_I, LOADL_D, LOADL_C, LOADG_I, LOADG_D, LOADG_C, SETL_I, SETL_D, SETL_C, SETG_I, SETG_D, SETG_C,
+    CALLEXT, ENTER,
+))
+
+
+def to_int(v):
+    """v as a 32-bit two's complement int, the range of AtomC ints"""
+    return ((v + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def to_char(v):
+    """v as a signed 8-bit char"""
+    return ((v + 0x80) & 0xFF) - 0x80
+
+
+class Program:
+    """A compiled program: its code and its initial global memory"""
+
+    def __init__(self):
+        self.code = array('i')  # (opcode, operand) pairs
+        self.constants = []  # Doubles, for PUSHCT_D
+        self.image = bytearray(8)  # Globals and string constants; address 0 stays unused
+        self.functions = {}  # Function name -> code position
+        self.entry = 0  # Code position where the execution starts
+
+    def __len__(self):
+        """Number of instructions"""
+        return len(self.code) // 2
+
+    def function_at(self, pc):
+        """Name of the function whose code contains position pc, or None"""
+        best = None
+        for name, start in self.functions.items():
+            if start <= pc and (best is None or start > self.functions[best]):
+                best = name
+        return best
+
+    def disassemble(self):
+        """Text listing, one instruction per line"""
+        labels = {start: name for name, start in self.functions.items()}
+        lines = []
+        code = self.code
+        for pc in range(0, len(code), 2):
+            if pc in labels:
+                lines.append(f"{labels[pc]}:")
+            op, arg = code[pc], code[pc + 1]
+            text = f"{pc:6}  {OPCODE_NAMES[op]}"
+            if op == PUSHCT_D:
+                text += f" {self.constants[arg]!r}"
+            elif op == CALLEXT:
+                text += f" {BUILTINS[arg]}"
+            elif op == CALL:
+                text += f" {labels.get(arg, arg)}"
+            elif op in WITH_OPERAND:
+                text += f" {arg}"
+            lines.append(text)
+        return "\n".join(lines)
@@ -0,0 +1,553 @@
+"""C backend: AtomC program -> portable C, built with the system compiler.
+
+The program is translated from its syntax tree: declarations use the
+Types of the symbols, structs become C structs, and expressions keep
+their C meaning, with the conversions the Parser decided made explicit
+where C's would differ (chars are signed chars, double -> char goes
+through int). Locals are zeroed like on the other backends, int
+arithmetic wraps (-fwrapv) and int division by zero is a runtime error.
+The builtins come from atomc_runtime.h.
+
+Binaries are kept in a BinaryCache directory, keyed by the hash of the C
+source, the runtime and the compiler command, so a program is built once,
+and the least recently used ones are removed past a size bound. Programs
+built without a cache share one temporary directory, removed at exit.
+
+Usage: python cbackend.py file.c [--source] [--cache DIR] [--cc CC] [--lexer ply|scanner]
+"""
+import atexit
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from bytecode import to_char, to_int
+from codegen import CodegenError, unescape
+from syntax_analyzer import TB_CHAR, TB_DOUBLE, TB_INT, TB_STRUCT, TB_VOID
+from syntax_tree import (
+    N_ADD, N_AND, N_ASSIGN, N_CALL, N_CAST, N_CT_CHAR, N_CT_INT, N_CT_REAL, N_CT_STRING, N_DIV, N_EMPTY,
+    N_EQUAL, N_FUNC, N_GREATER, N_GREATEREQ, N_ID, N_INDEX, N_LESS, N_LESSEQ, N_MEMBER, N_MUL, N_NEG,
+    N_NOT, N_NOTEQ, N_OR, N_STRUCT, N_SUB, N_VAR, NODE_NAMES, Visitor,
+)
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+RUNTIME = "atomc_runtime.h"
+CFLAGS = ("-O2", "-fwrapv", "-w")
+DEFAULT_CACHE = os.path.join(".atomc_cache", "bin")
+
+OPERATORS = {
+    N_ADD: "+", N_SUB: "-", N_MUL: "*", N_OR: "||", N_AND: "&&", N_EQUAL: "==", N_NOTEQ: "!=",
+    N_LESS: "<", N_LESSEQ: "<=", N_GREATER: ">", N_GREATEREQ: ">=",
+}
+C_TYPES = {TB_INT: "int", TB_DOUBLE: "double", TB_CHAR: "signed char", TB_VOID: "void"}
+
+
+class CBuildError(Exception):
+    """The C compiler is missing or failed"""
+
+
+def c_string(data):
+    """C string literal of bytes"""
+    out = []
+    for b in data:
+        if b in (0x22, 0x5C):
+            out.append("\\" + chr(b))
+        elif 0x20 <= b < 0x7F and b != 0x3F:  # No ? either: trigraphs
+            out.append(chr(b))
+        else:
+            out.append(f"\\{b:03o}")
+    return '"' + "".join(out) + '"'
+
+
+class Translator(Visitor):
+    """Visitor writing the C source of a program; expressions go through expr()"""
+
+    def __init__(self, tree):
+        super().__init__(tree)
+        self.structs = []  # Lines of the struct definitions
+        self.prototypes = []
+        self.module = []  # Lines of the globals and string constants
+        self.functions = []  # Lines of the function definitions
+        self.globals = {}  # Global Symbol -> C name
+        self.strings = {}  # Text of a string constant -> C name
+        self.main = None
+        # State of the function being translated
+        self.lines = None
+        self.indent = 1
+        self.locals = {}  # Symbol -> C name
+        self.local_names = set()
+        self.decls = []  # Declarations of the locals
+        self.loops = 0
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def error(self, n, message):
+        line, column = self.tree.position(n)
+        where = f" at line {line}, column {column}" if line is not None else ""
+        raise CodegenError(message + where)
+
+    # Names and types
+
+    def declaration(self, t, name, param=False):
+        """C declaration of name with type t, e.g. double l_v[10]"""
+        base = f"struct S_{t.s.name}" if t.typeBase == TB_STRUCT else C_TYPES[t.typeBase]
+        if t.nElements < 0:
+            return f"{base} {name}"
+        return f"{base} {name}[{'' if param or t.nElements == 0 else t.nElements}]"
+
+    def name(self, s):
+        """C name of variable s"""
+        if s.mem == "MEM_GLOBAL":
+            name = self.globals.get(s)
+            if name is None:
+                name = self.globals[s] = "g_" + s.name
+                self.module.append(f"static {self.declaration(s.type, name)};")
+            return name
+        name = self.locals.get(s)
+        if name is None:
+            name = "l_" + s.name
+            suffix = 1
+            while name in self.local_names:  # A block shadows another variable of the function
+                suffix += 1
+                name = f"l_{s.name}_{suffix}"
+            self.local_names.add(name)
+            self.locals[s] = name
+            if s.mem != "MEM_ARG":
+                zero = "0" if s.type.nElements < 0 and s.type.typeBase != TB_STRUCT else "{0}"
+                self.decls.append(f"{self.declaration(s.type, name)} = {zero};")
+        return name
+
+    def string(self, text):
+        name = self.strings.get(text)
+        if name is None:
+            name = self.strings[text] = f"s_{len(self.strings)}"
+            data = unescape(text).encode("utf-8")
+            self.module.append(f"static signed char {name}[{len(data) + 1}] = {c_string(data)};")
+        return name
+
+    def convert(self, code, src, dst):
+        """code converted from type src to type dst where C's implicit
+        conversion would not do the same"""
+        if dst.typeBase == TB_CHAR and src.typeBase == TB_DOUBLE and src.nElements < 0 and dst.nElements < 0:
+            return f"((signed char)(int){code})"
+        return code
+
+    # Expressions
+
+    def expr(self, n):
+        """C expression of the value of expression n"""
+        tree = self.tree
+        kind = tree.kinds[n]
+        if kind == N_ID:
+            s = tree.symbol(n)
+            if s.cls != "CLS_VAR":
+                self.error(n, f"{s.name} is not a variable")
+            return self.name(s)
+        if kind == N_CT_INT:
+            value = to_int(tree.value(n))
+            return "(-2147483647 - 1)" if value == -0x80000000 else str(value) if value >= 0 else f"({value})"
+        if kind == N_CT_REAL:
+            value = float(tree.value(n))
+            return "HUGE_VAL" if value == float("inf") else repr(value)
+        if kind == N_CT_CHAR:
+            text = unescape(tree.value(n))
+            value = to_char(ord(text)) if text else 0
+            return str(value) if value >= 0 else f"({value})"
+        if kind == N_CT_STRING:
+            return self.string(tree.value(n))
+        if kind in OPERATORS:
+            left, right = tree.child_list(n)
+            code = f"({self.expr(left)} {OPERATORS[kind]} {self.expr(right)})"
+            return f"((signed char){code})" if tree.type(n).typeBase == TB_CHAR else code
+        if kind == N_DIV:
+            left, right = tree.child_list(n)
+            base = tree.type(n).typeBase
+            if base == TB_DOUBLE:
+                return f"({self.expr(left)} / {self.expr(right)})"
+            code = f"rt_idiv({self.expr(left)}, {self.expr(right)})"
+            return f"((signed char){code})" if base == TB_CHAR else code
+        if kind == N_NOT:
+            (c,) = tree.child_list(n)
+            return f"(!{self.expr(c)})"
+        if kind == N_NEG:
+            (c,) = tree.child_list(n)
+            code = f"(-{self.expr(c)})"
+            return f"((signed char){code})" if tree.type(n).typeBase == TB_CHAR else code
+        if kind == N_CAST:
+            (c,) = tree.child_list(n)
+            src, dst = tree.type(c), tree.type(n)
+            code = self.convert(self.expr(c), src, dst)
+            return code if code.startswith("((signed char)") else f"(({C_TYPES[dst.typeBase]}){code})"
+        if kind == N_INDEX:
+            array, index = tree.child_list(n)
+            return f"{self.expr(array)}[{self.expr(index)}]"
+        if kind == N_MEMBER:
+            (operand,) = tree.child_list(n)
+            return f"{self.expr(operand)}.m_{tree.symbol(n).name}"
+        if kind == N_ASSIGN:
+            left, right = tree.child_list(n)
+            value = self.convert(self.expr(right), tree.type(right), tree.type(left))
+            return f"({self.expr(left)} = {value})"
+        if kind == N_CALL:
+            return self.call(n)
+        self.error(n, f"unexpected {NODE_NAMES[kind]} expression")
+
+    def call(self, n):
+        tree = self.tree
+        f = tree.symbol(n)
+        args = tree.child_list(n)[1:]
+        params = f.args.begin
+        if len(args) != len(params):
+            self.error(n, f"{f.name} takes {len(params)} arguments, not {len(args)}")
+        codes = [self.convert(self.expr(a), tree.type(a), p.type) for a, p in zip(args, params)]
+        name = f.name if f.cls == "CLS_EXTFUNC" else "f_" + f.name
+        return f"{name}({', '.join(codes)})"
+
+    def statement_expr(self, n):
+        """Expression n without the outer parentheses of an assignment"""
+        code = self.expr(n)
+        if self.tree.kinds[n] == N_ASSIGN:
+            code = code[1:-1]
+        return code
+
+    # Declarations
+
+    def visit_UNIT(self, n):
+        tree = self.tree
+        unit = []
+        for c in tree.children(n):
+            kind = tree.kinds[c]
+            if kind == N_STRUCT or kind == N_FUNC or kind == N_VAR:
+                self.visit(c)
+            else:
+                unit.append(c)
+        self.function("void", "unit", [], unit, None)
+        lines = [f'#include "{RUNTIME}"', ""] + self.structs + self.prototypes + [""]
+        lines += self.module + [""] + self.functions
+        lines.append("int main(void)")
+        lines.append("{")
+        lines.append("    unit();")
+        if self.main is not None:
+            lines.append("    f_main();")
+        lines.append("    fflush(stdout);")
+        lines.append("    return 0;")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+    def visit_STRUCT(self, n):
+        s = self.tree.symbol(n)
+        self.structs.append(f"struct S_{s.name} {{")
+        for m in s.members.begin:
+            self.structs.append(f"    {self.declaration(m.type, 'm_' + m.name)};")
+        if not s.members.begin:
+            self.structs.append("    char m_;")  # C structs need a member
+        self.structs.append("};")
+        self.structs.append("")
+
+    def visit_VAR(self, n):
+        self.name(self.tree.symbol(n))
+
+    def visit_FUNC(self, n):
+        tree = self.tree
+        s = tree.symbol(n)
+        if s.type.typeBase == TB_STRUCT and s.type.nElements < 0:
+            self.error(n, f"{s.name}: returning a structure is not supported")
+        if s.name == "main":
+            self.main = s
+        *params, body = tree.child_list(n)
+        result = self.declaration(s.type, "").rstrip()
+        self.function(result, "f_" + s.name, [tree.symbol(p) for p in params], [body], s)
+
+    def function(self, result, name, params, statements, func):
+        """Definition of a C function running statements"""
+        self.lines, self.indent, self.loops = [], 1, 0
+        self.locals, self.local_names, self.decls = {}, set(), []
+        args = ", ".join(self.declaration(p.type, self.name(p), param=True) for p in params) or "void"
+        for c in statements:
+            self.visit(c)
+        if func is not None and func.type.typeBase != TB_VOID:
+            self.emit("return 0;")  # Falling off the end
+        header = f"static {result} {name}({args})"
+        self.prototypes.append(header + ";")
+        lines = self.functions
+        lines.append(header)
+        lines.append("{")
+        lines.extend("    " + line for line in self.decls)
+        lines.extend(self.lines)
+        lines.append("}")
+        lines.append("")
+
+    # Statements
+
+    def suite(self, n):
+        """Braced block of statement n"""
+        self.indent += 1
+        self.visit(n)
+        self.indent -= 1
+
+    def visit_EXPR(self, n):
+        for c in self.tree.children(n):
+            self.emit(self.statement_expr(c) + ";")
+
+    def visit_IF(self, n):
+        cond, then, *rest = self.tree.child_list(n)
+        self.emit(f"if ({self.expr(cond)}) {{")
+        self.suite(then)
+        if rest:
+            self.emit("} else {")
+            self.suite(rest[0])
+        self.emit("}")
+
+    def loop(self, header, body):
+        self.emit(header + " {")
+        self.loops += 1
+        self.suite(body)
+        self.loops -= 1
+        self.emit("}")
+
+    def visit_WHILE(self, n):
+        cond, body = self.tree.child_list(n)
+        self.loop(f"while ({self.expr(cond)})", body)
+
+    def visit_FOR(self, n):
+        tree = self.tree
+        init, cond, step, body = tree.child_list(n)
+        parts = [self.statement_expr(c) if tree.kinds[c] != N_EMPTY else "" for c in (init, cond, step)]
+        self.loop(f"for ({parts[0]}; {parts[1]}; {parts[2]})", body)
+
+    def visit_BREAK(self, n):
+        if not self.loops:
+            self.error(n, "break outside of a loop")
+        self.emit("break;")
+
+    def visit_RETURN(self, n):
+        tree = self.tree
+        func = tree.symbol(n)
+        if func is None:
+            self.emit("rt_halt();")
+            return
+        values = [self.convert(self.expr(c), tree.type(c), func.type) for c in tree.children(n)]
+        self.emit(f"return {values[0]};" if values else "return;")
+
+    def generic_visit(self, n):
+        if self.tree.kinds[n] >= N_ASSIGN:
+            self.error(n, f"unexpected {NODE_NAMES[self.tree.kinds[n]]} expression")
+        super().generic_visit(n)
+
+
+def translate(tree):
+    """C source of a parsed program (its SyntaxTree)"""
+    return Translator(tree).visit()
+
+
+def find_compiler(cc=None):
+    """Path of the C compiler: cc, $CC, or the first of cc, gcc and clang found"""
+    for candidate in (cc, os.environ.get("CC"), "cc", "gcc", "clang"):
+        if candidate:
+            path = shutil.which(candidate)
+            if path is not None:
+                return path
+    raise CBuildError("no C compiler found (set CC)")
+
+
+class BinaryCache:
+    """Directory of built programs, keyed by what went into the build.
+
+    Like CompileCache, reading an entry refreshes its modification time and
+    prune() removes the least recently used entries once the directory grows
+    past max_bytes; build() prunes after every build, since binaries are
+    large and only written then."""
+
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.builds = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, command):
+        h = hashlib.sha256("\0".join(command).encode())
+        with open(os.path.join(ROOT, RUNTIME), "rb") as f:
+            h.update(f.read())
+        h.update(source.encode("utf-8"))
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """Path of the binary for key, or None"""
+        path = self.path(key)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            try:
+                os.utime(path)  # Most recently used
+            except OSError:
+                pass
+            self.hits += 1
+            return path
+        return None
+
+    def build(self, source, command):
+        """Path of the binary of C source, built by command (the compiler
+        and its flags) unless cached"""
+        key = self.key(source, command)
+        path = self.get(key)
+        if path is not None:
+            return path
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=folder, prefix=".build-") as tmp:
+            src = os.path.join(tmp, "program.c")
+            out = os.path.join(tmp, "program")
+            with open(src, "w") as f:
+                f.write(source)
+            done = subprocess.run([*command, "-I", ROOT, "-o", out, src, "-lm"],
+                                  capture_output=True, text=True)
+            if done.returncode != 0:
+                raise CBuildError(f"{command[0]} failed:\n{done.stderr}")
+            os.replace(src, path + ".c")  # Kept for reference
+            os.replace(out, path)  # Atomic: other processes see a whole binary or none
+        self.builds += 1
+        self.prune(keep=path)
+        return path
+
+    def entries(self):
+        """(mtime, size, path) of every binary, size including its C source"""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".")]  # Builds in progress
+            for filename in filenames:
+                if filename.endswith(".c") or filename.startswith("."):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                try:
+                    size = st.st_size + os.stat(path + ".c").st_size
+                except OSError:
+                    size = st.st_size
+                found.append((st.st_mtime, size, path))
+        return found
+
+    def prune(self, keep=None):
+        """Remove least recently used binaries (but not keep) until the
+        cache fits in max_bytes. Returns the number of binaries removed."""
+        found = self.entries()
+        total = sum(size for mtime, size, path in found)
+        removed = 0
+        if total <= self.max_bytes:
+            return removed
+        found.sort()
+        for mtime, size, path in found:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+            try:
+                os.unlink(path + ".c")
+            except OSError:
+                pass
+            total -= size
+        self.evictions += removed
+        return removed
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            for name in (path, path + ".c"):
+                try:
+                    os.unlink(name)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return {"hits": self.hits, "builds": self.builds, "evictions": self.evictions}
+
+
+_temporary_dir = None  # TemporaryDirectory of temporary_cache()
+_temporary_cache = None
+
+
+def temporary_cache():
+    """BinaryCache of this process in a temporary directory, removed at exit"""
+    global _temporary_dir, _temporary_cache
+    if _temporary_cache is None:
+        _temporary_dir = tempfile.TemporaryDirectory(prefix="atomc-")
+        atexit.register(_temporary_dir.cleanup)
+        _temporary_cache = BinaryCache(_temporary_dir.name)
+    return _temporary_cache
+
+
+class CProgram:
+    """A translated program and its binary"""
+
+    def __init__(self, source, cc=None, cflags=CFLAGS):
+        self.source = source
+        self.command = (find_compiler(cc), *cflags)
+        self.binary = None
+
+    def build(self, cache=None):
+        """Build the binary (in the process's temporary cache unless given
+        one, see temporary_cache) and return its path"""
+        if self.binary is None:
+            if cache is None:
+                cache = temporary_cache()
+            self.binary = cache.build(self.source, self.command)
+        return self.binary
+
+    def run(self, stdin=b"", timeout=None, cache=None):
+        """CompletedProcess of a run with stdin as its input (bytes)"""
+        return subprocess.run([self.build(cache)], input=stdin, capture_output=True, timeout=timeout)
+
+
+def compile_c(text, lexer_backend="ply", cc=None):
+    """Compile AtomC source text to a CProgram (not built yet). Returns
+    (CompileResult, program), the program being None if the compilation
+    failed."""
+    from compiler import compile_source
+    result = compile_source(text, lexer_backend=lexer_backend, build_ast=True)
+    return result, CProgram(translate(result.ast), cc) if result.success else None
+
+
+def main(argv=None):
+    import argparse
+    from lexical_analyzer import LEXER_BACKENDS
+    ap = argparse.ArgumentParser(description="Compile an AtomC program to a native binary and run it")
+    ap.add_argument("path", help="AtomC source file")
+    ap.add_argument("--source", action="store_true", help="print the C source instead of running it")
+    ap.add_argument("--cache", default=DEFAULT_CACHE, metavar="DIR", help="binary cache directory")
+    ap.add_argument("--cc", default=None, help="C compiler (default: $CC, cc, gcc or clang)")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    args = ap.parse_args(argv)
+
+    with open(args.path, 'r') as f:
+        text = f.read()
+    try:
+        result, program = compile_c(text, args.lexer, args.cc)
+        if program is None:
+            print(f"{args.path}: {result.error_kind} error: {result.error}", file=sys.stderr)
+            return 1
+        if args.source:
+            print(program.source, end="")
+            return 0
+        binary = program.build(BinaryCache(args.cache))
+    except (CodegenError, CBuildError) as e:
+        print(f"{args.path}: {e}", file=sys.stderr)
+        return 1
+    sys.stdout.flush()
+    return subprocess.run([binary]).returncode
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,555 @@
+"""Code generator: syntax tree -> bytecode Program (see bytecode.py, vm.py).
+
+It runs on the SyntaxTree of a successful parse, so the program is known to
+be well typed: the Type of each node selects the typed instructions and the
+conversions to insert, as the semantic rules of the Parser decided them.
+Ints are 4 bytes, doubles 8, chars 1; structs are laid out like C structs.
+Array arguments are passed by address, struct arguments by value.
+
+Conditions are compiled to jumps (&& and || short-circuit, as in C), loops
+test their condition at the bottom, and reads and writes of scalar
+variables use the fused LOADL/LOADG/SETL/SETG instructions.
+"""
+import re
+
+from bytecode import (
+    ADD_C, ADD_D, ADD_I, BUILTINS, CALL, CALLEXT, CAST_C_D, CAST_D_C, CAST_D_I, CAST_I_C, CAST_I_D, COPY,
+    DIV_C, DIV_D, DIV_I, DROP, DUP, ENTER, EQ_C, EQ_D, EQ_I, FPADDR, GREATER_C, GREATER_D, GREATER_I,
+    GREATEREQ_C, GREATEREQ_D, GREATEREQ_I, HALT, INDEX, JF_C, JF_D, JF_I, JMP, JT_C, JT_D, JT_I, LESS_C,
+    LESS_D, LESS_I, LESSEQ_C, LESSEQ_D, LESSEQ_I, LOAD_C, LOAD_D, LOAD_I, LOADG_C, LOADG_D, LOADG_I,
+    LOADL_C, LOADL_D, LOADL_I, MUL_C, MUL_D, MUL_I, NEG_C, NEG_D, NEG_I, NOT_C, NOT_D, NOT_I, NOTEQ_C,
+    NOTEQ_D, NOTEQ_I, OFFSET, PUSHCT_A, PUSHCT_C, PUSHCT_D, PUSHCT_I, RET, SET_C, SET_D, SET_I, SETG_C,
+    SETG_D, SETG_I, SETL_C, SETL_D, SETL_I, STORE_C, STORE_D, STORE_I, SUB_C, SUB_D, SUB_I, SWAP, Program,
+    to_char, to_int,
+)
+from syntax_analyzer import ARITH_TYPE, TB_CHAR, TB_DOUBLE, TB_INT, TB_STRUCT, TB_VOID
+from syntax_tree import (
+    N_ADD, N_AND, N_ASSIGN, N_CALL, N_CAST, N_CT_CHAR, N_CT_INT, N_CT_REAL, N_CT_STRING, N_DIV, N_EMPTY,
+    N_EQUAL, N_GREATER, N_GREATEREQ, N_ID, N_INDEX, N_LESS, N_LESSEQ, N_MEMBER, N_MUL, N_NEG, N_NOT,
+    N_NOTEQ, N_OR, N_SUB, NODE_NAMES, Visitor,
+)
+
+
+class CodegenError(Exception):
+    """The program uses something the code generator cannot compile"""
+
+
+SIZES = {TB_INT: 4, TB_DOUBLE: 8, TB_CHAR: 1}
+POINTER_SIZE = 4  # Addresses are stored as ints
+
+
+def typed(i, d, c):
+    return {TB_INT: i, TB_DOUBLE: d, TB_CHAR: c}
+
+
+ARITH_OPS = {
+    N_ADD: typed(ADD_I, ADD_D, ADD_C), N_SUB: typed(SUB_I, SUB_D, SUB_C),
+    N_MUL: typed(MUL_I, MUL_D, MUL_C), N_DIV: typed(DIV_I, DIV_D, DIV_C),
+}
+COMPARE_OPS = {
+    N_EQUAL: typed(EQ_I, EQ_D, EQ_C), N_NOTEQ: typed(NOTEQ_I, NOTEQ_D, NOTEQ_C),
+    N_LESS: typed(LESS_I, LESS_D, LESS_C), N_LESSEQ: typed(LESSEQ_I, LESSEQ_D, LESSEQ_C),
+    N_GREATER: typed(GREATER_I, GREATER_D, GREATER_C), N_GREATEREQ: typed(GREATEREQ_I, GREATEREQ_D, GREATEREQ_C),
+}
+NEG = typed(NEG_I, NEG_D, NEG_C)
+NOT = typed(NOT_I, NOT_D, NOT_C)
+LOAD = typed(LOAD_I, LOAD_D, LOAD_C)
+STORE = typed(STORE_I, STORE_D, STORE_C)
+SET = typed(SET_I, SET_D, SET_C)
+LOADL = typed(LOADL_I, LOADL_D, LOADL_C)
+LOADG = typed(LOADG_I, LOADG_D, LOADG_C)
+SETL = typed(SETL_I, SETL_D, SETL_C)
+SETG = typed(SETG_I, SETG_D, SETG_C)
+JF = typed(JF_I, JF_D, JF_C)
+JT = typed(JT_I, JT_D, JT_C)
+PUSH_ZERO = {TB_INT: (PUSHCT_I, 0), TB_CHAR: (PUSHCT_C, 0)}
+
+# Conversions between scalar type bases (char -> int needs none)
+CASTS = {
+    (TB_INT, TB_DOUBLE): CAST_I_D, (TB_INT, TB_CHAR): CAST_I_C, (TB_DOUBLE, TB_INT): CAST_D_I,
+    (TB_DOUBLE, TB_CHAR): CAST_D_C, (TB_CHAR, TB_DOUBLE): CAST_C_D,
+}
+
+ESCAPES = {'n': '\n', 't': '\t', 'r': '\r', '0': '\0', 'a': '\a', 'b': '\b', 'f': '\f', 'v': '\v'}
+ESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+
+def unescape(text):
+    """Text of a char or string constant, without its quotes and escapes"""
+    return ESCAPE_RE.sub(lambda m: ESCAPES.get(m.group(1), m.group(1)), text[1:-1])
+
+
+def align_up(n, alignment):
+    return -(-n // alignment) * alignment
+
+
+def base_of(t):
+    """Type base an operation on a value of type t works on: arrays are
+    handled through their address, an int"""
+    return TB_INT if t.nElements >= 0 else t.typeBase
+
+
+class CodeGenerator(Visitor):
+    """Visitor compiling statements; expressions go through value(),
+    address() and branch()"""
+
+    def __init__(self, tree):
+        super().__init__(tree)
+        self.program = Program()
+        self.code = self.program.code
+        self.labels = []  # Label -> code position, -1 until placed
+        self.fixups = []  # (code index of an operand, label)
+        self.locations = {}  # Variable Symbol -> (is global, address or frame offset)
+        self.layouts = {}  # Struct Symbol -> (size, alignment, {member Symbol: offset})
+        self.function_labels = {}  # Function Symbol -> label
+        self.strings = {}  # Bytes -> address
+        self.doubles = {}  # repr of a double -> index in the constants
+        self.loop_ends = []  # Exit label of each enclosing loop
+        self.frame_size = 0  # Bytes of the function being compiled
+        self.main = None
+        self.values = {
+            N_ID: self.value_id, N_CT_INT: self.value_int, N_CT_REAL: self.value_real,
+            N_CT_CHAR: self.value_char, N_CT_STRING: self.value_string, N_NEG: self.value_neg,
+            N_NOT: self.value_logical, N_AND: self.value_logical, N_OR: self.value_logical,
+            N_CAST: self.value_cast, N_INDEX: self.value_element, N_MEMBER: self.value_element,
+            N_ASSIGN: self.assign, N_CALL: self.call,
+        }
+        for kind in ARITH_OPS:
+            self.values[kind] = self.value_arith
+        for kind in COMPARE_OPS:
+            self.values[kind] = self.value_compare
+
+    # Code and labels
+
+    def emit(self, op, arg=0):
+        self.code.append(op)
+        self.code.append(arg)
+
+    def label(self):
+        self.labels.append(-1)
+        return len(self.labels) - 1
+
+    def place(self, label):
+        self.labels[label] = len(self.code)
+
+    def jump(self, op, label):
+        self.emit(op)
+        self.fixups.append((len(self.code) - 1, label))
+
+    def error(self, n, message):
+        line, column = self.tree.position(n)
+        where = f" at line {line}, column {column}" if line is not None else ""
+        raise CodegenError(message + where)
+
+    # Memory
+
+    def layout(self, s):
+        """(size, alignment, member offsets) of struct s"""
+        entry = self.layouts.get(s)
+        if entry is None:
+            offsets = {}
+            size, alignment = 0, 1
+            for m in s.members.begin:
+                msize, malign = self.size_align(m.type)
+                size = align_up(size, malign)
+                offsets[m] = size
+                size += msize
+                alignment = max(alignment, malign)
+            entry = self.layouts[s] = (align_up(size, alignment), alignment, offsets)
+        return entry
+
+    def size_align(self, t, param=False):
+        """(size, alignment) of a variable of type t. An array argument, or
+        an array of unknown size, holds the address of the array."""
+        if t.nElements >= 0 and (param or t.nElements == 0):
+            return POINTER_SIZE, POINTER_SIZE
+        if t.typeBase == TB_STRUCT:
+            size, alignment = self.layout(t.s)[:2]
+        else:
+            size = alignment = SIZES[t.typeBase]
+        return size * (t.nElements if t.nElements > 0 else 1), alignment
+
+    def alloc_global(self, size, alignment):
+        image = self.program.image
+        address = align_up(len(image), alignment)
+        image.extend(bytes(address + size - len(image)))
+        return address
+
+    def alloc_local(self, size, alignment):
+        offset = align_up(self.frame_size, alignment)
+        self.frame_size = offset + size
+        return offset
+
+    def location(self, s):
+        """(is global, address or frame offset) of variable s. Variables
+        declared implicitly by an assignment get their slot when first seen."""
+        loc = self.locations.get(s)
+        if loc is None:
+            size, alignment = self.size_align(s.type)
+            if s.mem == "MEM_GLOBAL":
+                loc = True, self.alloc_global(size, alignment)
+            else:
+                loc = False, self.alloc_local(size, alignment)
+            self.locations[s] = loc
+        return loc
+
+    def string(self, text):
+        """Address of a NUL-terminated string constant"""
+        data = unescape(text).encode("utf-8") + b"\0"
+        address = self.strings.get(data)
+        if address is None:
+            address = self.strings[data] = self.alloc_global(len(data), 1)
+            self.program.image[address:address + len(data)] = data
+        return address
+
+    # Declarations and statements
+
+    def visit_UNIT(self, n):
+        # Top-level statements run in a frame of their own
+        self.emit(ENTER)
+        enter = len(self.code) - 1
+        self.generic_visit(n)
+        self.code[enter] = align_up(self.frame_size, 8)
+        if self.main is not None:
+            self.jump(CALL, self.function_label(self.main))
+        self.emit(HALT)
+        for index, label in self.fixups:
+            self.code[index] = self.labels[label]
+        return self.program
+
+    def visit_STRUCT(self, n):
+        pass  # Laid out when used
+
+    def visit_VAR(self, n):
+        self.location(self.tree.symbol(n))
+
+    def function_label(self, s):
+        label = self.function_labels.get(s)
+        if label is None:
+            label = self.function_labels[s] = self.label()
+        return label
+
+    def visit_FUNC(self, n):
+        tree = self.tree
+        s = tree.symbol(n)
+        if s.type.typeBase == TB_STRUCT and s.type.nElements < 0:
+            self.error(n, f"{s.name}: returning a structure is not supported")
+        if s.name == "main":
+            self.main = s
+        skip = self.label()
+        self.jump(JMP, skip)
+        self.place(self.function_label(s))
+        self.program.functions[s.name] = len(self.code)
+        self.emit(ENTER)
+        enter = len(self.code) - 1
+        outer_size, self.frame_size = self.frame_size, 0
+
+        *params, body = tree.child_list(n)
+        slots = []
+        for p in params:
+            ps = tree.symbol(p)
+            size, alignment = self.size_align(ps.type, param=True)
+            offset = self.alloc_local(size, alignment)
+            self.locations[ps] = False, offset
+            slots.append((ps.type, size, offset))
+        # The arguments are on the operand stack, the last one on top
+        for t, size, offset in reversed(slots):
+            if t.typeBase == TB_STRUCT and t.nElements < 0:
+                self.emit(FPADDR, offset)
+                self.emit(SWAP)
+                self.emit(COPY, size)
+                self.emit(DROP)
+            else:
+                self.emit(SETL[base_of(t)], offset)
+
+        self.visit(body)
+        # Falling off the end of the function
+        if s.type.typeBase != TB_VOID:
+            self.push_zero(s.type)
+        self.emit(RET)
+        # Never empty, so that unbounded recursion overflows the stack
+        self.code[enter] = max(8, align_up(self.frame_size, 8))
+        self.frame_size = outer_size
+        self.place(skip)
+
+    def push_zero(self, t):
+        base = base_of(t)
+        if base == TB_DOUBLE:
+            self.emit(PUSHCT_D, self.double(0.0))
+        else:
+            self.emit(*PUSH_ZERO[base])
+
+    def visit_EXPR(self, n):
+        for c in self.tree.children(n):
+            self.discard(c)
+
+    def visit_IF(self, n):
+        cond, then, *rest = self.tree.child_list(n)
+        other = self.label()
+        self.branch(cond, other, False)
+        self.visit(then)
+        if rest:
+            end = self.label()
+            self.jump(JMP, end)
+            self.place(other)
+            self.visit(rest[0])
+            self.place(end)
+        else:
+            self.place(other)
+
+    def loop(self, cond, body, step=None):
+        """Body, then step, repeated while cond holds (tested first)"""
+        test, top, end = self.label(), self.label(), self.label()
+        self.jump(JMP, test)
+        self.place(top)
+        self.loop_ends.append(end)
+        self.visit(body)
+        self.loop_ends.pop()
+        if step is not None:
+            self.discard(step)
+        self.place(test)
+        if cond is None:
+            self.jump(JMP, top)
+        else:
+            self.branch(cond, top, True)
+        self.place(end)
+
+    def visit_WHILE(self, n):
+        cond, body = self.tree.child_list(n)
+        self.loop(cond, body)
+
+    def visit_FOR(self, n):
+        tree = self.tree
+        init, cond, step, body = tree.child_list(n)
+        if tree.kinds[init] != N_EMPTY:
+            self.discard(init)
+        self.loop(cond if tree.kinds[cond] != N_EMPTY else None, body,
+                  step if tree.kinds[step] != N_EMPTY else None)
+
+    def visit_BREAK(self, n):
+        if not self.loop_ends:
+            self.error(n, "break outside of a loop")
+        self.jump(JMP, self.loop_ends[-1])
+
+    def visit_RETURN(self, n):
+        func = self.tree.symbol(n)
+        for c in self.tree.children(n):
+            self.value(c)
+            self.convert(self.tree.type(c), func.type)
+        self.emit(RET if func is not None else HALT)
+
+    # Expressions
+
+    def value(self, n):
+        """Code pushing the value of expression n (the address of an array
+        or a struct)"""
+        self.values[self.tree.kinds[n]](n)
+
+    def discard(self, n):
+        """Code evaluating expression n for its side effects"""
+        kind = self.tree.kinds[n]
+        if kind == N_ASSIGN:
+            self.assign(n, False)
+        else:
+            self.value(n)
+            if kind != N_CALL or self.tree.symbol(n).type.typeBase != TB_VOID:
+                self.emit(DROP)
+
+    def convert(self, src, dst):
+        """Code converting the value on top of the stack from type src to dst"""
+        if src.nElements < 0 and dst.nElements < 0:
+            op = CASTS.get((src.typeBase, dst.typeBase))
+            if op is not None:
+                self.emit(op)
+
+    def double(self, value):
+        key = repr(value)
+        index = self.doubles.get(key)
+        if index is None:
+            index = self.doubles[key] = len(self.program.constants)
+            self.program.constants.append(value)
+        return index
+
+    def value_int(self, n):
+        self.emit(PUSHCT_I, to_int(self.tree.value(n)))
+
+    def value_real(self, n):
+        self.emit(PUSHCT_D, self.double(self.tree.value(n)))
+
+    def value_char(self, n):
+        text = unescape(self.tree.value(n))
+        self.emit(PUSHCT_C, to_char(ord(text)) if text else 0)
+
+    def value_string(self, n):
+        self.emit(PUSHCT_A, self.string(self.tree.value(n)))
+
+    def value_id(self, n):
+        s = self.tree.symbol(n)
+        if s.cls != "CLS_VAR":
+            self.error(n, f"{s.name} is not a variable")
+        t = s.type
+        if t.nElements >= 0 or t.typeBase == TB_STRUCT:
+            self.address(n)
+            return
+        is_global, where = self.location(s)
+        self.emit((LOADG if is_global else LOADL)[t.typeBase], where)
+
+    def value_element(self, n):
+        self.address(n)
+        t = self.tree.type(n)
+        if t.nElements < 0 and t.typeBase != TB_STRUCT:
+            self.emit(LOAD[t.typeBase])
+
+    def value_arith(self, n):
+        tree = self.tree
+        t = tree.type(n)
+        left, right = tree.child_list(n)
+        self.value(left)
+        self.convert(tree.type(left), t)
+        self.value(right)
+        self.convert(tree.type(right), t)
+        self.emit(ARITH_OPS[tree.kinds[n]][t.typeBase])
+
+    def value_compare(self, n):
+        tree = self.tree
+        left, right = tree.child_list(n)
+        common = ARITH_TYPE[tree.type(left).typeBase][tree.type(right).typeBase]
+        self.value(left)
+        self.convert(tree.type(left), common)
+        self.value(right)
+        self.convert(tree.type(right), common)
+        self.emit(COMPARE_OPS[tree.kinds[n]][common.typeBase])
+
+    def value_neg(self, n):
+        (c,) = self.tree.child_list(n)
+        self.value(c)
+        self.emit(NEG[self.tree.type(n).typeBase])
+
+    def value_logical(self, n):
+        tree = self.tree
+        if tree.kinds[n] == N_NOT:
+            (c,) = tree.child_list(n)
+            self.value(c)
+            self.emit(NOT[base_of(tree.type(c))])
+            return
+        false, end = self.label(), self.label()
+        self.branch(n, false, False)
+        self.emit(PUSHCT_I, 1)
+        self.jump(JMP, end)
+        self.place(false)
+        self.emit(PUSHCT_I, 0)
+        self.place(end)
+
+    def value_cast(self, n):
+        (c,) = self.tree.child_list(n)
+        self.value(c)
+        self.convert(self.tree.type(c), self.tree.type(n))
+
+    def branch(self, n, label, when):
+        """Code jumping to label if the truth of condition n is when"""
+        tree = self.tree
+        kind = tree.kinds[n]
+        if kind == N_NOT:
+            (c,) = tree.child_list(n)
+            self.branch(c, label, not when)
+        elif kind == N_AND or kind == N_OR:
+            left, right = tree.child_list(n)
+            if when == (kind == N_OR):
+                # Either operand decides alone
+                self.branch(left, label, when)
+                self.branch(right, label, when)
+            else:
+                # Both operands are needed
+                skip = self.label()
+                self.branch(left, skip, not when)
+                self.branch(right, label, when)
+                self.place(skip)
+        else:
+            self.value(n)
+            self.jump((JT if when else JF)[base_of(tree.type(n))], label)
+
+    def address(self, n):
+        """Code pushing the address of lvalue, array or struct n"""
+        tree = self.tree
+        kind = tree.kinds[n]
+        if kind == N_ID:
+            s = tree.symbol(n)
+            is_global, where = self.location(s)
+            if s.mem == "MEM_ARG" and s.type.nElements >= 0:
+                self.emit(LOADL_I, where)  # The argument holds the array's address
+            else:
+                self.emit(PUSHCT_A if is_global else FPADDR, where)
+        elif kind == N_INDEX:
+            array, index = tree.child_list(n)
+            self.address(array)
+            self.value(index)
+            self.emit(INDEX, self.size_align(tree.type(n))[0])
+        elif kind == N_MEMBER:
+            (operand,) = tree.child_list(n)
+            self.address(operand)
+            offset = self.layout(tree.type(operand).s)[2][tree.symbol(n)]
+            if offset:
+                self.emit(OFFSET, offset)
+        else:
+            self.value(n)  # An array valued expression: its value is an address
+
+    def assign(self, n, keep=True):
+        """Code of assignment n, leaving the value assigned on the stack if keep"""
+        tree = self.tree
+        left, right = tree.child_list(n)
+        t = tree.type(left)
+        if t.typeBase == TB_STRUCT:
+            self.address(left)
+            self.address(right)
+            self.emit(COPY, self.size_align(t)[0])
+            if not keep:
+                self.emit(DROP)
+            return
+        if tree.kinds[left] == N_ID:
+            self.value(right)
+            self.convert(tree.type(right), t)
+            if keep:
+                self.emit(DUP)
+            is_global, where = self.location(tree.symbol(left))
+            self.emit((SETG if is_global else SETL)[t.typeBase], where)
+            return
+        self.address(left)
+        self.value(right)
+        self.convert(tree.type(right), t)
+        self.emit((STORE if keep else SET)[t.typeBase])
+
+    def call(self, n):
+        tree = self.tree
+        f = tree.symbol(n)
+        args = tree.child_list(n)[1:]
+        params = f.args.begin
+        if len(args) != len(params):
+            self.error(n, f"{f.name} takes {len(params)} arguments, not {len(args)}")
+        for a, p in zip(args, params):
+            if p.type.nElements >= 0 or p.type.typeBase == TB_STRUCT:
+                self.address(a)
+            else:
+                self.value(a)
+                self.convert(tree.type(a), p.type)
+        if f.cls == "CLS_EXTFUNC":
+            self.emit(CALLEXT, BUILTINS.index(f.name))
+        else:
+            self.jump(CALL, self.function_label(f))
+
+    def generic_visit(self, n):
+        if self.tree.kinds[n] in self.values:
+            self.error(n, f"unexpected {NODE_NAMES[self.tree.kinds[n]]} expression")
+        super().generic_visit(n)
+
+
+def generate(tree):
+    """Bytecode Program of a parsed program (its SyntaxTree)"""
+    return CodeGenerator(tree).visit()
+
+
+def compile_program(text, lexer_backend="ply"):
+    """Compile AtomC source text to bytecode. Returns (CompileResult,
+    Program), the program being None if the compilation failed."""
+    from compiler import compile_source
+    result = compile_source(text, lexer_backend=lexer_backend, build_ast=True)
+    return result, generate(result.ast) if result.success else None
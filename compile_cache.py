@@ -0,0 +1,172 @@
+"""Persistent, content-addressed compile cache.
+
+An entry is keyed by the SHA-256 of the compiler version stamp and the
+source text, and stores the outcome of compiling it (see
+CompileResult.summary) as JSON. The stamp hashes the compiler's own source
+files, so editing the grammar or the semantic checks invalidates every
+entry. Answering from the cache needs neither PLY nor a Parser: this module
+only imports the standard library.
+
+Entries are written to a temporary file and renamed into place, so several
+processes can share one directory. Reading an entry refreshes its
+modification time, and prune() removes the least recently used entries
+once the directory grows past max_bytes.
+"""
+import hashlib
+import json
+import os
+from types import SimpleNamespace
+
+COMPILER_VERSION = "2"  # Bump when the cached outcome format changes
+
+# Sources whose behavior is part of the cached outcome
+STAMP_FILES = ("lexical_analyzer.py", "scanner.py", "syntax_analyzer.py", "syntax_tree.py", "token_stream.py",
+               "line_index.py", "compiler.py")
+
+_stamp = None
+
+
+def version_stamp():
+    """Hash of COMPILER_VERSION and the compiler sources, computed once"""
+    global _stamp
+    if _stamp is None:
+        h = hashlib.sha256(COMPILER_VERSION.encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in STAMP_FILES:
+            with open(os.path.join(root, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+        _stamp = h.hexdigest()
+    return _stamp
+
+
+class CachedResult:
+    """A compile outcome read back from the cache, with the same fields as
+    CompileResult (symbols is the summary list, there is no context)"""
+
+    def __init__(self, data):
+        self.success = data["success"]
+        self.error = data["error"]
+        self.error_kind = data["error_kind"]
+        self.line = data["line"]
+        self.column = data["column"]
+        self.snippet = data["snippet"]
+        self.symbols = data["symbols"]
+        self.lex_errors = [tuple(e) for e in data["lex_errors"]]
+        self.diagnostics = [SimpleNamespace(kind=kind, message=message, line=line, column=column, snippet=None)
+                            for kind, message, line, column in data["diagnostics"]]
+        self.truncated = data["truncated"]
+        self.data = data  # The whole entry, with the fields other backends store
+
+    def __bool__(self):
+        return self.success
+
+    def __repr__(self):
+        if self.success:
+            return "CachedResult(SUCCESS)"
+        return f"CachedResult({self.error_kind} error: {self.error})"
+
+
+class CompileCache:
+    """Directory of cached compile outcomes"""
+
+    def __init__(self, directory, max_bytes=64 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, text, variant=""):
+        """Cache key of a source text, compiled with the options variant
+        names (e.g. "recover")"""
+        h = hashlib.sha256(version_stamp().encode())
+        h.update(text.encode("utf-8", "surrogatepass"))
+        if variant:
+            h.update(b"\0" + variant.encode())
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key[2:] + ".json")
+
+    def get(self, key):
+        """Cached outcome for key, or None"""
+        path = self.path(key)
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # Most recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return CachedResult(data)
+
+    def put(self, key, summary):
+        """Store an outcome (a CompileResult.summary() dict) atomically"""
+        import tempfile
+        path = self.path(key)
+        folder = os.path.dirname(path)
+        os.makedirs(folder, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=folder, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(summary, f, separators=(",", ":"))
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+        self.writes += 1
+
+    def entries(self):
+        """(mtime, size, path) of every entry"""
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue  # Removed by another process
+                found.append((st.st_mtime, st.st_size, path))
+        return found
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits in
+        max_bytes. Returns the number of entries removed."""
+        found = self.entries()
+        total = sum(size for mtime, size, path in found)
+        removed = 0
+        if total <= self.max_bytes:
+            return removed
+        found.sort()
+        for mtime, size, path in found:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass
+            total -= size
+        self.evictions += removed
+        return removed
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "writes": self.writes, "evictions": self.evictions}
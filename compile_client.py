@@ -0,0 +1,237 @@
+"""Thin client of the compile daemon (compile_daemon.py).
+
+Only the standard library (and compile_cache, which only imports it) is
+imported, so a compilation through the daemon costs the start of a bare
+interpreter and one round trip on its socket, instead of the imports,
+lexer tables and global symbols of a compiler process. The daemon is
+started in the background when none is listening, and restarted when it
+runs another version of the compiler than this client's tree: every
+connection starts with a version handshake (see daemon_stamp). Busy
+answers (the daemon's queue is full) are retried after a growing pause.
+
+For each file the report section batch.py would print is written to
+stdout, followed by the artifacts asked for with --emit; --json writes the
+daemon's responses instead. The exit status is 0 if every file compiled,
+1 if one had errors, 2 if the daemon could not be reached.
+
+Usage: python compile_client.py [--socket PATH] [--recover] [--emit bytecode|python|c] [--json] [--no-start] files...
+       python compile_client.py --stats | --shutdown
+"""
+import json
+import os
+import socket
+import sys
+import time
+
+from compile_cache import version_stamp
+
+START_TIMEOUT = 30.0  # Seconds to wait for a daemon started by the client
+RETRY_PAUSE = 0.01  # First pause after a busy answer, doubled up to 1s
+
+# What the daemon's workers run besides the compiler (compile_cache.STAMP_FILES)
+DAEMON_FILES = ("compile_daemon.py", "batch.py", "parser_trace.py", "codegen.py", "bytecode.py", "vm.py",
+                "pybackend.py", "cbackend.py", "atomc_runtime.h")
+
+_stamp = None
+
+
+def daemon_stamp():
+    """Hash of the compiler's version stamp and of DAEMON_FILES, computed
+    once: a daemon answers for the code it was started from"""
+    global _stamp
+    if _stamp is None:
+        import hashlib
+        h = hashlib.sha256(version_stamp().encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in DAEMON_FILES:
+            with open(os.path.join(root, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+        _stamp = h.hexdigest()
+    return _stamp
+
+
+def default_socket_path():
+    """Per-user socket path, in XDG_RUNTIME_DIR when it is set"""
+    directory = os.environ.get("XDG_RUNTIME_DIR") or os.environ.get("TMPDIR") or "/tmp"
+    return os.path.join(directory, f"atomc-{os.getuid()}.sock")
+
+
+def start_daemon(path, args=()):
+    """Start compile_daemon.py in the background, detached from this process"""
+    import subprocess
+    daemon = os.path.join(os.path.dirname(os.path.abspath(__file__)), "compile_daemon.py")
+    subprocess.Popen([sys.executable, daemon, "--socket", path, *args], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def wait_stopped(path, timeout=START_TIMEOUT):
+    """Wait until the daemon of path has exited, i.e. released its lock"""
+    import fcntl
+    try:
+        lock = open(path + ".lock", "r")
+    except FileNotFoundError:
+        return
+    deadline = time.monotonic() + timeout
+    with lock:
+        while True:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                if time.monotonic() > deadline:
+                    raise ConnectionError(f"the compile daemon on {path} did not stop") from None
+                time.sleep(0.02)
+            else:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+                return
+
+
+def connect(path, start=True, daemon_args=()):
+    """Socket connected to the daemon at path, starting it if need be"""
+    deadline = None
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+            return sock
+        except (FileNotFoundError, ConnectionRefusedError):
+            sock.close()
+            if not start:
+                raise
+            if deadline is None:
+                start_daemon(path, daemon_args)
+                deadline = time.monotonic() + START_TIMEOUT
+            elif time.monotonic() > deadline:
+                raise ConnectionError(f"no compile daemon listening on {path}") from None
+            time.sleep(0.02)
+
+
+class DaemonClient:
+    """One connection to the daemon. Requests are answered in order.
+
+    A daemon started from another version of the compiler (its stamp is not
+    daemon_stamp()) is shut down and a new one started in its place, or
+    refused without start. check_version=False skips the handshake, e.g. to
+    stop any daemon."""
+
+    def __init__(self, path=None, start=True, daemon_args=(), check_version=True):
+        self.path = path or default_socket_path()
+        self.sock = connect(self.path, start, daemon_args)
+        self.stream = self.sock.makefile("rwb")
+        if check_version:
+            self.handshake(start, daemon_args)
+
+    def handshake(self, start, daemon_args):
+        """Make sure the daemon runs this version of the compiler"""
+        stamp = daemon_stamp()
+        try:
+            if self.request({"op": "version"}).get("stamp") == stamp:
+                return
+            if not start:
+                raise ConnectionError(f"the compile daemon on {self.path} runs another version of the compiler")
+            self.request({"op": "shutdown"})
+        except BaseException:
+            self.close()
+            raise
+        self.close()
+        wait_stopped(self.path)
+        self.sock = connect(self.path, start, daemon_args)
+        self.stream = self.sock.makefile("rwb")
+        try:
+            if self.request({"op": "version"}).get("stamp") != stamp:
+                raise ConnectionError(f"the compile daemon on {self.path} runs another version of the compiler")
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.stream.close()
+        self.sock.close()
+
+    def request(self, message):
+        """Send a request and return the response, retrying while busy"""
+        pause = RETRY_PAUSE
+        data = json.dumps(message).encode() + b"\n"
+        while True:
+            self.stream.write(data)
+            self.stream.flush()
+            line = self.stream.readline()
+            if not line:
+                raise ConnectionError("the compile daemon closed the connection")
+            response = json.loads(line)
+            if response.get("status") != "busy":
+                return response
+            time.sleep(pause)
+            pause = min(pause * 2, 1.0)
+
+    def compile(self, path=None, text=None, name=None, **options):
+        """Compile a file (its path is resolved here) or source text.
+        options: recover, max_errors, lexer, timeout, artifacts."""
+        message = {"op": "compile", **options}
+        if text is not None:
+            message["text"] = text
+            message["name"] = name or "<text>"
+        else:
+            message["path"] = os.path.abspath(path)
+            message["name"] = name or os.path.basename(path)
+        return self.request(message)
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Compile AtomC files through the compile daemon")
+    ap.add_argument("files", nargs="*", help="source files, - for stdin")
+    ap.add_argument("--socket", default=None, help="daemon socket (default: per user)")
+    ap.add_argument("--recover", action="store_true", help="report every error of a file, not only the first")
+    ap.add_argument("--max-errors", type=int, default=None, help="errors reported per file with --recover")
+    ap.add_argument("--lexer", default=None, help="lexer backend (see lexical_analyzer.LEXER_BACKENDS)")
+    ap.add_argument("--timeout", type=float, default=None, help="per-file timeout in seconds")
+    ap.add_argument("--emit", action="append", default=[], choices=("bytecode", "python", "c"),
+                    help="artifact to print after a successful compilation")
+    ap.add_argument("--json", action="store_true", help="print the daemon's responses as JSON lines")
+    ap.add_argument("--no-start", action="store_true", help="fail instead of starting a daemon")
+    ap.add_argument("--stats", action="store_true", help="print the daemon's counters")
+    ap.add_argument("--shutdown", action="store_true", help="stop the daemon")
+    args = ap.parse_args(argv)
+
+    options = {"artifacts": args.emit} if args.emit else {}
+    for key in ("recover", "max_errors", "lexer", "timeout"):
+        if getattr(args, key):
+            options[key] = getattr(args, key)
+    try:
+        client = DaemonClient(args.socket, start=not (args.no_start or args.stats or args.shutdown),
+                              check_version=not (args.stats or args.shutdown))
+    except OSError as e:
+        sys.stderr.write(f"compile_client: {e}\n")
+        return 2
+    status = 0
+    with client:
+        if args.stats or args.shutdown:
+            print(json.dumps(client.request({"op": "stats" if args.stats else "shutdown"})))
+            return 0
+        for path in args.files:
+            if path == "-":
+                response = client.compile(text=sys.stdin.read(), name="<stdin>", **options)
+            else:
+                response = client.compile(path, **options)
+            if args.json:
+                print(json.dumps(response))
+            else:
+                sys.stdout.write(response.get("report", ""))
+                for kind in args.emit:
+                    if kind in response.get("artifacts", {}):
+                        sys.stdout.write(response["artifacts"][kind])
+                if response.get("error"):
+                    sys.stderr.write(f"compile_client: {path}: {response['error']}\n")
+            if response.get("status") != "success":
+                status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""Persistent compile daemon on a Unix socket.
+
+Every run of main.py or batch.py pays for the interpreter start, importing
+the compiler and PLY, loading the lexer tables and adding the predefined
+functions before it compiles anything. The daemon pays for it once: an
+asyncio server listens on a Unix socket and hands compilations to a pool
+of worker processes, each of which imports the compiler, builds its lexers
+and a first CompilationContext when it starts. compile_client.py is the
+thin client, and starts a daemon when none is listening.
+
+Protocol: one JSON object per line, each way; the responses of a
+connection come in the order of its requests. A compile request carries
+the source file's "path" or its "text", and optionally "name", "recover",
+"max_errors", "lexer", "timeout" (seconds) and "artifacts" (any of
+"bytecode", "python" and "c": the bytecode listing or the translated
+source of a successful compilation). Its response has "status" (success,
+failure, syntax, semantic, timeout, error or busy), "report" (the section
+batch.py prints for the file), "result" (CompileResult.summary()),
+"artifacts" and "seconds". {"op": "version"} is answered with the
+daemon's "stamp" (compile_client.daemon_stamp, computed when it starts):
+clients check it first and restart a daemon started from other sources.
+{"op": "stats"} and {"op": "shutdown"} are the other requests.
+
+Flow control: at most `workers` compilations run at once and at most
+`max_queue` more wait for a worker; beyond that a request is answered
+"busy" at once and the client retries later. A connection is served one
+request at a time and its next line is only read once the response is
+written, so a client that does not read its responses is held back by the
+socket buffers. After `idle` seconds without a request the daemon closes
+its connections, stops its workers and removes its socket.
+
+Usage: python compile_daemon.py [--socket PATH] [--workers N] [--max-queue N] [--idle S] [--timeout S]
+"""
+import asyncio
+import io
+import json
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stdout
+
+from compile_client import daemon_stamp, default_socket_path
+
+DEFAULT_MAX_QUEUE = 64  # Requests waiting for a worker before the daemon answers busy
+DEFAULT_IDLE = 600.0  # Seconds without a request before the daemon exits
+MAX_REQUEST = 64 << 20  # Longest request line, source text included
+ARTIFACTS = ("bytecode", "python", "c")
+
+
+def warm_worker():
+    """Worker initializer: import the compiler, build the shared lexers and
+    the predefined functions once, by compiling an empty source with each
+    lexer, before the first request"""
+    from lexical_analyzer import LEXER_BACKENDS
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The daemon stops the pool on Ctrl-C
+    for backend in LEXER_BACKENDS:
+        compile_request({"text": "", "lexer": backend})
+
+
+def worker_pid():
+    return os.getpid()
+
+
+def build_artifact(kind, tree):
+    """Text of an artifact (see ARTIFACTS) of a parsed program"""
+    if kind == "bytecode":
+        from codegen import generate
+        return generate(tree).disassemble()
+    if kind == "python":
+        from pybackend import translate
+        return translate(tree)
+    from cbackend import translate
+    return translate(tree)
+
+
+def compile_request(request):
+    """Compile the source of a request in a worker and return the response"""
+    from batch import CompileTimeout, _alarm, print_result
+    from compiler import compile_source
+    from syntax_analyzer import DEFAULT_MAX_ERRORS
+
+    name = request.get("name") or request.get("path") or "<text>"
+    timeout = request.get("timeout")
+    artifacts = request.get("artifacts") or ()
+    response = {"name": name, "status": "error", "report": "", "result": None, "artifacts": {}}
+    use_alarm = timeout and hasattr(signal, "setitimer")
+    out = io.StringIO()
+    t0 = time.perf_counter()
+    try:
+        text = request.get("text")
+        if text is None:
+            with open(request["path"], 'r') as f:
+                text = f.read()
+        options = {"build_ast": True} if artifacts else {}
+        if request.get("recover"):
+            options.update(recover=True, max_errors=max(request.get("max_errors") or DEFAULT_MAX_ERRORS, 1))
+        if use_alarm:
+            signal.signal(signal.SIGALRM, _alarm)
+            signal.setitimer(signal.ITIMER_REAL, timeout)
+        try:
+            result = compile_source(text, lexer_backend=request.get("lexer") or "ply", **options)
+            if result.success:
+                response["artifacts"] = {kind: build_artifact(kind, result.ast) for kind in artifacts}
+        finally:
+            if use_alarm:
+                signal.setitimer(signal.ITIMER_REAL, 0)
+        with redirect_stdout(out):
+            print(f"\nProcessing file: {name}")
+            print_result(name, result)
+        response["status"] = result.error_kind or ("success" if result else "failure")
+        response["result"] = result.summary()
+    except CompileTimeout:
+        out.write(f"\nProcessing file: {name}\nTimeout: {name} took more than {timeout}s\n")
+        response["status"] = "timeout"
+    except Exception as e:
+        response["error"] = f"{type(e).__name__}: {e}"
+    response["report"] = out.getvalue()
+    response["seconds"] = time.perf_counter() - t0
+    return response
+
+
+def check_request(request):
+    """Error message for a malformed compile request, or None"""
+    if ("path" in request) == ("text" in request):
+        return "a compile request needs either a path or a text"
+    unknown = set(request.get("artifacts") or ()) - set(ARTIFACTS)
+    if unknown:
+        return f"unknown artifacts: {', '.join(sorted(unknown))} (known: {', '.join(ARTIFACTS)})"
+    return None
+
+
+class CompileDaemon:
+    """The server: client connections, flow control and the worker pool"""
+
+    def __init__(self, socket_path=None, workers=None, max_queue=DEFAULT_MAX_QUEUE, idle=DEFAULT_IDLE,
+                 timeout=None):
+        self.socket_path = socket_path or default_socket_path()
+        self.workers = workers or os.cpu_count() or 1
+        self.max_queue = max_queue
+        self.idle = idle
+        self.timeout = timeout  # Default per-request timeout
+        self.stamp = daemon_stamp()  # Of the code the workers will import
+        self.pool = None
+        self.slots = None  # Semaphore of the workers, created in the event loop
+        self.stopping = None
+        self.running = 0  # Compilations in the workers
+        self.waiting = 0  # Requests waiting for a worker
+        self.last_request = time.monotonic()
+        self.connections = set()
+        self.counts = {"connections": 0, "requests": 0, "compiled": 0, "busy": 0, "errors": 0, "restarts": 0}
+
+    def start_pool(self):
+        self.pool = ProcessPoolExecutor(self.workers, initializer=warm_worker)
+
+    async def warm_up(self):
+        """Start every worker now rather than on the first requests"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, worker_pid) for _ in range(self.workers)))
+
+    async def serve(self):
+        """Run until shut down, idle for too long, or stopped by a signal"""
+        loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        self.slots = asyncio.Semaphore(self.workers)
+        self.start_pool()
+        await self.warm_up()
+        mask = os.umask(0o177)  # The socket is only for this user
+        try:
+            server = await asyncio.start_unix_server(self.handle, path=self.socket_path, limit=MAX_REQUEST)
+        finally:
+            os.umask(mask)
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stopping.set)
+        watchdog = asyncio.create_task(self.watch_idle())
+        try:
+            await self.stopping.wait()
+        finally:
+            watchdog.cancel()
+            server.close()
+            writers = list(self.connections)
+            for writer in writers:
+                writer.close()  # After the responses already written, e.g. to a shutdown request
+            await asyncio.gather(*(writer.wait_closed() for writer in writers), return_exceptions=True)
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+            self.pool.shutdown(wait=True, cancel_futures=True)
+
+    async def watch_idle(self):
+        while True:
+            await asyncio.sleep(min(self.idle, 1.0))
+            if not self.running and not self.waiting and time.monotonic() - self.last_request >= self.idle:
+                self.stopping.set()
+                return
+
+    async def handle(self, reader, writer):
+        """Serve the requests of one connection, one at a time"""
+        self.connections.add(writer)
+        self.counts["connections"] += 1
+        try:
+            while not self.stopping.is_set():
+                try:
+                    line = await reader.readline()
+                except ValueError:  # Longer than MAX_REQUEST
+                    writer.write(self.encode({"status": "error", "error": "request too long"}))
+                    break
+                if not line:
+                    break
+                self.last_request = time.monotonic()
+                response = await self.respond(line)
+                writer.write(self.encode(response))
+                await writer.drain()
+                self.last_request = time.monotonic()
+        except ConnectionError:
+            pass
+        finally:
+            self.connections.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def encode(response):
+        return json.dumps(response).encode() + b"\n"
+
+    async def respond(self, line):
+        """Response to one request line"""
+        self.counts["requests"] += 1
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("not an object")
+        except ValueError as e:
+            self.counts["errors"] += 1
+            return {"status": "error", "error": f"invalid request: {e}"}
+        op = request.get("op", "compile")
+        if op == "version":
+            return {"status": "ok", "stamp": self.stamp}
+        if op == "stats":
+            return {"status": "ok", "workers": self.workers, "running": self.running, "waiting": self.waiting,
+                    "max_queue": self.max_queue, **self.counts}
+        if op == "shutdown":
+            self.stopping.set()
+            return {"status": "ok"}
+        error = check_request(request) if op == "compile" else f"unknown op: {op!r}"
+        if error:
+            self.counts["errors"] += 1
+            return {"status": "error", "name": request.get("name"), "error": error}
+        if self.running + self.waiting >= self.workers + self.max_queue:
+            self.counts["busy"] += 1
+            return {"status": "busy", "name": request.get("name"), "error": "too many requests waiting"}
+        if self.timeout and "timeout" not in request:
+            request["timeout"] = self.timeout
+        return await self.run(request)
+
+    async def run(self, request):
+        """Compile a request in a worker once one is free"""
+        loop = asyncio.get_running_loop()
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.running += 1
+        try:
+            pool = self.pool
+            response = await loop.run_in_executor(pool, compile_request, request)
+            self.counts["compiled"] += 1
+            return response
+        except BrokenProcessPool:
+            # A worker died (killed, out of memory...): start a new pool
+            if pool is self.pool:
+                self.counts["restarts"] += 1
+                pool.shutdown(wait=False)
+                self.start_pool()
+            self.counts["errors"] += 1
+            return {"status": "error", "name": request.get("name"), "error": "the worker compiling it died"}
+        finally:
+            self.running -= 1
+            self.slots.release()
+
+
+def claim_socket(path):
+    """Remove a stale socket left at path; fail if a daemon listens on it"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        os.unlink(path)
+    else:
+        raise RuntimeError(f"a compile daemon is already listening on {path}")
+    finally:
+        probe.close()
+
+
+def main(argv=None):
+    import argparse
+    import fcntl
+    ap = argparse.ArgumentParser(description="Serve AtomC compilations on a Unix socket")
+    ap.add_argument("--socket", default=None, help="socket path (default: per user)")
+    ap.add_argument("--workers", type=int, default=None, help="worker processes (default: one per CPU)")
+    ap.add_argument("--max-queue", type=int, default=DEFAULT_MAX_QUEUE, help="requests waiting for a worker")
+    ap.add_argument("--idle", type=float, default=DEFAULT_IDLE, help="seconds without a request before exiting")
+    ap.add_argument("--timeout", type=float, default=None, help="default per-request timeout in seconds")
+    args = ap.parse_args(argv)
+
+    daemon = CompileDaemon(args.socket, args.workers, args.max_queue, args.idle, args.timeout)
+    # Daemons started at the same time by several clients: one gets the lock
+    lock = open(daemon.socket_path + ".lock", "w")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        sys.stderr.write(f"compile_daemon: a daemon is already running on {daemon.socket_path}\n")
+        return 1
+    try:
+        claim_socket(daemon.socket_path)
+    except RuntimeError as e:
+        sys.stderr.write(f"compile_daemon: {e}\n")
+        return 1
+    asyncio.run(daemon.serve())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+"""Compiler entry points.
+
+compile_source() and compile_file() run the lexer and the parser in a fresh
+CompilationContext and return a CompileResult instead of printing, so they
+can be called repeatedly, from several threads, or from a long-running
+process such as an editor integration.
+"""
+from syntax_analyzer import TB_STRUCT, TYPE_BASE_NAMES, CompilationContext, Parser, SemanticError
+from token_stream import open_stream, tokenize
+
+
+class CompileResult:
+    """Outcome of one compilation"""
+
+    def __init__(self, ctx, tokens):
+        self.ctx = ctx  # CompilationContext, with the global symbols
+        self.tokens = tokens  # TokenBuffer of the source
+        self.success = False
+        self.error = None  # Error message
+        self.error_kind = None  # "syntax" or "semantic"
+        self.line = None  # 1-based position of the error
+        self.column = None
+        self.snippet = None  # Source line of the error with a caret
+        self.ast = None  # SyntaxTree, when built (build_ast=True)
+        self.diagnostics = []  # Every error (see Diagnostic), when recovering (recover=True)
+        self.truncated = False  # Whether the parse stopped at max_errors
+
+    def __bool__(self):
+        return self.success
+
+    @property
+    def symbols(self):
+        """Symbols left in the global scope after the compilation"""
+        return self.ctx.symbols
+
+    @property
+    def lex_errors(self):
+        """(offset, character) of the characters skipped by the lexer"""
+        return self.ctx.lex_errors
+
+    def summary(self):
+        """Plain-data outcome (JSON serializable), e.g. for CompileCache"""
+        return {
+            "success": self.success,
+            "error": self.error,
+            "error_kind": self.error_kind,
+            "line": self.line,
+            "column": self.column,
+            "snippet": self.snippet,
+            "symbols": symbol_summary(self.symbols),
+            "lex_errors": [list(e) for e in self.lex_errors],
+            "diagnostics": [[d.kind, d.message, d.line, d.column] for d in self.diagnostics],
+            "truncated": self.truncated,
+        }
+
+    def __repr__(self):
+        if self.success:
+            return "CompileResult(SUCCESS)"
+        return f"CompileResult({self.error_kind} error: {self.error})"
+
+
+def describe_type(t):
+    """AtomC spelling of a Type, e.g. double[10] or struct Pt"""
+    if t.typeBase == TB_STRUCT:
+        text = f"struct {t.s.name}" if t.s else "struct"
+    else:
+        text = TYPE_BASE_NAMES[t.typeBase][3:].lower() if t.typeBase is not None else ""
+    if t.nElements >= 0:
+        text += f"[{t.nElements or ''}]"
+    return text
+
+
+def describe_symbol(s):
+    """C-like declaration of a symbol, e.g. int f(int n, double v[])"""
+    if s.cls == "CLS_STRUCT":
+        members = " ".join(describe_symbol(m) + ";" for m in s.members.begin) if s.members else ""
+        return f"struct {s.name} {{ {members} }}" if members else f"struct {s.name}"
+    t = s.type
+    base = describe_type(t) if t.nElements < 0 else describe_type(t).rsplit("[", 1)[0]
+    if s.cls in ("CLS_FUNC", "CLS_EXTFUNC"):
+        args = ", ".join(describe_symbol(a) for a in s.args.begin) if s.args else ""
+        return f"{base} {s.name}({args})"
+    suffix = f"[{t.nElements or ''}]" if t.nElements >= 0 else ""
+    return f"{base} {s.name}{suffix}"
+
+
+def symbol_summary(symbols):
+    """(name, class, type) of the user-defined global symbols, functions
+    followed by their argument types"""
+    summary = []
+    for s in symbols.begin:
+        if s.cls == "CLS_EXTFUNC":
+            continue
+        entry = [s.name, s.cls[4:].lower(), describe_type(s.type)]
+        if s.args is not None:
+            entry.append([describe_type(a.type) for a in s.args.begin])
+        summary.append(entry)
+    return summary
+
+
+def compile_source(text, ctx=None, lexer_backend="ply", **parser_options):
+    """Compile AtomC source text. parser_options are passed to Parser.
+    lexer_backend (see lexical_analyzer.LEXER_BACKENDS) is used when no
+    context is given."""
+    ctx = ctx if ctx is not None else CompilationContext(lexer_backend=lexer_backend)
+    return compile_tokens(tokenize(ctx.lexer, text), ctx, **parser_options)
+
+
+def compile_tokens(tokens, ctx, **parser_options):
+    """Parse the tokens (a TokenBuffer or TokenStream) of a source in ctx"""
+    result = CompileResult(ctx, tokens)
+    parser = Parser(tokens, ctx, **parser_options)
+    result.ast = parser.ast
+    try:
+        result.success = bool(parser.unit())
+    except SyntaxError as e:
+        result.error, result.error_kind = str(e), "syntax"
+    except SemanticError as e:
+        result.error, result.error_kind = str(e), "semantic"
+    if result.error is not None:
+        result.line, result.column = parser.position()
+        result.snippet = parser.snippet()
+    elif parser.diagnostics:
+        # The first error is also reported like an error that stopped the parse
+        first = parser.diagnostics[0]
+        result.diagnostics = parser.diagnostics
+        result.truncated = len(parser.diagnostics) >= parser.max_errors
+        result.error, result.error_kind = first.message, first.kind
+        result.line, result.column, result.snippet = first.line, first.column, first.snippet
+    return result
+
+
+def compile_file(path, ctx=None, lexer_backend="ply", mapped=False, stream=False, **parser_options):
+    """Compile an AtomC source file, given by its path or as a text file
+    object (sys.stdin...). mapped=True maps the file and lexes it as bytes
+    instead of reading it as text (see mapped_source.py): for very large
+    files; token offsets are then byte offsets. stream=True, the only way
+    for a file object, lexes it chunk by chunk into a TokenStream (see
+    token_stream.open_stream): memory stays bounded by the largest
+    declaration, and errors come without a snippet."""
+    if hasattr(path, "read"):
+        ctx = ctx if ctx is not None else CompilationContext(lexer_backend=lexer_backend)
+        return compile_tokens(open_stream(ctx.lexer, path, errors=ctx.lex_errors), ctx, **parser_options)
+    if stream:
+        with open(path, 'r') as f:
+            return compile_file(f, ctx, lexer_backend, **parser_options)
+    if mapped:
+        from mapped_source import MappedSource, tokenize_mapped
+        ctx = ctx if ctx is not None else CompilationContext()
+        tokens = tokenize_mapped(MappedSource(path), ctx.lex_errors)
+        return compile_tokens(tokens, ctx, **parser_options)
+    with open(path, 'r') as f:
+        return compile_source(f.read(), ctx, lexer_backend, **parser_options)
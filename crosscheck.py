@@ -0,0 +1,135 @@
+"""Cross-check of the execution engines.
+
+Runs AtomC programs on the bytecode VM (vm.py), the Python backend
+(pybackend.py) and the native C backend (cbackend.py), and checks that each
+engine prints the same output and ends the same way (normally, with a
+runtime error, or not compiling). A program reads <file>.in when there is
+one next to it, the --input text otherwise. By default the programs of
+tests and of engine_tests, which holds the cases where the engines once
+disagreed (int wrap-around, deep recursion...), are checked.
+
+Usage: python crosscheck.py [--engines vm,python,c] [--input TEXT] [--timeout S] [--cache DIR] [paths...]
+"""
+import io
+import subprocess
+import sys
+
+from batch import collect_files
+from cbackend import DEFAULT_CACHE, BinaryCache, CBuildError, compile_c
+from codegen import CodegenError, compile_program
+from pybackend import compile_python
+from vm import Console, Machine, VMError
+
+DEFAULT_INPUT = b"3 1 2 3\nword\n2.5 7\n"
+DEFAULT_PATHS = ("tests", "engine_tests")
+
+# Outcomes, with the output printed before the end
+OK, RUNTIME_ERROR, NOT_COMPILED, TIMEOUT, CRASH = "ok", "runtime error", "not compiled", "timeout", "crash"
+
+
+def run_vm(text, stdin, options):
+    try:
+        result, program = compile_program(text)
+    except CodegenError:
+        return NOT_COMPILED, b""
+    if program is None:
+        return NOT_COMPILED, b""
+    out = io.BytesIO()
+    try:
+        Machine(program, Console(io.BytesIO(stdin), out)).run()
+    except VMError:
+        return RUNTIME_ERROR, out.getvalue()
+    return OK, out.getvalue()
+
+
+def run_python(text, stdin, options):
+    try:
+        result, program = compile_python(text)
+    except CodegenError:
+        return NOT_COMPILED, b""
+    if program is None:
+        return NOT_COMPILED, b""
+    out = io.BytesIO()
+    try:
+        program.run(Console(io.BytesIO(stdin), out))
+    except VMError:
+        return RUNTIME_ERROR, out.getvalue()
+    return OK, out.getvalue()
+
+
+def run_c(text, stdin, options):
+    try:
+        result, program = compile_c(text)
+    except CodegenError:
+        return NOT_COMPILED, b""
+    if program is None:
+        return NOT_COMPILED, b""
+    try:
+        done = program.run(stdin, options["timeout"], options["cache"])
+    except subprocess.TimeoutExpired as e:
+        return TIMEOUT, e.stdout or b""
+    if done.returncode == 0:
+        return OK, done.stdout
+    if done.returncode == 2:
+        return RUNTIME_ERROR, done.stdout
+    return CRASH, done.stdout
+
+
+ENGINES = {"vm": run_vm, "python": run_python, "c": run_c}
+
+
+def check(path, engines, default_input, options):
+    """(agree, {engine: (outcome, output)}) of the program in path"""
+    with open(path, "r") as f:
+        text = f.read()
+    try:
+        with open(path + ".in", "rb") as f:
+            stdin = f.read()
+    except FileNotFoundError:
+        stdin = default_input
+    outcomes = {name: ENGINES[name](text, stdin, options) for name in engines}
+    return len(set(outcomes.values())) == 1, outcomes
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Check that the execution engines agree")
+    ap.add_argument("paths", nargs="*", default=list(DEFAULT_PATHS),
+                    help=f"files or directories (default: {' '.join(DEFAULT_PATHS)})")
+    ap.add_argument("--engines", default=",".join(ENGINES), help="comma separated engines to compare")
+    ap.add_argument("--input", default=None, help="input of the programs without a .in file")
+    ap.add_argument("--timeout", type=float, default=60, help="per-run timeout of native programs")
+    ap.add_argument("--cache", default=DEFAULT_CACHE, metavar="DIR", help="binary cache of the C backend")
+    args = ap.parse_args(argv)
+
+    engines = [e.strip() for e in args.engines.split(",") if e.strip()]
+    for name in engines:
+        if name not in ENGINES:
+            ap.error(f"unknown engine {name} (known: {', '.join(ENGINES)})")
+    default_input = DEFAULT_INPUT if args.input is None else args.input.encode().replace(b"\\n", b"\n")
+    options = {"timeout": args.timeout, "cache": BinaryCache(args.cache) if "c" in engines else None}
+
+    mismatches = 0
+    for name, path in collect_files(args.paths):
+        if not name.endswith(".c"):
+            continue
+        try:
+            agree, outcomes = check(path, engines, default_input, options)
+        except CBuildError as e:
+            print(f"ERROR     {name}: {e}")
+            mismatches += 1
+            continue
+        outcome = next(iter(outcomes.values()))[0]
+        if agree:
+            print(f"ok        {name} ({outcome})")
+            continue
+        mismatches += 1
+        print(f"MISMATCH  {name}")
+        for engine, (outcome, output) in outcomes.items():
+            print(f"    {engine:8} {outcome:14} {output[:200]!r}")
+    print(f"{mismatches} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
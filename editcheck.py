@@ -0,0 +1,124 @@
+"""Differential check of the incremental analysis.
+
+Applies edits to a Document one after the other and, after each, checks
+that Document.analyze() reports what a fresh compile_source() of the same
+text does: the same lexical errors and the same syntax or semantic error
+(kind, message and position). The edits are the cases of EDGE_CASES and
+random edits of the files given and of programs from program_generator.py,
+biased towards the characters that open and close comments, strings and
+blocks.
+
+Usage: python editcheck.py [--edits N] [--seed S] [--generated N] [paths...]
+"""
+import random
+import sys
+
+from batch import collect_files
+from compiler import compile_source
+from incremental import POSITION_SUFFIX_RE, Document
+from program_generator import generate_program
+
+# Text and (a, b, inserted) edits, applied in order; a negative offset
+# counts from the end of the text
+EDGE_CASES = {
+    "nested-opener": ("int a;\n/* x /* y\nint b;\nint c;\n", [(-1, -1, " */")]),
+    "close-then-open": ("/* a */ int b; /* c /* d\nint e;\n", [(-1, -1, "*/")]),
+    "reopen": ("int a; /* b */ int c;\n", [(8, 8, "/*"), (0, 0, "/* ")]),
+    "slash-star-slash": ("int a; /*/ b\nint c;\n", [(-1, -1, "*/")]),
+    "string-closer": ("char *s; /* \"*/\" x\nint b;\n", [(-1, -1, "*/")]),
+    "unclose": ("int a; /* b */ int c;\n", [(13, 15, ""), (-1, -1, "*/")]),
+}
+
+# Inserted by the random edits
+SNIPPETS = ("/*", "*/", "/* ", " */", '"', "'", "//", "\n", ";", "{", "}", "(", ")", "int x;", " ", "1e+", "@")
+
+
+def outcome_of_compile(text):
+    """(lexical error offsets, error) of a fresh compilation"""
+    result = compile_source(text)
+    error = None
+    if result.error_kind in ("syntax", "semantic"):
+        error = (result.error_kind, POSITION_SUFFIX_RE.sub("", result.error), result.line, result.column)
+    return [offset for offset, _ in result.lex_errors], error
+
+
+def outcome_of_document(doc):
+    """(lexical error offsets, error) of the incremental analysis"""
+    lexical, error = [], None
+    for d in doc.analyze():
+        if d.kind == "lexical":
+            lexical.append(d.start)
+        else:
+            line, column = doc.position(d.start)
+            error = (d.kind, d.message, line + 1, column + 1)
+    return lexical, error
+
+
+def random_edit(rng, text):
+    """(a, b, inserted) of a random edit of text"""
+    a = rng.randrange(len(text) + 1)
+    choice = rng.random()
+    if choice < 0.6:
+        return a, a, rng.choice(SNIPPETS)
+    b = min(a + rng.randrange(1, 8), len(text))
+    if choice < 0.8:
+        return a, b, ""
+    return a, b, rng.choice(SNIPPETS)
+
+
+def check(text, edits):
+    """Descriptions of the differences, for text edited by edits in order:
+    (a, b, inserted) tuples or functions of the text returning one"""
+    doc = Document(text)
+    differences = []
+    for n, edit in enumerate(edits):
+        if callable(edit):
+            a, b, ins = edit(doc.text)
+        else:
+            a, b, ins = edit
+            a, b = (x if x >= 0 else len(doc.text) + 1 + x for x in (a, b))
+        doc.edit(a, b, ins)
+        expected, got = outcome_of_compile(doc.text), outcome_of_document(doc)
+        if got != expected:
+            differences.append(f"edit {n} ({a}, {b}, {ins!r}): {got} incremental, {expected} fresh")
+            break  # The next edits start from a wrong state
+    return differences
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Check the incremental analysis against fresh compilations")
+    ap.add_argument("paths", nargs="*", default=["tests"], help="files or directories (default: tests)")
+    ap.add_argument("--edits", type=int, default=40, help="random edits per source")
+    ap.add_argument("--seed", type=int, default=0, help="seed of the random edits")
+    ap.add_argument("--generated", type=int, default=5, help="generated programs to edit")
+    args = ap.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    cases = list(EDGE_CASES.items())
+    sources = []
+    for name, path in collect_files(args.paths):
+        if name.endswith(".c"):
+            with open(path, "r") as f:
+                sources.append((name, f.read()))
+    sources += [(f"generated-{seed}", generate_program(functions=3, depth=2, seed=seed))
+                for seed in range(args.generated)]
+    for name, text in sources:
+        cases.append((f"{name} (random)", (text, [lambda t: random_edit(rng, t)] * args.edits)))
+
+    mismatches = 0
+    for name, (text, edits) in cases:
+        differences = check(text, edits)
+        if not differences:
+            print(f"ok        {name}")
+            continue
+        mismatches += 1
+        print(f"MISMATCH  {name}")
+        for difference in differences:
+            print(f"    {difference}")
+    print(f"{mismatches} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
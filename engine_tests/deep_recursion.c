@@ -0,0 +1,10 @@
+int depth(int n)
+{
+	if(n == 0) return 0;
+	return depth(n - 1) + 1;
+}
+void main()
+{
+	put_i(depth(100000));
+	put_c('\n');
+}
@@ -0,0 +1,25 @@
+int big;
+int wrapped(int a, int b)
+{
+	return a * b;
+}
+void main()
+{
+	int i;
+	i = 2147483647;
+	i = i + 1;
+	put_i(i);
+	put_c(' ');
+	i = -2147483647 - 1;
+	i = i - 1;
+	put_i(i);
+	put_c(' ');
+	i = -2147483647 - 1;
+	put_i(-i);
+	put_c(' ');
+	put_i(i / -1);
+	put_c(' ');
+	big = 65536;
+	put_i(big * big + wrapped(100000, 100000));
+	put_c('\n');
+}
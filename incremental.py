@@ -0,0 +1,535 @@
+"""Incremental analysis of a document being edited, for editor integration.
+
+A Document keeps its tokens across edits. An edit lexes again only the
+tokens around it: lexing restarts a little before the edit and stops as soon
+as it produces a token identical to an old one past the edit, and every
+offset after the edit is moved with a pending shift (see ShiftedOffsets)
+instead of being rewritten.
+
+The analysis reuses the previous results of top-level declarations (and
+statements) through the Parser's slide() hook, which the token buffer
+receives at every top-level boundary. A declaration is skipped, with its
+global symbols put back in the table, when its tokens and the token after it
+are unchanged and it starts from the same global state: the state is summed
+up by a hash of the signatures of the global symbols declared before it
+(see symbol_signature). A declaration parsed again keeps the previous Symbol
+objects when their signatures did not change, so that the declarations
+after it, which refer to those objects, stay valid and are skipped too.
+Typing inside a function body thus parses that function alone.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import count
+
+from compiler import describe_symbol
+from line_index import LineIndex
+from syntax_analyzer import CompilationContext, Parser, SemanticError
+from token_stream import END, ID, TOKEN_CODES, TokenBuffer, tokenize
+
+MAX_SHIFTS = 32  # Pending shifts folded into the offsets past this number
+MIN_COMPACT = 1024  # Interned values below which the value table is never compacted
+
+# Position suffix of the SemanticError messages (the position is reported apart)
+POSITION_SUFFIX_RE = re.compile(r" at line \d+(, column \d+)?$")
+
+
+class AnalysisCancelled(Exception):
+    """The analysis was abandoned, e.g. because the document changed again"""
+
+
+class ShiftedOffsets:
+    """Ascending source offsets that stay valid across edits.
+
+    An edit moves every offset after it. Rather than rewriting the tail on
+    each keystroke, the move is kept as a pending (index, delta) shift and the
+    shifts are folded into the stored values once MAX_SHIFTS pile up. Supports
+    len(), indexing and the bisect functions.
+    """
+
+    def __init__(self, values=()):
+        self.raw = array('q', values)
+        self.shifts = []  # (index, delta): delta applies to raw[index:]
+
+    def __len__(self):
+        return len(self.raw)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.raw)
+        value = self.raw[i]
+        for index, delta in self.shifts:
+            if i >= index:
+                value += delta
+        return value
+
+    def pending(self, i):
+        return sum(delta for index, delta in self.shifts if i >= index)
+
+    def splice(self, i, j, values, delta):
+        """Replace the offsets [i, j) by values and move those after by delta"""
+        end = i + len(values)
+        grow = end - j
+        shifts = []
+        for index, d in self.shifts:
+            if index >= j:
+                index += grow
+            elif index > i:
+                index = end
+            shifts.append((index, d))
+        self.shifts = shifts
+        self.raw[i:j] = array('q', [v - self.pending(i + k) for k, v in enumerate(values)])
+        if delta:
+            self.shifts.append((end, delta))
+            if len(self.shifts) > MAX_SHIFTS:
+                self.compact()
+
+    def compact(self):
+        """Fold the pending shifts into the stored offsets"""
+        raw = self.raw
+        bounds = sorted({index for index, delta in self.shifts if index < len(raw)})
+        bounds.append(len(raw))
+        for lo, hi in zip(bounds, bounds[1:]):
+            delta = self.pending(lo)
+            if delta:
+                raw[lo:hi] = array('q', map(delta.__add__, raw[lo:hi]))
+        self.shifts = []
+
+
+class DocumentTokens(TokenBuffer):
+    """Token buffer of a Document: top-level boundaries are reported to the
+    document, which may skip the declarations it can reuse"""
+
+    def __init__(self, buf):
+        super().__init__(buf.source)
+        self.kinds = buf.kinds
+        self.value_ids = buf.value_ids
+        self.values = buf.values
+        self.value_index = buf.value_index
+        self.starts = ShiftedOffsets(buf.starts)
+        self.on_boundary = None
+        self.compact_at = max(2 * len(self.values), MIN_COMPACT)  # Size of values that triggers compact()
+
+    def slide(self, pos):
+        return self.on_boundary(pos) if self.on_boundary is not None else pos
+
+    def value_id(self, kind, value):
+        """Index of value in values, interning it if needed"""
+        if value is None:
+            return -1
+        key = (kind, value)
+        vid = self.value_index.get(key)
+        if vid is None:
+            vid = self.value_index[key] = len(self.values)
+            self.values.append(value)
+        return vid
+
+    def compact(self):
+        """Drop the values no token refers to any more (left by edits) and
+        renumber the others"""
+        old, kinds, ids = self.values, self.kinds, self.value_ids
+        remap = [-1] * len(old)
+        values, index = [], {}
+        for i, vid in enumerate(ids):
+            if vid >= 0 and remap[vid] < 0:
+                remap[vid] = index[kinds[i], old[vid]] = len(values)
+                values.append(old[vid])
+        ids[:] = array('i', [remap[vid] if vid >= 0 else -1 for vid in ids])
+        self.values, self.value_index = values, index
+        self.compact_at = max(2 * len(values), MIN_COMPACT)
+
+
+class Decl:
+    """Analysis of one top-level declaration or statement"""
+
+    def __init__(self, start, length, env, exports, depth, env_out, refs):
+        self.start = start  # Index of its first token, None once dropped
+        self.length = length  # Number of tokens
+        self.env = env  # Global state hash it was analyzed in
+        self.exports = exports  # Symbols it left in the global table
+        self.depth = depth  # crtDepth after it
+        self.env_out = env_out  # Global state hash after it
+        self.refs = refs  # Token index relative to start -> (symbol, is definition)
+
+
+class Diagnostic:
+    def __init__(self, kind, message, start, end):
+        self.kind = kind  # "syntax", "semantic" or "lexical"
+        self.message = message
+        self.start = start  # Source offsets of the offending text
+        self.end = end
+
+
+def type_signature(t):
+    return (t.typeBase, t.nElements, t.s)
+
+
+def symbol_signature(s):
+    """Everything later declarations can observe of a global symbol. Struct
+    types are compared by identity: a struct parsed again and not adopted is a
+    different struct for the declarations using it."""
+    args = tuple((a.name, a.mem, type_signature(a.type)) for a in s.args.begin) if s.args is not None else None
+    members = tuple(symbol_signature(m) for m in s.members.begin) if s.members is not None else None
+    return (s.name, s.cls, s.depth, s.mem, type_signature(s.type), args, members)
+
+
+def adopt(new, old, mapping):
+    """Map new (and its members and arguments) to the equivalent old symbol"""
+    mapping[new] = old
+    if new.members is not None:
+        for n, o in zip(new.members.begin, old.members.begin):
+            adopt(n, o, mapping)
+    if new.args is not None:
+        for n, o in zip(new.args.begin, old.args.begin):
+            mapping[n] = o
+
+
+class Document:
+    """An AtomC source being edited"""
+
+    def __init__(self, text):
+        self.lexing = CompilationContext()  # Lexer and its error list
+        self.lexer = self.lexing.lexer
+        self.text = text
+        self.tokens = DocumentTokens(tokenize(self.lexer, text))
+        self.lex_errors = list(self.lexing.lex_errors)
+        lines = LineIndex(text)
+        lines.line_starts = ShiftedOffsets(lines.line_starts)
+        self.tokens.line_index = self.lines = lines
+        self.decls = {}  # Start token index -> Decl
+        self.definitions = {}  # Symbol -> (Decl, relative token index) of its definition
+        self.adoptable = {}  # Signature -> symbol of a dropped Decl
+        self.serial = count()
+        self.live = []  # Decls of the last analysis, in order
+        self.diagnostics = []
+        self.ctx = None  # State of the running analysis
+        self.cancelled = None
+        self.open_start = None
+
+    # Edits
+
+    def replace(self, text):
+        """Replace the whole text, as an edit of the part that changed"""
+        old = self.text
+        n = min(len(old), len(text))
+        # Common prefix and suffix, found by comparing halves
+        lo, hi = 0, n
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[:mid] == text[:mid]:
+                lo = mid
+            else:
+                hi = mid - 1
+        a = lo
+        lo, hi = 0, n - a
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if old[len(old) - mid:] == text[len(text) - mid:]:
+                lo = mid
+            else:
+                hi = mid - 1
+        self.edit(a, len(old) - lo, text[a:len(text) - lo])
+
+    def edit(self, a, b, ins):
+        """Replace text[a:b] by ins"""
+        old = self.text
+        text = self.text = old[:a] + ins + old[b:]
+        delta = len(ins) - (b - a)
+        toks = self.tokens
+        toks.source = text
+        self.edit_lines(a, b, ins, delta)
+
+        kinds = toks.kinds
+        starts = toks.starts
+        last = len(kinds) - 1  # END
+        restart, tr = self.restart_point(old, a, b, ins)
+
+        # Lex from the restart point until a token matches an old one past the edit
+        errors = self.lexing.lex_errors = []
+        lexer = self.lexer
+        lexer.input(text)
+        lexer.lexpos = restart
+        codes = TOKEN_CODES
+        edit_end = a + len(ins)
+        k = bisect_left(starts, b)
+        new_kinds, new_vids, new_starts = [], [], []
+        while True:
+            tok = lexer.token()
+            if tok is None:
+                k = last
+                break
+            p = tok.lexpos
+            kind = codes[tok.type]
+            if p >= edit_end:
+                old_p = p - delta
+                while k < last and starts[k] < old_p:
+                    k += 1
+                if k < last and starts[k] == old_p and kinds[k] == kind and toks.value(k) == tok.value:
+                    break
+            new_kinds.append(kind)
+            new_vids.append(toks.value_id(kind, tok.value))
+            new_starts.append(p)
+
+        # Lexical errors between the restart point and the resynchronized token
+        resync = starts[k] if k < last else len(old)
+        self.lex_errors = ([e for e in self.lex_errors if e[0] < restart] + errors +
+                           [(offset + delta, char) for offset, char in self.lex_errors if offset >= resync])
+
+        kinds[tr:k] = array('B', new_kinds)
+        toks.value_ids[tr:k] = array('i', new_vids)
+        starts.splice(tr, k, new_starts, delta)
+        self.shift_decls(tr, k, len(new_kinds) - (k - tr))
+        if len(toks.values) >= toks.compact_at:
+            toks.compact()  # Amortized: the table has doubled since the last time
+
+    def edit_lines(self, a, b, ins, delta):
+        """Update the line starts for text[a:b] replaced by ins"""
+        starts = self.lines.line_starts
+        i = bisect_right(starts, a)
+        j = bisect_right(starts, b)
+        new = [a + m.end() for m in re.finditer('\n', ins)]
+        starts.splice(i, j, new, delta)
+
+    def restart_point(self, old, a, b, ins):
+        """(offset, token index) to lex again from, for old[a:b] replaced by ins"""
+        starts = self.tokens.starts
+        ti = bisect_left(starts, a) - 1  # Last token before the edit
+        if ti < 0:
+            return 0, 0
+        # Tokens such as 1e+5 are decided by the characters after them:
+        # restart from the first token of the line
+        line_start = old.rfind('\n', 0, a) + 1
+        tr = min(ti, bisect_left(starts, line_start))
+        # Unterminated comments, strings and characters are lexed as other
+        # tokens or errors: restart before them in case the edit closes them.
+        # The comment is opened by the first /* after the last */ (not the
+        # nearest /*, which may be inside it); starting earlier is harmless
+        if '*/' in old[max(a - 1, 0):a] + ins + old[b:b + 1]:
+            closer = old.rfind('*/', 0, a)
+            opener = old.find('/*', max(closer - 1, 0) if closer >= 0 else 0, a)
+            if opener >= 0:
+                tr = min(tr, max(bisect_left(starts, opener) - 1, 0))
+        if self.lex_errors and self.lex_errors[0][0] < starts[tr]:
+            tr = max(bisect_left(starts, self.lex_errors[0][0]) - 1, 0)
+        return starts[tr], tr
+
+    def shift_decls(self, i, j, grow):
+        """Drop the Decls touched by tokens [i, j) being replaced, or whose
+        following token (read as lookahead) was, and renumber those after"""
+        decls = {}
+        for start, d in self.decls.items():
+            if start + d.length < i:
+                decls[start] = d
+            elif start >= j:
+                d.start = start + grow
+                decls[d.start] = d
+            else:
+                self.drop(d)
+        self.decls = decls
+
+    def drop(self, d):
+        """Forget a Decl; its global symbols may be adopted by its new version"""
+        for s in d.exports:
+            self.adoptable.setdefault(symbol_signature(s), s)
+        definitions = self.definitions
+        for s, is_def in d.refs.values():
+            if is_def and definitions.get(s, (None,))[0] is d:
+                del definitions[s]
+        d.start = None
+
+    # Analysis
+
+    def analyze(self, cancelled=None):
+        """Analyze the document, reusing what the edits did not touch.
+        cancelled, if given, is polled at each top-level boundary and the
+        analysis raises AnalysisCancelled when it returns true."""
+        ctx = self.ctx = CompilationContext(self.lexer)
+        ctx.references = []
+        self.cancelled = cancelled
+        self.env = 0
+        self.live = []
+        self.open_start = None
+        toks = self.tokens
+        toks.on_boundary = self.boundary
+        parser = Parser(toks, ctx)
+        diagnostics = []
+        error = None
+        try:
+            parser.unit()
+            self.close_decl(parser.pos - 1)  # Before END
+        except SyntaxError as e:
+            error = Diagnostic("syntax", str(e), *self.token_span(parser.pos))
+        except SemanticError as e:
+            error = Diagnostic("semantic", POSITION_SUFFIX_RE.sub("", str(e)), *self.token_span(parser.pos))
+        finally:
+            toks.on_boundary = None
+            self.ctx = None
+            self.cancelled = None
+        for offset, char in self.lex_errors:
+            diagnostics.append(Diagnostic("lexical", f"illegal character {char!r}", offset, offset + 1))
+        if error is not None:
+            diagnostics.append(error)
+        else:
+            # Forget the Decls the complete analysis did not go through
+            live = {d.start for d in self.live}
+            for start, d in list(self.decls.items()):
+                if start not in live:
+                    self.drop(d)
+                    del self.decls[start]
+            self.adoptable.clear()
+        self.diagnostics = diagnostics
+        return diagnostics
+
+    def boundary(self, pos):
+        """Top-level boundary: record the declaration just parsed and skip
+        the reusable ones ahead. Returns the position to parse from."""
+        if self.cancelled is not None and self.cancelled():
+            raise AnalysisCancelled()
+        self.close_decl(pos)
+        kinds = self.tokens.kinds
+        decls = self.decls
+        while True:
+            d = decls.get(pos)
+            # The last declaration is parsed: the Parser expects one after a boundary
+            if d is None or d.env != self.env or kinds[pos + d.length] == END:
+                break
+            self.install(d)
+            pos += d.length
+        self.open_decl(pos)
+        return pos
+
+    def install(self, d):
+        symbols = self.ctx.symbols
+        for s in d.exports:
+            symbols.add(s)
+        self.ctx.crtDepth = d.depth
+        self.env = d.env_out
+        self.live.append(d)
+
+    def open_decl(self, pos):
+        begin = self.ctx.symbols.begin
+        self.open_start = pos
+        self.open_count = len(begin)
+        self.open_last = begin[-1] if begin else None
+        self.open_refs = len(self.ctx.references)
+
+    def close_decl(self, pos):
+        start = self.open_start
+        if start is None or pos == start:
+            return
+        self.open_start = None
+        ctx = self.ctx
+        symbols = ctx.symbols
+        begin = symbols.begin
+        n = self.open_count
+        intact = len(begin) >= n and (n == 0 or begin[n - 1] is self.open_last)
+
+        old = self.decls.get(start)
+        if old is not None:
+            self.drop(old)
+        mapping = {}
+        exports = begin[n:] if intact else []
+        final = []
+        sigs = []
+        for s in exports:
+            sig = symbol_signature(s)
+            o = self.adoptable.pop(sig, None)
+            if o is not None and o is not s:
+                adopt(s, o, mapping)
+                s = o
+            final.append(s)
+            sigs.append(sig)
+        if mapping:
+            for _ in exports:
+                symbols.pop()
+            for s in final:
+                symbols.add(s)
+
+        refs = {}
+        for idx, s, is_def in ctx.references[self.open_refs:]:
+            refs[idx - start] = (mapping.get(s, s), is_def)
+        if intact:
+            env_out = hash((self.env, tuple(sigs), ctx.crtDepth))
+            env_in = self.env
+        else:
+            # Global symbols were removed: nothing after this can be reused
+            env_out = ("opaque", next(self.serial))
+            env_in = None
+        d = Decl(start, pos - start, env_in, final, ctx.crtDepth, env_out, refs)
+        self.decls[start] = d
+        definitions = self.definitions
+        for rel, (s, is_def) in refs.items():
+            if is_def:
+                definitions[s] = (d, rel)
+        self.env = env_out
+        self.live.append(d)
+
+    # Queries
+
+    def token_span(self, i):
+        """Source offsets (start, end) of token i"""
+        toks = self.tokens
+        if i >= len(toks.kinds) - 1:
+            return len(self.text), len(self.text)
+        start = toks.starts[i]
+        if toks.kinds[i] == ID:
+            return start, start + len(toks.value(i))
+        self.lexer.input(self.text)
+        self.lexer.lexpos = start
+        self.lexer.token()
+        return start, self.lexer.lexpos
+
+    def decl_at(self, i):
+        """Decl containing token i, or None"""
+        starts = sorted(self.decls)
+        k = bisect_right(starts, i) - 1
+        if k >= 0:
+            d = self.decls[starts[k]]
+            if i < d.start + d.length:
+                return d
+        return None
+
+    def symbol_at(self, offset):
+        """(symbol, token index) of the identifier at offset, or (None, None)"""
+        toks = self.tokens
+        i = bisect_right(toks.starts, offset) - 1
+        if i < 0 or toks.kinds[i] != ID:
+            return None, None
+        start, end = self.token_span(i)
+        if offset > end:
+            return None, None
+        d = self.decl_at(i)
+        if d is None:
+            return None, i
+        entry = d.refs.get(i - d.start)
+        return (entry[0] if entry else None), i
+
+    def hover(self, offset):
+        """(description, (start, end)) of the symbol at offset, or None"""
+        s, i = self.symbol_at(offset)
+        if s is None:
+            return None
+        return describe_symbol(s), self.token_span(i)
+
+    def definition(self, offset):
+        """(start, end) of the definition of the symbol at offset, or None"""
+        s, i = self.symbol_at(offset)
+        if s is None:
+            return None
+        entry = self.definitions.get(s)
+        if entry is None or entry[0].start is None:
+            return None
+        d, rel = entry
+        return self.token_span(d.start + rel)
+
+    def position(self, offset):
+        """0-based (line, column) of a source offset"""
+        line, column = self.lines.position(offset)
+        return line - 1, column - 1
+
+    def offset(self, line, column):
+        """Source offset of a 0-based (line, column)"""
+        starts = self.lines.line_starts
+        if line >= len(starts):
+            return len(self.text)
+        return min(starts[line] + column, len(self.text))
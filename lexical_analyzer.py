@@ -1,13 +1,20 @@
-import ply.lex as lex
+"""AtomC lexer rules for PLY.
 
-from syntax_analyzer import Token
+The lexer is built on first use (get_lexer(), or the module attribute
+`lexer`), so importing this module loads neither PLY nor any regex. The
+first build validates the rules and saves PLY's tables in __pycache__,
+keyed by a hash of the rule sources; later processes load those tables in
+PLY's optimize mode and skip the validation.
 
-tokens = [
-    'ID', 'CT_INT', 'CT_REAL', 'CT_CHAR', 'CT_STRING',
-    'COMMA', 'SEMICOLON', 'LPAR', 'RPAR', 'LBRACKET', 'RBRACKET', 'LACC', 'RACC',
-    'ADD', 'SUB', 'MUL', 'DIV', 'DOT', 'AND', 'OR', 'NOT', 'ASSIGN', 'EQUAL', 'NOTEQ', 'LESS', 'LESSEQ', 'GREATER', 'GREATEREQ',
-    'BREAK', 'CHAR', 'DOUBLE', 'ELSE', 'FOR', 'IF', 'INT', 'RETURN', 'STRUCT', 'VOID', 'WHILE', 'INVALID', 'END'
-]
+get_lexer("scanner") returns the master-regex Scanner built from the same
+rules instead (see scanner.py).
+"""
+import os
+import sys
+
+from token_stream import TOKEN_NAMES
+
+tokens = list(TOKEN_NAMES)
 
 t_COMMA = r','
 t_SEMICOLON = r';'
@@ -50,17 +57,19 @@ keywords = {
 def t_ID(t):
     r'[a-zA-Z_][a-zA-Z0-9_]*'
     t.type = keywords.get(t.value, 'ID')
-    return Token(code=t.type, value=t.value)
+    return t
 
 def t_CT_HEX(t):
     r'0[xX][0-9a-fA-F]+'
+    t.type = 'CT_INT'
     t.value = int(t.value, 16)
-    return Token(code='CT_INT', value=t.value)
+    return t
 
 def t_CT_OCTAL(t):
     r'0[0-7]+'
+    t.type = 'CT_INT'
     t.value = int(t.value, 8)
-    return Token(code='CT_INT', value=t.value)
+    return t
 
 def t_CT_REAL(t):
     r'((\d+\.\d*([eE][+-]?\d+)?)|(\.\d+([eE][+-]?\d+)?)|(\d+[eE][+-]?\d+))'
@@ -68,21 +77,22 @@ def t_CT_REAL(t):
         t.value = float(t.value)
     except ValueError:
         print(f"Invalid real number: {t.value}")
-        return Token(code='INVALID', value=t.value)
-    return Token(code='CT_REAL', value=t.value)
+        t.type = 'INVALID'
+    return t
 
 def t_CT_INT_DECIMAL(t):
     r'[1-9]\d*|0'
+    t.type = 'CT_INT'
     t.value = int(t.value)
-    return Token(code='CT_INT', value=t.value)
+    return t
 
 def t_CT_CHAR(t):
     r"'([^'\\]|\\.)'"
-    return Token(code='CT_CHAR', value=t.value)
+    return t
 
 def t_CT_STRING(t):
     r'"([^"\\]|\\.)*"'
-    return Token(code='CT_STRING', value=t.value)
+    return t
 
 def t_COMMENT(t):
     r'//.*|\/\*(.|\n)*?\*\/'
@@ -91,7 +101,8 @@ def t_COMMENT(t):
 
 def t_END(t):
     r'\0'
-    return Token(code='END', value=None)
+    t.value = None
+    return t
 
 t_ignore = ' \t\r'
 
@@ -103,4 +114,80 @@ def t_error(t):
     print(f"Illegal character '{t.value[0]}'")
     t.lexer.skip(1)
 
-lexer = lex.lex()
\ No newline at end of file
+
+# Sources the lexer tables are built from
+TABLE_SOURCES = ("lexical_analyzer.py", "token_stream.py")
+TABLE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "__pycache__")
+
+LEXER_BACKENDS = ("ply", "scanner")
+
+_lexers = {}  # Backend -> shared lexer
+
+
+def table_name():
+    """Module name of the saved tables of the current rules"""
+    import hashlib
+    import ply.lex as lex
+    h = hashlib.sha256(f"{lex.__version__} {lex.__tabversion__}".encode())
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in TABLE_SOURCES:
+        with open(os.path.join(root, name), "rb") as f:
+            h.update(f.read())
+    return "atomc_lextab_" + h.hexdigest()[:16]
+
+
+def load_tables(name):
+    """Saved table module, or None"""
+    import importlib.util
+    path = os.path.join(TABLE_DIR, name + ".py")
+    if not os.path.exists(path):
+        return None
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+    except Exception:
+        return None  # Truncated or unreadable: rebuild
+    return module
+
+
+def build_lexer():
+    """Build a PLY lexer from the saved tables if there are any, else
+    from the rules, saving the tables for the next process"""
+    import ply.lex as lex
+    rules = sys.modules[__name__]
+    name = table_name()
+    tables = load_tables(name)
+    if tables is not None:
+        try:
+            return lex.lex(module=rules, optimize=True, lextab=tables)
+        except (ImportError, AttributeError):
+            pass  # Tables from another PLY version
+    built = lex.lex(module=rules)
+    try:
+        os.makedirs(TABLE_DIR, exist_ok=True)
+        built.writetab(name, TABLE_DIR)
+    except OSError:
+        pass  # Read-only tree: validate the rules on every start
+    return built
+
+
+def get_lexer(backend="ply"):
+    """The shared lexer of a backend (see LEXER_BACKENDS), built on first use"""
+    lexer = _lexers.get(backend)
+    if lexer is None:
+        if backend == "ply":
+            lexer = build_lexer()
+        elif backend == "scanner":
+            from scanner import Scanner
+            lexer = Scanner()
+        else:
+            raise ValueError(f"unknown lexer backend: {backend!r}")
+        _lexers[backend] = lexer
+    return lexer
+
+
+def __getattr__(name):
+    if name == "lexer":
+        return get_lexer()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
\ No newline at end of file
@@ -0,0 +1,49 @@
+"""Offset to line/column mapping for diagnostics.
+
+Tokens only carry their start offset in the source. The offsets where lines
+start are collected once, when a diagnostic first needs a position, and
+positions are then found with a binary search.
+"""
+from array import array
+from bisect import bisect_right
+
+
+class LineIndex:
+    """Sorted start offsets of the source lines"""
+
+    def __init__(self, text=None):
+        self.line_starts = array('q', [0])
+        self.first_line = 1  # Line number of line_starts[0]
+        if text:
+            self.add_text(text, 0)
+
+    def add_text(self, text, offset):
+        """Record the line starts of text, which starts at offset in the source"""
+        starts = self.line_starts
+        find = text.find
+        nl = find('\n')
+        while nl >= 0:
+            starts.append(offset + nl + 1)
+            nl = find('\n', nl + 1)
+
+    def discard_before(self, offset):
+        """Forget the lines that end before offset (streamed input)"""
+        i = bisect_right(self.line_starts, offset) - 1
+        if i > 0:
+            del self.line_starts[:i]
+            self.first_line += i
+
+    def position(self, offset):
+        """1-based (line, column) of a source offset"""
+        i = bisect_right(self.line_starts, offset) - 1
+        return self.first_line + i, offset - self.line_starts[i] + 1
+
+    def snippet(self, text, offset):
+        """The source line containing offset, followed by a caret under it"""
+        i = bisect_right(self.line_starts, offset) - 1
+        start = self.line_starts[i]
+        end = text.find('\n', start)
+        line = text[start:end if end >= 0 else len(text)].rstrip('\r')
+        # Keep tabs so the caret lines up with the source line
+        pad = ''.join(c if c == '\t' else ' ' for c in line[:offset - start])
+        return f"{line}\n{pad}^"
@@ -0,0 +1,333 @@
+"""Language server for AtomC: LSP over stdio.
+
+Publishes diagnostics as the document is edited, and answers hover (the
+declaration of the symbol under the cursor) and go-to-definition. Documents
+are analyzed incrementally (see incremental.Document), so a keystroke costs
+about one function's worth of lexing and parsing whatever the file size.
+
+Messages are read by a thread and handled in order by the main loop. A
+changed document is analyzed once no message has been waiting for
+`debounce` seconds, and an analysis is abandoned at the next top-level
+boundary when a newer version of its document arrives. Hover and definition
+requests analyze the pending changes first.
+
+Usage: python lsp_server.py [--debounce SECONDS] [--record session.jsonl]
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from incremental import AnalysisCancelled, Document
+
+DEFAULT_DEBOUNCE = 0.005
+
+# JSON-RPC error codes
+METHOD_NOT_FOUND = -32601
+INTERNAL_ERROR = -32603
+REQUEST_CANCELLED = -32800
+
+SEVERITY = {"syntax": 1, "semantic": 1, "lexical": 2}  # Error, Warning
+
+
+def read_message(stream):
+    """Read one JSON-RPC message from a binary stream, None at the end"""
+    length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            return None
+        line = line.strip()
+        if not line:
+            if length is not None:
+                break
+            continue
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            length = int(value)
+    return json.loads(stream.read(length))
+
+
+def write_message(stream, message):
+    body = json.dumps(message, separators=(",", ":")).encode()
+    stream.write(b"Content-Length: %d\r\n\r\n" % len(body) + body)
+    stream.flush()
+
+
+def utf16_length(text):
+    return len(text) + sum(1 for c in text if ord(c) > 0xFFFF)
+
+
+class Server:
+    def __init__(self, out, debounce=DEFAULT_DEBOUNCE, record=None):
+        self.out = out  # Binary stream to the client
+        self.debounce = debounce
+        self.record = record  # Text file receiving the incoming messages, timed
+        self.inbox = queue.Queue()
+        self.documents = {}  # uri -> Document
+        self.versions = {}  # uri -> version of the Document
+        self.latest = {}  # uri -> newest version received, set by the reader thread
+        self.due = {}  # uri -> time its analysis is due
+        self.cancelled = set()  # Ids of the requests the client cancelled
+        self.utf16 = True  # Columns count UTF-16 code units (the LSP default)
+        self.running = True
+        self.shut_down = False
+
+    def send(self, message):
+        write_message(self.out, message)
+
+    def respond(self, msg_id, result=None, error=None):
+        if error is not None:
+            self.send({"jsonrpc": "2.0", "id": msg_id, "error": {"code": error[0], "message": error[1]}})
+        else:
+            self.send({"jsonrpc": "2.0", "id": msg_id, "result": result})
+
+    def notify(self, method, params):
+        self.send({"jsonrpc": "2.0", "method": method, "params": params})
+
+    # Message loop
+
+    def reader(self, stream):
+        """Queue the incoming messages. New document versions and
+        cancellations are noted at once, so running work can see them."""
+        t0 = time.perf_counter()
+        while True:
+            msg = read_message(stream)
+            if msg is None:
+                self.inbox.put(None)
+                return
+            if self.record is not None:
+                self.record.write(json.dumps({"t": round(time.perf_counter() - t0, 6), "message": msg}) + "\n")
+                self.record.flush()
+            method = msg.get("method")
+            if method == "textDocument/didChange":
+                doc = msg["params"]["textDocument"]
+                self.latest[doc["uri"]] = doc.get("version")
+            elif method == "$/cancelRequest":
+                self.cancelled.add(msg["params"]["id"])
+                continue
+            self.inbox.put(msg)
+
+    def serve(self, stream):
+        threading.Thread(target=self.reader, args=(stream,), daemon=True).start()
+        while self.running:
+            timeout = None
+            if self.due:
+                timeout = max(0.0, min(self.due.values()) - time.perf_counter())
+            try:
+                msg = self.inbox.get(timeout=timeout)
+            except queue.Empty:
+                self.run_due()
+                continue
+            if msg is None:
+                break
+            self.handle(msg)
+
+    def handle(self, msg):
+        method = msg.get("method")
+        msg_id = msg.get("id")
+        handler = getattr(self, "on_" + method.replace("/", "_").replace("$", "_"), None) if method else None
+        if msg_id is not None and msg_id in self.cancelled:
+            self.cancelled.discard(msg_id)
+            self.respond(msg_id, error=(REQUEST_CANCELLED, "request cancelled"))
+            return
+        if handler is None:
+            if msg_id is not None and method is not None:
+                self.respond(msg_id, error=(METHOD_NOT_FOUND, f"unsupported method: {method}"))
+            return
+        try:
+            result = handler(msg.get("params") or {})
+        except Exception as e:
+            traceback.print_exc(file=sys.stderr)
+            if msg_id is not None:
+                self.respond(msg_id, error=(INTERNAL_ERROR, str(e)))
+            return
+        if msg_id is not None:
+            self.respond(msg_id, result)
+
+    # Analysis
+
+    def run_due(self):
+        now = time.perf_counter()
+        for uri, due in list(self.due.items()):
+            if due <= now:
+                self.analyze(uri, cancellable=True)
+
+    def analyze(self, uri, cancellable=False):
+        """Analyze a document and publish its diagnostics. A cancellable
+        analysis gives up as soon as a newer version of the document arrives."""
+        doc = self.documents.get(uri)
+        if doc is None:
+            self.due.pop(uri, None)
+            return
+        version = self.versions.get(uri)
+        latest = self.latest
+
+        def cancelled():
+            return latest.get(uri, version) != version
+
+        try:
+            diagnostics = doc.analyze(cancelled if cancellable else None)
+        except AnalysisCancelled:
+            return
+        self.due.pop(uri, None)
+        self.notify("textDocument/publishDiagnostics", {
+            "uri": uri,
+            "version": version,
+            "diagnostics": [self.diagnostic(doc, d) for d in diagnostics],
+        })
+
+    def analyzed(self, uri):
+        """Document with its pending changes analyzed, e.g. to answer a request"""
+        if uri in self.due:
+            self.analyze(uri)
+        return self.documents.get(uri)
+
+    def diagnostic(self, doc, d):
+        return {
+            "range": self.range(doc, d.start, d.end),
+            "severity": SEVERITY[d.kind],
+            "source": "atomc",
+            "message": d.message,
+        }
+
+    # Positions
+
+    def offset(self, doc, position):
+        """Source offset of an LSP position"""
+        line, column = position["line"], position["character"]
+        start = doc.offset(line, 0)
+        text = doc.text[start:doc.offset(line + 1, 0)].rstrip("\r\n")
+        if self.utf16 and not text.isascii():
+            units = 0
+            for i, c in enumerate(text):
+                if units >= column:
+                    column = i
+                    break
+                units += 2 if ord(c) > 0xFFFF else 1
+        # Columns past the end of the line mean its end
+        return start + min(column, len(text))
+
+    def position(self, doc, offset):
+        """LSP position of a source offset"""
+        line, column = doc.position(offset)
+        if self.utf16:
+            prefix = doc.text[offset - column:offset]
+            if not prefix.isascii():
+                column = utf16_length(prefix)
+        return {"line": line, "character": column}
+
+    def range(self, doc, start, end):
+        return {"start": self.position(doc, start), "end": self.position(doc, end)}
+
+    # Lifecycle
+
+    def on_initialize(self, params):
+        encodings = params.get("capabilities", {}).get("general", {}).get("positionEncodings", [])
+        if "utf-32" in encodings:
+            self.utf16 = False
+        options = params.get("initializationOptions") or {}
+        if "debounce" in options:
+            self.debounce = float(options["debounce"])
+        return {
+            "capabilities": {
+                "positionEncoding": "utf-16" if self.utf16 else "utf-32",
+                "textDocumentSync": {"openClose": True, "change": 2},  # Incremental
+                "hoverProvider": True,
+                "definitionProvider": True,
+            },
+            "serverInfo": {"name": "atomc-lsp"},
+        }
+
+    def on_initialized(self, params):
+        pass
+
+    def on_shutdown(self, params):
+        self.shut_down = True
+        return None
+
+    def on_exit(self, params):
+        self.running = False
+
+    # Documents
+
+    def on_textDocument_didOpen(self, params):
+        item = params["textDocument"]
+        uri = item["uri"]
+        self.documents[uri] = Document(item["text"])
+        self.versions[uri] = item.get("version")
+        self.due[uri] = time.perf_counter()
+
+    def on_textDocument_didChange(self, params):
+        uri = params["textDocument"]["uri"]
+        doc = self.documents.get(uri)
+        if doc is None:
+            return
+        for change in params["contentChanges"]:
+            if "range" in change:
+                a = self.offset(doc, change["range"]["start"])
+                b = self.offset(doc, change["range"]["end"])
+                doc.edit(a, b, change["text"])
+            else:
+                doc.replace(change["text"])
+        self.versions[uri] = params["textDocument"].get("version")
+        self.due[uri] = time.perf_counter() + self.debounce
+
+    def on_textDocument_didClose(self, params):
+        uri = params["textDocument"]["uri"]
+        self.documents.pop(uri, None)
+        self.versions.pop(uri, None)
+        self.due.pop(uri, None)
+        self.notify("textDocument/publishDiagnostics", {"uri": uri, "diagnostics": []})
+
+    # Requests
+
+    def on_textDocument_hover(self, params):
+        uri = params["textDocument"]["uri"]
+        doc = self.analyzed(uri)
+        if doc is None:
+            return None
+        found = doc.hover(self.offset(doc, params["position"]))
+        if found is None:
+            return None
+        text, (start, end) = found
+        return {
+            "contents": {"kind": "markdown", "value": f"```c\n{text}\n```"},
+            "range": self.range(doc, start, end),
+        }
+
+    def on_textDocument_definition(self, params):
+        uri = params["textDocument"]["uri"]
+        doc = self.analyzed(uri)
+        if doc is None:
+            return None
+        span = doc.definition(self.offset(doc, params["position"]))
+        if span is None:
+            return None
+        return {"uri": uri, "range": self.range(doc, *span)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="AtomC language server (stdio)")
+    ap.add_argument("--debounce", type=float, default=DEFAULT_DEBOUNCE,
+                    help="seconds without new messages before analyzing a changed document")
+    ap.add_argument("--record", default=None, help="append the incoming messages, timed, to this file")
+    args = ap.parse_args(argv)
+    record = open(args.record, "a") if args.record else None
+    server = Server(sys.stdout.buffer, args.debounce, record)
+    try:
+        server.serve(sys.stdin.buffer)
+    finally:
+        if record is not None:
+            record.close()
+    sys.stdout.flush()
+    # The reader thread may still be blocked on stdin: exit without joining it
+    os._exit(0 if server.shut_down else 1)
+
+
+if __name__ == "__main__":
+    main()
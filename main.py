@@ -1,72 +1,52 @@
-from lexical_analyzer import lexer
-from syntax_analyzer import Parser, Token
+import sys
+
+from parser_trace import TRACE_SEMANTIC
+from syntax_analyzer import CompilationContext, Parser
 from syntax_analyzer import SemanticError
+from token_stream import TOKEN_NAMES, tokenize
 
-# Function to read input from a file
+# Function to read input from a file, or from stdin for -
 def read_input_from_file(file_path):
+    if file_path == '-':
+        return sys.stdin.read()
     with open(file_path, 'r') as file:
         return file.read()
 
-# File path to the input file
-input_file_path = r'input'
+# File path to the input file: the first argument if given
+input_file_path = sys.argv[1] if len(sys.argv) > 1 else r'input'
 
 # Read input from the file
 data = read_input_from_file(input_file_path)
 
-# Tokenize input
-lexer.input(data)
-
-# Collect tokens into a list
-tokens = []
-while True:
-    tok = lexer.token()
-    if not tok:
-        token = Token(code='END', value='None')
-        tokens.append(token)
-        break
-    # Convert LexToken to Token
-    token = Token(code=tok.type, value=tok.value)
-    tokens.append(token)
+# Compilation state: lexer, symbol table, current function/struct
+ctx = CompilationContext()
 
-# Convert list to linked list
-for i in range(len(tokens) - 1):
-    tokens[i].next = tokens[i + 1]
+# Tokenize input into a token buffer
+tokens = tokenize(ctx.lexer, data)
 
 # Debug Step 1: Print the token stream to verify lexer output
 print("Token Stream:")
-current = tokens[0]
-while current:
-    print(f"  {current.code}('{current.value}')")
-    current = current.next
+for i in range(len(tokens)):
+    print(f"  {TOKEN_NAMES[tokens.kinds[i]]}('{tokens.value(i)}')")
 print("End of Token Stream\n")
 
 # Create parser and parse the token stream
-parser = Parser(tokens[0])
-
-# Debug Step 2: Modify the consume method to trace token consumption
-original_consume = parser.consume
-
-def debug_consume(code):
-    print(f"Trying to consume: {code}, Current token: {parser.crtTk.code if parser.crtTk else 'None'}")
-    result = original_consume(code)
-    if result:
-        print(f"Consumed: {result.code}('{result.value}')")
-    return result
-
-parser.consume = debug_consume
+# Debug Step 2: Trace token consumption and semantic actions
+parser = Parser(tokens, ctx, trace=TRACE_SEMANTIC, trace_sink=print)
 
 # Parse and handle exceptions
 try:
     result = parser.unit()
     print("SUCCESS")
 except SyntaxError as e:
-    print(f"Syntax error: {e}")
+    line, column = parser.position()
+    print(f"Syntax error: {e} at line {line}, column {column}")
+    print(parser.snippet())
 except SemanticError as e:
     print(f"Semantic error: {e}")
+    print(parser.snippet())
     # Debug Step 3: Print context around the error
-    if parser.crtTk:
-        print(f"Error occurred at token: {parser.crtTk.code}('{parser.crtTk.value}')")
-        if parser.crtTk.next:
-            print(f"Next token: {parser.crtTk.next.code}('{parser.crtTk.next.value}')")
-        if parser.crtTk.next and parser.crtTk.next.next:
-            print(f"Following token: {parser.crtTk.next.next.code}('{parser.crtTk.next.next.value}')")
+    for k, label in enumerate(("Error occurred at token", "Next token", "Following token")):
+        tk = tokens.token(parser.pos + k)
+        if tk:
+            print(f"{label}: {tk.code}('{tk.value}')")
@@ -0,0 +1,284 @@
+"""Memory-mapped source files, lexed as bytes.
+
+tokenize() and lex_stream() work on text: the file is decoded into a str
+before it is lexed, and every token value is a slice of it. For very large
+sources MappedSource maps the file instead, and scan_mapped() runs the
+master regex of scanner.py, compiled for bytes, over the mapping: the
+source is never decoded as a whole, and the pages already lexed are handed
+back to the kernel as the scan moves on. Only the kind and the byte offset
+of each token are kept; the value of a name or a constant is decoded (and
+converted) when the parser or a diagnostic asks for it, by matching the
+token again at its offset. tokenize_mapped() collects the tokens in a
+MappedTokenBuffer, stream_mapped() feeds a MappedTokenStream window.
+
+The source must be UTF-8. The rules match ASCII only outside character
+and string constants and comments, so the tokens are the ones the text
+lexer finds in the decoded file; the character rule is rewritten to take
+one multibyte character. Bytes that are not valid UTF-8 raise
+SourceDecodeError, with their byte offset, when they are decoded: in a
+constant when its value is needed, in illegal input when it is lexed;
+comments are never decoded. Token and lexer error offsets are byte
+offsets; lines and columns count characters, like the text lexer's.
+"""
+import mmap
+import os
+import re
+from array import array
+
+import lexical_analyzer as rules
+from scanner import COMMENT, END_, KEYWORDS, LATE_OPERATOR, MASTER, NAME, OPERATOR, OPERATORS, BLANKS
+from scanner import CHAR_, DECIMAL, HEX, OCTAL, REAL, STRING, convert, master_pattern
+from token_stream import CT_CHAR, CT_INT, CT_REAL, CT_STRING, END, ID, TOKEN_NAMES, TokenBuffer, TokenStream
+
+# The character rule with one UTF-8 sequence (possibly escaped) as an
+# alternative, keeping its single group so the group numbers do not move
+CHAR_RULE = rules.t_CT_CHAR.__doc__
+UTF8_CHAR_RULE = r"'([^'\\\x80-\xff]|\\[^\n\x80-\xff]|\\?[\xc0-\xff][\x80-\xbf]*)'"
+
+MASTER_BYTES = re.compile(master_pattern().replace(CHAR_RULE, UTF8_CHAR_RULE).encode("ascii"), re.VERBOSE)
+assert MASTER_BYTES.groupindex == MASTER.groupindex, "the bytes rules must keep the group numbers of scanner.py"
+
+KEYWORDS_BYTES = {text.encode("ascii"): kind for text, kind in KEYWORDS.items()}
+OPERATORS_BYTES = {text.encode("ascii"): kind for text, kind in OPERATORS.items()}
+BLANK_BYTES = frozenset(BLANKS.encode("ascii"))
+
+NAME_BYTES = re.compile(rules.t_ID.__doc__.encode("ascii"))
+
+# Value of the keywords and operators by kind (None for the other kinds),
+# which need no match
+FIXED_VALUES = tuple({kind: text for text, kind in (*KEYWORDS.items(), *OPERATORS.items())}.get(kind)
+                     for kind in range(len(TOKEN_NAMES)))
+
+GROUP_KINDS = {HEX: CT_INT, OCTAL: CT_INT, DECIMAL: CT_INT, REAL: CT_REAL,
+               CHAR_: CT_CHAR, STRING: CT_STRING, END_: END}  # Kind of the groups that are not looked up
+
+BLOCK = 1 << 20  # Bytes per entry of the line count index
+RELEASE_STEP = 8 << 20  # Bytes lexed between two page releases, and kept behind the scan
+RECENT_VALUES = 1024  # Decoded values kept by MappedSource.value()
+
+
+class SourceDecodeError(SyntaxError):
+    """Bytes of a mapped source that are not valid UTF-8"""
+
+    def __init__(self, byte_offset, byte, reason):
+        super().__init__(f"Cannot decode byte 0x{byte:02x} at byte offset {byte_offset}: {reason}")
+        self.byte_offset = byte_offset
+
+
+class MappedSource:
+    """A source file mapped read-only into memory"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(mmap, "MADV_SEQUENTIAL"):
+                    self.data.madvise(mmap.MADV_SEQUENTIAL)
+            else:
+                self.data = b""  # Empty files cannot be mapped
+        self.released = 0  # Pages before this offset have been handed back
+        self.line_counts = None  # Newlines before each block, built on the first position query
+        self.recent = {}  # Offset -> value of the tokens decoded last
+
+    def __len__(self):
+        return len(self.data)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unmap the file; fails while tokens still hold matches on it"""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def release(self, offset):
+        """Let the kernel drop the pages more than RELEASE_STEP bytes before
+        offset. They are read back from the file if touched again."""
+        end = offset - RELEASE_STEP
+        end -= end % mmap.PAGESIZE
+        if end - self.released < RELEASE_STEP or not hasattr(mmap, "MADV_DONTNEED"):
+            return
+        self.data.madvise(mmap.MADV_DONTNEED, self.released, end - self.released)
+        self.released = end
+
+    def decode(self, start, end):
+        """data[start:end] as text, or SourceDecodeError"""
+        try:
+            return self.data[start:end].decode("utf-8")
+        except UnicodeDecodeError as e:
+            raise SourceDecodeError(start + e.start, self.data[start + e.start], e.reason) from None
+
+    def value(self, offset, kind=None):
+        """Value of the token at offset, as the text lexer gives it. The
+        parser reads most values more than once, so the last ones are kept."""
+        value = self.recent.get(offset)
+        if value is not None:
+            return value
+        if kind == ID:  # Names are ASCII
+            value = NAME_BYTES.match(self.data, offset).group().decode("ascii")
+        else:
+            m = MASTER_BYTES.match(self.data, offset)
+            if m is None or m.lastindex == END_:
+                return None
+            g = m.lastindex
+            value = convert(g, self.decode(m.start(g), m.end(g)))[1]
+        if len(self.recent) >= RECENT_VALUES:
+            self.recent.clear()
+        self.recent[offset] = value
+        return value
+
+    def illegal(self, pos, errors):
+        """Skip the character at pos, which no rule matches, recording
+        (offset, character) in errors or printing it like the PLY lexer.
+        Returns the offset after the character."""
+        lead = self.data[pos]
+        end = pos + (1 if lead < 0x80 else 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4)
+        char = self.decode(pos, end)
+        if errors is None:
+            print(f"Illegal character '{char}'")
+        else:
+            errors.append((pos, char))
+        return end
+
+    def lines_before(self, block):
+        """Number of newlines before block * BLOCK"""
+        if self.line_counts is None:
+            data = self.data
+            counts = self.line_counts = array('q', [0])
+            for k in range(0, len(data), BLOCK):
+                counts.append(counts[-1] + data[k:k + BLOCK].count(b"\n"))
+        return self.line_counts[block]
+
+    def line_start(self, offset):
+        return self.data.rfind(b"\n", 0, offset) + 1
+
+    def position(self, offset):
+        """1-based (line, column) of a byte offset, the column in characters"""
+        block = offset // BLOCK
+        line = self.lines_before(block) + self.data[block * BLOCK:offset].count(b"\n") + 1
+        start = self.line_start(offset)
+        return line, len(self.data[start:offset].decode("utf-8", "replace")) + 1
+
+    def snippet(self, offset):
+        """The source line containing offset, followed by a caret under it"""
+        start = self.line_start(offset)
+        end = self.data.find(b"\n", start)
+        line = self.data[start:end if end >= 0 else len(self.data)].decode("utf-8", "replace").rstrip('\r')
+        prefix = self.data[start:offset].decode("utf-8", "replace")
+        pad = ''.join(c if c == '\t' else ' ' for c in prefix)
+        return f"{line}\n{pad}^"
+
+
+def scan_mapped(mapped, errors=None):
+    """Lex a MappedSource and yield (kind, None, start) for each token, the
+    value being left in the mapping, ending with END like lex_stream().
+    Illegal characters are recorded in errors (see MappedSource.illegal)."""
+    data = mapped.data
+    size = len(data)
+    keywords = KEYWORDS_BYTES.get
+    operators = OPERATORS_BYTES
+    kinds = GROUP_KINDS
+    pos = 0
+    next_release = 2 * RELEASE_STEP
+    while True:
+        for m in MASTER_BYTES.finditer(data, pos):
+            stop = m.start()
+            if stop != pos:
+                # No rule matches after the blanks of data[pos:stop]
+                while pos < stop:
+                    if data[pos] in BLANK_BYTES:
+                        pos += 1
+                    else:
+                        pos = mapped.illegal(pos, errors)
+                if pos != stop:
+                    break  # Skipped into the match: search again from pos
+            g = m.lastindex
+            pos = m.end()
+            if g == NAME:
+                yield keywords(m.group(g), ID), None, m.start(g)
+            elif g == OPERATOR or g == LATE_OPERATOR:
+                yield operators[m.group(g)], None, m.start(g)
+            elif g != COMMENT:
+                yield kinds[g], None, m.start(g)
+            if pos > next_release:
+                mapped.release(pos)
+                next_release = pos + RELEASE_STEP
+        else:
+            # Blanks and illegal input at the end
+            while pos < size and data[pos] in BLANK_BYTES:
+                pos += 1
+            if pos < size:
+                pos = mapped.illegal(pos, errors)
+                continue
+            yield END, None, size
+            return
+
+
+class MappedTokenBuffer(TokenBuffer):
+    """Kinds and byte offsets of the tokens of a MappedSource; values,
+    positions and snippets are read from the mapping when asked for"""
+
+    def __init__(self, mapped):
+        super().__init__(offsets='q' if len(mapped) >= 1 << 31 else 'i')
+        self.mapped = mapped
+
+    def append(self, kind, value=None, start=-1):
+        self.kinds.append(kind)
+        self.starts.append(start)
+
+    def extend(self, tokens):
+        kinds, starts = self.kinds.append, self.starts.append
+        for kind, _, start in tokens:
+            kinds(kind)
+            starts(start)
+
+    def value(self, i):
+        kind = self.kinds[i]
+        value = FIXED_VALUES[kind]
+        if value is not None:
+            return value
+        return self.mapped.value(self.starts[i], kind)
+
+    def position(self, i):
+        if not 0 <= i < len(self.kinds) or self.starts[i] < 0:
+            return None, None
+        return self.mapped.position(self.starts[i])
+
+    def snippet(self, i):
+        if not 0 <= i < len(self.kinds) or self.starts[i] < 0:
+            return None
+        return self.mapped.snippet(self.starts[i])
+
+
+class MappedTokenStream(TokenStream):
+    """TokenStream window over a MappedSource, which the scan moves through
+    once: memory stays bounded by the window and the mapped pages kept
+    around the scan. Values, positions and snippets as MappedTokenBuffer."""
+
+    def __init__(self, mapped, tokens, lookahead=4):
+        self.mapped = mapped
+        super().__init__(tokens, lookahead)
+
+    def append(self, kind, value=None, start=-1):
+        self.kinds.append(kind)
+        self.starts.append(start)
+
+    value = MappedTokenBuffer.value
+    position = MappedTokenBuffer.position
+    snippet = MappedTokenBuffer.snippet
+
+
+def tokenize_mapped(mapped, errors=None):
+    """All the tokens of a MappedSource, terminated by END"""
+    buf = MappedTokenBuffer(mapped)
+    buf.extend(scan_mapped(mapped, errors))
+    return buf
+
+
+def stream_mapped(mapped, errors=None, lookahead=4):
+    """MappedTokenStream over a MappedSource"""
+    return MappedTokenStream(mapped, scan_mapped(mapped, errors), lookahead)
@@ -0,0 +1,205 @@
+"""Parser profiling: per-rule counters, a table and collapsed stacks.
+
+A ParserProfile given to a Parser (profile=...) records, for each grammar
+rule, its calls, successes and failures, cumulative and self time, the
+tokens it consumed and the tokens restore() gave back while it was the
+innermost rule. It also counts the symbol lookups (find_symbol) and the
+create_type() calls and Type allocations of the parse, through the
+parser's own find_symbol and create_type hooks: parses running at the same
+time in other threads are neither counted nor slowed down. Like tracing,
+profiling is set up when the Parser is built: without a profile nothing is
+wrapped, so an unprofiled parse runs exactly the same code as before.
+
+A profile can be shared by several parses to add them up. table() formats
+the counters; collapsed() writes one "unit;declFunc;stmCompound;... self
+microseconds" line per rule stack, the input of flame graph tools such as
+flamegraph.pl or speedscope.
+
+Usage: python parser_profile.py [--backtrack] [--packrat] [--pratt] [--lexer ply] [--collapsed FILE] files...
+"""
+import sys
+import time
+
+import syntax_analyzer
+from parser_trace import TRACED_RULES
+
+PROFILED_RULES = TRACED_RULES  # Every grammar rule; unit() is profiled as well
+
+
+class RuleStats:
+    """Counters of one rule"""
+
+    __slots__ = ("calls", "successes", "failures", "cumulative", "self_time", "consumed", "discarded", "active")
+
+    def __init__(self):
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0  # Returned False or raised
+        self.cumulative = 0.0  # Seconds, recursive calls counted once
+        self.self_time = 0.0  # Seconds, without the rules it called
+        self.consumed = 0  # Tokens consumed by its successful calls
+        self.discarded = 0  # Tokens given back by restore() in its own code
+        self.active = 0  # Calls in progress, for recursive rules
+
+
+class ParserProfile:
+    """Counters of one or more profiled parses"""
+
+    def __init__(self):
+        self.rules = {}  # Rule name -> RuleStats
+        self.stacks = {}  # "unit;declFunc;..." -> self seconds
+        self.stack = []  # Frames [stack key, seconds spent in callees, RuleStats] of the rules running
+        self.restores = 0
+        self.symbol_probes = 0  # find_symbol calls
+        self.type_requests = 0  # create_type calls
+        self.type_allocations = 0  # create_type calls that made a new Type
+
+    def stats(self, name):
+        s = self.rules.get(name)
+        if s is None:
+            s = self.rules[name] = RuleStats()
+        return s
+
+    def attach(self, parser):
+        """Wrap the rules, restore(), unit() and the symbol and type hooks
+        of a parser"""
+        for name in PROFILED_RULES:
+            setattr(parser, name, self.rule(parser, name, getattr(parser, name)))
+        parser.restore = self.restore(parser, parser.restore)
+        parser.unit = self.rule(parser, "unit", parser.unit)
+        parser.find_symbol = self.find_symbol(parser.find_symbol)
+        parser.create_type = self.create_type(parser, parser.create_type)
+
+    def rule(self, parser, name, rule):
+        """Wrap a rule to update its counters and its stack's self time"""
+        stats = self.stats(name)
+        stack = self.stack
+        stacks = self.stacks
+        clock = time.perf_counter
+
+        def run(*args):
+            key = stack[-1][0] + ";" + name if stack else name
+            frame = [key, 0.0, stats]
+            stack.append(frame)
+            stats.active += 1
+            pos = parser.pos
+            ok = False
+            t0 = clock()
+            try:
+                ok = rule(*args)
+                return ok
+            finally:
+                elapsed = clock() - t0
+                stack.pop()
+                if stack:
+                    stack[-1][1] += elapsed
+                stats.active -= 1
+                if not stats.active:
+                    stats.cumulative += elapsed
+                own = elapsed - frame[1]
+                stats.self_time += own
+                stacks[key] = stacks.get(key, 0.0) + own
+                stats.calls += 1
+                if ok:
+                    stats.successes += 1
+                    stats.consumed += parser.pos - pos
+                else:
+                    stats.failures += 1
+
+        return run
+
+    def restore(self, parser, restore):
+        """Wrap restore() to count the tokens it gives back"""
+        stack = self.stack
+
+        def run(saved):
+            pos = parser.pos
+            restore(saved)
+            self.restores += 1
+            if stack and parser.pos < pos:
+                stack[-1][2].discarded += pos - parser.pos
+
+        return run
+
+    def find_symbol(self, find_symbol):
+        """Wrap a parser's find_symbol hook to count the lookups"""
+
+        def run(symtab, name):
+            self.symbol_probes += 1
+            return find_symbol(symtab, name)
+
+        return run
+
+    def create_type(self, parser, create_type):
+        """Wrap a parser's create_type hook to count the calls, and the
+        calls that grew a table of interned types"""
+        arrays = parser.ctx.array_types
+
+        def run(type_base, n_elements, s=None):
+            self.type_requests += 1
+            table = syntax_analyzer.type_table(n_elements, s, arrays)
+            n = len(table)
+            t = create_type(type_base, n_elements, s)
+            if len(table) > n:
+                self.type_allocations += 1
+            return t
+
+        return run
+
+    def table(self, sort="self_time"):
+        """The counters as a text table, sorted by a RuleStats field"""
+        total = sum(s.self_time for s in self.rules.values()) or 1.0
+        lines = [f"{'rule':14} {'calls':>9} {'ok':>9} {'failed':>9} {'cum ms':>9} {'self ms':>9} {'self%':>6}"
+                 f" {'consumed':>9} {'discarded':>9}"]
+        for name, s in sorted(self.rules.items(), key=lambda item: -getattr(item[1], sort)):
+            if not s.calls:
+                continue
+            lines.append(f"{name:14} {s.calls:9} {s.successes:9} {s.failures:9} {s.cumulative * 1e3:9.2f}"
+                         f" {s.self_time * 1e3:9.2f} {s.self_time / total * 100:6.1f} {s.consumed:9} {s.discarded:9}")
+        lines.append(f"restore() calls: {self.restores}, find_symbol probes: {self.symbol_probes}, "
+                     f"create_type calls: {self.type_requests}, Type allocations: {self.type_allocations}")
+        return "\n".join(lines)
+
+    def collapsed(self):
+        """Collapsed stacks: one "rule;rule;... microseconds" line per stack"""
+        return "".join(f"{key} {round(seconds * 1e6)}\n" for key, seconds in sorted(self.stacks.items())
+                       if round(seconds * 1e6) > 0)
+
+
+def main(argv=None):
+    import argparse
+    from lexical_analyzer import LEXER_BACKENDS
+    from syntax_analyzer import CompilationContext, Parser, SemanticError
+    from token_stream import tokenize
+    ap = argparse.ArgumentParser(description="Profile the parser rule by rule")
+    ap.add_argument("files", nargs="+", help="AtomC files, profiled together")
+    ap.add_argument("--backtrack", action="store_true", help="try every alternative (no FIRST-set dispatch)")
+    ap.add_argument("--packrat", action="store_true", help="memoize the expression rules")
+    ap.add_argument("--pratt", action="store_true", help="precedence engine (profiled as expr and stm)")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    ap.add_argument("--sort", default="self_time", choices=("self_time", "cumulative", "calls", "discarded"),
+                    help="table order")
+    ap.add_argument("--collapsed", default=None, metavar="FILE", help="write collapsed stacks to FILE")
+    args = ap.parse_args(argv)
+
+    profile = ParserProfile()
+    for path in args.files:
+        with open(path, "r") as f:
+            text = f.read()
+        ctx = CompilationContext(lexer_backend=args.lexer)
+        tokens = tokenize(ctx.lexer, text)
+        parser = Parser(tokens, ctx, packrat=args.packrat, backtrack=args.backtrack, profile=profile,
+                        pratt=args.pratt)
+        try:
+            parser.unit()
+        except (SyntaxError, SemanticError) as e:
+            line, column = parser.position()
+            print(f"{path}: {e} (line {line}, column {column})", file=sys.stderr)
+    print(profile.table(args.sort))
+    if args.collapsed:
+        with open(args.collapsed, "w") as f:
+            f.write(profile.collapsed())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""Parser tracing: verbosity levels and output sinks.
+
+A sink is any callable taking one line of text. Tracing is set up once when
+the Parser is built: with TRACE_OFF nothing is wrapped or bound, so a
+non-traced parse runs exactly the same code as before tracing existed.
+"""
+from collections import deque
+
+TRACE_OFF = 0
+TRACE_RULES = 1  # Rule entry and failure
+TRACE_TOKENS = 2  # + every consume() attempt
+TRACE_SEMANTIC = 3  # + types, array sizes and variables resolved
+
+TRACE_LEVELS = {
+    "off": TRACE_OFF,
+    "rules": TRACE_RULES,
+    "tokens": TRACE_TOKENS,
+    "semantic": TRACE_SEMANTIC,
+}
+
+# Grammar rules reported at TRACE_RULES
+TRACED_RULES = (
+    "declStruct", "declVar", "typeBase", "arrayDecl", "typeName", "declFunc", "funcArg",
+    "stm", "stmCompound", "stmExpr", "stmIf", "stmWhile", "stmFor", "stmBreak", "stmReturn",
+    "expr", "exprAssign", "exprOr", "exprAnd", "exprEq", "exprRel", "exprAdd", "exprMul",
+    "exprCast", "exprUnary", "exprPostfix", "exprPrimary",
+)
+
+
+def trace_level(level):
+    """Accept a level number or one of the TRACE_LEVELS names"""
+    if isinstance(level, str):
+        try:
+            return TRACE_LEVELS[level.lower()]
+        except KeyError:
+            raise ValueError(f"unknown trace level: {level}") from None
+    return level
+
+
+def file_sink(file):
+    """Sink writing one line per event to an open text file"""
+    write = file.write
+
+    def sink(line):
+        write(line + "\n")
+
+    return sink
+
+
+class RingBuffer:
+    """Sink keeping only the last `capacity` lines, e.g. to dump on error"""
+
+    def __init__(self, capacity=1000):
+        self.buffer = deque(maxlen=capacity)
+
+    def __call__(self, line):
+        self.buffer.append(line)
+
+    def lines(self):
+        return list(self.buffer)
+
+    def clear(self):
+        self.buffer.clear()
@@ -0,0 +1,255 @@
+"""Synthetic AtomC programs of tunable size and shape.
+
+Generates valid programs: structs (each one nesting the previous one),
+global variables and arrays of structs used like tests/9.c, then functions
+whose bodies nest if/while/for statements and compute expressions over
+their locals, parameters, globals, struct members and calls, and a main
+calling them. Loops are bounded, indexes stay in their arrays and the
+functions that make calls only call functions making none, outside
+loops, so the programs also run (int arithmetic may overflow). The same options and
+seed always give the same program.
+
+Usage: python program_generator.py [--functions N] [--structs N] [--depth N] [--expr N] [--idents N] [--seed N] [-o out.c]
+"""
+import random
+import sys
+
+ARRAY_SIZE = 16  # Elements of the global arrays of structs
+LOOP_COUNT = 8  # Iterations of every loop, so loop counters index the arrays
+MEMBER_ARRAY = 4  # Elements of the array member of the structs
+
+
+class ProgramGenerator:
+    """Writes one program. The shape is set by:
+    structs: struct definitions, each one containing the previous one
+    functions: functions besides main
+    depth: nesting depth of the statements of a function body
+    expr_length: binary operators per expression
+    identifiers: local variables per function, and global scalars
+    statements: statements per block
+    struct_arrays: use global arrays of structs (tests/9.c) in expressions"""
+
+    def __init__(self, structs=4, functions=20, depth=3, expr_length=4, identifiers=8, statements=4,
+                 struct_arrays=True, seed=0):
+        self.structs = structs
+        self.functions = functions
+        self.depth = depth
+        self.expr_length = expr_length
+        self.identifiers = max(identifiers, 2)
+        self.statements = max(statements, 1)
+        self.struct_arrays = struct_arrays
+        self.rng = random.Random(seed)
+        self.out = []
+        self.funcs = []  # (name, returns an int) of the functions written so far
+        self.leaves = []  # (name, returns an int) of the functions making no calls, which others call
+        self.calls = False  # Whether the function being written makes calls
+        self.ints = []  # int variables in scope
+        self.doubles = []  # double variables in scope
+        self.counters = []  # Loop counters of the enclosing loops
+
+    def emit(self, line, indent=0):
+        self.out.append("\t" * indent + line)
+
+    def generate(self):
+        """The program text"""
+        for k in range(self.structs):
+            self.struct(k)
+        self.globals()
+        for k in range(self.functions):
+            self.function(k)
+        self.main()
+        return "\n".join(self.out) + "\n"
+
+    def struct(self, k):
+        self.emit(f"struct S{k}{{")
+        self.emit(f"int a, v[{MEMBER_ARRAY}];", 1)
+        self.emit("double b;", 1)
+        self.emit("char c;", 1)
+        if k:
+            self.emit(f"struct S{k - 1} in;", 1)
+        self.emit("};")
+
+    def globals(self):
+        n = self.identifiers // 2 or 1
+        self.emit(f"int {', '.join(f'g{i}' for i in range(n))};")
+        self.emit(f"double {', '.join(f'h{i}' for i in range(n))};")
+        self.global_ints = [f"g{i}" for i in range(n)]
+        self.global_doubles = [f"h{i}" for i in range(n)]
+        for k in range(self.structs):
+            self.emit(f"struct S{k} s{k};")
+            if self.struct_arrays:
+                self.emit(f"struct S{k} sa{k}[{ARRAY_SIZE}];")
+
+    def member_paths(self, k):
+        """Member access paths down the nested structs from struct k:
+        ("", k), (".in", k - 1)..."""
+        paths = []
+        path = ""
+        while k >= 0:
+            paths.append((path, k))
+            path += ".in"
+            k -= 1
+        return paths
+
+    def struct_operand(self, is_int):
+        """A member of a global struct, or of an element of an array of structs"""
+        rng = self.rng
+        k = rng.randrange(self.structs)
+        path = rng.choice(self.member_paths(k))[0]
+        if self.struct_arrays and self.counters and rng.random() < 0.6:
+            base = f"sa{k}[{rng.choice(self.counters)}]"
+        else:
+            base = f"s{k}"
+        if not is_int:
+            return f"{base}{path}.b"
+        if rng.random() < 0.3:
+            return f"{base}{path}.v[{rng.randrange(MEMBER_ARRAY)}]"
+        return f"{base}{path}.a"
+
+    def operand(self, is_int, calls=True):
+        rng = self.rng
+        r = rng.random()
+        if r < 0.15:
+            return str(rng.randrange(1, 100)) if is_int else f"{rng.randrange(1, 100)}.{rng.randrange(10)}"
+        if r < 0.35 and self.structs:
+            return self.struct_operand(is_int)
+        # A double is never converted to an int: it may have overflowed
+        leaves = [name for name, returns_int in self.leaves if returns_int or not is_int]
+        if r < 0.42 and calls and self.calls and leaves and not self.counters:
+            name = rng.choice(leaves)
+            return f"{name}({self.expr(is_int=True, calls=False)}, {self.expr(is_int=False, calls=False)})"
+        return rng.choice(self.ints if is_int else self.doubles)
+
+    def expr(self, is_int=True, length=None, calls=True):
+        """An int or double expression of expr_length operators (length if
+        given). Divisions are by nonzero constants."""
+        rng = self.rng
+        length = self.expr_length if length is None else length
+        parts = [self.operand(is_int, calls)]
+        for _ in range(length):
+            op = rng.choice("+-*/")
+            if op == "/":
+                parts.append(f"/ {rng.randrange(2, 9)}")
+                continue
+            parts.append(op)
+            operand = self.operand(is_int, calls)
+            if rng.random() < 0.2:
+                operand = f"({operand} {rng.choice('+-')} {self.operand(is_int, calls)})"
+            parts.append(operand)
+        return " ".join(parts)
+
+    def condition(self):
+        rng = self.rng
+        half = self.expr_length // 2
+        test = f"{self.expr(length=half)} {rng.choice(['<', '<=', '>', '>=', '==', '!='])} {self.expr(length=half)}"
+        if rng.random() < 0.3:
+            test += f" {rng.choice(['&&', '||'])} !({self.expr(length=0)})"
+        return test
+
+    def lvalue(self, is_int):
+        rng = self.rng
+        if rng.random() < 0.25 and self.structs:
+            return self.struct_operand(is_int)
+        return rng.choice(self.locals_int if is_int else self.locals_double)
+
+    def block(self, level, indent):
+        for _ in range(self.statements):
+            self.statement(level, indent)
+
+    def statement(self, level, indent):
+        rng = self.rng
+        r = rng.random() if level < self.depth else 1.0
+        if r < 0.2:
+            self.emit(f"if({self.condition()}){{", indent)
+            self.block(level + 1, indent + 1)
+            if rng.random() < 0.5:
+                self.emit("}else{", indent)
+                self.block(level + 1, indent + 1)
+            self.emit("}", indent)
+        elif r < 0.4:
+            k = f"k{level}"
+            self.emit(f"for({k} = 0; {k} < {LOOP_COUNT}; {k} = {k} + 1){{", indent)
+            self.counters.append(k)
+            self.block(level + 1, indent + 1)
+            self.counters.pop()
+            self.emit("}", indent)
+        elif r < 0.5:
+            k = f"k{level}"
+            self.emit(f"{k} = 0;", indent)
+            self.emit(f"while({k} < {LOOP_COUNT}){{", indent)
+            self.counters.append(k)
+            self.block(level + 1, indent + 1)
+            self.counters.pop()
+            self.emit(f"{k} = {k} + 1;", indent + 1)
+            self.emit("}", indent)
+        else:
+            is_int = rng.random() < 0.6
+            self.emit(f"{self.lvalue(is_int)} = {self.expr(is_int)};", indent)
+
+    def function(self, k):
+        returns_int = k % 2 == 0
+        name = f"f{k}"
+        # Only calls to functions making none, outside loops, so that the
+        # run time stays bounded
+        self.calls = k % 3 == 2
+        n = self.identifiers
+        self.locals_int = [f"i{i}" for i in range((n + 1) // 2)]
+        self.locals_double = [f"d{i}" for i in range(n // 2 or 1)]
+        self.ints = self.locals_int + ["p0"] + self.global_ints
+        self.doubles = self.locals_double + ["p1"] + self.global_doubles
+        self.emit(f"{'int' if returns_int else 'double'} {name}(int p0, double p1)")
+        self.emit("{")
+        self.emit(f"int {', '.join(self.locals_int + [f'k{i}' for i in range(self.depth + 1)])};", 1)
+        self.emit(f"double {', '.join(self.locals_double)};", 1)
+        for v in self.locals_int:
+            self.emit(f"{v} = p0;", 1)
+        for v in self.locals_double:
+            self.emit(f"{v} = p1;", 1)
+        self.block(0, 1)
+        self.emit(f"return {self.expr(returns_int)};", 1)
+        self.emit("}")
+        self.funcs.append((name, returns_int))
+        if not self.calls:
+            self.leaves.append((name, returns_int))
+
+    def main(self):
+        self.emit("void main()")
+        self.emit("{")
+        for name, returns_int in self.funcs[-4:]:
+            put = "put_i" if returns_int else "put_d"
+            self.emit(f"{put}({name}({self.rng.randrange(10)}, 0.5));", 1)
+            self.emit("put_c('\\n');", 1)
+        self.emit("}")
+
+
+def generate_program(**options):
+    """Text of a program generated with ProgramGenerator(**options)"""
+    return ProgramGenerator(**options).generate()
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Generate a synthetic AtomC program")
+    ap.add_argument("--structs", type=int, default=4, help="struct definitions")
+    ap.add_argument("--functions", type=int, default=20, help="functions besides main")
+    ap.add_argument("--depth", type=int, default=3, help="statement nesting depth")
+    ap.add_argument("--expr", type=int, default=4, help="binary operators per expression")
+    ap.add_argument("--idents", type=int, default=8, help="local variables per function")
+    ap.add_argument("--statements", type=int, default=4, help="statements per block")
+    ap.add_argument("--no-struct-arrays", action="store_true", help="no arrays of structs")
+    ap.add_argument("--seed", type=int, default=0, help="random seed")
+    ap.add_argument("-o", "--output", default=None, help="output file (default: stdout)")
+    args = ap.parse_args(argv)
+
+    text = generate_program(structs=args.structs, functions=args.functions, depth=args.depth,
+                            expr_length=args.expr, identifiers=args.idents, statements=args.statements,
+                            struct_arrays=not args.no_struct_arrays, seed=args.seed)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == '__main__':
+    main()
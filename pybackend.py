@@ -0,0 +1,643 @@
+"""Python backend: AtomC program -> Python module, run by CPython itself.
+
+Each AtomC function becomes a Python function, so loops run as Python
+bytecode without an interpreter loop written in Python on top (see vm.py
+for that one). Variables are Python variables, globals being module
+globals. Arrays are preallocated lists and structs are slotted classes
+with copy() and set() for C's by-value semantics; strings are lists of
+char codes ending with 0, as in C. Ints and doubles are Python numbers.
+Chars wrap on 8 bits and int division truncates, as in C; ints wrap on 32
+bits, like the VM's and the C backend's (-fwrapv). A program runs in a
+thread of its own with a large stack and a raised recursion limit, so it
+can nest RECURSION_LIMIT calls, more than the VM's frame memory holds.
+
+The generated source is compiled once with compile(); programs are kept
+in memory by source hash and, with a CompileCache, on disk as Python
+source next to the compile outcome.
+
+Usage: python pybackend.py file.c [--source] [--cache DIR] [--lexer ply|scanner]
+"""
+import hashlib
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from bytecode import to_char, to_int
+from codegen import CodegenError, unescape
+from syntax_analyzer import TB_CHAR, TB_DOUBLE, TB_INT, TB_STRUCT, TB_VOID
+from syntax_tree import (
+    N_ADD, N_AND, N_ASSIGN, N_CALL, N_CAST, N_CT_CHAR, N_CT_INT, N_CT_REAL, N_CT_STRING, N_DIV, N_EMPTY,
+    N_EQUAL, N_FUNC, N_GREATER, N_GREATEREQ, N_ID, N_INDEX, N_LESS, N_LESSEQ, N_MEMBER, N_MUL, N_NEG,
+    N_NOT, N_NOTEQ, N_OR, N_STRUCT, N_SUB, N_VAR, NODE_NAMES, Visitor,
+)
+from vm import DOUBLE_INPUT, INT_INPUT, Console, VMError, float_div
+
+OPERATORS = {
+    N_ADD: "+", N_SUB: "-", N_MUL: "*", N_EQUAL: "==", N_NOTEQ: "!=",
+    N_LESS: "<", N_LESSEQ: "<=", N_GREATER: ">", N_GREATEREQ: ">=",
+}
+CONDITIONS = frozenset((N_AND, N_OR, N_NOT, N_EQUAL, N_NOTEQ, N_LESS, N_LESSEQ, N_GREATER, N_GREATEREQ))
+ZEROS = {TB_INT: "0", TB_CHAR: "0", TB_DOUBLE: "0.0"}
+MEMORY_CACHE_SIZE = 64  # Programs kept by compile_python()
+RECURSION_LIMIT = 1000000  # Python frames a program may nest, raised process-wide when it runs
+THREAD_STACK = 256 << 20  # Bytes of C stack of the thread running a program
+
+
+class Halt(Exception):
+    """A return statement outside of any function: the program stops"""
+
+
+def idiv(a, b):
+    """C division of ints: the quotient is truncated towards zero, and
+    wraps like the other int operations (INT_MIN / -1)"""
+    q = a // b
+    if q < 0 and q * b != a:
+        q += 1
+    return q if q != 0x80000000 else -0x80000000
+
+
+def store(seq, index, value):
+    seq[index] = value
+    return value
+
+
+def store_attr(obj, name, value):
+    setattr(obj, name, value)
+    return value
+
+
+def runtime(console):
+    """Globals of a generated module: the builtins, writing to console,
+    and the helpers the generated code calls"""
+    write = console.write
+
+    def put_s(s):
+        write(bytes(c & 0xFF for c in s[:s.index(0)]))
+
+    def get_s(s):
+        data = console.gets()
+        if len(data) >= len(s):
+            raise VMError("get_s: the input line does not fit in the array")
+        s[:len(data) + 1] = [to_char(b) for b in data] + [0]
+
+    def put_i(i):
+        write(b"%d" % i)
+
+    def get_i():
+        return to_int(console.number(INT_INPUT, int))
+
+    def put_d(d):
+        write(b"%g" % d)
+
+    def get_d():
+        return console.number(DOUBLE_INPUT, float)
+
+    def put_c(c):
+        write(bytes((c & 0xFF,)))
+
+    def get_c():
+        return to_char(console.getc())
+
+    return {
+        "put_s": put_s, "get_s": get_s, "put_i": put_i, "get_i": get_i, "put_d": put_d, "get_d": get_d,
+        "put_c": put_c, "get_c": get_c, "seconds": time.perf_counter,
+        "_idiv": idiv, "_fdiv": float_div, "_int": to_int, "_char": to_char, "_store": store,
+        "_store_attr": store_attr, "_Halt": Halt, "__name__": "atomc",
+    }
+
+
+def is_aggregate(t):
+    return t.nElements >= 0 or t.typeBase == TB_STRUCT
+
+
+class Translator(Visitor):
+    """Visitor writing the Python source of a program; expressions go
+    through expr() and cond()"""
+
+    def __init__(self, tree):
+        super().__init__(tree)
+        self.classes = []  # Lines of the struct classes
+        self.module = []  # Lines of the globals and string constants
+        self.functions = []  # Lines of the functions
+        self.globals = {}  # Global Symbol -> Python name
+        self.strings = {}  # Text of a string constant -> Python name
+        self.main = None
+        # State of the function being translated
+        self.lines = None
+        self.indent = 1
+        self.func = None
+        self.locals = {}  # Symbol -> Python name
+        self.local_names = set()
+        self.inits = []  # Initialization lines of the locals
+        self.assigned_globals = set()  # Global names rebound by the function
+        self.loops = 0  # Depth of the enclosing loops
+
+    def emit(self, line):
+        self.lines.append("    " * self.indent + line)
+
+    def error(self, n, message):
+        line, column = self.tree.position(n)
+        where = f" at line {line}, column {column}" if line is not None else ""
+        raise CodegenError(message + where)
+
+    # Names and values
+
+    def name(self, s):
+        """Python name of variable s"""
+        if s.mem == "MEM_GLOBAL":
+            name = self.globals.get(s)
+            if name is None:
+                name = self.globals[s] = "g_" + s.name
+                self.module.append(f"{name} = {self.initial(s.type)}")
+            return name
+        name = self.locals.get(s)
+        if name is None:
+            name = "l_" + s.name
+            suffix = 1
+            while name in self.local_names:  # A block shadows another variable of the function
+                suffix += 1
+                name = f"l_{s.name}_{suffix}"
+            self.local_names.add(name)
+            self.locals[s] = name
+            if s.mem != "MEM_ARG":
+                self.inits.append(f"{name} = {self.initial(s.type)}")
+        return name
+
+    def initial(self, t):
+        """Expression of a new zeroed variable of type t"""
+        if t.typeBase == TB_STRUCT:
+            value = f"S_{t.s.name}()"
+            if t.nElements >= 0:
+                return f"[{value} for _ in range({t.nElements})]"
+            return value
+        if t.nElements >= 0:
+            return f"[{ZEROS[t.typeBase]}] * {t.nElements}"
+        return ZEROS[t.typeBase]
+
+    def string(self, text):
+        name = self.strings.get(text)
+        if name is None:
+            name = self.strings[text] = f"_s{len(self.strings)}"
+            codes = [to_char(b) for b in unescape(text).encode("utf-8")] + [0]
+            self.module.append(f"{name} = {codes!r}")
+        return name
+
+    def convert(self, code, src, dst):
+        """code converted from type src to type dst. Ints are valid doubles."""
+        if is_aggregate(src) or is_aggregate(dst) or src.typeBase == dst.typeBase:
+            return code
+        if dst.typeBase == TB_INT and src.typeBase == TB_DOUBLE:
+            return f"_int(int({code}))"
+        if dst.typeBase == TB_CHAR:
+            if code.isdigit():
+                return str(to_char(int(code)))
+            return f"_char(int({code}))" if src.typeBase == TB_DOUBLE else f"_char({code})"
+        return code
+
+    def expr(self, n):
+        """Python expression of the value of expression n"""
+        tree = self.tree
+        kind = tree.kinds[n]
+        if kind == N_ID:
+            s = tree.symbol(n)
+            if s.cls != "CLS_VAR":
+                self.error(n, f"{s.name} is not a variable")
+            return self.name(s)
+        if kind == N_CT_INT:
+            value = to_int(tree.value(n))
+            return str(value) if value >= 0 else f"({value})"
+        if kind == N_CT_REAL:
+            return f"({float(tree.value(n))!r})"
+        if kind == N_CT_CHAR:
+            text = unescape(tree.value(n))
+            return str(to_char(ord(text))) if text else "0"
+        if kind == N_CT_STRING:
+            return self.string(tree.value(n))
+        if kind in OPERATORS and kind not in CONDITIONS:
+            left, right = tree.child_list(n)
+            code = f"({self.expr(left)} {OPERATORS[kind]} {self.expr(right)})"
+            return self.wrap(code, tree.type(n).typeBase)
+        if kind == N_DIV:
+            left, right = tree.child_list(n)
+            base = tree.type(n).typeBase
+            code = f"_{'f' if base == TB_DOUBLE else 'i'}div({self.expr(left)}, {self.expr(right)})"
+            return f"_char({code})" if base == TB_CHAR else code
+        if kind in CONDITIONS:
+            return f"(1 if {self.cond(n)} else 0)"
+        if kind == N_NEG:
+            (c,) = tree.child_list(n)
+            code = f"(-{self.expr(c)})"
+            return self.wrap(code, tree.type(n).typeBase)
+        if kind == N_CAST:
+            (c,) = tree.child_list(n)
+            return self.convert(self.expr(c), tree.type(c), tree.type(n))
+        if kind == N_INDEX:
+            array, index = tree.child_list(n)
+            return f"{self.expr(array)}[{self.expr(index)}]"
+        if kind == N_MEMBER:
+            (operand,) = tree.child_list(n)
+            return f"{self.expr(operand)}.m_{tree.symbol(n).name}"
+        if kind == N_ASSIGN:
+            return self.assign_expr(n)
+        if kind == N_CALL:
+            return self.call(n)
+        self.error(n, f"unexpected {NODE_NAMES[kind]} expression")
+
+    @staticmethod
+    def wrap(code, base):
+        """Parenthesized code of an arithmetic result, wrapped to its type.
+        Ints are range-checked inline: they seldom overflow, and a call
+        per operation would make int arithmetic several times slower."""
+        if base == TB_CHAR:
+            return f"_char{code}"
+        if base == TB_INT:
+            return f"(_v if -0x80000000 <= (_v := {code}) <= 0x7FFFFFFF else _int(_v))"
+        return code
+
+    def cond(self, n):
+        """Python expression of the truth of condition n"""
+        tree = self.tree
+        kind = tree.kinds[n]
+        if kind == N_AND or kind == N_OR:
+            left, right = tree.child_list(n)
+            return f"({self.cond(left)} {'and' if kind == N_AND else 'or'} {self.cond(right)})"
+        if kind == N_NOT:
+            (c,) = tree.child_list(n)
+            return f"(not {self.cond(c)})"
+        if kind in OPERATORS:
+            left, right = tree.child_list(n)
+            return f"({self.expr(left)} {OPERATORS[kind]} {self.expr(right)})"
+        return self.expr(n)
+
+    def call(self, n):
+        tree = self.tree
+        f = tree.symbol(n)
+        args = tree.child_list(n)[1:]
+        params = f.args.begin
+        if len(args) != len(params):
+            self.error(n, f"{f.name} takes {len(params)} arguments, not {len(args)}")
+        codes = []
+        for a, p in zip(args, params):
+            code = self.expr(a)
+            if p.type.typeBase == TB_STRUCT and p.type.nElements < 0:
+                code += ".copy()"  # Passed by value
+            codes.append(self.convert(code, tree.type(a), p.type))
+        name = f.name if f.cls == "CLS_EXTFUNC" else "f_" + f.name
+        return f"{name}({', '.join(codes)})"
+
+    def target(self, left):
+        """Python name of a variable assigned by its ID node, noting the
+        globals the function rebinds"""
+        name = self.name(self.tree.symbol(left))
+        if name.startswith("g_"):
+            self.assigned_globals.add(name)
+        return name
+
+    def assign(self, n, keep):
+        """Statements of assignment n; returns an expression of the value
+        assigned if keep"""
+        tree = self.tree
+        left, right = tree.child_list(n)
+        t = tree.type(left)
+        value = self.assign(right, True) if tree.kinds[right] == N_ASSIGN else self.expr(right)
+        if t.typeBase == TB_STRUCT:
+            target = self.expr(left)
+            self.emit(f"{target}.set({value})")
+            return target
+        value = self.convert(value, tree.type(right), t)
+        if tree.kinds[left] == N_ID:
+            name = self.target(left)
+            self.emit(f"{name} = {value}")
+            return name
+        target = self.expr(left)
+        if not keep:
+            self.emit(f"{target} = {value}")
+            return None
+        self.emit(f"_t = {value}")
+        self.emit(f"{target} = _t")
+        return "_t"
+
+    def assign_expr(self, n):
+        """Expression of assignment n, used inside another expression"""
+        tree = self.tree
+        left, right = tree.child_list(n)
+        t = tree.type(left)
+        if t.typeBase == TB_STRUCT:
+            return f"{self.expr(left)}.set({self.expr(right)})"
+        value = self.convert(self.expr(right), tree.type(right), t)
+        kind = tree.kinds[left]
+        if kind == N_ID:
+            return f"({self.target(left)} := {value})"
+        if kind == N_INDEX:
+            array, index = tree.child_list(left)
+            return f"_store({self.expr(array)}, {self.expr(index)}, {value})"
+        (operand,) = tree.child_list(left)
+        return f"_store_attr({self.expr(operand)}, 'm_{tree.symbol(left).name}', {value})"
+
+    # Declarations
+
+    def visit_UNIT(self, n):
+        tree = self.tree
+        unit = []
+        for c in tree.children(n):
+            kind = tree.kinds[c]
+            if kind == N_STRUCT or kind == N_FUNC or kind == N_VAR:
+                self.visit(c)
+            else:
+                unit.append(c)
+        self.function("_unit", [], unit, None)
+        lines = self.classes + self.module + self.functions
+        lines.append("def _run():")
+        lines.append("    _unit()")
+        if self.main is not None:
+            lines.append("    f_main()")
+        return "\n".join(lines) + "\n"
+
+    def visit_STRUCT(self, n):
+        s = self.tree.symbol(n)
+        cls = "S_" + s.name
+        members = [(m, "m_" + m.name) for m in s.members.begin]
+        lines = self.classes
+        lines.append(f"class {cls}:")
+        lines.append(f"    __slots__ = {tuple(name for m, name in members)!r}")
+        lines.append("")
+        lines.append("    def __init__(self):")
+        lines.extend(f"        self.{name} = {self.initial(m.type)}" for m, name in members)
+        if not members:
+            lines.append("        pass")
+        lines.append("")
+        lines.append("    def copy(self):")
+        lines.append(f"        other = {cls}.__new__({cls})")
+        for m, name in members:
+            t = m.type
+            if t.typeBase == TB_STRUCT:
+                value = f"[e.copy() for e in self.{name}]" if t.nElements >= 0 else f"self.{name}.copy()"
+            else:
+                value = f"self.{name}[:]" if t.nElements >= 0 else f"self.{name}"
+            lines.append(f"        other.{name} = {value}")
+        lines.append("        return other")
+        lines.append("")
+        lines.append("    def set(self, other):")
+        for m, name in members:
+            t = m.type
+            if t.typeBase == TB_STRUCT and t.nElements >= 0:
+                lines.append(f"        for mine, theirs in zip(self.{name}, other.{name}):")
+                lines.append("            mine.set(theirs)")
+            elif t.typeBase == TB_STRUCT:
+                lines.append(f"        self.{name}.set(other.{name})")
+            elif t.nElements >= 0:
+                lines.append(f"        self.{name}[:] = other.{name}")
+            else:
+                lines.append(f"        self.{name} = other.{name}")
+        lines.append("        return self")
+        lines.append("")
+
+    def visit_VAR(self, n):
+        self.name(self.tree.symbol(n))
+
+    def visit_FUNC(self, n):
+        tree = self.tree
+        s = tree.symbol(n)
+        if s.type.typeBase == TB_STRUCT and s.type.nElements < 0:
+            self.error(n, f"{s.name}: returning a structure is not supported")
+        if s.name == "main":
+            self.main = s
+        *params, body = tree.child_list(n)
+        self.function("f_" + s.name, [tree.symbol(p) for p in params], [body], s)
+
+    def function(self, name, params, statements, func):
+        """Lines of a Python function running statements"""
+        self.lines, self.indent, self.func = [], 1, func
+        self.locals, self.local_names, self.inits, self.assigned_globals = {}, set(), [], set()
+        args = [self.name(p) for p in params]
+        for c in statements:
+            self.visit(c)
+        if func is not None and func.type.typeBase != TB_VOID:
+            self.emit(f"return {self.initial(func.type)}")  # Falling off the end
+        lines = self.functions
+        lines.append(f"def {name}({', '.join(args)}):")
+        if self.assigned_globals:
+            lines.append(f"    global {', '.join(sorted(self.assigned_globals))}")
+        lines.extend("    " + line for line in self.inits)
+        lines.extend(self.lines or ["    pass"])
+        lines.append("")
+        lines.append("")
+
+    # Statements
+
+    def suite(self, n):
+        """Indented block of statement n"""
+        self.indent += 1
+        mark = len(self.lines)
+        self.visit(n)
+        if len(self.lines) == mark:
+            self.emit("pass")
+        self.indent -= 1
+
+    def discard(self, n):
+        """Statement evaluating expression n for its side effects"""
+        if self.tree.kinds[n] == N_ASSIGN:
+            self.assign(n, False)
+        else:
+            self.emit(self.expr(n))
+
+    def visit_EXPR(self, n):
+        for c in self.tree.children(n):
+            self.discard(c)
+
+    def visit_IF(self, n):
+        cond, then, *rest = self.tree.child_list(n)
+        self.emit(f"if {self.cond(cond)}:")
+        self.suite(then)
+        if rest:
+            self.emit("else:")
+            self.suite(rest[0])
+
+    def loop(self, cond, body, step=None):
+        self.emit(f"while {self.cond(cond) if cond is not None else 'True'}:")
+        self.loops += 1
+        self.suite(body)
+        self.loops -= 1
+        if step is not None:
+            self.indent += 1
+            self.discard(step)
+            self.indent -= 1
+
+    def visit_WHILE(self, n):
+        cond, body = self.tree.child_list(n)
+        self.loop(cond, body)
+
+    def visit_FOR(self, n):
+        tree = self.tree
+        init, cond, step, body = tree.child_list(n)
+        if tree.kinds[init] != N_EMPTY:
+            self.discard(init)
+        self.loop(cond if tree.kinds[cond] != N_EMPTY else None, body,
+                  step if tree.kinds[step] != N_EMPTY else None)
+
+    def visit_BREAK(self, n):
+        if not self.loops:
+            self.error(n, "break outside of a loop")
+        self.emit("break")
+
+    def visit_RETURN(self, n):
+        tree = self.tree
+        func = tree.symbol(n)
+        if func is None:
+            self.emit("raise _Halt()")
+            return
+        values = [self.convert(self.expr(c), tree.type(c), func.type) for c in tree.children(n)]
+        self.emit(f"return {values[0]}" if values else "return")
+
+    def generic_visit(self, n):
+        if self.tree.kinds[n] >= N_ASSIGN:
+            self.error(n, f"unexpected {NODE_NAMES[self.tree.kinds[n]]} expression")
+        super().generic_visit(n)
+
+
+def translate(tree):
+    """Python source of a parsed program (its SyntaxTree)"""
+    return Translator(tree).visit()
+
+
+class PyProgram:
+    """A translated program, compiled to a CPython code object"""
+
+    def __init__(self, source):
+        self.source = source
+        self.code = compile(source, "<atomc>", "exec")
+
+    def run(self, console=None):
+        """Execute the program in a fresh module namespace"""
+        console = console if console is not None else Console()
+        namespace = runtime(console)
+        try:
+            exec(self.code, namespace)
+            run_deep(namespace["_run"])
+        except Halt:
+            pass
+        except ZeroDivisionError:
+            raise VMError("division by zero") from None
+        except RecursionError:
+            raise VMError("stack overflow") from None
+        except (IndexError, ValueError):
+            raise VMError("invalid memory access") from None
+        finally:
+            console.flush()
+
+
+def run_deep(fn):
+    """Call fn in a thread with a THREAD_STACK stack, the recursion limit
+    raised to RECURSION_LIMIT, and return or raise its outcome"""
+    outcome = []
+
+    def target():
+        try:
+            outcome.append((True, fn()))
+        except BaseException as e:
+            outcome.append((False, e))
+
+    if sys.getrecursionlimit() < RECURSION_LIMIT:
+        sys.setrecursionlimit(RECURSION_LIMIT)
+    size = threading.stack_size(THREAD_STACK)
+    try:
+        thread = threading.Thread(target=target, name="atomc")
+        thread.start()
+    finally:
+        threading.stack_size(size)
+    thread.join()
+    ok, value = outcome[0]
+    if not ok:
+        raise value
+    return value
+
+
+_backend_stamp = None
+_programs = OrderedDict()  # Key -> (CachedResult, PyProgram or None), most recently used last
+
+
+def backend_key(text):
+    """Hash of a source text, the compiler and this backend"""
+    global _backend_stamp
+    from compile_cache import version_stamp
+    if _backend_stamp is None:
+        h = hashlib.sha256(version_stamp().encode())
+        root = os.path.dirname(os.path.abspath(__file__))
+        for name in ("pybackend.py", "codegen.py", "vm.py"):
+            with open(os.path.join(root, name), "rb") as f:
+                h.update(name.encode() + b"\0" + f.read())
+        _backend_stamp = h.hexdigest()
+    h = hashlib.sha256(_backend_stamp.encode())
+    h.update(text.encode("utf-8", "surrogatepass"))
+    return h.hexdigest()
+
+
+def compile_python(text, lexer_backend="ply", cache=None):
+    """Compile AtomC source text to a PyProgram. Returns (result, program),
+    the program being None if the compilation failed. Programs are kept in
+    memory, and in cache (a CompileCache) if given; the result is then a
+    CachedResult."""
+    from compile_cache import CachedResult
+    key = backend_key(text)
+    entry = _programs.get(key)
+    if entry is not None:
+        _programs.move_to_end(key)
+        return entry
+    cached = cache.get(key) if cache is not None else None
+    if cached is not None and "python" in cached.data:
+        source = cached.data["python"]
+        entry = cached, PyProgram(source) if source is not None else None
+    else:
+        from compiler import compile_source
+        result = compile_source(text, lexer_backend=lexer_backend, build_ast=True)
+        source = translate(result.ast) if result.success else None
+        summary = dict(result.summary(), python=source)
+        if cache is not None:
+            cache.put(key, summary)
+        program = PyProgram(source) if source is not None else None
+        _programs[key] = CachedResult(summary), program
+        if len(_programs) > MEMORY_CACHE_SIZE:
+            _programs.popitem(last=False)
+        return result, program
+    _programs[key] = entry
+    if len(_programs) > MEMORY_CACHE_SIZE:
+        _programs.popitem(last=False)
+    return entry
+
+
+def main(argv=None):
+    import argparse
+    from compile_cache import CompileCache
+    from lexical_analyzer import LEXER_BACKENDS
+    ap = argparse.ArgumentParser(description="Translate an AtomC program to Python and run it")
+    ap.add_argument("path", help="AtomC source file")
+    ap.add_argument("--source", action="store_true", help="print the Python source instead of running it")
+    ap.add_argument("--cache", default=None, metavar="DIR", help="compile cache directory")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    args = ap.parse_args(argv)
+
+    with open(args.path, 'r') as f:
+        text = f.read()
+    try:
+        result, program = compile_python(text, args.lexer, CompileCache(args.cache) if args.cache else None)
+    except CodegenError as e:
+        print(f"{args.path}: {e}", file=sys.stderr)
+        return 1
+    if program is None:
+        print(f"{args.path}: {result.error_kind} error: {result.error}", file=sys.stderr)
+        return 1
+    if args.source:
+        print(program.source, end="")
+        return 0
+    try:
+        program.run()
+    except VMError as e:
+        print(f"{args.path}: runtime error: {e}", file=sys.stderr)
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
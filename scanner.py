@@ -0,0 +1,222 @@
+"""Master-regex scanner: an alternative to the PLY lexer.
+
+The rules of lexical_analyzer are joined into one compiled pattern. Rules
+that can match at the same character keep the order PLY tries them in
+(function rules as defined, then string rules by decreasing regex length),
+so every match is the one PLY would make. The whole input is walked with finditer(): the kind of a match is read from the
+index of its group, keywords and operators are found with a dict lookup, and
+no rule function is called.
+
+Scanner has the part of the PLY lexer interface the compiler uses (input,
+token, clone, skip, lexpos, lineno, lexerrorf), so it can replace it
+anywhere. tokenize() and lex_stream() use the faster scan() instead of
+token() when the lexer has one.
+"""
+import re
+
+import lexical_analyzer as rules
+from token_stream import CT_CHAR, CT_INT, CT_REAL, CT_STRING, END, ID, TOKEN_CODES, TOKEN_NAMES
+
+# Function rules, in PLY order, and what a match of each produces (blanks
+# and newlines produce nothing)
+FUNCTION_RULES = (
+    ("t_ID", "name"),
+    ("t_CT_HEX", "hex"),
+    ("t_CT_OCTAL", "octal"),
+    ("t_CT_REAL", "real"),
+    ("t_CT_INT_DECIMAL", "decimal"),
+    ("t_CT_CHAR", "char"),
+    ("t_CT_STRING", "string"),
+    ("t_COMMENT", "comment"),
+    ("t_END", "end"),
+    ("t_newline", "newline"),
+)
+
+# Operator text -> kind, from the string rules (simple escaped literals)
+OPERATORS = {getattr(rules, "t_" + name).replace("\\", ""): TOKEN_CODES[name]
+             for name in TOKEN_NAMES if isinstance(getattr(rules, "t_" + name, None), str)}
+
+KEYWORDS = {text: TOKEN_CODES[name] for text, name in rules.keywords.items()}
+
+
+# Characters skipped between tokens: the ignored ones and newlines
+BLANKS = rules.t_ignore + "\n"
+
+
+def master_pattern():
+    """The rules as one alternation of named groups, after any blanks.
+
+    Only the relative order of rules that can match at the same character
+    matters, so the frequent ones come first: names and the operators that
+    start no other token. The comment and real-number rules stay ahead of
+    the / and . operators, as in PLY.
+    """
+    operators = sorted((getattr(rules, "t_" + TOKEN_NAMES[code]) for code in OPERATORS.values()),
+                       key=len, reverse=True)  # PLY order: decreasing regex length, then as defined
+    late = [op for op in operators if op.replace("\\", "") in ("/", ".")]
+    early = [op for op in operators if op not in late]
+    doc = {action: getattr(rules, rule).__doc__ for rule, action in FUNCTION_RULES}
+    parts = ["(?P<name>%s)" % doc["name"], "(?P<operator>%s)" % "|".join(early)]
+    for rule, action in FUNCTION_RULES:
+        if action not in ("name", "newline"):
+            parts.append(f"(?P<{action}>{doc[action]})")
+    parts.append("(?P<late_operator>%s)" % "|".join(late))
+    return "[%s]*(?:%s)" % (re.escape(BLANKS), "|".join(parts))
+
+
+MASTER = re.compile(master_pattern(), re.VERBOSE)  # PLY compiles its rules with re.VERBOSE
+SKIP_BLANKS = re.compile("[%s]*" % re.escape(BLANKS))
+
+_groups = MASTER.groupindex
+NAME, OPERATOR, HEX, OCTAL, REAL, DECIMAL, CHAR_, STRING, COMMENT, END_, LATE_OPERATOR = (
+    _groups[g] for g in ("name", "operator", "hex", "octal", "real", "decimal", "char", "string",
+                         "comment", "end", "late_operator"))
+
+
+class LexError(Exception):
+    """The error handler did not skip the illegal input"""
+
+
+class ScanToken:
+    """Token with the fields of a PLY LexToken"""
+
+    def __init__(self, type, value, lineno, lexpos, lexer):
+        self.type = type
+        self.value = value
+        self.lineno = lineno
+        self.lexpos = lexpos
+        self.lexer = lexer
+
+    def __repr__(self):
+        return f"LexToken({self.type},{self.value!r},{self.lineno},{self.lexpos})"
+
+
+class Scanner:
+    """Lexer over one master regex, interchangeable with the PLY lexer"""
+
+    def __init__(self):
+        self.lexdata = ""
+        self.lexpos = 0
+        self.lexlen = 0
+        self.lineno = 1
+        self.lexerrorf = rules.t_error  # Called with an "error" token at illegal input
+
+    def clone(self):
+        copy = Scanner.__new__(Scanner)
+        copy.__dict__.update(self.__dict__)
+        return copy
+
+    def input(self, data):
+        self.lexdata = data
+        self.lexpos = 0
+        self.lexlen = len(data)
+
+    def skip(self, n):
+        self.lexpos += n
+
+    def illegal(self, pos):
+        """Hand the illegal input at pos to the error handler. Returns the
+        handler's token, if any; self.lexpos is where to go on."""
+        if self.lexerrorf is None:
+            raise LexError(f"Illegal character {self.lexdata[pos]!r} at index {pos}")
+        self.lexpos = pos
+        tok = self.lexerrorf(ScanToken("error", self.lexdata[pos:], self.lineno, pos, self))
+        if self.lexpos == pos:
+            raise LexError(f"Scanning error. Illegal character {self.lexdata[pos]!r}")
+        return tok
+
+    def token(self):
+        """Next token as a ScanToken, or None at the end of the input"""
+        data = self.lexdata
+        pos = self.lexpos
+        while True:
+            blanks = SKIP_BLANKS.match(data, pos)
+            self.lineno += data.count("\n", pos, blanks.end())
+            pos = blanks.end()
+            if pos >= self.lexlen:
+                self.lexpos = pos
+                return None
+            m = MASTER.match(data, pos)
+            if m is None:
+                tok = self.illegal(pos)
+                pos = self.lexpos
+                if tok:
+                    return tok
+                continue
+            g = m.lastindex
+            text = m.group(g)
+            pos = m.end()
+            if g == COMMENT:
+                self.lineno += text.count("\n")
+                continue
+            self.lexpos = pos
+            kind, value = convert(g, text)
+            return ScanToken(TOKEN_NAMES[kind], value, self.lineno, m.start(g), self)
+
+    def scan(self, data):
+        """Lex data (without the token() overhead) and yield
+        (kind, value, start) for each token. Illegal input goes to the
+        error handler, as with token(). Line numbers are not counted."""
+        self.input(data)
+        keywords = KEYWORDS.get
+        operators = OPERATORS
+        pos = 0
+        while True:
+            for m in MASTER.finditer(data, pos):
+                if m.start() != pos:
+                    # No rule matches after the blanks of data[pos:m.start()]
+                    stop = m.start()
+                    while pos < stop:
+                        if data[pos] in BLANKS:
+                            pos += 1
+                            continue
+                        tok = self.illegal(pos)
+                        if tok:
+                            yield TOKEN_CODES[tok.type], tok.value, tok.lexpos
+                        pos = self.lexpos
+                    if pos != stop:
+                        break  # The handler skipped into the match: search again from pos
+                g = m.lastindex
+                pos = m.end()
+                if g == NAME:
+                    text = m.group(g)
+                    yield keywords(text, ID), text, m.start(g)
+                elif g == OPERATOR:
+                    text = m.group(g)
+                    yield operators[text], text, m.start(g)
+                elif g != COMMENT:
+                    kind, value = convert(g, m.group(g))
+                    yield kind, value, m.start(g)
+            else:
+                # Blanks and illegal input at the end
+                while pos < self.lexlen and data[pos] in BLANKS:
+                    pos += 1
+                if pos < self.lexlen:
+                    tok = self.illegal(pos)
+                    if tok:
+                        yield TOKEN_CODES[tok.type], tok.value, tok.lexpos
+                    pos = self.lexpos
+                    continue
+                self.lexpos = pos
+                return
+
+
+def convert(g, text):
+    """(kind, value) of a token matched by group g"""
+    if g == NAME:
+        return KEYWORDS.get(text, ID), text
+    if g == OPERATOR or g == LATE_OPERATOR:
+        return OPERATORS[text], text
+    if g == DECIMAL:
+        return CT_INT, int(text)
+    if g == REAL:
+        return CT_REAL, float(text)
+    if g == HEX:
+        return CT_INT, int(text, 16)
+    if g == OCTAL:
+        return CT_INT, int(text, 8)
+    if g == CHAR_:
+        return CT_CHAR, text
+    if g == STRING:
+        return CT_STRING, text
+    return END, None
@@ -0,0 +1,124 @@
+"""Differential check of the streaming lexer.
+
+Lexes AtomC sources whole with tokenize() and chunk by chunk with
+lex_stream() at small chunk sizes, which put a chunk boundary next to
+almost every character, and checks that both give the same tokens (kind,
+value and start offset) and lex errors, with each lexer backend.
+open_stream() is checked the same way, by compiling its TokenStream and
+comparing the outcome with compile_source()'s (snippets aside: a stream
+keeps no source text). The sources are the files given, programs from
+program_generator.py and the cases of EDGE_CASES.
+
+Usage: python streamcheck.py [--chunks 1,2,7,64] [--lexers ply,scanner] [--generated N] [paths...]
+"""
+import io
+import sys
+
+from batch import collect_files
+from compiler import compile_source, compile_tokens
+from lexical_analyzer import LEXER_BACKENDS
+from program_generator import generate_program
+from syntax_analyzer import CompilationContext
+from token_stream import lex_stream, open_stream, tokenize
+
+DEFAULT_CHUNKS = (1, 2, 7, 64)
+
+# Sources where a cut at the wrong newline changes the tokens
+EDGE_CASES = {
+    "char-quote": "char q; q = '\"'; /* \" a\nb c d */\nint x;\n",
+    "escaped-quote": "char q; q = '\\''; /* ' \" */\nq = '\\\\';\n\"a\\\"b\n\";\n",
+    "comment-quotes": "/* \"\n' */ int a; // \" '\nint b;\n/* '\"' \n */\n",
+    "string-comment": "void f(){ put_s(\"/* not\n a comment\"); }\nint c;\n",
+    "lone-quote": "int a; a = 'x\n; int b;\n",
+    "illegal": "int a; @\n# a = 1;\n$\n",
+    "non-ascii": "/* étape\n« » */ char c; c = 'é';\nint n°;\n",
+    "unterminated": "int a;\n/* never\nclosed\n",
+}
+
+
+def lexed(backend, text, chunk_size=None):
+    """(tokens, lex errors) of text, lexed whole or chunk by chunk"""
+    ctx = CompilationContext(lexer_backend=backend)
+    if chunk_size is None:
+        buf = tokenize(ctx.lexer, text)
+        tokens = [(buf.kinds[i], buf.value(i), buf.starts[i]) for i in range(len(buf))]
+    else:
+        tokens = list(lex_stream(ctx.lexer, io.StringIO(text), chunk_size, errors=ctx.lex_errors))
+    return tokens, ctx.lex_errors
+
+
+def outcome(result):
+    summary = result.summary()
+    del summary["snippet"]
+    return summary
+
+
+def compiled(backend, text, chunk_size=None):
+    """Outcome of the compilation of text, whole or through open_stream()"""
+    if chunk_size is None:
+        return outcome(compile_source(text, lexer_backend=backend))
+    ctx = CompilationContext(lexer_backend=backend)
+    tokens = open_stream(ctx.lexer, io.StringIO(text), chunk_size, errors=ctx.lex_errors)
+    return outcome(compile_tokens(tokens, ctx))
+
+
+def check(text, backends, chunks):
+    """Descriptions of the differences between the whole and streamed runs"""
+    differences = []
+    for backend in backends:
+        whole, result = lexed(backend, text), compiled(backend, text)
+        for chunk_size in chunks:
+            streamed = lexed(backend, text, chunk_size)
+            if streamed != whole:
+                differences.append(f"{backend}, lex_stream chunk {chunk_size}: {first_difference(whole, streamed)}")
+            if compiled(backend, text, chunk_size) != result:
+                differences.append(f"{backend}, open_stream chunk {chunk_size}: different compilation outcome")
+    return differences
+
+
+def first_difference(whole, streamed):
+    for label, a, b in (("token", whole[0], streamed[0]), ("lex error", whole[1], streamed[1])):
+        for k, (x, y) in enumerate(zip(a, b)):
+            if x != y:
+                return f"{label} {k}: {x} whole, {y} streamed"
+        if len(a) != len(b):
+            return f"{len(a)} {label}s whole, {len(b)} streamed"
+    return "no difference"
+
+
+def main(argv=None):
+    import argparse
+    ap = argparse.ArgumentParser(description="Check that streamed lexing matches whole-buffer lexing")
+    ap.add_argument("paths", nargs="*", default=["tests"], help="files or directories (default: tests)")
+    ap.add_argument("--chunks", default=",".join(map(str, DEFAULT_CHUNKS)), help="comma separated chunk sizes")
+    ap.add_argument("--lexers", default=",".join(LEXER_BACKENDS), help="comma separated lexer backends")
+    ap.add_argument("--generated", type=int, default=5, help="generated programs to check")
+    args = ap.parse_args(argv)
+
+    chunks = [int(c) for c in args.chunks.split(",") if c.strip()]
+    backends = [b.strip() for b in args.lexers.split(",") if b.strip()]
+    sources = []
+    for name, path in collect_files(args.paths):
+        if name.endswith(".c"):
+            with open(path, "r") as f:
+                sources.append((name, f.read()))
+    sources += [(f"generated-{seed}", generate_program(functions=3, depth=2, seed=seed))
+                for seed in range(args.generated)]
+    sources += EDGE_CASES.items()
+
+    mismatches = 0
+    for name, text in sources:
+        differences = check(text, backends, chunks)
+        if not differences:
+            print(f"ok        {name}")
+            continue
+        mismatches += 1
+        print(f"MISMATCH  {name}")
+        for difference in differences:
+            print(f"    {difference}")
+    print(f"{mismatches} mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,58 +1,145 @@
+from parser_trace import TRACE_OFF, TRACE_RULES, TRACE_SEMANTIC, TRACE_TOKENS, TRACED_RULES, trace_level
+from syntax_tree import (
+    BINARY_NODES, N_ASSIGN, N_BLOCK, N_BREAK, N_CALL, N_CAST, N_CT_CHAR, N_CT_INT, N_CT_REAL, N_CT_STRING,
+    N_EMPTY, N_EXPR, N_FOR, N_FUNC, N_ID, N_IF, N_INDEX, N_MEMBER, N_NEG, N_NOT, N_PARAM, N_RETURN,
+    N_STRUCT, N_VAR, N_WHILE, SyntaxTree,
+)
+from token_stream import (
+    ADD, AND, ASSIGN, BREAK, CHAR, COMMA, CT_CHAR, CT_INT, CT_REAL, CT_STRING, DIV, DOT, DOUBLE, ELSE, END,
+    EQUAL, FOR, GREATER, GREATEREQ, ID, IF, INT, LACC, LBRACKET, LESS, LESSEQ, LPAR, MUL, NOT, NOTEQ, OR,
+    RACC, RBRACKET, RETURN, RPAR, SEMICOLON, STRUCT, SUB, TOKEN_NAMES, VOID, WHILE,
+)
+
+
 class Token:
-    def __init__(self, code, value=None, next_token=None, text=None, line=None):
+    __slots__ = ("code", "value", "next", "line", "column")
+
+    def __init__(self, code, value=None, next_token=None, line=None, column=None):
         self.code = code  # Token type (e.g., 'ID', 'CT_INT', etc.)
-        self.type = code  # Add this line to make it compatible with PLY
-        self.value = value
-        self.text = text if text is not None else value  # Store the token text
+        self.value = value  # Token text, or the value of a constant
         self.next = next_token
         self.line = line  # Line number for error reporting
-        # For specific token types
-        self.i = None  # For integer and char constants
-        self.r = None  # For real constants
+        self.column = column  # Column number for error reporting
+
+    @property
+    def type(self):
+        """The code, under the name PLY tokens use"""
+        return self.code
+
+    @property
+    def text(self):
+        return self.value
+
+
+# Type bases: small integers, named by TYPE_BASE_NAMES
+TYPE_BASE_NAMES = ('TB_INT', 'TB_DOUBLE', 'TB_CHAR', 'TB_VOID', 'TB_STRUCT')
+TB_INT, TB_DOUBLE, TB_CHAR, TB_VOID, TB_STRUCT = range(len(TYPE_BASE_NAMES))
 
 
 class Type:
-    def __init__(self):
-        self.typeBase = None  # TB_INT, TB_DOUBLE, TB_CHAR, TB_VOID, TB_STRUCT
-        self.nElements = -1  # -1 for non-array, 0 for arrays with unknown size, >0 for arrays with known size
-        self.s = None  # Symbol reference for struct types
+    """Immutable type. Types are hash-consed: within a parse there is a
+    single instance for each (typeBase, nElements, s), obtained with
+    create_type(), so types can be shared freely and compared with `is`."""
+
+    __slots__ = ("typeBase", "nElements", "s")
 
-    def copy(self):
-        """Create a deep copy of this Type object"""
-        t = Type()
-        t.typeBase = self.typeBase
-        t.nElements = self.nElements
-        t.s = self.s  # Reference to the same symbol
-        return t
+    def __init__(self, type_base=None, n_elements=-1, s=None):
+        set_field = object.__setattr__
+        set_field(self, "typeBase", type_base)  # TB_INT, TB_DOUBLE, TB_CHAR, TB_VOID, TB_STRUCT or None
+        set_field(self, "nElements", n_elements)  # -1 for non-array, 0 for arrays with unknown size, >0 for arrays with known size
+        set_field(self, "s", s)  # Symbol reference for struct types
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Type objects are immutable")
+
+    def __repr__(self):
+        base = TYPE_BASE_NAMES[self.typeBase] if self.typeBase is not None else None
+        return f"Type({base}, {self.nElements}{', ' + self.s.name if self.s else ''})"
+
+    def with_elements(self, n_elements, arrays=None):
+        """The same base type with n_elements (-1: not an array); arrays as
+        for create_type()"""
+        if n_elements == self.nElements:
+            return self
+        return create_type(self.typeBase, n_elements, self.s, arrays)
+
+
+def type_base_name(type_base):
+    """TB_INT... for a type base, None if unset"""
+    return TYPE_BASE_NAMES[type_base] if type_base is not None else None
 
 
 class Symbol:
+    __slots__ = ("name", "cls", "depth", "mem", "type", "args", "members", "types")
+
     def __init__(self, name, cls):
         self.name = name  # Symbol name
         self.cls = cls  # CLS_VAR, CLS_FUNC, CLS_STRUCT, CLS_EXTFUNC
         self.depth = 0  # Symbol scope depth
         self.mem = None  # MEM_GLOBAL, MEM_LOCAL, MEM_ARG
-        self.type = Type()  # Symbol type
+        self.type = NO_TYPE  # Symbol type
         self.args = None  # For functions: list of argument symbols
         self.members = None  # For structs: list of member symbols
+        self.types = None  # For structs: nElements -> Type of this struct
 
 
 class RetVal:
+    __slots__ = ("type", "isLVal", "isCtVal", "ctVal", "symbol")
+
     def __init__(self):
-        self.type = Type()  # Type of the result
+        self.type = NO_TYPE  # Type of the result
         self.isLVal = False  # If it is a LVal
         self.isCtVal = False  # If it is a constant value
         self.ctVal = None  # The constant value (can be int, double, char, or str)
+        self.symbol = None  # Symbol of an ID operand, checked by function calls
 
 
 class SymbolTable:
+    """Scoped symbol table.
+
+    ``begin`` keeps the symbols in declaration order and doubles as the undo
+    log used when a scope is left: the symbols of the innermost scope are
+    always at its tail. ``index`` maps each name to the stack of symbols that
+    currently shadow each other, innermost last, so lookups do not scan.
+    """
+
     def __init__(self):
-        self.begin = []  # List of symbols
+        self.begin = []  # List of symbols (declaration order / undo log)
         self.end = []  # End marker for each depth level
+        self.index = {}  # name -> stack of visible symbols, innermost last
 
     def init_symbols(self):
         self.begin = []
         self.end = [None]  # Initial end marker
+        self.index = {}
+
+    def add(self, s):
+        """Append a symbol, shadowing any visible symbol with the same name"""
+        self.begin.append(s)
+        stack = self.index.get(s.name)
+        if stack is None:
+            self.index[s.name] = [s]
+        else:
+            stack.append(s)
+
+    def find(self, name):
+        """Return the innermost visible symbol called name, or None"""
+        stack = self.index.get(name)
+        return stack[-1] if stack else None
+
+    def contains(self, s):
+        """Check whether this exact symbol is still in the table"""
+        stack = self.index.get(s.name)
+        return stack is not None and s in stack
+
+    def pop(self):
+        """Remove the most recently added symbol and return it"""
+        s = self.begin.pop()
+        stack = self.index[s.name]
+        stack.pop()
+        if not stack:
+            del self.index[s.name]
+        return s
 
 
 class SemanticError(Exception):
@@ -60,95 +147,167 @@ class SemanticError(Exception):
     pass
 
 
+class TooManyErrors(Exception):
+    """Stops a parse with error recovery once max_errors errors are recorded"""
+    pass
+
+
+DEFAULT_MAX_ERRORS = 100  # Errors a parse with error recovery records at most
+
+
+class Diagnostic:
+    """An error recorded by a parse with error recovery"""
+
+    __slots__ = ("kind", "message", "line", "column", "snippet")
+
+    def __init__(self, kind, message, line=None, column=None, snippet=None):
+        self.kind = kind  # "syntax" or "semantic"
+        self.message = message
+        self.line = line  # 1-based position of the error
+        self.column = column
+        self.snippet = snippet  # Source line of the error with a caret
+
+    def __repr__(self):
+        return f"Diagnostic({self.kind} error: {self.message}, line {self.line}, column {self.column})"
+
+
 def find_symbol(symtab, name):
     """Find a symbol in the symbol table by name"""
-    for s in reversed(symtab.begin):
-        if s.name == name:
-            return s
-    return None
+    return symtab.find(name)
 
 
-def add_symbol(symtab, name, cls):
-    """Add a symbol to the symbol table"""
+def add_symbol(symtab, name, cls, depth=0):
+    """Add a symbol declared at the given scope depth to the symbol table"""
     s = Symbol(name, cls)
-    s.depth = crtDepth
-    symtab.begin.append(s)
+    s.depth = depth
+    symtab.add(s)
     return s
 
 
-def delete_symbols_after(symtab, start):
+def delete_symbols_after(symtab, start, depth=0):
     """Delete all symbols after the given symbol"""
     if start is None:
         # Delete all symbols from the current depth
-        symtab.begin = [s for s in symtab.begin if s.depth < crtDepth]
-    else:
-        # Find the index of the start symbol
-        try:
-            idx = symtab.begin.index(start)
-            # Keep symbols up to and including start
-            symtab.begin = symtab.begin[:idx + 1]
-        except ValueError:
-            # Symbol not found, don't delete anything
-            pass
+        keep = [s for s in symtab.begin if s.depth < depth]
+        while symtab.begin:
+            symtab.pop()
+        for s in keep:
+            symtab.add(s)
+    elif symtab.contains(start):
+        # Keep symbols up to and including start; only the scope's own
+        # symbols are visited
+        while symtab.begin[-1] is not start:
+            symtab.pop()
+    # Otherwise the symbol is not in the table, don't delete anything
+
+
+_types = {}  # (typeBase, nElements) -> Type, for the scalars and the arrays of unknown size
+
+
+def type_table(n_elements, s=None, arrays=None):
+    """The table create_type() interns a type in, keyed by nElements for
+    struct types and by (typeBase, nElements) for the others, or None"""
+    if s is not None:
+        if s.types is None:
+            s.types = {}
+        return s.types
+    return arrays if n_elements > 0 else _types
+
+
+def create_type(type_base, n_elements, s=None, arrays=None):
+    """The type with the specified base, number of elements and struct symbol.
+    Only the scalars and the arrays of unknown size, a few per type base,
+    are shared by every parse. Struct types are kept by their symbol, so
+    they go away with it; sized arrays of the other bases are kept in
+    arrays, the table of a parse (CompilationContext.array_types), and
+    without one every call makes a new Type."""
+    table = type_table(n_elements, s, arrays)
+    key = n_elements if s is not None else (type_base, n_elements)
+    t = table.get(key) if table is not None else None
+    if t is None:
+        # setdefault: a parse in another thread may intern the same type
+        t = Type(type_base, n_elements, s)
+        if table is not None:
+            t = table.setdefault(key, t)
+    return t
 
 
-def create_type(type_base, n_elements):
-    """Create a new type with specified base type and number of elements"""
-    t = Type()
-    t.typeBase = type_base
-    t.nElements = n_elements
-    return t
+NO_TYPE = create_type(None, -1)  # Not typed yet
+INT_TYPE = create_type(TB_INT, -1)
+DOUBLE_TYPE = create_type(TB_DOUBLE, -1)
+CHAR_TYPE = create_type(TB_CHAR, -1)
+STRING_TYPE = create_type(TB_CHAR, 0)
+
+# Conversions between type bases (CAST_RULE[src][dst]), arrays aside
+CAST_OK, CAST_SAME_STRUCT, CAST_INCOMPATIBLE = range(3)
+ARITH_BASES = frozenset((TB_CHAR, TB_INT, TB_DOUBLE))
+CAST_RULE = {src: {dst: CAST_OK if src in ARITH_BASES and dst in ARITH_BASES
+                   else CAST_SAME_STRUCT if src == dst == TB_STRUCT
+                   else CAST_INCOMPATIBLE
+                   for dst in (*range(len(TYPE_BASE_NAMES)), None)}
+             for src in (*range(len(TYPE_BASE_NAMES)), None)}
+
+# Result type of arithmetic on two type bases (ARITH_TYPE[b1][b2]), None if
+# an operand is not arithmetic: the wider one, double > int > char
+_RANK = {TB_CHAR: (0, CHAR_TYPE), TB_INT: (1, INT_TYPE), TB_DOUBLE: (2, DOUBLE_TYPE)}
+ARITH_TYPE = {b1: {b2: max(_RANK[b1], _RANK[b2])[1] if b1 in _RANK and b2 in _RANK else None
+                   for b2 in (*range(len(TYPE_BASE_NAMES)), None)}
+              for b1 in (*range(len(TYPE_BASE_NAMES)), None)}
 
 
 def tkerr(tk, msg, *args):
     """Report a semantic error"""
     formatted_msg = msg % args if args else msg
-    line_info = f" at line {tk.line}" if hasattr(tk, 'line') else ""
+    if tk is None or tk.line is None:
+        line_info = ""
+    elif tk.column is None:
+        line_info = f" at line {tk.line}"
+    else:
+        line_info = f" at line {tk.line}, column {tk.column}"
     raise SemanticError(f"{formatted_msg}{line_info}")
 
 
-def cast(dst, src):
-    """Try to convert src type to dst type according to AtomC rules"""
+def error_token(parser):
+    """Current token of parser to report an error at, or None. Only built
+    when an error is raised: it needs the token's line and column."""
+    return parser.crtTk if parser else None
+
+
+def cast(dst, src, parser=None):
+    """Try to convert src type to dst type according to AtomC rules.
+    Errors are reported at the current token of parser."""
     # Check array conversions
     if src.nElements > -1:  # src is an array
         if dst.nElements > -1:  # dst is also an array
             if src.typeBase != dst.typeBase:
-                tkerr(crtTk, "an array cannot be converted to an array of another type")
+                tkerr(error_token(parser), "an array cannot be converted to an array of another type")
         else:  # dst is not an array
-            tkerr(crtTk, "an array cannot be converted to a non-array")
+            tkerr(error_token(parser), "an array cannot be converted to a non-array")
     else:  # src is not an array
         if dst.nElements > -1:  # dst is an array
-            tkerr(crtTk, "a non-array cannot be converted to an array")
-
-    # Check type conversions
-    if src.typeBase in ["TB_CHAR", "TB_INT", "TB_DOUBLE"]:
-        if dst.typeBase in ["TB_CHAR", "TB_INT", "TB_DOUBLE"]:
-            return  # Arithmetic types can be converted to any other arithmetic type
-
-    # Check struct conversions
-    if src.typeBase == "TB_STRUCT":
-        if dst.typeBase == "TB_STRUCT":
-            if src.s != dst.s:
-                tkerr(crtTk, "a structure cannot be converted to another one")
-            return
+            tkerr(error_token(parser), "a non-array cannot be converted to an array")
 
-    # If we get here, no conversion is possible
-    tkerr(crtTk, "incompatible types")
+    # Arithmetic types convert to one another, a struct only to itself
+    rule = CAST_RULE[src.typeBase][dst.typeBase]
+    if rule == CAST_OK:
+        return
+    if rule == CAST_SAME_STRUCT:
+        if src.s is not dst.s:
+            tkerr(error_token(parser), "a structure cannot be converted to another one")
+        return
 
+    # If we get here, no conversion is possible
+    tkerr(error_token(parser), "incompatible types")
 
-def get_arith_type(s1, s2):
-    """Get the result type from an arithmetic operation on two types"""
-    # Check if both operands are arithmetic types
-    if s1.typeBase not in ["TB_CHAR", "TB_INT", "TB_DOUBLE"] or \
-            s2.typeBase not in ["TB_CHAR", "TB_INT", "TB_DOUBLE"]:
-        tkerr(crtTk, "operands must be of arithmetic type")
 
-    # Return the "wider" type (double > int > char)
-    if s1.typeBase == "TB_DOUBLE" or s2.typeBase == "TB_DOUBLE":
-        return create_type("TB_DOUBLE", -1)
-    if s1.typeBase == "TB_INT" or s2.typeBase == "TB_INT":
-        return create_type("TB_INT", -1)
-    return create_type("TB_CHAR", -1)
+def get_arith_type(s1, s2, parser=None):
+    """Get the result type from an arithmetic operation on two types.
+    Errors are reported at the current token of parser."""
+    # The "wider" type (double > int > char), None unless both are arithmetic
+    t = ARITH_TYPE[s1.typeBase][s2.typeBase]
+    if t is None:
+        tkerr(error_token(parser), "operands must be of arithmetic type")
+    return t
 
 
 def add_ext_func(symbols, name, type_base, n_elements=-1):
@@ -171,369 +330,863 @@ def add_func_arg(func, name, type_base, n_elements=-1):
 def add_ext_funcs(symbols):
     """Add predefined functions to symbol table"""
     # void put_s(char s[])
-    s = add_ext_func(symbols, "put_s", "TB_VOID")
-    add_func_arg(s, "s", "TB_CHAR", 0)
+    s = add_ext_func(symbols, "put_s", TB_VOID)
+    add_func_arg(s, "s", TB_CHAR, 0)
 
     # void get_s(char s[])
-    s = add_ext_func(symbols, "get_s", "TB_VOID")
-    add_func_arg(s, "s", "TB_CHAR", 0)
+    s = add_ext_func(symbols, "get_s", TB_VOID)
+    add_func_arg(s, "s", TB_CHAR, 0)
 
     # void put_i(int i)
-    s = add_ext_func(symbols, "put_i", "TB_VOID")
-    add_func_arg(s, "i", "TB_INT", -1)
+    s = add_ext_func(symbols, "put_i", TB_VOID)
+    add_func_arg(s, "i", TB_INT, -1)
 
     # int get_i()
-    s = add_ext_func(symbols, "get_i", "TB_INT")
+    s = add_ext_func(symbols, "get_i", TB_INT)
 
     # void put_d(double d)
-    s = add_ext_func(symbols, "put_d", "TB_VOID")
-    add_func_arg(s, "d", "TB_DOUBLE", -1)
+    s = add_ext_func(symbols, "put_d", TB_VOID)
+    add_func_arg(s, "d", TB_DOUBLE, -1)
 
     # double get_d()
-    s = add_ext_func(symbols, "get_d", "TB_DOUBLE")
+    s = add_ext_func(symbols, "get_d", TB_DOUBLE)
 
     # void put_c(char c)
-    s = add_ext_func(symbols, "put_c", "TB_VOID")
-    add_func_arg(s, "c", "TB_CHAR", -1)
+    s = add_ext_func(symbols, "put_c", TB_VOID)
+    add_func_arg(s, "c", TB_CHAR, -1)
 
     # char get_c()
-    s = add_ext_func(symbols, "get_c", "TB_CHAR")
+    s = add_ext_func(symbols, "get_c", TB_CHAR)
 
     # double seconds()
-    s = add_ext_func(symbols, "seconds", "TB_DOUBLE")
+    s = add_ext_func(symbols, "seconds", TB_DOUBLE)
+
+
+class CompilationContext:
+    """State of one compilation: its lexer and the semantic analysis state.
+
+    Each context is independent, so several compilations can run at the same
+    time (e.g. in threads) or be kept alive side by side.
+    """
+
+    def __init__(self, lexer=None, lexer_backend="ply"):
+        self._lexer = lexer  # PLY lexer or Scanner, a clone of the shared one by default
+        self.lexer_backend = lexer_backend  # See lexical_analyzer.LEXER_BACKENDS
+        self.lex_errors = []  # (offset, character) of characters the lexer skipped
+        self.symbols = SymbolTable()
+        self.symbols.init_symbols()
+        self.crtDepth = 0
+        self.crtFunc = None
+        self.crtStruct = None
+        self.references = None  # List to collect (token index, symbol, is definition) in, e.g. for an editor
+        self.array_types = {}  # (typeBase, nElements) -> Type of the sized arrays, see create_type()
+        # Initialize predefined functions
+        add_ext_funcs(self.symbols)
+
+    @property
+    def lexer(self):
+        """This context's lexer, cloned on first use"""
+        if self._lexer is None:
+            from lexical_analyzer import get_lexer
+            self._lexer = get_lexer(self.lexer_backend).clone()
+            self._lexer.lexerrorf = self.lex_error
+        return self._lexer
+
+    def create_type(self, type_base, n_elements, s=None):
+        """create_type() interning sized arrays in this context"""
+        return create_type(type_base, n_elements, s, self.array_types)
+
+    def lex_error(self, t):
+        """Lexer error handler: record the illegal character and skip it"""
+        self.lex_errors.append((t.lexpos, t.value[0]))
+        t.lexer.skip(1)
+
+
+# Rules that can be memoized in packrat mode: they only read the symbol
+# table (exprPrimary may auto-declare a variable, which a replay must not
+# repeat), so their outcome at a given token is always the same.
+PACKRAT_RULES = (
+    "typeBase", "exprAssign", "exprOr", "exprAnd", "exprEq", "exprRel",
+    "exprAdd", "exprMul", "exprCast", "exprUnary", "exprPostfix", "exprPrimary",
+)
+
+
+# FIRST sets: the tokens each declaration/statement rule can start with
+TYPE_FIRST = frozenset((INT, DOUBLE, CHAR, VOID, STRUCT))
+FIRST = {
+    "declStruct": frozenset((STRUCT,)),
+    "declFunc": TYPE_FIRST,
+    "declVar": TYPE_FIRST,
+    "stmCompound": frozenset((LACC,)),
+    "stmIf": frozenset((IF,)),
+    "stmWhile": frozenset((WHILE,)),
+    "stmFor": frozenset((FOR,)),
+    "stmBreak": frozenset((BREAK,)),
+    "stmReturn": frozenset((RETURN,)),
+}
+
+# Statement rule selected by the first token; anything else is stmExpr
+STM_DISPATCH = {code: rule
+                for rule in ("stmCompound", "stmIf", "stmWhile", "stmFor", "stmBreak", "stmReturn")
+                for code in FIRST[rule]}
+
+
+ARITH_OPS = frozenset((ADD, SUB, MUL, DIV))
+
+# Error raised when the operand of an operator is missing
+OPERAND_EXPECTED = {
+    ASSIGN: "Expected expression after =",
+    OR: "Expected expression after OR",
+    AND: "Expected expression after AND",
+    EQUAL: "Expected expression after equality operator",
+    NOTEQ: "Expected expression after equality operator",
+    LESS: "Expected expression after relational operator",
+    LESSEQ: "Expected expression after relational operator",
+    GREATER: "Expected expression after relational operator",
+    GREATEREQ: "Expected expression after relational operator",
+    ADD: "Expected expression after additive operator",
+    SUB: "Expected expression after additive operator",
+    MUL: "Expected expression after multiplicative operator",
+    DIV: "Expected expression after multiplicative operator",
+}
+UNARY_OPERAND_EXPECTED = {SUB: "Expected expression after unary -", NOT: "Expected expression after unary !"}
+
+# Error raised when the statement of an if, else, while or for is missing
+BODY_EXPECTED = {
+    IF: "Expected statement for if block",
+    ELSE: "Expected statement for else block",
+    WHILE: "Expected statement for while block",
+    FOR: "Expected statement for for block",
+}
+STATEMENT_NODES = {IF: N_IF, ELSE: N_IF, WHILE: N_WHILE, FOR: N_FOR}
+
+
+# Precedence engine (Parser(pratt=True)): binding power of the binary
+# operators, loosest first. = groups to the right, the others to the left.
+BINARY_POWER = {
+    ASSIGN: 1, OR: 2, AND: 3, EQUAL: 4, NOTEQ: 4, LESS: 5, LESSEQ: 5, GREATER: 5, GREATEREQ: 5,
+    ADD: 6, SUB: 6, MUL: 7, DIV: 7,
+}
+# Tokens an operand can start with: any other one ends an expression
+OPERAND_FIRST = frozenset((ID, CT_INT, CT_REAL, CT_CHAR, CT_STRING, LPAR, SUB, NOT))
+# Power of the engine's frames that are not binary operators: prefix
+# operators (- ! and casts) and groups (parentheses, indexes and calls)
+PREFIX, GROUP = -1, 0
+# Token closing each group, and the error when it is missing
+GROUP_CLOSE = {
+    LPAR: (RPAR, "Expected )"),
+    LBRACKET: (RBRACKET, "Expected ] after array index"),
+    COMMA: (RPAR, "Expected ) in function call"),
+}
+
+
+RETVAL_FIELDS = RetVal.__slots__
+
+
+def copy_fields(out):
+    """Snapshot of the fields a rule wrote into its RetVal out-parameter.
+    Types are immutable, so stored and replayed results can share them."""
+    return tuple(getattr(out, name) for name in RETVAL_FIELDS)
+
+
+def restore_fields(out, state):
+    """Write a snapshot taken by copy_fields back into a RetVal"""
+    for name, value in zip(RETVAL_FIELDS, state):
+        setattr(out, name, value)
 
 
-# Global variables for semantic analysis
-symbols = SymbolTable()
-crtDepth = 0
-crtFunc = None
-crtStruct = None
-crtTk = None  # Current token for error reporting
-
+class Parser:
+    def __init__(self, tokens, ctx=None, packrat=False, backtrack=False, trace=TRACE_OFF, trace_sink=None,
+                 build_ast=False, recover=False, max_errors=DEFAULT_MAX_ERRORS, profile=None, pratt=False):
+        self.tokens = tokens  # TokenBuffer or TokenStream
+        self.kinds = tokens.kinds  # Token kind codes, indexed by position
+        self.pos = 0  # Index of the current token
+        self.backtrack = backtrack  # Try every alternative instead of FIRST-set dispatch
+        self.ctx = ctx if ctx is not None else CompilationContext()  # Semantic analysis state
+        self.references = self.ctx.references  # Symbol references to record, or None
+        # Symbol lookups and types of the semantic actions, per parser so
+        # that a ParserProfile can count this parse's calls alone
+        self.find_symbol = find_symbol
+        self.create_type = self.ctx.create_type
+
+        # Precedence engine: expressions by precedence climbing and nested
+        # statements over an explicit stack, instead of a Python call per
+        # grammar rule and nesting level (see exprPrecedence and statements),
+        # so that deep nesting cannot exhaust the Python stack
+        self.pratt = pratt
+        if pratt:
+            if backtrack:
+                raise ValueError("the precedence engine uses FIRST-set dispatch: it cannot backtrack")
+            self.expr = self.exprPrecedence
+            self.stm = self.stmIterative
+            self.stmCompound = self.stmCompoundIterative
+
+        # Packrat mode: (rule, position) -> (success, end position, out fields)
+        self.memo = None
+        self.memo_stats = None
+        if packrat:
+            self.memo = {}
+            self.memo_stats = {"calls": 0, "hits": 0, "tokens_saved": 0}
+            for name in PACKRAT_RULES:
+                setattr(self, name, self.memoized(name, getattr(self, name)))
+
+        # Syntax tree (see syntax_tree), built on request: save() and
+        # restore() then also drop the nodes of an abandoned alternative
+        self.ast = None
+        if build_ast:
+            if packrat:
+                raise ValueError("a syntax tree cannot be built in packrat mode")
+            self.ast = SyntaxTree(tokens)
+            self.save = self.ast_save
+            self.restore = self.ast_restore
+
+        # Tracing: rules are wrapped and consume rebound only when enabled,
+        # so a non-traced parse runs no tracing code at all
+        self.trace = trace_level(trace)
+        self.trace_sink = trace_sink if trace_sink is not None else print
+        if self.trace >= TRACE_RULES:
+            for name in TRACED_RULES:
+                setattr(self, name, self.traced(name, getattr(self, name)))
+        if self.trace >= TRACE_TOKENS:
+            self.consume = self.traced_consume
+        if self.trace >= TRACE_SEMANTIC:
+            self.add_var = self.traced_add_var(self.add_var)
+
+        # Error recovery (panic mode): statements, variable declarations and
+        # top-level items are wrapped to record their error and skip to the
+        # next ; or }, so one parse reports every error. Off by default, the
+        # first error is raised.
+        self.diagnostics = None  # Diagnostics, when recovering
+        self.max_errors = max_errors
+        if recover:
+            self.diagnostics = []
+            # With FIRST-set dispatch, a statement is expected wherever stm()
+            # is called and a declaration after a type keyword: failing is
+            # an error there. At the end of the input the caller reports
+            # what is missing. The statements of the precedence engine
+            # recover by themselves.
+            every = frozenset(range(len(TOKEN_NAMES))) - {END}
+            if not pratt:
+                self.stm = self.recovering(self.stm, N_EMPTY, every, "Unexpected token: %s")
+            self.declVar = self.recovering(self.declVar, None, TYPE_FIRST, "Invalid declaration starting with %s")
+            self.item = self.recovering_item(self.item)
+            self.itemBacktrack = self.recovering_item(self.itemBacktrack)
+
+        # Profiling (see parser_profile): the rules, restore() and unit()
+        # are wrapped only when a ParserProfile is given
+        self.profile = profile
+        if profile is not None:
+            profile.attach(self)
+
+    @property
+    def crtTk(self):
+        """Current token as a Token object, for diagnostics"""
+        return self.tokens.token(self.pos)
+
+    def position(self):
+        """(line, column) of the current token, for diagnostics"""
+        return self.tokens.position(self.pos)
+
+    def snippet(self):
+        """Source line of the current token with a caret under it, or None"""
+        return self.tokens.snippet(self.pos)
+
+    def memoized(self, name, rule):
+        """Wrap a rule so it runs at most once per token position"""
+        memo = self.memo
+        stats = self.memo_stats
+
+        def run(out):
+            stats["calls"] += 1
+            key = (name, self.pos)
+            entry = memo.get(key)
+            if entry is not None:
+                ok, end, state = entry
+                stats["hits"] += 1
+                stats["tokens_saved"] += end - self.pos
+                restore_fields(out, state)
+                self.pos = end
+                return ok
+            ok = rule(out)
+            memo[key] = (ok, self.pos, copy_fields(out))
+            return ok
+
+        return run
+
+    def traced(self, name, rule):
+        """Wrap a rule so its entry and failure are reported to the sink"""
+        emit = self.trace_sink
+        # Rules filling a type also report it at the semantic level
+        semantic = self.trace >= TRACE_SEMANTIC and name in ("typeBase", "typeName", "arrayDecl")
+
+        def run(*args):
+            emit(f"Checking {name}")
+            ok = rule(*args)
+            if not ok:
+                emit(f"{name} failed")
+            elif semantic:
+                t = args[0].type
+                emit(f"Found {name}: {type_base_name(t.typeBase)}, nElements: {t.nElements}")
+            return ok
+
+        return run
+
+    def traced_consume(self, code):
+        """consume() reporting every attempt to the sink"""
+        emit = self.trace_sink
+        emit(f"Trying to consume: {TOKEN_NAMES[code]}, Current token: {TOKEN_NAMES[self.kinds[self.pos]]}")
+        ok = Parser.consume(self, code)
+        if ok:
+            emit(f"Consumed: {TOKEN_NAMES[code]}('{self.consumed()}')")
+        return ok
+
+    def traced_add_var(self, add_var):
+        """Wrap add_var so every declared variable is reported to the sink"""
+        emit = self.trace_sink
+
+        def run(tkName, t):
+            s = add_var(tkName, t)
+            emit(f"Added variable: {tkName}, type: {type_base_name(t.typeBase)}, nElements: {t.nElements}")
+            return s
 
-def init_globals():
-    global symbols, crtDepth, crtFunc, crtStruct, crtTk
-    symbols = SymbolTable()
-    symbols.init_symbols()
-    crtDepth = 0
-    crtFunc = None
-    crtStruct = None
-    crtTk = None
-    # Initialize predefined functions
-    add_ext_funcs(symbols)
+        return run
+
+    def report(self, error):
+        """Record an error raised by a rule, stopping the parse at the cap"""
+        kind = "semantic" if isinstance(error, SemanticError) else "syntax"
+        line, column = self.position()
+        self.diagnostics.append(Diagnostic(kind, str(error), line, column, self.snippet()))
+        if len(self.diagnostics) >= self.max_errors:
+            raise TooManyErrors(f"stopped after {len(self.diagnostics)} errors")
+
+    def recovering(self, rule, placeholder, required, message):
+        """Wrap a statement or declaration rule: an error is recorded, what
+        the rule did undone and the tokens up to the end of the statement
+        skipped. Failing is an error too when the rule starts at one of the
+        required token kinds (unless every alternative is tried). In the
+        syntax tree the statement becomes a placeholder node, if given, so
+        that its parent keeps its number of children."""
+        ctx = self.ctx
+        symbols = ctx.symbols
+        if self.backtrack:
+            required = frozenset()
+
+        def run():
+            start = self.pos
+            state = self.ast.checkpoint() if self.ast is not None else None
+            depth = ctx.crtDepth
+            mark = symbols.begin[-1] if symbols.begin else None
+            try:
+                if rule():
+                    return True
+                if self.kinds[start] not in required or self.at_definition(start):
+                    # A definition ends the enclosing one, see sync()
+                    return False
+                raise SyntaxError(message % TOKEN_NAMES[self.kinds[self.pos]])
+            except (SyntaxError, SemanticError) as e:
+                self.recover(e, start, state, depth, mark, placeholder)
+            return True
 
+        return run
+
+    def recover(self, error, start, state, depth, mark, placeholder):
+        """Record the error of the statement begun at start, undo what it
+        did (the scope depth, the symbols added after mark and the nodes
+        added after the tree state) and skip to its end"""
+        self.report(error)
+        self.ctx.crtDepth = depth
+        self.drop_symbols(mark, depth)
+        self.sync(start)
+        if state is not None:
+            self.ast.rollback(state)
+            if placeholder is not None:
+                self.ast.add(placeholder, start)
+
+    def recovering_item(self, item):
+        """Wrap the parsing of a top-level item like recovering(), leaving
+        any function or struct it was in"""
+        ctx = self.ctx
+        symbols = ctx.symbols
+
+        def run():
+            start = self.pos
+            state = self.ast.checkpoint() if self.ast is not None else None
+            depth = ctx.crtDepth
+            mark = symbols.begin[-1] if symbols.begin else None
+            try:
+                item()
+            except (SyntaxError, SemanticError) as e:
+                self.report(e)
+                ctx.crtDepth = depth
+                if ctx.crtFunc is not None and symbols.contains(ctx.crtFunc):
+                    delete_symbols_after(symbols, ctx.crtFunc, depth)
+                else:
+                    self.drop_symbols(mark, depth)
+                ctx.crtFunc = ctx.crtStruct = None
+                self.sync(start)
+                if state is not None:
+                    self.ast.rollback(state)
+            if self.pos == start:
+                # A } with no block to close: the statement gave up on it
+                self.pos += 1
+
+        return run
+
+    def drop_symbols(self, mark, depth):
+        """Remove the symbols added after mark in scopes deeper than depth"""
+        symbols = self.ctx.symbols
+        if mark is not None and not symbols.contains(mark):
+            return
+        kept = []
+        while symbols.begin and symbols.begin[-1] is not mark:
+            s = symbols.pop()
+            if s.depth <= depth:
+                kept.append(s)
+        for s in reversed(kept):
+            symbols.add(s)
+
+    def sync(self, start):
+        """Skip to the end of the statement begun at start: past its ; or
+        the } closing its block, or up to a } closing an enclosing block or
+        a type keyword starting the next declaration. The tokens parsed
+        since start are scanned for the braces left open, so that
+        recovering costs no more than the parse that failed. Definitions
+        do not nest, so a function or struct definition ends the statement
+        even inside open braces: they are the ones missing."""
+        kinds = self.kinds
+        braces = parens = 0
+        for kind in kinds[start:self.pos]:
+            if kind == LACC:
+                braces += 1
+            elif kind == RACC:
+                braces -= 1
+            elif kind == LPAR:
+                parens += 1
+            elif kind == RPAR:
+                parens = max(parens - 1, 0)
+        i = self.pos
+        while True:
+            if i + 1 >= len(kinds):
+                self.tokens.fill(i)  # A TokenStream reads ahead
+            kind = kinds[i]
+            if kind == END:
+                break
+            if kind == RACC:
+                if braces <= 0:
+                    break
+                braces -= 1
+                if braces == 0:
+                    i += 1
+                    break
+            elif kind == LACC:
+                braces += 1
+            elif kind == LPAR:
+                parens += 1
+            elif kind == RPAR:
+                parens = max(parens - 1, 0)
+            elif braces == 0 and parens == 0:
+                if kind == SEMICOLON:
+                    i += 1
+                    break
+                if kind in TYPE_FIRST and i > start:
+                    break
+            if i > start and self.at_definition(i):
+                break
+            i += 1
+        self.pos = i
 
-class Parser:
-    def __init__(self, tokens):
-        self.crtTk = tokens  # Current token
-        global crtTk
-        crtTk = tokens  # Set global current token for error reporting
-        init_globals()  # Initialize semantic analysis globals
+    def at_definition(self, pos):
+        """Check if a function or struct definition starts at pos"""
+        if self.kinds[pos] not in TYPE_FIRST:
+            return False
+        saved, self.pos = self.pos, pos
+        try:
+            if self.kinds[pos] == STRUCT and self.peek(2) == LACC:
+                return True
+            return self.at_func_decl()
+        finally:
+            self.pos = saved
+
+    def peek(self, k=0):
+        """Return the kind of the token k positions after the current one"""
+        i = self.pos + k
+        return self.kinds[i] if i < len(self.kinds) else END
+
+    def at_func_decl(self):
+        """Check if the tokens ahead start a function definition: a typeBase
+        (or VOID), an optional * for non-void types, then ID and LPAR"""
+        code = self.kinds[self.pos]
+        k = 2 if code == STRUCT else 1
+        if code != VOID and self.peek(k) == MUL:
+            k += 1
+        return self.peek(k) == ID and self.peek(k + 1) == LPAR
+
+    def slide(self):
+        """Called between top-level declarations, where no backtrack point is
+        alive: a streamed token window (TokenStream) drops what was parsed,
+        and so does the packrat memo, whatever the token buffer"""
+        self.pos = self.tokens.slide(self.pos)
+        if self.memo:
+            self.memo.clear()
 
     def save(self):
         """Save current token position for backtracking"""
-        return self.crtTk
+        return self.pos
 
     def restore(self, saved_pos):
         """Restore to previously saved position"""
-        self.crtTk = saved_pos
-        global crtTk
-        crtTk = saved_pos  # Update global token pointer too
+        self.pos = saved_pos
+
+    def ast_save(self):
+        """save() when building a syntax tree"""
+        return self.pos, self.ast.checkpoint()
+
+    def ast_restore(self, saved):
+        """restore() when building a syntax tree"""
+        self.pos, state = saved
+        self.ast.rollback(state)
 
     def consume(self, code):
-        print(f"Trying to consume: {code}, Current token: {self.crtTk.code if self.crtTk else 'None'}")
-        if self.crtTk and self.crtTk.code == code:
-            last_consumed = self.crtTk
-            self.crtTk = self.crtTk.next
-            global crtTk
-            crtTk = self.crtTk  # Update global token pointer too
-            return last_consumed  # Return the consumed token
+        if self.kinds[self.pos] == code:
+            self.pos += 1
+            return True
+        return False
+
+    def consumed(self):
+        """Value of the token consumed last (name, constant...)"""
+        return self.tokens.value(self.pos - 1)
+
+    def consume_id(self):
+        """Consume an ID token and return its name, or None"""
+        if self.consume(ID):
+            return self.consumed()
         return None
 
     def unit(self):
-        # Iterate through tokens and process declarations/statements
-        while self.crtTk and self.crtTk.code != "END":
-            # Try each type of declaration/statement with proper backtracking
-            startPos = self.save()
+        # Each declaration/statement is entered once, chosen by lookahead,
+        # unless every alternative is tried
+        item = self.itemBacktrack if self.backtrack else self.item
+        try:
+            while self.kinds[self.pos] != END:
+                self.slide()
+                item()
+        except TooManyErrors:
+            return False
 
-            if self.declStruct():
-                continue
+        # Consume the END token
+        self.consume(END)
+        if self.ast is not None:
+            self.ast.finish()
 
-            self.restore(startPos)
-            if self.declFunc():
-                continue
+        return not self.diagnostics
 
-            self.restore(startPos)
-            if self.declVar():
-                continue
+    def item(self):
+        """Parse a top-level declaration or statement"""
+        startPos = self.save()
+        code = self.kinds[self.pos]
+
+        if code in TYPE_FIRST:
+            # declStruct() also reports a STRUCT without its ID, as the
+            # backtracking parser does by trying it first
+            if code == STRUCT and (self.peek(1) != ID or self.peek(2) == LACC):
+                ok = self.declStruct()
+            elif self.at_func_decl():
+                ok = self.declFunc()
+            else:
+                ok = self.declVar()
+        else:
+            ok = self.stm()
+        if ok:
+            return
 
-            self.restore(startPos)
-            if self.stm():
-                continue
+        self.restore(startPos)
+        raise SyntaxError(f"Unexpected token: {TOKEN_NAMES[self.kinds[self.pos]]}")
 
-            # If we get here, no valid parsing function succeeded
-            raise SyntaxError(f"Unexpected token: {self.crtTk.code if self.crtTk else 'None'}")
+    def itemBacktrack(self):
+        """item() trying each type of declaration/statement with proper
+        backtracking"""
+        startPos = self.save()
 
-        # Consume the END token if present
-        if self.crtTk and self.crtTk.code == "END":
-            self.consume("END")
+        if self.declStruct():
+            return
 
-        return True
+        self.restore(startPos)
+        if self.declFunc():
+            return
+
+        self.restore(startPos)
+        if self.declVar():
+            return
+
+        self.restore(startPos)
+        if self.stm():
+            return
+
+        # If we get here, no valid parsing function succeeded
+        raise SyntaxError(f"Unexpected token: {TOKEN_NAMES[self.kinds[self.pos]]}")
 
     def declStruct(self):
-        print("Checking declStruct")
-        if not self.consume("STRUCT"):
+        if not self.consume(STRUCT):
             return False
 
         # Get struct name token
-        tkName = self.consume("ID")
+        tkName = self.consume_id()
         if not tkName:
             raise SyntaxError("Expected ID after STRUCT")
+        tkPos = self.pos - 1
 
-        if not self.consume("LACC"):
+        if not self.consume(LACC):
             # Not a struct definition
             return False
 
         # Semantic action: Check for symbol redefinition and create struct symbol
-        global crtStruct
-        if find_symbol(symbols, tkName.text):
-            tkerr(self.crtTk, "symbol redefinition: %s", tkName.text)
-        crtStruct = add_symbol(symbols, tkName.text, "CLS_STRUCT")
-        crtStruct.members = SymbolTable()
-        crtStruct.members.init_symbols()
+        if self.find_symbol(self.ctx.symbols, tkName):
+            tkerr(self.crtTk, "symbol redefinition: %s", tkName)
+        self.ctx.crtStruct = add_symbol(self.ctx.symbols, tkName, "CLS_STRUCT", self.ctx.crtDepth)
+        self.ctx.crtStruct.members = SymbolTable()
+        self.ctx.crtStruct.members.init_symbols()
+        if self.references is not None:
+            self.references.append((tkPos, self.ctx.crtStruct, True))
+        if self.ast is not None:
+            members = self.ast.open()
 
         # Process struct members
         while self.declVar():
             pass
 
-        if not self.consume("RACC"):
+        if not self.consume(RACC):
             raise SyntaxError("Expected } to close struct definition")
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             raise SyntaxError("Expected ; after struct definition")
+        if self.ast is not None:
+            self.ast.add_from(N_STRUCT, tkPos, members, symbol=self.ctx.crtStruct)
 
         # Clear current struct pointer
-        crtStruct = None
+        self.ctx.crtStruct = None
         return True
 
     def add_var(self, tkName, t):
         """Helper function to add variables with semantic analysis"""
-        global crtStruct, crtFunc, crtDepth
 
         s = None
-        if crtStruct:
-            if find_symbol(crtStruct.members, tkName.text):
-                tkerr(self.crtTk, "symbol redefinition: %s", tkName.text)
-            s = add_symbol(crtStruct.members, tkName.text, "CLS_VAR")
-        elif crtFunc:
-            s = find_symbol(symbols, tkName.text)
-            if s and s.depth == crtDepth:
-                tkerr(self.crtTk, "symbol redefinition: %s", tkName.text)
-            s = add_symbol(symbols, tkName.text, "CLS_VAR")
+        if self.ctx.crtStruct:
+            if self.find_symbol(self.ctx.crtStruct.members, tkName):
+                tkerr(self.crtTk, "symbol redefinition: %s", tkName)
+            s = add_symbol(self.ctx.crtStruct.members, tkName, "CLS_VAR", self.ctx.crtDepth)
+        elif self.ctx.crtFunc:
+            s = self.find_symbol(self.ctx.symbols, tkName)
+            if s and s.depth == self.ctx.crtDepth:
+                tkerr(self.crtTk, "symbol redefinition: %s", tkName)
+            s = add_symbol(self.ctx.symbols, tkName, "CLS_VAR", self.ctx.crtDepth)
             s.mem = "MEM_LOCAL"
         else:
-            if find_symbol(symbols, tkName.text):
-                tkerr(self.crtTk, "symbol redefinition: %s", tkName.text)
-            s = add_symbol(symbols, tkName.text, "CLS_VAR")
+            if self.find_symbol(self.ctx.symbols, tkName):
+                tkerr(self.crtTk, "symbol redefinition: %s", tkName)
+            s = add_symbol(self.ctx.symbols, tkName, "CLS_VAR", self.ctx.crtDepth)
             s.mem = "MEM_GLOBAL"
 
-        # Create a deep copy of the type for the variable
-        s.type = t.copy()
-        # Ensure array type is properly preserved
-        s.type.nElements = t.nElements
-        print(f"Added variable: {tkName.text}, type: {t.typeBase}, nElements: {t.nElements}")
+        s.type = t
         return s
 
     def declVar(self):
-        print("Checking declVar")
         startPos = self.save()
 
         # Get type base (e.g., int, double, char, struct X)
-        t = Type()
-        if not self.typeBase(t):
+        base = RetVal()
+        if not self.typeBase(base):
             self.restore(startPos)
             return False
 
         # Get variable name
-        tkName = self.consume("ID")
+        tkName = self.consume_id()
         if not tkName:
             self.restore(startPos)
             return False
+        tkPos = self.pos - 1
 
         # Check for array declaration for the first variable
-        current_type = t.copy()  # Create a copy to avoid modifying the original
-        if not self.arrayDecl(current_type):
-            current_type.nElements = -1  # Not an array
+        var = RetVal()
+        var.type = base.type
+        self.arrayDecl(var)
 
         # Add the first variable
-        self.add_var(tkName, current_type)
+        s = self.add_var(tkName, var.type)
+        if self.references is not None:
+            self.references.append((tkPos, s, True))
+        if self.ast is not None:
+            self.ast.add(N_VAR, tkPos, 0, var.type, s)
 
         # Process additional variables separated by commas
-        while self.consume("COMMA"):
-            tkName = self.consume("ID")
+        while self.consume(COMMA):
+            tkName = self.consume_id()
             if not tkName:
                 raise SyntaxError("Expected variable name after comma")
+            tkPos = self.pos - 1
 
-            # Create a new type for each variable
-            var_type = t.copy()  # Start with the base type
-            if not self.arrayDecl(var_type):
-                var_type.nElements = -1  # Not an array
+            # Each variable starts from the base type
+            var = RetVal()
+            var.type = base.type
+            self.arrayDecl(var)
 
             # Add the variable to the symbol table
-            self.add_var(tkName, var_type)
+            s = self.add_var(tkName, var.type)
+            if self.references is not None:
+                self.references.append((tkPos, s, True))
+            if self.ast is not None:
+                self.ast.add(N_VAR, tkPos, 0, var.type, s)
 
         # Require semicolon at end
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             self.restore(startPos)
             return False
 
         return True
 
     def typeBase(self, ret):
-        """Parse a type base and store it in ret"""
-        print("Checking typeBase")
+        """Parse a type base and store it in ret.type (a RetVal)"""
         startPos = self.save()
 
-        if self.consume("INT"):
-            print("Found INT")
-            ret.typeBase = "TB_INT"
+        if self.consume(INT):
+            ret.type = self.create_type(TB_INT, -1)
             return True
 
         self.restore(startPos)
-        if self.consume("DOUBLE"):
-            print("Found DOUBLE")
-            ret.typeBase = "TB_DOUBLE"
+        if self.consume(DOUBLE):
+            ret.type = self.create_type(TB_DOUBLE, -1)
             return True
 
         self.restore(startPos)
-        if self.consume("CHAR"):
-            print("Found CHAR")
-            ret.typeBase = "TB_CHAR"
+        if self.consume(CHAR):
+            ret.type = self.create_type(TB_CHAR, -1)
             return True
 
         self.restore(startPos)
-        if self.consume("VOID"):
-            print("Found VOID")
-            ret.typeBase = "TB_VOID"
+        if self.consume(VOID):
+            ret.type = self.create_type(TB_VOID, -1)
             return True
 
         # Check for struct type
         self.restore(startPos)
-        if self.consume("STRUCT"):
-            tkName = self.consume("ID")
+        if self.consume(STRUCT):
+            tkName = self.consume_id()
             if not tkName:
                 self.restore(startPos)
                 return False
 
             # Semantic action: Check that struct exists
-            s = find_symbol(symbols, tkName.text)
+            s = self.find_symbol(self.ctx.symbols, tkName)
             if s is None:
-                tkerr(self.crtTk, "undefined symbol: %s", tkName.text)
+                tkerr(self.crtTk, "undefined symbol: %s", tkName)
             if s.cls != "CLS_STRUCT":
-                tkerr(self.crtTk, "%s is not a struct", tkName.text)
+                tkerr(self.crtTk, "%s is not a struct", tkName)
+            if self.references is not None:
+                self.references.append((self.pos - 1, s, False))
 
-            ret.typeBase = "TB_STRUCT"
-            ret.s = s
+            ret.type = self.create_type(TB_STRUCT, -1, s)
             return True
 
         self.restore(startPos)
-        print("typeBase failed")
         return False
 
     def arrayDecl(self, ret):
-        """Parse array declaration and update type"""
-        if not self.consume("LBRACKET"):
+        """Parse array declaration and make ret.type (a RetVal) an array"""
+        if not self.consume(LBRACKET):
             return False
 
-        # Evaluate the array size expression
+        # Evaluate the array size expression (kept in the type, not in the tree)
+        if self.ast is not None:
+            nodes = self.ast.checkpoint()
         rv = RetVal()
         if self.expr(rv):
             # Check if the expression is a constant integer
             if not rv.isCtVal:
                 tkerr(self.crtTk, "the array size is not a constant")
-            if rv.type.typeBase != "TB_INT":
+            if rv.type.typeBase != TB_INT:
                 tkerr(self.crtTk, "the array size is not an integer")
-            ret.nElements = int(rv.ctVal)  # Cast to integer
-            print(f"Array size evaluated as constant: {ret.nElements}")
+            ret.type = self.create_type(ret.type.typeBase, int(rv.ctVal), ret.type.s)  # Cast to integer
         else:
             tkerr(self.crtTk, "invalid array size expression")
+        if self.ast is not None:
+            self.ast.rollback(nodes)
 
-        if not self.consume("RBRACKET"):
+        if not self.consume(RBRACKET):
             raise SyntaxError("Expected ] in array declaration")
 
         return True
 
     def typeName(self, ret):
-        """Parse a type name (base type + optional array)"""
+        """Parse a type name (base type + optional array) into ret.type"""
         if not self.typeBase(ret):
             return False
 
-        if not self.arrayDecl(ret):
-            ret.nElements = -1
-
+        self.arrayDecl(ret)
         return True
 
     def declFunc(self):
         """Parse function declaration with semantic analysis"""
-        print("Checking declFunc")
         startPos = self.save()
 
         # Get return type (typeBase or void)
-        t = Type()
-        void_type = self.consume("VOID")
+        ret = RetVal()
+        void_type = self.consume(VOID)
         if void_type:
-            t.typeBase = "TB_VOID"
+            ret.type = self.create_type(TB_VOID, -1)
         else:
-            if not self.typeBase(t):
+            if not self.typeBase(ret):
                 self.restore(startPos)
                 return False
 
             # Check for pointer return type
-            if self.consume("MUL"):
-                t.nElements = 0  # Mark as pointer
-            else:
-                t.nElements = -1  # Not an array/pointer
+            if self.consume(MUL):
+                ret.type = self.create_type(ret.type.typeBase, 0, ret.type.s)  # Mark as pointer
 
         # Get function name
-        tkName = self.consume("ID")
+        tkName = self.consume_id()
         if not tkName:
             self.restore(startPos)
             return False
+        tkPos = self.pos - 1
 
         # Start of parameter list
-        if not self.consume("LPAR"):
+        if not self.consume(LPAR):
             self.restore(startPos)
             return False
 
         # Semantic action: check for redefinition and create func symbol
-        global crtFunc, crtDepth
-        if find_symbol(symbols, tkName.text):
-            tkerr(self.crtTk, "symbol redefinition: %s", tkName.text)
-        crtFunc = add_symbol(symbols, tkName.text, "CLS_FUNC")
-        crtFunc.args = SymbolTable()
-        crtFunc.args.init_symbols()
-        crtFunc.type = t.copy()  # Deep copy the type
-        crtDepth += 1
+        if self.find_symbol(self.ctx.symbols, tkName):
+            tkerr(self.crtTk, "symbol redefinition: %s", tkName)
+        self.ctx.crtFunc = add_symbol(self.ctx.symbols, tkName, "CLS_FUNC", self.ctx.crtDepth)
+        self.ctx.crtFunc.args = SymbolTable()
+        self.ctx.crtFunc.args.init_symbols()
+        self.ctx.crtFunc.type = ret.type
+        if self.references is not None:
+            self.references.append((tkPos, self.ctx.crtFunc, True))
+        if self.ast is not None:
+            params = self.ast.open()
+        self.ctx.crtDepth += 1
 
         # Parse function arguments
         if self.funcArg():
-            while self.consume("COMMA"):
+            while self.consume(COMMA):
                 if not self.funcArg():
                     raise SyntaxError("Expected function argument after comma")
 
         # End of parameter list
-        if not self.consume("RPAR"):
+        if not self.consume(RPAR):
             raise SyntaxError("Expected ) to close function parameters")
 
         # Decrease depth before function body
-        crtDepth -= 1
+        self.ctx.crtDepth -= 1
 
         # Function body
         if not self.stmCompound():
             raise SyntaxError("Expected function body { ... }")
+        if self.ast is not None:
+            self.ast.add_from(N_FUNC, tkPos, params, ret.type, self.ctx.crtFunc)
 
         # Clean up symbols after function declaration
-        delete_symbols_after(symbols, crtFunc)
-        crtFunc = None
+        delete_symbols_after(self.ctx.symbols, self.ctx.crtFunc, self.ctx.crtDepth)
+        self.ctx.crtFunc = None
 
         return True
 
@@ -542,35 +1195,42 @@ class Parser:
         startPos = self.save()
 
         # Get parameter type
-        t = Type()
-        if not self.typeBase(t):
+        arg = RetVal()
+        if not self.typeBase(arg):
             self.restore(startPos)
             return False
 
         # Get parameter name
-        tkName = self.consume("ID")
+        tkName = self.consume_id()
         if not tkName:
             self.restore(startPos)
             return False
+        tkPos = self.pos - 1
 
         # Check for array parameter
-        if not self.arrayDecl(t):
-            t.nElements = -1
+        self.arrayDecl(arg)
 
         # Semantic action: add parameter to symbol table
-        s = add_symbol(symbols, tkName.text, "CLS_VAR")
+        s = add_symbol(self.ctx.symbols, tkName, "CLS_VAR", self.ctx.crtDepth)
         s.mem = "MEM_ARG"
-        s.type = t.copy()  # Deep copy the type
+        s.type = arg.type
+        if self.references is not None:
+            self.references.append((tkPos, s, True))
+        if self.ast is not None:
+            self.ast.add(N_PARAM, tkPos, 0, arg.type, s)
 
         # Also add to function args
-        s = add_symbol(crtFunc.args, tkName.text, "CLS_VAR")
+        s = add_symbol(self.ctx.crtFunc.args, tkName, "CLS_VAR", self.ctx.crtDepth)
         s.mem = "MEM_ARG"
-        s.type = t.copy()  # Deep copy the type
+        s.type = arg.type
 
         return True
 
     def stm(self):
         """Parse a statement"""
+        if not self.backtrack:
+            return getattr(self, STM_DISPATCH.get(self.kinds[self.pos], "stmExpr"))()
+
         startPos = self.save()
 
         # Try each statement type
@@ -604,53 +1264,296 @@ class Parser:
         return False
 
     def stmCompound(self):
-        if not self.consume("LACC"):
+        if not self.consume(LACC):
             return False
+        tkPos, items, start = self.open_block()
 
-        global crtDepth
-        start = symbols.begin[-1] if symbols.begin else None
+        # Process declarations and statements inside the block
+        if not self.backtrack:
+            while self.block_items() and self.stm():
+                pass
+        else:
+            while True:
+                startPos = self.save()
+                if self.declVar():
+                    continue
 
-        # Enter new scope
-        crtDepth += 1
+                self.restore(startPos)
+                if self.stm():
+                    continue
 
-        # Process declarations and statements inside the block
-        while True:
-            startPos = self.save()
+                break
 
-            if self.declVar():
-                continue
+        self.close_block(tkPos, items, start)
+        return True
 
-            self.restore(startPos)
-            if self.stm():
-                continue
+    def open_block(self):
+        """Enter the block whose { was just consumed. Returns its token, its
+        tree mark and the last symbol before it, for close_block()."""
+        start = self.ctx.symbols.begin[-1] if self.ctx.symbols.begin else None
+        tkPos = self.pos - 1
+        items = self.ast.open() if self.ast is not None else None
 
-            break
+        # Enter new scope
+        self.ctx.crtDepth += 1
+        return tkPos, items, start
 
-        if not self.consume("RACC"):
+    def block_items(self):
+        """Parse the declarations of a block up to its next statement: True
+        if a statement starts at the current token, False at the } or where
+        no declaration or statement can start"""
+        while True:
+            startPos = self.save()
+            # A type keyword can only start a declaration
+            if self.kinds[self.pos] in TYPE_FIRST:
+                if self.declVar():
+                    continue
+                self.restore(startPos)
+                return False
+            return self.kinds[self.pos] != RACC
+
+    def close_block(self, tkPos, items, start):
+        """Consume the } of a block opened by open_block() and leave its scope"""
+        if not self.consume(RACC):
             raise SyntaxError("Expected } to close compound statement")
+        if self.ast is not None:
+            self.ast.add_from(N_BLOCK, tkPos, items)
 
         # Exit scope and clean up symbols only if not the function body
-        if crtDepth > 1:  # Assuming function body is at depth 1
-            crtDepth -= 1
-            delete_symbols_after(symbols, start)
-
-        return True
+        if self.ctx.crtDepth > 1:  # Assuming function body is at depth 1
+            self.ctx.crtDepth -= 1
+            delete_symbols_after(self.ctx.symbols, start, self.ctx.crtDepth)
+
+    def stmIterative(self):
+        """stm() over an explicit stack, see statements()"""
+        return self.statements(False)
+
+    def stmCompoundIterative(self):
+        """stmCompound() over an explicit stack, see statements()"""
+        return self.statements(True)
+
+    def statements(self, body):
+        """Parse a statement, or a function body if body, keeping the
+        blocks and the if, while and for statements it nests in a list of
+        frames [kind, recovery state, token, tree mark, scope start] rather
+        than in Python calls, so the call depth does not grow with their
+        nesting. The other statements and the declarations are parsed by
+        their rules. With error recovery each statement recovers like a
+        recovering() stm: its frame holds what recover() needs."""
+        kinds = self.kinds
+        ctx = self.ctx
+        symbols = ctx.symbols
+        ast = self.ast
+        recovering = self.diagnostics is not None
+        frames = []
+        ok = None  # Outcome of the statement just parsed, None to start one
+        if body:
+            if not self.consume(LACC):
+                return False
+            frames.append([LACC, None, *self.open_block()])
+            ok = True
+        while True:
+            try:
+                if ok is None:
+                    saved = None
+                    if recovering:
+                        saved = (self.pos, ast.checkpoint() if ast is not None else None, ctx.crtDepth,
+                                 symbols.begin[-1] if symbols.begin else None)
+                    code = kinds[self.pos]
+                    if code == LACC:
+                        self.pos += 1
+                        frames.append([LACC, saved, *self.open_block()])
+                        ok = True
+                    elif code == IF or code == WHILE or code == FOR:
+                        self.pos += 1
+                        frames.append([code, saved, self.pos - 1, ast.open() if ast is not None else None, None])
+                        if code == FOR:
+                            self.for_head()
+                        else:
+                            self.condition("if" if code == IF else "while")
+                        continue
+                    else:
+                        frames.append([None, saved])
+                        ok = getattr(self, STM_DISPATCH.get(code, "stmExpr"))()
+                        if not ok and recovering and kinds[saved[0]] != END and not self.at_definition(saved[0]):
+                            raise SyntaxError(f"Unexpected token: {TOKEN_NAMES[kinds[self.pos]]}")
+                        frames.pop()
+
+                # Go on with the innermost open statement
+                while True:
+                    if not frames:
+                        return ok
+                    kind, _, tkPos, parts, start = frames[-1]
+                    if kind == LACC:
+                        if ok and self.block_items():
+                            ok = None
+                            break
+                        self.close_block(tkPos, parts, start)
+                    else:
+                        if not ok:
+                            raise SyntaxError(BODY_EXPECTED[kind])
+                        if kind == IF and self.consume(ELSE):
+                            frames[-1][0] = ELSE
+                            ok = None
+                            break
+                        if ast is not None:
+                            ast.add_from(STATEMENT_NODES[kind], tkPos, parts)
+                    frames.pop()
+                    ok = True
+            except (SyntaxError, SemanticError) as e:
+                saved = frames[-1][1]
+                if saved is None:
+                    raise
+                frames.pop()
+                self.recover(e, *saved, N_EMPTY)
+                ok = True
 
     def expr(self, rv):
         """Parse an expression and set its RetVal"""
         return self.exprAssign(rv)
 
+    def exprPrecedence(self, out):
+        """expr() by precedence climbing over an explicit stack: the
+        operators waiting for their right operand, the prefix operators and
+        the open parentheses, indexes and calls are frames of a list rather
+        than Python calls, so the call depth does not grow with the nesting
+        of the expression. The semantic actions are those of the expression
+        rules, run at the same tokens in the same order, so the types,
+        constants, errors and syntax tree are the same. A frame is (power,
+        operator token, token position, RetVal, cast type or callee mark);
+        the call of a group is keyed by COMMA, the separator of its
+        arguments."""
+        kinds = self.kinds
+        if kinds[self.pos] not in OPERAND_FIRST:
+            return False
+        stack = []
+        rv = out  # Operand being parsed
+        cast_ok = True  # A cast can start it: not right after - or !
+        while True:
+            # Prefix operators, then the primary of the operand
+            code = kinds[self.pos]
+            if code == SUB or code == NOT:
+                stack.append((PREFIX, code, self.pos, None, None))
+                self.pos += 1
+                if kinds[self.pos] not in OPERAND_FIRST:
+                    raise SyntaxError(UNARY_OPERAND_EXPECTED[code])
+                cast_ok = False
+                continue
+            if code == LPAR:
+                tkPos = self.pos
+                if cast_ok and kinds[tkPos + 1] in TYPE_FIRST:
+                    # A cast, unless no operand follows: then it is read
+                    # again as a parenthesized expression, which fails
+                    startPos = self.save()
+                    self.pos += 1
+                    t = RetVal()
+                    if self.typeName(t) and kinds[self.pos] == RPAR and kinds[self.pos + 1] in OPERAND_FIRST:
+                        self.pos += 1
+                        stack.append((PREFIX, LPAR, tkPos, None, t.type))
+                        continue
+                    self.restore(startPos)
+                stack.append((GROUP, LPAR, tkPos, rv, None))
+                self.pos += 1
+                if kinds[self.pos] not in OPERAND_FIRST:
+                    raise SyntaxError("Expected expression after (")
+                cast_ok = True
+                continue
+            self.exprPrimary(rv)
+
+            # Postfix operators, the prefix operators of the complete
+            # operand, then the binary operator after it or the end of the
+            # innermost group
+            while True:
+                code = kinds[self.pos]
+                if code == LBRACKET:
+                    stack.append((GROUP, LBRACKET, self.pos, rv, None))
+                    self.pos += 1
+                    if kinds[self.pos] not in OPERAND_FIRST:
+                        raise SyntaxError("Expected expression inside [ ]")
+                    rv = RetVal()
+                    break
+                if code == DOT:
+                    self.pos += 1
+                    self.member_action(rv)
+                    continue
+                if code == LPAR:
+                    opPos = self.pos
+                    self.pos += 1
+                    callee = self.call_check(rv)
+                    if kinds[self.pos] != RPAR:
+                        stack.append((GROUP, COMMA, opPos, rv, callee))
+                        if kinds[self.pos] not in OPERAND_FIRST:
+                            raise SyntaxError("Expected expression in function arguments")
+                        rv = RetVal()
+                        break
+                    self.pos += 1
+                    self.call_action(opPos, callee, rv)
+                    continue
+
+                while stack and stack[-1][0] == PREFIX:
+                    _, op, tkPos, _, t = stack.pop()
+                    if op == LPAR:
+                        self.cast_action(t, tkPos, rv)
+                    else:
+                        self.unary_action(op, tkPos, rv)
+
+                power = BINARY_POWER.get(code)
+                if power is not None:
+                    # Reduce the operators binding at least as tightly
+                    bound = power + 1 if code == ASSIGN else power
+                    while stack and stack[-1][0] >= bound:
+                        _, op, opPos, left, _ = stack.pop()
+                        self.binary_action(op, opPos, left, rv)
+                        rv = left
+                    stack.append((power, code, self.pos, rv, None))
+                    self.pos += 1
+                    if kinds[self.pos] not in OPERAND_FIRST:
+                        raise SyntaxError(OPERAND_EXPECTED[code])
+                    rv = RetVal()
+                    break
+
+                while stack and stack[-1][0] > GROUP:
+                    _, op, opPos, left, _ = stack.pop()
+                    self.binary_action(op, opPos, left, rv)
+                    rv = left
+                if not stack:
+                    return True
+                _, group, opPos, outer, callee = stack[-1]
+                if group == COMMA and code == COMMA:
+                    # The next argument of a call
+                    self.pos += 1
+                    if kinds[self.pos] not in OPERAND_FIRST:
+                        raise SyntaxError("Expected expression after comma")
+                    rv = RetVal()
+                    break
+                end, message = GROUP_CLOSE[group]
+                if code != end:
+                    raise SyntaxError(message)
+                self.pos += 1
+                stack.pop()
+                if group == LBRACKET:
+                    self.index_action(opPos, outer, rv)
+                elif group == COMMA:
+                    self.call_action(opPos, callee, outer)
+                rv = outer
+            cast_ok = True
+
     def stmExpr(self):
         """Parse an expression statement (expr;)"""
         startPos = self.save()
+        if self.ast is not None:
+            tkPos = self.pos
+            items = self.ast.open()
 
         # Optional expression
         rv = RetVal()
         self.expr(rv)  # We don't check the return since it's optional
 
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             self.restore(startPos)
             return False
+        if self.ast is not None:
+            self.ast.add_from(N_EXPR, tkPos, items)
         return True
 
     def exprAssign(self, rv):
@@ -663,25 +1566,17 @@ class Parser:
             return False
 
         # If followed by assignment, it's an assignment expression
-        if self.consume("ASSIGN"):
+        if self.consume(ASSIGN):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprAssign(rve):
-                raise SyntaxError("Expected expression after =")
-
-            # Check if left side is an lvalue
-            if not rv.isLVal:
-                tkerr(self.crtTk, "cannot assign to a non-lval")
-
-            # Check for array assignment
-            if rv.type.nElements > -1 or rve.type.nElements > -1:
-                tkerr(self.crtTk, "the arrays cannot be assigned")
-
-            # Try to cast right to left type
-            cast(rv.type, rve.type)
-
-            # Result is not a constant or lvalue
-            rv.isCtVal = rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[ASSIGN])
+            self.binary_action(ASSIGN, opPos, rv, rve)
+            return True
 
+        # The operand is the whole expression. With a syntax tree it is kept
+        # as it is: parsing it again would only rebuild the same nodes.
+        if self.ast is not None:
             return True
 
         # Restore token position for backtracking
@@ -695,18 +1590,12 @@ class Parser:
         if not self.exprAnd(rv):
             return False
 
-        while self.consume("OR"):
+        while self.consume(OR):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprAnd(rve):
-                raise SyntaxError("Expected expression after OR")
-
-            # Check if operands are structures
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
-                tkerr(self.crtTk, "a structure cannot be logically tested")
-
-            # Result is always int
-            rv.type = create_type("TB_INT", -1)
-            rv.isCtVal = rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[OR])
+            self.binary_action(OR, opPos, rv, rve)
 
         return True
 
@@ -715,18 +1604,12 @@ class Parser:
         if not self.exprEq(rv):
             return False
 
-        while self.consume("AND"):
+        while self.consume(AND):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprEq(rve):
-                raise SyntaxError("Expected expression after AND")
-
-            # Check if operands are structures
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
-                tkerr(self.crtTk, "a structure cannot be logically tested")
-
-            # Result is always int
-            rv.type = create_type("TB_INT", -1)
-            rv.isCtVal = rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[AND])
+            self.binary_action(AND, opPos, rv, rve)
 
         return True
 
@@ -735,21 +1618,12 @@ class Parser:
         if not self.exprRel(rv):
             return False
 
-        while self.consume("EQUAL") or self.consume("NOTEQ"):
+        while self.consume(EQUAL) or self.consume(NOTEQ):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprRel(rve):
-                raise SyntaxError("Expected expression after equality operator")
-
-            # Semantic action: Check types and compute result
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
-                tkerr(self.crtTk, "a structure cannot be compared")
-
-            # Convert operands to common type
-            t = get_arith_type(rv.type, rve.type)
-
-            # Result is always int
-            rv.type = create_type("TB_INT", -1)
-            rv.isCtVal = rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[EQUAL])
+            self.binary_action(self.kinds[opPos], opPos, rv, rve)
 
         return True
 
@@ -758,22 +1632,13 @@ class Parser:
         if not self.exprAdd(rv):
             return False
 
-        while self.consume("LESS") or self.consume("LESSEQ") or \
-                self.consume("GREATER") or self.consume("GREATEREQ"):
+        while self.consume(LESS) or self.consume(LESSEQ) or \
+                self.consume(GREATER) or self.consume(GREATEREQ):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprAdd(rve):
-                raise SyntaxError("Expected expression after relational operator")
-
-            # Semantic action: Check types and compute result
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
-                tkerr(self.crtTk, "a structure cannot be compared")
-
-            # Convert operands to common type
-            t = get_arith_type(rv.type, rve.type)
-
-            # Result is always int
-            rv.type = create_type("TB_INT", -1)
-            rv.isCtVal = rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[LESS])
+            self.binary_action(self.kinds[opPos], opPos, rv, rve)
 
         return True
 
@@ -782,32 +1647,13 @@ class Parser:
         if not self.exprMul(rv):
             return False
 
-        while True:
-            add_op = self.consume("ADD")
-            sub_op = self.consume("SUB")
-            if not (add_op or sub_op):
-                break
-
+        # A - after + is the sign of the right operand
+        while self.consume(ADD) or self.consume(SUB):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprMul(rve):
-                raise SyntaxError("Expected expression after additive operator")
-
-            # Constant folding for addition/subtraction
-            if rv.isCtVal and rve.isCtVal:
-                if add_op:
-                    rv.ctVal += rve.ctVal
-                else:
-                    rv.ctVal -= rve.ctVal
-            else:
-                rv.isCtVal = False
-
-            # Type checking
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
-                tkerr(self.crtTk, "a structure cannot be used in arithmetic operations")
-
-            # Update result type
-            rv.type = get_arith_type(rv.type, rve.type)
-            rv.isLVal = False
+                raise SyntaxError(OPERAND_EXPECTED[ADD])
+            self.binary_action(self.kinds[opPos], opPos, rv, rve)
 
         return True
 
@@ -816,21 +1662,54 @@ class Parser:
         if not self.exprCast(rv):
             return False
 
-        while True:
-            mul_op = self.consume("MUL")
-            div_op = self.consume("DIV")
-            if not (mul_op or div_op):
-                break
-
+        while self.consume(MUL) or self.consume(DIV):
+            opPos = self.pos - 1
             rve = RetVal()
             if not self.exprCast(rve):
-                raise SyntaxError("Expected expression after multiplicative operator")
+                raise SyntaxError(OPERAND_EXPECTED[MUL])
+            self.binary_action(self.kinds[opPos], opPos, rv, rve)
+
+        return True
+
+    def binary_action(self, code, opPos, rv, rve):
+        """Semantic action of the binary operator code, at opPos: check the
+        operands rv and rve, fold constants and leave the result in rv"""
+        if code == ASSIGN:
+            # Check if left side is an lvalue
+            if not rv.isLVal:
+                tkerr(self.crtTk, "cannot assign to a non-lval")
 
-            # Constant folding for multiplication/division
+            # Check for array assignment
+            if rv.type.nElements > -1 or rve.type.nElements > -1:
+                tkerr(self.crtTk, "the arrays cannot be assigned")
+
+            # Try to cast right to left type
+            cast(rv.type, rve.type, self)
+
+            # Result is not a constant or lvalue
+            rv.isCtVal = rv.isLVal = False
+            if self.ast is not None:
+                self.ast.add(N_ASSIGN, opPos, 2, rv.type)
+            return
+
+        if code == OR or code == AND:
+            # Check if operands are structures
+            if rv.type.typeBase == TB_STRUCT or rve.type.typeBase == TB_STRUCT:
+                tkerr(self.crtTk, "a structure cannot be logically tested")
+
+            # Result is always int
+            rv.type = INT_TYPE
+            rv.isCtVal = rv.isLVal = False
+        elif code in ARITH_OPS:
+            # Constant folding
             if rv.isCtVal and rve.isCtVal:
-                if mul_op:
+                if code == ADD:
+                    rv.ctVal += rve.ctVal
+                elif code == SUB:
+                    rv.ctVal -= rve.ctVal
+                elif code == MUL:
                     rv.ctVal *= rve.ctVal
-                elif div_op:
+                else:
                     if rve.ctVal == 0:
                         tkerr(self.crtTk, "division by zero")
                     rv.ctVal = int(rv.ctVal / rve.ctVal)  # Integer division
@@ -838,60 +1717,80 @@ class Parser:
                 rv.isCtVal = False
 
             # Type checking
-            if rv.type.typeBase == "TB_STRUCT" or rve.type.typeBase == "TB_STRUCT":
+            if rv.type.typeBase == TB_STRUCT or rve.type.typeBase == TB_STRUCT:
                 tkerr(self.crtTk, "a structure cannot be used in arithmetic operations")
 
             # Update result type
-            rv.type = get_arith_type(rv.type, rve.type)
+            rv.type = get_arith_type(rv.type, rve.type, self)
             rv.isLVal = False
+        else:
+            # Comparison: check types and convert operands to common type
+            if rv.type.typeBase == TB_STRUCT or rve.type.typeBase == TB_STRUCT:
+                tkerr(self.crtTk, "a structure cannot be compared")
+            get_arith_type(rv.type, rve.type, self)
 
-        return True
+            # Result is always int
+            rv.type = INT_TYPE
+            rv.isCtVal = rv.isLVal = False
+        if self.ast is not None:
+            self.ast.add(BINARY_NODES[code], opPos, 2, rv.type)
 
     def exprCast(self, rv):
         """Parse a cast expression"""
         startPos = self.save()
+        tkPos = self.pos
 
-        if self.consume("LPAR"):
-            t = Type()
+        if self.consume(LPAR):
+            t = RetVal()
             if self.typeName(t):
-                if self.consume("RPAR"):
+                if self.consume(RPAR):
                     if self.exprCast(rv):
                         # Try to cast the value to the specified type
-                        cast(t, rv.type)
-                        rv.type = t.copy()  # Use a deep copy of the type
-                        rv.isLVal = False
+                        self.cast_action(t.type, tkPos, rv)
                         return True
 
         # If cast didn't match, try unary expression
         self.restore(startPos)
         return self.exprUnary(rv)
 
+    def cast_action(self, t, tkPos, rv):
+        """Semantic action of a cast to type t, at tkPos, of the operand rv"""
+        cast(t, rv.type, self)
+        rv.type = t
+        rv.isLVal = False
+        if self.ast is not None:
+            self.ast.add(N_CAST, tkPos, 1, rv.type)
+
     def exprUnary(self, rv):
         """Parse a unary expression"""
-        if self.consume("SUB"):
+        tkPos = self.pos
+        if self.consume(SUB) or self.consume(NOT):
             if not self.exprUnary(rv):
-                raise SyntaxError("Expected expression after unary -")
+                raise SyntaxError(UNARY_OPERAND_EXPECTED[self.kinds[tkPos]])
+            self.unary_action(self.kinds[tkPos], tkPos, rv)
+            return True
 
+        return self.exprPostfix(rv)
+
+    def unary_action(self, code, tkPos, rv):
+        """Semantic action of unary - or ! (code), at tkPos, on the operand rv"""
+        if code == SUB:
             # Check if operand is numeric
-            if rv.type.typeBase not in ["TB_INT", "TB_CHAR", "TB_DOUBLE"]:
+            if rv.type.typeBase not in ARITH_BASES:
                 tkerr(self.crtTk, "unary - requires numeric operand")
 
             rv.isLVal = False
-            return True
-
-        if self.consume("NOT"):
-            if not self.exprUnary(rv):
-                raise SyntaxError("Expected expression after unary !")
-
+            node = N_NEG
+        else:
             # Check if operand is arithmetic
-            if rv.type.typeBase not in ["TB_INT", "TB_CHAR", "TB_DOUBLE"]:
+            if rv.type.typeBase not in ARITH_BASES:
                 tkerr(self.crtTk, "unary ! requires arithmetic operand")
 
-            rv.type = create_type("TB_INT", -1)
+            rv.type = INT_TYPE
             rv.isLVal = rv.isCtVal = False
-            return True
-
-        return self.exprPostfix(rv)
+            node = N_NOT
+        if self.ast is not None:
+            self.ast.add(node, tkPos, 1, rv.type)
 
     def exprPostfix(self, rv):
         """Parse a postfix expression (array access, struct member, function call)"""
@@ -900,77 +1799,43 @@ class Parser:
 
         while True:
             # Array access
-            if self.consume("LBRACKET"):
+            if self.consume(LBRACKET):
+                opPos = self.pos - 1
                 rve = RetVal()
                 if not self.expr(rve):
                     raise SyntaxError("Expected expression inside [ ]")
 
-                if not self.consume("RBRACKET"):
+                if not self.consume(RBRACKET):
                     raise SyntaxError("Expected ] after array index")
-
-                # Check array indexing semantics
-                if rv.type.nElements == -1:
-                    tkerr(self.crtTk, "indexed operand is not an array")
-
-                if rve.type.typeBase not in ["TB_INT", "TB_CHAR"]:
-                    tkerr(self.crtTk, "array index must be an integer")
-
-                # Result type is the element type of the array
-                rv.type.nElements = -1
-                rv.isLVal = True
-                rv.isCtVal = False
+                self.index_action(opPos, rv, rve)
 
             # Struct member access
-            elif self.consume("DOT"):
-                tkName = self.consume("ID")
-                if not tkName:
-                    raise SyntaxError("Expected field name after .")
-
-                # Check struct member access semantics
-                if rv.type.typeBase != "TB_STRUCT":
-                    tkerr(self.crtTk, "accessing a member of a non-struct")
-
-                s = find_symbol(rv.type.s.members, tkName.text)
-                if not s:
-                    tkerr(self.crtTk, "undefined struct member: %s", tkName.text)
-
-                # Result type is the member's type
-                rv.type = s.type
-                rv.isLVal = True
-                rv.isCtVal = False
+            elif self.consume(DOT):
+                self.member_action(rv)
 
             # Function call
-            elif self.consume("LPAR"):
-                # Check that the symbol is a function
-                if not hasattr(rv, 'symbol') or rv.symbol.cls not in ["CLS_FUNC", "CLS_EXTFUNC"]:
-                    tkerr(self.crtTk, "calling a non-function: %s",
-                          rv.symbol.name if hasattr(rv, 'symbol') else "<unknown>")
+            elif self.consume(LPAR):
+                opPos = self.pos - 1
+                callee = self.call_check(rv)
 
                 args = []  # Collect argument types for validation
 
                 # Parse arguments
-                if self.crtTk.code != "RPAR":
+                if self.kinds[self.pos] != RPAR:
                     rve = RetVal()
                     if not self.expr(rve):
                         raise SyntaxError("Expected expression in function arguments")
                     args.append(rve)
 
-                    while self.consume("COMMA"):
+                    while self.consume(COMMA):
                         rve = RetVal()
                         if not self.expr(rve):
                             raise SyntaxError("Expected expression after comma")
                         args.append(rve)
 
-                if not self.consume("RPAR"):
+                if not self.consume(RPAR):
                     raise SyntaxError("Expected ) in function call")
-
-                # Check arguments against function definition
-                # (simplified validation for now)
-
-                # Result type is the function's return type
-                rv.type = rv.symbol.type.copy()  # Return type (e.g., TB_INT)
-                rv.isLVal = False
-                rv.isCtVal = False
+                self.call_action(opPos, callee, rv)
 
             else:
                 # No more postfix operators
@@ -978,82 +1843,154 @@ class Parser:
 
         return True
 
+    def index_action(self, opPos, rv, rve):
+        """Semantic action of the indexing, at opPos, of rv by rve"""
+        # Check array indexing semantics
+        if rv.type.nElements == -1:
+            tkerr(self.crtTk, "indexed operand is not an array")
+
+        if rve.type.typeBase not in (TB_INT, TB_CHAR):
+            tkerr(self.crtTk, "array index must be an integer")
+
+        # Result type is the element type of the array
+        rv.type = self.create_type(rv.type.typeBase, -1, rv.type.s)
+        rv.isLVal = True
+        rv.isCtVal = False
+        if self.ast is not None:
+            self.ast.add(N_INDEX, opPos, 2, rv.type)
+
+    def member_action(self, rv):
+        """Parse the name after a . and access that member of rv"""
+        tkName = self.consume_id()
+        if not tkName:
+            raise SyntaxError("Expected field name after .")
+
+        # Check struct member access semantics
+        if rv.type.typeBase != TB_STRUCT:
+            tkerr(self.crtTk, "accessing a member of a non-struct")
+
+        s = self.find_symbol(rv.type.s.members, tkName)
+        if not s:
+            tkerr(self.crtTk, "undefined struct member: %s", tkName)
+        if self.references is not None:
+            self.references.append((self.pos - 1, s, False))
+
+        # Result type is the member's type
+        rv.type = s.type
+        rv.isLVal = True
+        rv.isCtVal = False
+        if self.ast is not None:
+            self.ast.add(N_MEMBER, self.pos - 1, 1, rv.type, s)
+
+    def call_check(self, rv):
+        """Check that rv, followed by (, can be called. Returns the tree
+        mark of the callee node, with a syntax tree."""
+        callee = self.ast.open() - 1 if self.ast is not None else None
+        # Check that the symbol is a function
+        if rv.symbol is None or rv.symbol.cls not in ["CLS_FUNC", "CLS_EXTFUNC"]:
+            tkerr(self.crtTk, "calling a non-function: %s",
+                  rv.symbol.name if rv.symbol is not None else "<unknown>")
+        return callee
+
+    def call_action(self, opPos, callee, rv):
+        """Semantic action of the call, at opPos, of rv once its arguments
+        are parsed"""
+        # Check arguments against function definition
+        # (simplified validation for now)
+
+        # Result type is the function's return type
+        rv.type = rv.symbol.type  # Return type (e.g., TB_INT)
+        rv.isLVal = False
+        rv.isCtVal = False
+        if self.ast is not None:
+            self.ast.add_from(N_CALL, opPos, callee, rv.type, rv.symbol)
+
     def exprPrimary(self, rv):
         """Parse primary expression (variable, constant, parenthesized expression)"""
         # ID - variable, function, etc.
-        tkName = self.consume("ID")
+        tkName = self.consume_id()
         if tkName:
             # Find symbol in the symbol table
-            s = find_symbol(symbols, tkName.text)
+            s = self.find_symbol(self.ctx.symbols, tkName)
             if not s:
                 # Handle undefined variables more gracefully
-                if self.crtTk and self.crtTk.code == "ASSIGN" and crtFunc:
+                if self.kinds[self.pos] == ASSIGN and self.ctx.crtFunc:
                     # Auto-declare variable if it's being assigned in a function
-                    s = add_symbol(symbols, tkName.text, "CLS_VAR")
+                    s = add_symbol(self.ctx.symbols, tkName, "CLS_VAR", self.ctx.crtDepth)
                     s.mem = "MEM_LOCAL"
-                    s.type = create_type("TB_INT", -1)  # Default to int
+                    s.type = INT_TYPE  # Default to int
+                    if self.references is not None:
+                        self.references.append((self.pos - 1, s, True))
                 else:
-                    tkerr(self.crtTk, "undefined symbol: %s", tkName.text)
+                    tkerr(self.crtTk, "undefined symbol: %s", tkName)
+            elif self.references is not None:
+                self.references.append((self.pos - 1, s, False))
 
             # Store the symbol in RetVal for later checks
-            rv.symbol = s  # <-- Add this line
+            rv.symbol = s
 
             # Set return value based on symbol type
             if s.cls == "CLS_VAR":
-                rv.type = s.type.copy()
+                rv.type = s.type
                 rv.isLVal = True
                 rv.isCtVal = False
             elif s.cls in ["CLS_FUNC", "CLS_EXTFUNC"]:
-                rv.type = s.type.copy()
+                rv.type = s.type
                 rv.isLVal = False
                 rv.isCtVal = False
             else:
-                tkerr(self.crtTk, "invalid symbol usage: %s", tkName.text)
+                tkerr(self.crtTk, "invalid symbol usage: %s", tkName)
+            if self.ast is not None:
+                self.ast.add(N_ID, self.pos - 1, 0, rv.type, s)
 
             return True
 
 
         # Integer constant
-        tkInt = self.consume("CT_INT")
-        if tkInt:
-            rv.type = create_type("TB_INT", -1)
+        if self.consume(CT_INT):
+            rv.type = INT_TYPE
             rv.isCtVal = True
             rv.isLVal = False
-            rv.ctVal = int(tkInt.value)
+            rv.ctVal = int(self.consumed())
+            if self.ast is not None:
+                self.ast.add(N_CT_INT, self.pos - 1, 0, rv.type, value=rv.ctVal)
             return True
 
         # Real constant
-        tkReal = self.consume("CT_REAL")
-        if tkReal:
-            rv.type = create_type("TB_DOUBLE", -1)
+        if self.consume(CT_REAL):
+            rv.type = DOUBLE_TYPE
             rv.isCtVal = True
             rv.isLVal = False
-            rv.ctVal = float(tkReal.value)
+            rv.ctVal = float(self.consumed())
+            if self.ast is not None:
+                self.ast.add(N_CT_REAL, self.pos - 1, 0, rv.type, value=rv.ctVal)
             return True
 
         # Character constant
-        tkChar = self.consume("CT_CHAR")
-        if tkChar:
-            rv.type = create_type("TB_CHAR", -1)
+        if self.consume(CT_CHAR):
+            rv.type = CHAR_TYPE
             rv.isCtVal = True
             rv.isLVal = False
-            rv.ctVal = tkChar.value
+            rv.ctVal = self.consumed()
+            if self.ast is not None:
+                self.ast.add(N_CT_CHAR, self.pos - 1, 0, rv.type, value=rv.ctVal)
             return True
 
         # String constant
-        tkString = self.consume("CT_STRING")
-        if tkString:
-            rv.type = create_type("TB_CHAR", 0)  # Array of chars
+        if self.consume(CT_STRING):
+            rv.type = STRING_TYPE  # Array of chars
             rv.isCtVal = True
             rv.isLVal = False
-            rv.ctVal = tkString.value
+            rv.ctVal = self.consumed()
+            if self.ast is not None:
+                self.ast.add(N_CT_STRING, self.pos - 1, 0, rv.type, value=rv.ctVal)
             return True
 
         # Parenthesized expression
-        if self.consume("LPAR"):
+        if self.consume(LPAR):
             if not self.expr(rv):
                 raise SyntaxError("Expected expression after (")
-            if not self.consume("RPAR"):
+            if not self.consume(RPAR):
                 raise SyntaxError("Expected )")
             return True
 
@@ -1061,118 +1998,137 @@ class Parser:
 
     def stmIf(self):
         """Parse if statement with semantic analysis"""
-        if not self.consume("IF"):
+        if not self.consume(IF):
             return False
-
-        if not self.consume("LPAR"):
-            raise SyntaxError("Expected ( after if")
-
-        rv = RetVal()
-        if not self.expr(rv):
-            raise SyntaxError("Expected condition in if statement")
-
-        # Check if condition is valid for logical test
-        if rv.type.typeBase == "TB_STRUCT":
-            tkerr(self.crtTk, "a structure cannot be logically tested")
-
-        if not self.consume("RPAR"):
-            raise SyntaxError("Expected ) after if condition")
+        if self.ast is not None:
+            tkPos = self.pos - 1
+            parts = self.ast.open()
+        self.condition("if")
 
         if not self.stm():
-            raise SyntaxError("Expected statement for if block")
+            raise SyntaxError(BODY_EXPECTED[IF])
 
-        if self.consume("ELSE"):
+        if self.consume(ELSE):
             if not self.stm():
-                raise SyntaxError("Expected statement for else block")
+                raise SyntaxError(BODY_EXPECTED[ELSE])
+        if self.ast is not None:
+            self.ast.add_from(N_IF, tkPos, parts)
 
         return True
 
     def stmWhile(self):
         """Parse while statement with semantic analysis"""
-        if not self.consume("WHILE"):
+        if not self.consume(WHILE):
             return False
+        if self.ast is not None:
+            tkPos = self.pos - 1
+            parts = self.ast.open()
+        self.condition("while")
+
+        if not self.stm():
+            raise SyntaxError(BODY_EXPECTED[WHILE])
+        if self.ast is not None:
+            self.ast.add_from(N_WHILE, tkPos, parts)
+
+        return True
 
-        if not self.consume("LPAR"):
-            raise SyntaxError("Expected ( after while")
+    def condition(self, keyword):
+        """Parse the (condition) after an if or while keyword"""
+        if not self.consume(LPAR):
+            raise SyntaxError(f"Expected ( after {keyword}")
 
         rv = RetVal()
         if not self.expr(rv):
-            raise SyntaxError("Expected condition in while statement")
+            raise SyntaxError(f"Expected condition in {keyword} statement")
 
         # Check if condition is valid for logical test
-        if rv.type.typeBase == "TB_STRUCT":
+        if rv.type.typeBase == TB_STRUCT:
             tkerr(self.crtTk, "a structure cannot be logically tested")
 
-        if not self.consume("RPAR"):
-            raise SyntaxError("Expected ) after while condition")
-
-        if not self.stm():
-            raise SyntaxError("Expected statement for while block")
-
-        return True
+        if not self.consume(RPAR):
+            raise SyntaxError(f"Expected ) after {keyword} condition")
 
     def stmFor(self):
         """Parse for statement with semantic analysis"""
-        if not self.consume("FOR"):
+        if not self.consume(FOR):
             return False
+        if self.ast is not None:
+            tkPos = self.pos - 1
+            parts = self.ast.open()
+        self.for_head()
+
+        if not self.stm():
+            raise SyntaxError(BODY_EXPECTED[FOR])
+        if self.ast is not None:
+            self.ast.add_from(N_FOR, tkPos, parts)
+
+        return True
 
-        if not self.consume("LPAR"):
+    def for_head(self):
+        """Parse the (init; condition; increment) after a for keyword"""
+        if not self.consume(LPAR):
             raise SyntaxError("Expected ( after for")
 
         # Expression 1 (initialization) - optional
         rv = RetVal()
-        self.expr(rv)  # We don't check the return since it's optional
+        if not self.expr(rv) and self.ast is not None:
+            self.ast.add(N_EMPTY, self.pos)
 
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             raise SyntaxError("Expected ; after for initialization")
 
         # Expression 2 (condition) - optional
-        if self.crtTk.code != "SEMICOLON":
-            rv = RetVal()
-            if self.expr(rv):
-                # Check if condition is valid for logical test
-                if rv.type.typeBase == "TB_STRUCT":
-                    tkerr(self.crtTk, "a structure cannot be logically tested")
+        rv = RetVal()
+        if self.kinds[self.pos] != SEMICOLON and self.expr(rv):
+            # Check if condition is valid for logical test
+            if rv.type.typeBase == TB_STRUCT:
+                tkerr(self.crtTk, "a structure cannot be logically tested")
+        elif self.ast is not None:
+            self.ast.add(N_EMPTY, self.pos)
 
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             raise SyntaxError("Expected ; after for condition")
 
         # Expression 3 (increment) - optional
         rv = RetVal()
-        self.expr(rv)  # Optional
+        if not self.expr(rv) and self.ast is not None:
+            self.ast.add(N_EMPTY, self.pos)
 
-        if not self.consume("RPAR"):
+        if not self.consume(RPAR):
             raise SyntaxError("Expected ) after for loop")
 
-        if not self.stm():
-            raise SyntaxError("Expected statement for for block")
-
-        return True
-
     def stmBreak(self):
         """Parse break statement"""
-        if not self.consume("BREAK"):
+        if not self.consume(BREAK):
             return False
 
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             raise SyntaxError("Expected ; after break")
+        if self.ast is not None:
+            self.ast.add(N_BREAK, self.pos - 2)
 
         return True
 
     def stmReturn(self):
         """Parse return statement with semantic analysis"""
-        if not self.consume("RETURN"):
+        if not self.consume(RETURN):
             return False
+        if self.ast is not None:
+            tkPos = self.pos - 1
+            parts = self.ast.open()
 
         # Return value is optional
-        if self.crtTk.code != "SEMICOLON":
+        if self.kinds[self.pos] != SEMICOLON:
             rv = RetVal()
             if self.expr(rv):
                 # Check if return type matches function return type
-                if crtFunc:
-                    cast(crtFunc.type, rv.type)
+                if self.ctx.crtFunc:
+                    cast(self.ctx.crtFunc.type, rv.type, self)
 
-        if not self.consume("SEMICOLON"):
+        if not self.consume(SEMICOLON):
             raise SyntaxError("Expected ; after return")
+        if self.ast is not None:
+            func = self.ctx.crtFunc
+            self.ast.add_from(N_RETURN, tkPos, parts, func.type if func else None, func)
 
         return True
\ No newline at end of file
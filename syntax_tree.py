@@ -0,0 +1,265 @@
+"""Compact syntax tree built by the Parser (Parser(..., build_ast=True)).
+
+A node is an integer. Its kind, token, type and symbol (or constant) are
+stored in parallel typed arrays, like the tokens of a TokenBuffer, and its
+children are linked first-child/next-sibling, so a node costs a few array
+slots rather than a Python object. Types, symbols and constants are interned
+in side lists and referenced by index; the name of a node is the name of
+its symbol.
+
+The Parser adds nodes in postorder, as rules complete: finished nodes wait
+on a stack until the node of the enclosing rule takes them as its children.
+When the Parser backtracks, the nodes added since the position it goes back
+to are dropped (see checkpoint/rollback).
+"""
+from array import array
+
+from token_stream import ADD, AND, DIV, EQUAL, GREATER, GREATEREQ, LESS, LESSEQ, MUL, NOTEQ, OR, SUB
+
+NODE_NAMES = (
+    # Declarations and statements
+    'UNIT', 'STRUCT', 'VAR', 'FUNC', 'PARAM', 'BLOCK', 'IF', 'WHILE', 'FOR', 'BREAK', 'RETURN', 'EXPR',
+    'EMPTY',
+    # Expressions
+    'ASSIGN', 'OR', 'AND', 'EQUAL', 'NOTEQ', 'LESS', 'LESSEQ', 'GREATER', 'GREATEREQ',
+    'ADD', 'SUB', 'MUL', 'DIV', 'CAST', 'NEG', 'NOT', 'INDEX', 'MEMBER', 'CALL',
+    'ID', 'CT_INT', 'CT_REAL', 'CT_CHAR', 'CT_STRING',
+)
+
+(N_UNIT, N_STRUCT, N_VAR, N_FUNC, N_PARAM, N_BLOCK, N_IF, N_WHILE, N_FOR, N_BREAK, N_RETURN, N_EXPR,
+ N_EMPTY,
+ N_ASSIGN, N_OR, N_AND, N_EQUAL, N_NOTEQ, N_LESS, N_LESSEQ, N_GREATER, N_GREATEREQ,
+ N_ADD, N_SUB, N_MUL, N_DIV, N_CAST, N_NEG, N_NOT, N_INDEX, N_MEMBER, N_CALL,
+ N_ID, N_CT_INT, N_CT_REAL, N_CT_CHAR, N_CT_STRING) = range(len(NODE_NAMES))
+
+# Node kind of each binary operator token
+BINARY_NODES = {
+    OR: N_OR, AND: N_AND, EQUAL: N_EQUAL, NOTEQ: N_NOTEQ, LESS: N_LESS, LESSEQ: N_LESSEQ,
+    GREATER: N_GREATER, GREATEREQ: N_GREATEREQ, ADD: N_ADD, SUB: N_SUB, MUL: N_MUL, DIV: N_DIV,
+}
+
+# Nodes whose ref is a symbol (the other ones with a ref are constants)
+SYMBOL_NODES = frozenset((N_STRUCT, N_VAR, N_FUNC, N_PARAM, N_RETURN, N_MEMBER, N_CALL, N_ID))
+
+# Children of the nodes that have some:
+#   UNIT, BLOCK      declarations and statements
+#   STRUCT           VAR of each member
+#   FUNC             PARAM of each argument, then the BLOCK of the body
+#   IF               condition, statement [, else statement]
+#   WHILE            condition, statement
+#   FOR              init, condition, step (EMPTY if left out), statement
+#   RETURN           [expression] (the symbol is the function)
+#   EXPR             [expression]
+#   ASSIGN, binary   left, right
+#   CAST, NEG, NOT   operand (the type of CAST is the target type)
+#   INDEX            array, index
+#   MEMBER           struct operand (the symbol is the member)
+#   CALL             function, arguments (the symbol is the function)
+
+
+class SyntaxTree:
+    """Nodes stored column-wise in typed arrays"""
+
+    def __init__(self, tokens=None):
+        self.kinds = array('B')  # Node kind codes
+        self.tokens = array('i')  # Token of the node (operator, name, keyword...)
+        self.type_ids = array('i')  # Index in types, -1 for untyped nodes
+        self.refs = array('i')  # Index in symbols (SYMBOL_NODES) or in constants, -1 for none
+        self.firsts = array('i')  # First child, -1 for none
+        self.nexts = array('i')  # Next sibling, -1 for none
+        self.types = []
+        self.type_index = {}  # Type -> index in types (types are interned)
+        self.symbols = []
+        self.symbol_index = {}  # Symbol -> index in symbols
+        self.constants = []
+        self.constant_index = {}  # (kind, value) -> index in constants
+        self.stack = []  # Finished nodes without a parent yet
+        self.source = tokens  # TokenBuffer or TokenStream the token indexes refer to
+        self.root = None  # The UNIT node, once the whole input is parsed
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def add(self, kind, token, n_children=0, type=None, symbol=None, value=None):
+        """Add a node taking the last n_children finished nodes as its
+        children, and return it. A node has a symbol or a (constant) value."""
+        n = len(self.kinds)
+        self.kinds.append(kind)
+        self.tokens.append(token + self.source.base)
+        if type is None:
+            self.type_ids.append(-1)
+        else:
+            tid = self.type_index.get(type)
+            if tid is None:
+                tid = self.type_index[type] = len(self.types)
+                self.types.append(type)
+            self.type_ids.append(tid)
+        if symbol is not None:
+            ref = self.symbol_index.get(symbol)
+            if ref is None:
+                ref = self.symbol_index[symbol] = len(self.symbols)
+                self.symbols.append(symbol)
+        elif value is not None:
+            key = (kind, value)  # The kind keeps 1, 1.0 and '1' apart
+            ref = self.constant_index.get(key)
+            if ref is None:
+                ref = self.constant_index[key] = len(self.constants)
+                self.constants.append(value)
+        else:
+            ref = -1
+        self.refs.append(ref)
+        stack = self.stack
+        if n_children == 0:
+            first = -1
+        elif n_children == 1:
+            first = stack.pop()
+        elif n_children == 2:
+            second = stack.pop()
+            first = stack.pop()
+            self.nexts[first] = second
+        else:
+            children = stack[-n_children:]
+            del stack[-n_children:]
+            nexts = self.nexts
+            for i in range(n_children - 1):
+                nexts[children[i]] = children[i + 1]
+            first = children[0]
+        self.firsts.append(first)
+        self.nexts.append(-1)
+        stack.append(n)
+        return n
+
+    def add_from(self, kind, token, start, type=None, symbol=None, value=None):
+        """Add a node taking the finished nodes from stack index start on"""
+        return self.add(kind, token, len(self.stack) - start, type, symbol, value)
+
+    def open(self):
+        """Stack index where the children of a node about to be parsed start"""
+        return len(self.stack)
+
+    def finish(self):
+        """Add the UNIT node over all the finished nodes"""
+        self.root = self.add_from(N_UNIT, -self.source.base, 0)
+        return self.root
+
+    def checkpoint(self):
+        """State to go back to with rollback()"""
+        return len(self.kinds), len(self.stack)
+
+    def rollback(self, state):
+        """Drop the nodes added since checkpoint() returned state. A rule
+        only goes back to a position it saved itself, so none of the older
+        nodes has been given a parent in between."""
+        n, depth = state
+        if n < len(self.kinds):
+            for column in (self.kinds, self.tokens, self.type_ids, self.refs, self.firsts, self.nexts):
+                del column[n:]
+        del self.stack[depth:]
+
+    # Node fields
+
+    def kind(self, n):
+        return self.kinds[n]
+
+    def name(self, n):
+        """Kind name of node n, e.g. 'ADD'"""
+        return NODE_NAMES[self.kinds[n]]
+
+    def token(self, n):
+        """Index of the token of node n in the whole token sequence"""
+        return self.tokens[n]
+
+    def value(self, n):
+        """Name (of the symbol) or constant of node n, or None"""
+        ref = self.refs[n]
+        if ref < 0:
+            return None
+        if self.kinds[n] in SYMBOL_NODES:
+            return self.symbols[ref].name
+        return self.constants[ref]
+
+    def type(self, n):
+        """Type of the value of an expression node, or of the declared
+        symbol; None for statements"""
+        tid = self.type_ids[n]
+        return self.types[tid] if tid >= 0 else None
+
+    def symbol(self, n):
+        """Symbol the node declares or refers to, or None"""
+        ref = self.refs[n]
+        return self.symbols[ref] if ref >= 0 and self.kinds[n] in SYMBOL_NODES else None
+
+    def position(self, n):
+        """1-based (line, column) of the token of node n, or (None, None)
+        if the tokens have been dropped (TokenStream)"""
+        return self.source.position(self.tokens[n] - self.source.base)
+
+    # Traversal
+
+    def children(self, n):
+        """Iterate over the children of node n"""
+        c = self.firsts[n]
+        nexts = self.nexts
+        while c >= 0:
+            yield c
+            c = nexts[c]
+
+    def child_list(self, n):
+        return list(self.children(n))
+
+    def walk(self, n=None):
+        """Iterate over node n (the root by default) and its descendants in
+        preorder, without recursion"""
+        if n is None:
+            n = self.root
+        firsts, nexts = self.firsts, self.nexts
+        pending = [n]
+        while pending:
+            n = pending.pop()
+            yield n
+            c = firsts[n]
+            if c >= 0:
+                kids = []
+                while c >= 0:
+                    kids.append(c)
+                    c = nexts[c]
+                pending.extend(reversed(kids))
+
+    def dump(self, n=None):
+        """Indented text of the tree under node n, one node per line"""
+        if n is None:
+            n = self.root
+        lines = []
+        pending = [(n, 0)]
+        while pending:
+            n, depth = pending.pop()
+            text = "  " * depth + NODE_NAMES[self.kinds[n]]
+            value = self.value(n)
+            if value is not None:
+                text += f" {value!r}"
+            t = self.type(n)
+            if t is not None:
+                text += f" : {t!r}"
+            lines.append(text)
+            pending.extend((c, depth + 1) for c in reversed(self.child_list(n)))
+        return "\n".join(lines)
+
+
+class Visitor:
+    """Tree walker calling visit_<NODE NAME>(n) for each node, e.g.
+    visit_CALL. Nodes without a method go to generic_visit(), which visits
+    their children; a method visits the children it wants itself."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.dispatch = tuple(getattr(self, "visit_" + name, self.generic_visit) for name in NODE_NAMES)
+
+    def visit(self, n=None):
+        """Visit node n (the root by default) and return the method's result"""
+        if n is None:
+            n = self.tree.root
+        return self.dispatch[self.tree.kinds[n]](n)
+
+    def generic_visit(self, n):
+        for c in self.tree.children(n):
+            self.visit(c)
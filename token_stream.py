@@ -0,0 +1,317 @@
+"""Compact token stream.
+
+Token kinds are small integers (the position of their name in TOKEN_NAMES,
+which is also the PLY `tokens` list) stored in an array('B'), with parallel
+arrays for the start offset and value of each token. Lines and columns are
+only computed from the start offsets when a diagnostic asks for them. The Parser walks
+it with a plain integer cursor, so consume() and backtracking are integer
+operations and no object is kept per token.
+
+TokenStream is the streaming variant: a window over tokens pulled lazily
+from lex_stream(), which the Parser slides forward after every top-level
+declaration, so memory stays bounded by the largest declaration.
+"""
+import re
+from array import array
+
+from line_index import LineIndex
+
+TOKEN_NAMES = (
+    'ID', 'CT_INT', 'CT_REAL', 'CT_CHAR', 'CT_STRING',
+    'COMMA', 'SEMICOLON', 'LPAR', 'RPAR', 'LBRACKET', 'RBRACKET', 'LACC', 'RACC',
+    'ADD', 'SUB', 'MUL', 'DIV', 'DOT', 'AND', 'OR', 'NOT', 'ASSIGN', 'EQUAL', 'NOTEQ', 'LESS', 'LESSEQ', 'GREATER', 'GREATEREQ',
+    'BREAK', 'CHAR', 'DOUBLE', 'ELSE', 'FOR', 'IF', 'INT', 'RETURN', 'STRUCT', 'VOID', 'WHILE', 'INVALID', 'END'
+)
+
+(ID, CT_INT, CT_REAL, CT_CHAR, CT_STRING,
+ COMMA, SEMICOLON, LPAR, RPAR, LBRACKET, RBRACKET, LACC, RACC,
+ ADD, SUB, MUL, DIV, DOT, AND, OR, NOT, ASSIGN, EQUAL, NOTEQ, LESS, LESSEQ, GREATER, GREATEREQ,
+ BREAK, CHAR, DOUBLE, ELSE, FOR, IF, INT, RETURN, STRUCT, VOID, WHILE, INVALID, END) = range(len(TOKEN_NAMES))
+
+TOKEN_CODES = {name: code for code, name in enumerate(TOKEN_NAMES)}
+
+
+class TokenBuffer:
+    """Tokens stored column-wise in typed arrays"""
+
+    def __init__(self, source=None, offsets='i'):
+        self.kinds = array('B')  # Token kind codes
+        self.starts = array(offsets)  # Start offset in the source, -1 if unknown ('i': < 2 GiB)
+        self.value_ids = array('i')  # Index in values, -1 for no value
+        self.values = []  # Distinct token values
+        self.value_index = {}  # (kind, value) -> index in values
+        self.source = source  # Source text, for positions and snippets
+        self.line_index = None  # Built on the first position query
+        self.base = 0  # Index of kinds[0] in the whole token sequence (see TokenStream)
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def slide(self, pos):
+        """All tokens are kept in memory: positions never move"""
+        return pos
+
+    def fill(self, pos):
+        """All tokens are in memory already (see TokenStream.fill)"""
+        pass
+
+    def append(self, kind, value=None, start=-1):
+        """Add a token at the end of the buffer"""
+        self.kinds.append(kind)
+        self.starts.append(start)
+        if value is None:
+            self.value_ids.append(-1)
+            return
+        # The kind is part of the key so that 1, 1.0 and '1' stay distinct
+        key = (kind, value)
+        vid = self.value_index.get(key)
+        if vid is None:
+            vid = self.value_index[key] = len(self.values)
+            self.values.append(value)
+        self.value_ids.append(vid)
+
+    def extend(self, tokens):
+        """Append (kind, value, start) tuples; append() without the call per token"""
+        kinds, starts, value_ids = self.kinds.append, self.starts.append, self.value_ids.append
+        index, values = self.value_index, self.values
+        for kind, value, start in tokens:
+            kinds(kind)
+            starts(start)
+            if value is None:
+                value_ids(-1)
+                continue
+            vid = index.get((kind, value))
+            if vid is None:
+                vid = index[kind, value] = len(values)
+                values.append(value)
+            value_ids(vid)
+
+    def value(self, i):
+        """Value of token i (identifier name, constant...), or None"""
+        vid = self.value_ids[i]
+        return self.values[vid] if vid >= 0 else None
+
+    def lines(self):
+        """LineIndex of the source, built on first use"""
+        if self.line_index is None and self.source is not None:
+            self.line_index = LineIndex(self.source)
+        return self.line_index
+
+    def position(self, i):
+        """1-based (line, column) of token i, or (None, None) if unknown"""
+        if not 0 <= i < len(self.kinds) or self.starts[i] < 0 or self.lines() is None:
+            return None, None
+        return self.line_index.position(self.starts[i])
+
+    def snippet(self, i):
+        """Source line of token i with a caret under the token, or None"""
+        if not 0 <= i < len(self.kinds) or self.starts[i] < 0 or self.source is None:
+            return None
+        return self.lines().snippet(self.source, self.starts[i])
+
+    def token(self, i):
+        """Build a standalone Token for token i, e.g. for diagnostics"""
+        from syntax_analyzer import Token
+        if i >= len(self.kinds):
+            return None
+        line, column = self.position(i)
+        return Token(code=TOKEN_NAMES[self.kinds[i]], value=self.value(i), line=line, column=column)
+
+
+def tokenize(lexer, data):
+    """Run a PLY lexer (or a Scanner) over data and collect its tokens,
+    terminated by END"""
+    lexer.lineno = 1
+    buf = TokenBuffer(data)
+    append = buf.append
+    scan = getattr(lexer, "scan", None)
+    if scan is not None:
+        buf.extend(scan(data))
+        append(END, None, len(data))
+        return buf
+    lexer.input(data)
+    codes = TOKEN_CODES
+    while True:
+        tok = lexer.token()
+        if not tok:
+            break
+        append(codes[tok.type], tok.value, tok.lexpos)
+    append(END, None, len(data))
+    return buf
+
+
+# A chunk of source may only be cut at a newline outside comments and
+# strings: complete comments, character constants (t_CT_CHAR, so that '"'
+# opens no string) and strings are skipped whole, plain text is group 2 and
+# the first unterminated opener (group 1) ends the search
+SAFE_CUT_RE = re.compile(r'/\*.*?\*/|//[^\n]*|\'(?:[^\'\\]|\\[^\n])\'|"(?:[^"\\]|\\.)*"|(/\*|")'
+                         r'|([^/"\']+)|[/\']', re.S)
+
+
+def safe_cut(text):
+    """Position after the last newline of text outside comments and strings,
+    or 0 if there is none"""
+    cut = 0
+    for m in SAFE_CUT_RE.finditer(text):
+        if m.group(1):
+            break
+        if m.group(2):
+            nl = text.rfind('\n', m.start(), m.end())
+            if nl >= 0:
+                cut = nl + 1
+    return cut
+
+
+def lex_stream(lexer, source, chunk_size=1 << 16, line_index=None, errors=None):
+    """Lex a text file object (a source file, sys.stdin...) chunk by chunk.
+
+    Each piece handed to the lexer ends at a newline outside comments and
+    strings, so no token straddles two pieces. Yields (kind, value, start)
+    tuples with start offsets relative to the whole input, ending with END.
+    The line starts of each piece are added to line_index if given. errors
+    is the list the lexer's error handler records (offset, character) in
+    (CompilationContext.lex_errors): its offsets are made relative to the
+    whole input too.
+    """
+    lexer.lineno = 1
+    codes = TOKEN_CODES
+    scan = getattr(lexer, "scan", None)
+    pending = ''
+    offset = 0  # Source offset of pending[0]
+    while True:
+        chunk = source.read(chunk_size)
+        pending += chunk
+        if chunk:
+            cut = safe_cut(pending)
+            if not cut:
+                continue
+            piece, pending = pending[:cut], pending[cut:]
+        else:
+            piece, pending = pending, ''
+        if line_index is not None:
+            line_index.add_text(piece, offset)
+        if scan is not None:
+            tokens = scan(piece)
+        else:
+            lexer.input(piece)
+            tokens = ((codes[tok.type], tok.value, tok.lexpos) for tok in iter(lexer.token, None))
+        recorded = len(errors) if errors is not None else 0
+        for kind, value, start in tokens:
+            if errors is not None and len(errors) != recorded:
+                # Errors recorded before this token: shift them as they come,
+                # since the parse may stop before the piece is lexed
+                errors[recorded:] = [(offset + pos, char) for pos, char in errors[recorded:]]
+                recorded = len(errors)
+            yield kind, value, offset + start
+        if errors is not None:
+            errors[recorded:] = [(offset + pos, char) for pos, char in errors[recorded:]]
+        offset += len(piece)
+        if not chunk:
+            yield END, None, offset
+            return
+
+
+class TokenStream(TokenBuffer):
+    """Sliding token window fed by a token iterator (see lex_stream).
+
+    Positions are relative to the window. The Parser calls slide() between
+    top-level declarations, where no backtrack point is alive: the tokens
+    already parsed are dropped and the window is refilled with the next
+    declaration, found by brace/parenthesis depth, plus a few tokens of
+    lookahead. Values are stored per token rather than interned, so that
+    they can be dropped with their tokens. The source text is not kept, so
+    positions come from a LineIndex filled as the input is read (see
+    lex_stream) and there are no snippets. The window is small, so its
+    start offsets are 64-bit: a stream has no size limit.
+    """
+
+    def __init__(self, source, lookahead=4, line_index=None):
+        super().__init__(offsets='q')
+        self.line_index = line_index
+        self.source = iter(source)
+        self.lookahead = lookahead
+        self.exhausted = False
+        self.base = 0  # Index of window[0] in the whole token sequence
+        self.fill(0)
+
+    def append(self, kind, value=None, start=-1):
+        self.kinds.append(kind)
+        self.starts.append(start)
+        self.values.append(value)
+
+    def extend(self, tokens):
+        for kind, value, start in tokens:
+            self.append(kind, value, start)
+
+    def value(self, i):
+        return self.values[i]
+
+    def snippet(self, i):
+        """The source text is not kept: no snippets"""
+        return None
+
+    def pull(self):
+        """Append the next token from the source, END once it is exhausted"""
+        if self.exhausted:
+            return False
+        tok = next(self.source, None)
+        if tok is None:
+            self.exhausted = True
+            if not self.kinds or self.kinds[-1] != END:
+                self.append(END)
+        else:
+            self.append(*tok)
+        return True
+
+    def fill(self, pos):
+        """Make sure the window holds the top-level declaration or statement
+        starting at pos and the lookahead after it"""
+        kinds = self.kinds
+        braces = parens = 0
+        i = pos
+        while True:
+            while i >= len(kinds):
+                if not self.pull():
+                    return
+            kind = kinds[i]
+            if kind == END:
+                return
+            i += 1
+            if kind == LACC:
+                braces += 1
+                continue
+            if kind == LPAR:
+                parens += 1
+                continue
+            if kind == RPAR:
+                parens = max(parens - 1, 0)
+                continue
+            if kind == RACC:
+                braces = max(braces - 1, 0)
+            elif kind != SEMICOLON:
+                continue
+            if braces or parens:
+                continue
+            # End of a declaration/statement, unless an else follows
+            while len(kinds) < i + self.lookahead and self.pull():
+                pass
+            if i >= len(kinds) or kinds[i] != ELSE:
+                return
+
+    def slide(self, pos):
+        """Drop the tokens before pos, refill and return the new position"""
+        if pos:
+            del self.kinds[:pos]
+            del self.starts[:pos]
+            del self.values[:pos]
+            self.base += pos
+            if self.line_index is not None and self.starts and self.starts[0] >= 0:
+                self.line_index.discard_before(self.starts[0])
+        self.fill(0)
+        return 0
+
+
+def open_stream(lexer, source, chunk_size=1 << 16, lookahead=4, errors=None):
+    """TokenStream over a text file object, lexed chunk by chunk"""
+    line_index = LineIndex()
+    return TokenStream(lex_stream(lexer, source, chunk_size, line_index, errors), lookahead, line_index)
@@ -1,64 +1,16 @@
-import os
-import traceback
-from contextlib import redirect_stdout
-from lexical_analyzer import lexer
-from syntax_analyzer import Parser, Token
-from syntax_analyzer import SemanticError
-
-
-def read_input_from_file(file_path):
-    with open(file_path, 'r') as file:
-        return file.read()
+from batch import collect_files, run_batch, write_report
+from parser_trace import TRACE_OFF
 
 
 # Configuration paths
 folder_path = r'tests'
 output_file_path = r'output.txt'
+trace_level = TRACE_OFF  # TRACE_RULES / TRACE_TOKENS / TRACE_SEMANTIC add a parser trace to the output
+jobs = 1  # Worker processes, see batch.py for the command line driver
+lexer_backend = 'ply'  # 'scanner' for the master-regex lexer of scanner.py
+cache_dir = r'.atomc_cache'  # Compile cache for unchanged files, None to disable
 
+results = run_batch(collect_files([folder_path]), jobs=jobs, trace=trace_level, cache_dir=cache_dir,
+                    lexer_backend=lexer_backend)
 with open(output_file_path, 'w') as output_file:
-    with redirect_stdout(output_file):
-        print("===== Compiler Analysis Results =====")
-
-        for filename in os.listdir(folder_path):
-            file_path = os.path.join(folder_path, filename)
-
-            if not os.path.isfile(file_path):
-                continue
-
-            try:
-                print(f"\nProcessing file: {filename}")
-
-                # Read and tokenize input
-                data = read_input_from_file(file_path)
-                lexer.input(data)
-
-                # Convert to custom Token objects
-                tokens = []
-                while True:
-                    tok = lexer.token()
-                    if not tok:
-                        tokens.append(Token(code='END', value='None'))
-                        break
-                    tokens.append(Token(code=tok.type, value=tok.value))
-
-                # Link tokens as a linked list
-                for i in range(len(tokens) - 1):
-                    tokens[i].next = tokens[i + 1]
-
-                # Parse tokens
-                parser = Parser(tokens[0])
-                try:
-                    result = parser.unit()
-                    print(f"Result for {filename}: {'SUCCESS' if result else 'FAILURE'}")
-                except SyntaxError as e:
-                    print(f"Syntax error: {e}")
-                except SemanticError as e:
-                    print(f"Semantic error: {e}")
-
-            except Exception as e:
-                print(f"\n Error processing {filename}:")
-                traceback.print_exc()
-                print("=" * 50)
-
-        print("\n===== Analysis Complete =====")
-
+    write_report(results, output_file)
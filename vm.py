@@ -0,0 +1,572 @@
+"""Stack virtual machine running the bytecode of codegen.py.
+
+The interpreter loop is one line: the handler of each opcode is a closure
+over the machine state, stored in a list indexed by opcode, and returns
+the code position of the next instruction (negative to stop):
+
+    pc = handlers[code[pc]](code[pc + 1], pc)
+
+Operands live on a Python list; memory is one bytearray holding the
+globals followed by the frames, read and written through memoryview casts
+to int, double and char arrays (an address is a byte offset: the int at
+address a is ints[a >> 2]). Ints wrap around on 32 bits and chars on 8, as
+on the usual C targets.
+
+The builtins read and write through a Console with binary buffers: output
+is collected and written at exit, or before the program waits for input.
+
+Usage: python vm.py file.c [--disassemble] [--stack BYTES] [--count] [--lexer ply|scanner]
+"""
+import math
+import re
+import sys
+import time
+
+from bytecode import BUILTINS, OPCODE_NAMES, to_char, to_int
+
+INT_MIN, INT_MAX = -0x80000000, 0x7FFFFFFF
+FLUSH_SIZE = 1 << 16  # Output bytes buffered before a write
+DEFAULT_STACK = 1 << 20  # Bytes of memory for the frames
+INT_INPUT = re.compile(rb"[+-]?[0-9]+")
+DOUBLE_INPUT = re.compile(rb"[+-]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][+-]?[0-9]+)?")
+
+
+class VMError(Exception):
+    """Runtime error of the program (division by zero, stack overflow...)"""
+
+
+class Console:
+    """Standard input and output of a program, as bytes"""
+
+    def __init__(self, stdin=None, stdout=None):
+        self.stdin = stdin if stdin is not None else sys.stdin.buffer
+        self.stdout = stdout if stdout is not None else sys.stdout.buffer
+        self.pending = []  # Output not written yet
+        self.size = 0  # Bytes in pending
+        self.line = b""  # Input line being read
+        self.pos = 0  # Next byte of line
+
+    def write(self, data):
+        self.pending.append(data)
+        self.size += len(data)
+        if self.size >= FLUSH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.stdout.write(b"".join(self.pending))
+            self.pending.clear()
+            self.size = 0
+        if hasattr(self.stdout, "flush"):
+            self.stdout.flush()
+
+    def fill(self):
+        """Read the next input line, False at the end of the input"""
+        self.flush()  # Prompts are shown before the program waits
+        self.line = self.stdin.readline()
+        self.pos = 0
+        return bool(self.line)
+
+    def getc(self):
+        """Next input byte, -1 at the end of the input (getchar)"""
+        if self.pos >= len(self.line) and not self.fill():
+            return -1
+        self.pos += 1
+        return self.line[self.pos - 1]
+
+    def number(self, pattern, convert):
+        """Number read like scanf: blanks are skipped, then the longest
+        prefix matching pattern is converted; 0 if there is none (the input
+        is left as it is) or at the end of the input"""
+        while True:
+            line, pos = self.line, self.pos
+            while pos < len(line) and line[pos] in b" \t\r\n\v\f":
+                pos += 1
+            if pos < len(line):
+                break
+            if not self.fill():
+                return 0
+        self.pos = pos
+        m = pattern.match(line, pos)
+        if m is None:
+            return 0
+        self.pos = m.end()
+        return convert(m.group())
+
+    def gets(self):
+        """Rest of the current input line, without its end of line"""
+        if self.pos >= len(self.line) and not self.fill():
+            return b""
+        text = self.line[self.pos:]
+        self.pos = len(self.line)
+        return text.rstrip(b"\r\n")
+
+
+def float_div(a, b):
+    """a / b with the IEEE results for a zero divisor"""
+    try:
+        return a / b
+    except ZeroDivisionError:
+        if a == 0 or a != a:
+            return math.nan
+        return math.copysign(math.inf, a) * math.copysign(1.0, b)
+
+
+class Machine:
+    """Memory and execution of one Program"""
+
+    def __init__(self, program, console=None, stack_size=DEFAULT_STACK):
+        self.program = program
+        self.console = console if console is not None else Console()
+        self.stack_base = -(-len(program.image) // 8) * 8
+        self.memory = bytearray(self.stack_base + -(-stack_size // 8) * 8)
+        self.memory[:len(program.image)] = program.image
+        self.steps = 0  # Instructions executed by run(count=True)
+
+    def error(self, pc, e):
+        name = self.program.function_at(pc)
+        where = f" in {name}" if name is not None else ""
+        op = OPCODE_NAMES[self.program.code[pc]] if 0 <= pc < len(self.program.code) else "?"
+        return VMError(f"{e} (at {pc} {op}{where})")
+
+    def run(self, count=False):
+        """Execute the program from its entry point. With count, the
+        number of instructions executed is left in self.steps."""
+        code = self.program.code
+        handlers = self.handlers()
+        pc = self.program.entry
+        try:
+            if count:
+                steps = 0
+                while pc >= 0:
+                    pc = handlers[code[pc]](code[pc + 1], pc)
+                    steps += 1
+                self.steps = steps
+            else:
+                while pc >= 0:
+                    pc = handlers[code[pc]](code[pc + 1], pc)
+        except VMError as e:
+            raise self.error(pc, e) from None
+        except ZeroDivisionError:
+            raise self.error(pc, "division by zero") from None
+        except IndexError:
+            raise self.error(pc, "invalid memory access") from None
+        except (OverflowError, ValueError) as e:
+            raise self.error(pc, e) from None
+        finally:
+            self.console.flush()
+
+    def handlers(self):
+        """Handler of each opcode, closures over a fresh machine state"""
+        memory = self.memory
+        view = memoryview(memory)
+        ints, doubles, chars = view.cast('i'), view.cast('d'), view.cast('b')
+        constants = self.program.constants
+        console = self.console
+        stack = []
+        push, pop = stack.append, stack.pop
+        frames = []  # (return position, caller's FP) of each active call
+        end = len(memory)
+        fp = sp = self.stack_base
+
+        def NOP(a, pc):
+            return pc + 2
+
+        def HALT(a, pc):
+            return -1
+
+        def PUSHCT(a, pc):
+            push(a)
+            return pc + 2
+
+        def PUSHCT_D(a, pc):
+            push(constants[a])
+            return pc + 2
+
+        def DROP(a, pc):
+            pop()
+            return pc + 2
+
+        def DUP(a, pc):
+            push(stack[-1])
+            return pc + 2
+
+        def SWAP(a, pc):
+            stack[-1], stack[-2] = stack[-2], stack[-1]
+            return pc + 2
+
+        def FPADDR(a, pc):
+            push(fp + a)
+            return pc + 2
+
+        def OFFSET(a, pc):
+            stack[-1] += a
+            return pc + 2
+
+        def INDEX(a, pc):
+            i = pop()
+            stack[-1] += i * a
+            return pc + 2
+
+        def LOAD_I(a, pc):
+            stack[-1] = ints[stack[-1] >> 2]
+            return pc + 2
+
+        def LOAD_D(a, pc):
+            stack[-1] = doubles[stack[-1] >> 3]
+            return pc + 2
+
+        def LOAD_C(a, pc):
+            stack[-1] = chars[stack[-1]]
+            return pc + 2
+
+        def STORE_I(a, pc):
+            v = pop()
+            ints[pop() >> 2] = v
+            push(v)
+            return pc + 2
+
+        def STORE_D(a, pc):
+            v = pop()
+            doubles[pop() >> 3] = v
+            push(v)
+            return pc + 2
+
+        def STORE_C(a, pc):
+            v = pop()
+            chars[pop()] = v
+            push(v)
+            return pc + 2
+
+        def SET_I(a, pc):
+            v = pop()
+            ints[pop() >> 2] = v
+            return pc + 2
+
+        def SET_D(a, pc):
+            v = pop()
+            doubles[pop() >> 3] = v
+            return pc + 2
+
+        def SET_C(a, pc):
+            v = pop()
+            chars[pop()] = v
+            return pc + 2
+
+        def COPY(a, pc):
+            src = pop()
+            dst = stack[-1]
+            memory[dst:dst + a] = memory[src:src + a]
+            return pc + 2
+
+        def LOADL_I(a, pc):
+            push(ints[(fp + a) >> 2])
+            return pc + 2
+
+        def LOADL_D(a, pc):
+            push(doubles[(fp + a) >> 3])
+            return pc + 2
+
+        def LOADL_C(a, pc):
+            push(chars[fp + a])
+            return pc + 2
+
+        def LOADG_I(a, pc):
+            push(ints[a >> 2])
+            return pc + 2
+
+        def LOADG_D(a, pc):
+            push(doubles[a >> 3])
+            return pc + 2
+
+        def LOADG_C(a, pc):
+            push(chars[a])
+            return pc + 2
+
+        def SETL_I(a, pc):
+            ints[(fp + a) >> 2] = pop()
+            return pc + 2
+
+        def SETL_D(a, pc):
+            doubles[(fp + a) >> 3] = pop()
+            return pc + 2
+
+        def SETL_C(a, pc):
+            chars[fp + a] = pop()
+            return pc + 2
+
+        def SETG_I(a, pc):
+            ints[a >> 2] = pop()
+            return pc + 2
+
+        def SETG_D(a, pc):
+            doubles[a >> 3] = pop()
+            return pc + 2
+
+        def SETG_C(a, pc):
+            chars[a] = pop()
+            return pc + 2
+
+        def ADD_I(a, pc):
+            v = pop()
+            v += stack[-1]
+            stack[-1] = v if INT_MIN <= v <= INT_MAX else to_int(v)
+            return pc + 2
+
+        def SUB_I(a, pc):
+            v = pop()
+            v = stack[-1] - v
+            stack[-1] = v if INT_MIN <= v <= INT_MAX else to_int(v)
+            return pc + 2
+
+        def MUL_I(a, pc):
+            v = pop()
+            v *= stack[-1]
+            stack[-1] = v if INT_MIN <= v <= INT_MAX else to_int(v)
+            return pc + 2
+
+        def DIV_I(a, pc):
+            v = pop()
+            u = stack[-1]
+            if v == 0:
+                raise VMError("division by zero")
+            q = abs(u) // abs(v)  # C division truncates towards zero
+            stack[-1] = to_int(q if (u < 0) == (v < 0) else -q)
+            return pc + 2
+
+        def NEG_I(a, pc):
+            stack[-1] = to_int(-stack[-1])
+            return pc + 2
+
+        def ADD_D(a, pc):
+            v = pop()
+            stack[-1] += v
+            return pc + 2
+
+        def SUB_D(a, pc):
+            v = pop()
+            stack[-1] -= v
+            return pc + 2
+
+        def MUL_D(a, pc):
+            v = pop()
+            stack[-1] *= v
+            return pc + 2
+
+        def DIV_D(a, pc):
+            v = pop()
+            stack[-1] = float_div(stack[-1], v)
+            return pc + 2
+
+        def NEG_D(a, pc):
+            stack[-1] = -stack[-1]
+            return pc + 2
+
+        def ADD_C(a, pc):
+            v = pop()
+            stack[-1] = to_char(stack[-1] + v)
+            return pc + 2
+
+        def SUB_C(a, pc):
+            v = pop()
+            stack[-1] = to_char(stack[-1] - v)
+            return pc + 2
+
+        def MUL_C(a, pc):
+            v = pop()
+            stack[-1] = to_char(stack[-1] * v)
+            return pc + 2
+
+        def DIV_C(a, pc):
+            v = pop()
+            u = stack[-1]
+            if v == 0:
+                raise VMError("division by zero")
+            q = abs(u) // abs(v)
+            stack[-1] = to_char(q if (u < 0) == (v < 0) else -q)
+            return pc + 2
+
+        def NEG_C(a, pc):
+            stack[-1] = to_char(-stack[-1])
+            return pc + 2
+
+        # Comparisons are the same for the three types
+        def EQ(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] == v else 0
+            return pc + 2
+
+        def NOTEQ(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] != v else 0
+            return pc + 2
+
+        def LESS(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] < v else 0
+            return pc + 2
+
+        def LESSEQ(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] <= v else 0
+            return pc + 2
+
+        def GREATER(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] > v else 0
+            return pc + 2
+
+        def GREATEREQ(a, pc):
+            v = pop()
+            stack[-1] = 1 if stack[-1] >= v else 0
+            return pc + 2
+
+        def NOT(a, pc):
+            stack[-1] = 0 if stack[-1] else 1
+            return pc + 2
+
+        def CAST_TO_D(a, pc):
+            stack[-1] = float(stack[-1])
+            return pc + 2
+
+        def CAST_I_C(a, pc):
+            stack[-1] = to_char(stack[-1])
+            return pc + 2
+
+        def CAST_D_I(a, pc):
+            stack[-1] = to_int(int(stack[-1]))
+            return pc + 2
+
+        def CAST_D_C(a, pc):
+            stack[-1] = to_char(int(stack[-1]))
+            return pc + 2
+
+        def JMP(a, pc):
+            return a
+
+        def JF(a, pc):
+            return a if not pop() else pc + 2
+
+        def JT(a, pc):
+            return a if pop() else pc + 2
+
+        def CALL(a, pc):
+            frames.append((pc + 2, fp))
+            return a
+
+        def CALLEXT(a, pc):
+            builtins[a]()
+            return pc + 2
+
+        def ENTER(a, pc):
+            nonlocal fp, sp
+            fp = sp
+            sp += a
+            if sp > end:
+                raise VMError("stack overflow")
+            memory[fp:sp] = bytes(a)
+            return pc + 2
+
+        def RET(a, pc):
+            nonlocal fp, sp
+            sp = fp
+            pc, fp = frames.pop()
+            return pc
+
+        # Builtins: the arguments are on the operand stack
+
+        def put_s():
+            address = pop()
+            console.write(bytes(memory[address:memory.index(0, address)]))
+
+        def get_s():
+            data = console.gets()
+            address = pop()
+            memory[address:address + len(data) + 1] = data + b"\0"
+
+        def put_i():
+            console.write(b"%d" % pop())
+
+        def get_i():
+            push(to_int(console.number(INT_INPUT, int)))
+
+        def put_d():
+            console.write(b"%g" % pop())
+
+        def get_d():
+            push(console.number(DOUBLE_INPUT, float))
+
+        def put_c():
+            console.write(bytes((pop() & 0xFF,)))
+
+        def get_c():
+            push(to_char(console.getc()))
+
+        def seconds():
+            push(time.perf_counter())
+
+        named = locals()
+        builtins = [named[name] for name in BUILTINS]
+        handlers = []
+        for name in OPCODE_NAMES:
+            handler = named.get(name)
+            if handler is None:
+                if name.startswith("PUSHCT_"):
+                    handler = PUSHCT
+                elif name.startswith(("JF_", "JT_")):
+                    handler = named[name[:2]]
+                elif name.startswith("NOT_"):
+                    handler = NOT
+                elif name in ("CAST_I_D", "CAST_C_D"):
+                    handler = CAST_TO_D
+                else:
+                    handler = named[name.rsplit("_", 1)[0]]  # Typed comparisons
+            handlers.append(handler)
+        return handlers
+
+
+def count_instructions(program, console=None, stack_size=DEFAULT_STACK):
+    """Number of instructions executed by a run of program"""
+    machine = Machine(program, console, stack_size)
+    machine.run(count=True)
+    return machine.steps
+
+
+def main(argv=None):
+    import argparse
+    from codegen import CodegenError, compile_program
+    from lexical_analyzer import LEXER_BACKENDS
+    ap = argparse.ArgumentParser(description="Compile an AtomC program to bytecode and run it")
+    ap.add_argument("path", help="AtomC source file")
+    ap.add_argument("--disassemble", action="store_true", help="list the bytecode instead of running it")
+    ap.add_argument("--stack", type=int, default=DEFAULT_STACK, metavar="BYTES", help="memory for the frames")
+    ap.add_argument("--count", action="store_true", help="report the instructions executed on stderr")
+    ap.add_argument("--lexer", default="ply", choices=LEXER_BACKENDS, help="lexer backend")
+    args = ap.parse_args(argv)
+
+    with open(args.path, 'r') as f:
+        text = f.read()
+    try:
+        result, program = compile_program(text, args.lexer)
+    except CodegenError as e:
+        print(f"{args.path}: {e}", file=sys.stderr)
+        return 1
+    if program is None:
+        print(f"{args.path}: {result.error_kind} error: {result.error}", file=sys.stderr)
+        return 1
+    if args.disassemble:
+        print(program.disassemble())
+        return 0
+    machine = Machine(program, stack_size=args.stack)
+    try:
+        machine.run(count=args.count)
+    except VMError as e:
+        print(f"{args.path}: runtime error: {e}", file=sys.stderr)
+        return 2
+    if args.count:
+        print(f"{machine.steps} instructions", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())